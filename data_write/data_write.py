@@ -16,7 +16,10 @@ import warnings
 import time
 import threading
 import errno
+import heapq
+import itertools
 from multiprocessing import shared_memory
+import _posixshmem
 import subprocess as sp
 import argparse as ap
 import numpy as np
@@ -36,7 +39,11 @@ if not borealis_path:
 sys.path.append(borealis_path + '/utils/')
 import shared_macros.shared_macros as sm
 import data_write_options.data_write_options as dwo
+import dmap_write.dmap_write as dmap
+import record_index.record_index as record_index
+from array_write.array_write import ArrayFile, CHUNK_BYTES, DEFAULT_CHUNK_BYTES, hdf5_lock
 from zmq_borealis_helpers import socket_operations as so
+from metrics.metrics import MetricsRegistry
 
 dw_print = sm.MODULE_PRINT("Data Write", "cyan")
 
@@ -51,6 +58,8 @@ DATA_TEMPLATE = {
     "num_slices" : None, # Number of slices in the experiment at this integration time.
     "station" : None, # Three letter radar identifier.
     "num_sequences": None, # Number of sampling periods in the integration time.
+    "lost_sequences": None, # Indices of the sequences of the integration time that were lost
+    # before data_write. They are left out of the data and num_sequences.
     "num_ranges": None, # Number of ranges to calculate correlations for
     "range_sep": None, # range gate separation (equivalent distance between samples) in km.
     "first_range_rtt" : None, # Round trip time of flight to first range in microseconds.
@@ -102,6 +111,9 @@ DATA_TEMPLATE = {
     "lp_status_word" : None # 32 bits, a '1' in bit position corresponds to a low power condition on that transmitter
 }
 
+# Data products that ParseData can parse, by the name of their data_write flag.
+DATA_PRODUCTS = ('rawacf', 'bfiq', 'antenna_iq', 'raw_rf')
+
 TX_TEMPLATE = {
     "tx_rate": [],
     "tx_center_freq": [],
@@ -113,18 +125,191 @@ TX_TEMPLATE = {
 }
 
 
+def file_product(data_type):
+    """Gets the data product of a file type, as used for its compression settings.
+
+    Args:
+        data_type (str): The data type of the file, e.g. rawacf or stage_1_iq.
+
+    Returns:
+        str: The data product, with every iq stage as antennas_iq.
+    """
+    return 'antennas_iq' if data_type.endswith('_iq') else data_type
+
+
+def unlink_shm(name):
+    """Unlinks a shared memory segment without mapping it.
+
+    Args:
+        name (str): The name of the segment, as given by SharedMemory.name.
+    """
+    try:
+        _posixshmem.shm_unlink('/' + name)
+    except FileNotFoundError:
+        pass
+
+
+def count_shm_segments():
+    """Counts the shared memory segments of this user made by multiprocessing.shared_memory,
+    which names them psm_*. These are the segments rx_signal_processing made for data_write that
+    are not yet unlinked, along with any the other Borealis modules are using.
+
+    Returns:
+        int: The number of segments.
+    """
+    uid = os.getuid()
+    count = 0
+    with os.scandir('/dev/shm') as entries:
+        for entry in entries:
+            if not entry.name.startswith('psm_'):
+                continue
+            try:
+                count += entry.stat().st_uid == uid
+            except FileNotFoundError:
+                pass  # Unlinked since the directory was read
+    return count
+
+
+def unlink_processed_data(processed_data):
+    """Unlinks the shared memory of a processed sequence that will not be parsed.
+
+    Args:
+        processed_data (ProcessedSequenceMessage): The processed sequence.
+    """
+    names = [processed_data.bfiq_main_shm, processed_data.bfiq_intf_shm,
+             processed_data.rawrf_shm]
+    for stage in processed_data.debug_data:
+        names.extend([stage.main_shm, stage.intf_shm])
+    for data_set in processed_data.output_datasets:
+        names.extend([data_set.main_acf_shm, data_set.intf_acf_shm, data_set.xcf_shm])
+
+    for name in names:
+        if name:
+            unlink_shm(name)
+
+
+class ReorderBuffer(object):
+    """Puts processed sequences back in sequence number order. rx_signal_processing processes
+    sequences in parallel threads, so they can arrive out of order.
+
+    Sequences are held in a min-heap on sequence number until all the sequences before them have
+    arrived. A missing sequence is declared lost once window sequences are held, or once the
+    earliest held sequence has waited timeout seconds, and is skipped.
+
+    Args:
+        window (int): Number of sequences to hold while waiting for a missing one.
+        timeout (float): Seconds to wait for a missing sequence while later ones are held.
+        first_sequence_num (int): The first sequence number expected. By default, the first
+            sequence pushed, so that data_write can be restarted while the radar runs.
+    """
+
+    def __init__(self, window, timeout, first_sequence_num=None):
+        super(ReorderBuffer, self).__init__()
+        self.window = window
+        self.timeout = timeout
+        self.expected_sequence_num = first_sequence_num
+        self.lost = 0
+        self.late = 0
+        self._heap = []
+        self._arrivals = itertools.count()
+
+    @property
+    def depth(self):
+        """Number of sequences held waiting for an earlier one.
+
+        Returns:
+            int: Number of sequences held.
+        """
+        return len(self._heap)
+
+    def push(self, processed_data, now=None):
+        """Adds a processed sequence. A sequence that arrives after it was declared lost, or a
+        duplicate, is counted as late and its shared memory is unlinked.
+
+        Args:
+            processed_data (ProcessedSequenceMessage): The processed sequence.
+            now (float): The arrival time, from time.monotonic(). Optional.
+
+        Returns:
+            bool: False if the sequence was late and dropped.
+        """
+        if self.expected_sequence_num is None:
+            self.expected_sequence_num = processed_data.sequence_num
+        elif processed_data.sequence_num < self.expected_sequence_num:
+            self.late += 1
+            unlink_processed_data(processed_data)
+            return False
+
+        now = time.monotonic() if now is None else now
+        heapq.heappush(self._heap, (processed_data.sequence_num, now, next(self._arrivals),
+                                    processed_data))
+        return True
+
+    def pop(self, now=None):
+        """Takes the sequences that are ready, in order.
+
+        Args:
+            now (float): The current time, from time.monotonic(). Optional.
+
+        Returns:
+            list: (sequence_num, processed_data) for each sequence that is ready. processed_data
+            is None for a sequence that was declared lost.
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        while self._heap:
+            sequence_num, arrival, _, processed_data = self._heap[0]
+            if sequence_num < self.expected_sequence_num:
+                heapq.heappop(self._heap)
+                self.late += 1
+                unlink_processed_data(processed_data)
+            elif sequence_num == self.expected_sequence_num:
+                heapq.heappop(self._heap)
+                ready.append((sequence_num, processed_data))
+                self.expected_sequence_num += 1
+            elif len(self._heap) >= self.window or now - arrival >= self.timeout:
+                ready.append((self.expected_sequence_num, None))
+                self.lost += 1
+                self.expected_sequence_num += 1
+            else:
+                break
+        return ready
+
+    def time_to_timeout(self, now=None):
+        """Time until the missing sequence being waited for is declared lost.
+
+        Args:
+            now (float): The current time, from time.monotonic(). Optional.
+
+        Returns:
+            float: Seconds until the timeout, or None if no sequence is being waited for.
+        """
+        if not self._heap:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._heap[0][1] + self.timeout - now)
+
+
 class ParseData(object):
     """Parse message data from sockets into file writable types, such as hdf5, json, dmap, etc.
 
+    Only the data products being written are parsed. The shared memory of the others is unlinked
+    without being mapped.
+
+    Args:
+        data_write_options (DataWriteOptions): The data write options from config.
+        products (set): The data products to parse, from DATA_PRODUCTS. All of them by default.
+
     Attributes:
         nested_dict (Python default nested dictionary): alias to a nested defaultdict
         processed_data (ProcessedSequenceMessage): Contains a message from dsp socket.
     """
 
-    def __init__(self, data_write_options):
+    def __init__(self, data_write_options, products=DATA_PRODUCTS):
         super(ParseData, self).__init__()
 
         self.options = data_write_options
+        self.products = frozenset(products)
 
         # defaultdict will populate non-specified entries in the dictionary with the default
         # value given as an argument, in this case a dictionary. Nesting it in a lambda lets you
@@ -153,6 +338,8 @@ class ParseData(object):
 
         self._slice_ids = set()
         self._timestamps = []
+        self._noise_at_freq = collections.defaultdict(list)
+        self._lost_sequences = []
 
         self._gps_locked = True  # init True so that logical AND works properly in update() method
         self._gps_to_system_time_diff = 0.0
@@ -227,7 +414,7 @@ class ParseData(object):
         main_shm.unlink()
 
         intf_available = False
-        if self.processed_data.bfiq_intf_shm != '':
+        if self.processed_data.bfiq_intf_shm:
             intf_available = True
             intf_shm = shared_memory.SharedMemory(name=self.processed_data.bfiq_intf_shm)
             temp_data = np.ndarray((num_slices, max_num_beams, num_samps), dtype=np.complex64, buffer=intf_shm.buf)
@@ -362,11 +549,15 @@ class ParseData(object):
 
         for data_set in data.output_datasets:
             self._slice_ids.add(data_set.slice_id)
+            self._noise_at_freq[data_set.slice_id].append(data_set.noise_at_freq)
 
-        if data.rawrf_shm != '':
-            self._raw_rf_available = True
-            self._rawrf_num_samps = data.rawrf_num_samps
-            self._rawrf_locations.append(data.rawrf_shm)
+        if data.rawrf_shm:
+            if 'raw_rf' in self.products:
+                self._raw_rf_available = True
+                self._rawrf_num_samps = data.rawrf_num_samps
+                self._rawrf_locations.append(data.rawrf_shm)
+            else:
+                unlink_shm(data.rawrf_shm)
 
         # Logical AND to catch any time the GPS may have been unlocked during the integration period
         self._gps_locked = self._gps_locked and data.gps_locked
@@ -384,9 +575,28 @@ class ParseData(object):
         # TODO(keith): Parallelize?
         procs = []
 
-        self.parse_correlations()
-        self.parse_bfiq()
-        self.parse_antenna_iq()
+        if 'rawacf' in self.products:
+            self.parse_correlations()
+        else:
+            for data_set in data.output_datasets:
+                for name in (data_set.main_acf_shm, data_set.intf_acf_shm, data_set.xcf_shm):
+                    if name:
+                        unlink_shm(name)
+
+        if 'bfiq' in self.products:
+            self.parse_bfiq()
+        else:
+            for name in (data.bfiq_main_shm, data.bfiq_intf_shm):
+                if name:
+                    unlink_shm(name)
+
+        if 'antenna_iq' in self.products:
+            self.parse_antenna_iq()
+        else:
+            for debug_stage in data.debug_data:
+                for name in (debug_stage.main_shm, debug_stage.intf_shm):
+                    if name:
+                        unlink_shm(name)
 
         for proc in procs:
             proc.start()
@@ -394,6 +604,14 @@ class ParseData(object):
         for proc in procs:
             proc.join()
 
+    def lost_sequence(self, sequence_num):
+        """ Records a sequence of the averaging period that was lost before data_write.
+
+        Args:
+            sequence_num (int): The sequence number that was lost.
+        """
+        self._lost_sequences.append(sequence_num)
+
     @property
     def sequence_num(self):
         """ Gets the sequence num of the latest processeddata packet.
@@ -508,6 +726,25 @@ class ParseData(object):
         """
         return self._timestamps
 
+    @property
+    def lost_sequences(self):
+        """Return the sequence numbers of the averaging period that were lost
+
+        Returns:
+            python list: The lost sequence numbers, in order
+        """
+        return self._lost_sequences
+
+    @property
+    def noise_at_freq(self):
+        """Return the noise at the receive frequency of each sequence, for each slice, from the
+        processed data packets
+
+        Returns:
+            dict: slice id: python list of the noise of each sequence
+        """
+        return self._noise_at_freq
+
     @property
     def rx_rate(self):
         """Return the rx_rate of the data in the data packet
@@ -607,13 +844,26 @@ class DataWrite(object):
 
     Args:
         data_write_options (DataWriteOptions): The data write options from config.
+        metrics (MetricsRegistry): Registry to report write throughput to. Optional.
     """
 
-    def __init__(self, data_write_options):
+    def __init__(self, data_write_options, metrics=None):
         super(DataWrite, self).__init__()
 
         # Used for getting info from config.
         self.options = data_write_options
+        tables.set_blosc_max_threads(self.options.compression_threads)
+
+        # Write throughput is reported here if given.
+        if metrics is None:
+            metrics = MetricsRegistry("data_write")
+        self.bytes_written = metrics.counter('bytes_written', 'Bytes of records written')
+        self.records_written = metrics.counter('records_written', 'Records written to file')
+        self.write_bandwidth = metrics.gauge('write_bandwidth_mbps',
+                                             'Write bandwidth of the last record, in MB/s')
+        self.write_latency = metrics.histogram('record_write_ms',
+                                               'Time to write a record and copy it to the two '
+                                               'hour file')
 
         # String format used for output files names that have slice data.
         self.two_hr_format = "{dt}.{site}.{sliceid}.{{ext}}"
@@ -629,6 +879,14 @@ class DataWrite(object):
         # A dict to hold filenames for all available slices in the experiment as they are received.
         self.slice_filenames = {}
 
+        # The array files being written to, by two hour file name with data type.
+        self.array_files = {}
+
+        # The averaging periods are written by their own threads, so two can append to the same
+        # DMAP file at once. Held over writing a record and indexing it, so the index entries of
+        # a DMAP file are in the order of its records.
+        self.dmap_lock = threading.Lock()
+
         # The git hash used to identify what version of Borealis is running.
         self.git_hash = sp.check_output("git describe --always".split()).strip()
 
@@ -638,6 +896,14 @@ class DataWrite(object):
         # Default this to true so we know if we are running for the first time.
         self.first_time = True
 
+    def close_array_files(self):
+        """
+        Close the array files being written to. They are reopened if written to again.
+        """
+        for array_file in self.array_files.values():
+            array_file.close()
+        self.array_files = {}
+
     def write_json_file(self, filename, data_dict):
         """
         Write out data to a json file. If the file already exists it will be overwritten.
@@ -647,12 +913,13 @@ class DataWrite(object):
         with open(filename, 'w+') as f:
             f.write(json.dumps(data_dict))
 
-    def write_hdf5_file(self, filename, data_dict, dt_str):
+    def write_hdf5_file(self, filename, data_dict, dt_str, compression=None):
         """
         Write out data to an HDF5 file. If the file already exists it will be overwritten.
         :param filename: The path to the file to write out. String
         :param data_dict: Python dictionary to write out to the HDF5 file.
         :param dt_str: A datetime timestamp of the first transmission time in the record as string.
+        :param compression: PyTables compression library and level, or None for no compression.
         """
 
         def convert_to_numpy(dd):
@@ -678,7 +945,9 @@ class DataWrite(object):
         warnings.simplefilter('ignore', tables.NaturalNameWarning)
 
         try:
-            dd.io.save(filename, time_stamped_dd, compression=None)
+            # Shared with the array files, as the HDF5 library is not thread safe.
+            with hdf5_lock:
+                dd.io.save(filename, time_stamped_dd, compression=compression)
         except Exception as e:
             if "No space left on device" in str(e):
                 print("No space left on device. Exiting")
@@ -687,17 +956,29 @@ class DataWrite(object):
                 print('Unknown error when saving to file: {}'.format(e))
                 os._exit(-1)
 
-    def write_dmap_file(self, filename, data_dict):
+    def write_dmap_file(self, filename, data_dict, data_type, borealis_file):
         """
-        Write out data to a dmap file. If the file already exists it will be overwritten.
-        :param filename: The path to the file to write out. String
-        :param data_dict: Python dictionary to write out to the dmap file.
+        Append a record to a SuperDARN DMAP file, as one DMAP record per beam. Only rawacf and bfiq
+        records have DMAP equivalents (rawacf and iqdat).
+        :param filename: The path to the DMAP file to append to. String
+        :param data_dict: Python dictionary of the Borealis record.
+        :param data_type: The Borealis data type of the record, rawacf or bfiq. String
+        :param borealis_file: The name of the two hour file the record belongs to. String
+        :returns: The byte offset of the record in the file and the number of bytes written.
+        :raises ValueError: if the record cannot be written as DMAP.
         """
-        # TODO: Complete this by parsing through the dictionary and write out to proper dmap format
-        raise NotImplementedError
+        records = dmap.DMAP_PRODUCTS[data_type][1](data_dict, borealis_file)
+        try:
+            return dmap.append_records(filename, records)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                print("No space left on device. Exiting")
+            else:
+                print('Unknown error when saving to file: {}'.format(e))
+            os._exit(-1)
 
     def output_data(self, write_bfiq, write_antenna_iq, write_raw_rf, write_tx, file_ext,
-                    aveperiod_meta, data_parsing, rt_dw, write_rawacf=True):
+                    aveperiod_meta, data_parsing, rt_dw, write_rawacf=True, array_format=False):
         """
         Parse through samples and write to file.
 
@@ -713,6 +994,8 @@ class DataWrite(object):
                                     in ParseData object.
         :param rt_dw:               Pair of socket and iden for RT purposes.
         :param write_rawacf:        Should rawacfs be written to file? Bool, default True.
+        :param array_format:        Should hdf5 rawacf, bfiq and antennas_iq files be written in
+                                    array format instead of site format? Bool, default False.
         """
 
         start = time.time()
@@ -780,8 +1063,25 @@ class DataWrite(object):
                                                        site=self.options.site_id)
                 self.slice_filenames[slice_id] = two_hr_str
 
+            self.close_array_files()
             self.next_boundary = two_hr_ceiling(time_now)
 
+        def index_record(indexed_file, final_data_dict, location, record_size):
+            """
+            Add a record written to a two hour file to the file's index.
+
+            :param indexed_file:        The two hour file the record was written to. String
+            :param final_data_dict:     Data dict of the record. Dict
+            :param location:            Where the record is in the file. Int
+            :param record_size:         The bytes the record added to the file. Int
+            """
+            try:
+                record_index.append_entry(indexed_file, final_data_dict, epoch_milliseconds,
+                                          location, record_size)
+            except OSError as e:
+                # The data is written, readers just have to scan the file for this record.
+                dw_print("Could not index record of {}: {}".format(indexed_file, e))
+
         def write_file(tmp_file, final_data_dict, two_hr_file_with_type):
             """
             Writes the final data out to the location based on the type of file extension required
@@ -798,7 +1098,59 @@ class DataWrite(object):
                     print("No space left on device. Exiting")
                     os._exit(-1)
 
-            if file_ext == 'hdf5':
+            write_start = time.time()
+            data_type = two_hr_file_with_type.rsplit('.', 1)[-1]
+            product = file_product(data_type)
+            compression = self.options.data_compression.get(product)
+            if file_ext == 'hdf5' and array_format and (data_type in ('rawacf', 'bfiq') or
+                                                        data_type.endswith('_iq')):
+                filters = None
+                if compression is not None:
+                    filters = tables.Filters(complib=compression[0], complevel=compression[1],
+                                             shuffle=True)
+                chunk_bytes = CHUNK_BYTES.get(product, DEFAULT_CHUNK_BYTES)
+                array_file = self.array_files.get(two_hr_file_with_type)
+                if array_file is None:
+                    array_file = ArrayFile("{0}/{1}.hdf5".format(dataset_directory,
+                                                                 two_hr_file_with_type),
+                                           filters=filters, chunk_bytes=chunk_bytes)
+                    self.array_files[two_hr_file_with_type] = array_file
+
+                try:
+                    size_before = os.path.getsize(array_file.filename)
+                except FileNotFoundError:
+                    size_before = 0
+                try:
+                    if not array_file.append(final_data_dict):
+                        # The metadata shared by the records of the file changed, so start a new
+                        # file named for this record.
+                        new_name = "{0}.{1}".format(time_now.strftime("%Y%m%d.%H%M.%S"),
+                                                    two_hr_file_with_type.split('.', 3)[3])
+                        dw_print("Metadata of {} changed, continuing in {}".format(
+                                 two_hr_file_with_type, new_name))
+                        array_file.close()
+                        array_file = ArrayFile("{0}/{1}.hdf5".format(dataset_directory, new_name),
+                                               filters=filters, chunk_bytes=chunk_bytes)
+                        self.array_files[two_hr_file_with_type] = array_file
+                        size_before = 0
+                        array_file.append(final_data_dict)
+                except Exception as e:
+                    if "No space left on device" in str(e):
+                        print("No space left on device. Exiting")
+                    else:
+                        print('Unknown error when saving to file: {}'.format(e))
+                    os._exit(-1)
+                record_size = os.path.getsize(array_file.filename) - size_before
+                index_record(array_file.filename, final_data_dict, array_file.num_records - 1,
+                             record_size)
+
+                # Realtime reads each rawacf record from its own site format file.
+                if data_type == 'rawacf':
+                    self.write_hdf5_file(tmp_file, final_data_dict, epoch_milliseconds,
+                                         compression)
+                    so.send_data(rt_dw['socket'], rt_dw['iden'], tmp_file)
+
+            elif file_ext == 'hdf5':
                 full_two_hr_file = "{0}/{1}.hdf5.site".format(dataset_directory, two_hr_file_with_type)
 
                 try:
@@ -812,7 +1164,9 @@ class DataWrite(object):
                         print("Unknown error when opening two hour file. Exiting")
                         os._exit(-1)
 
-                self.write_hdf5_file(tmp_file, final_data_dict, epoch_milliseconds)
+                self.write_hdf5_file(tmp_file, final_data_dict, epoch_milliseconds,
+                                     compression)
+                record_size = os.path.getsize(tmp_file)
 
                 # use external h5copy utility to move new record into 2hr file.
                 cmd = 'h5copy -i {newfile} -o {twohr} -s {dtstr} -d {dtstr}'
@@ -820,13 +1174,39 @@ class DataWrite(object):
 
                 # TODO(keith): improve call to subprocess.
                 sp.call(cmd.split())
+                index_record(full_two_hr_file, final_data_dict, int(epoch_milliseconds),
+                             record_size)
                 so.send_data(rt_dw['socket'], rt_dw['iden'], tmp_file)
                 # temp file is removed in real time module.
 
             elif file_ext == 'json':
                 self.write_json_file(tmp_file, final_data_dict)
+                record_size = os.path.getsize(tmp_file)
             elif file_ext == 'dmap':
-                self.write_dmap_file(tmp_file, final_data_dict)
+                # DMAP records are appended straight to the two hour file, with the DMAP file type
+                # in place of the Borealis one, e.g. bfiq records go to an iqdat file.
+                two_hr_file = two_hr_file_with_type.rsplit('.', 1)[0]
+                if data_type not in dmap.DMAP_PRODUCTS:
+                    dw_print("No DMAP format for {} data, not writing it".format(data_type))
+                    return
+                full_two_hr_file = "{0}/{1}.{2}.dmap".format(dataset_directory, two_hr_file,
+                                                             dmap.DMAP_PRODUCTS[data_type][0])
+                with self.dmap_lock:
+                    try:
+                        location, record_size = self.write_dmap_file(full_two_hr_file,
+                                                                     final_data_dict, data_type,
+                                                                     two_hr_file_with_type)
+                    except ValueError as e:
+                        dw_print("Not writing {} record as DMAP: {}".format(data_type, e))
+                        return
+                    index_record(full_two_hr_file, final_data_dict, location, record_size)
+
+            write_time = time.time() - write_start
+            self.records_written.inc()
+            self.bytes_written.inc(record_size)
+            self.write_latency.observe(write_time * 1000)
+            if write_time > 0 and record_size > 0:
+                self.write_bandwidth.set(record_size / write_time / 1e6)
 
         def write_correlations(parameters_holder):
             """
@@ -843,7 +1223,7 @@ class DataWrite(object):
 
             needed_fields = ["borealis_git_hash", "experiment_id",
             "experiment_name", "experiment_comment", "num_slices", "slice_comment", "station",
-            "num_sequences", "range_sep", "first_range_rtt", "first_range", "rx_sample_rate",
+            "num_sequences", "lost_sequences", "range_sep", "first_range_rtt", "first_range", "rx_sample_rate",
             "scan_start_marker", "int_time", "tx_pulse_len", "tau_spacing",
             "main_antenna_count", "intf_antenna_count", "freq", "samples_data_type",
             "pulses", "lags", "blanked_samples", "sqn_timestamps", "beam_nums", "beam_azms",
@@ -935,7 +1315,7 @@ class DataWrite(object):
             """
             needed_fields = ["borealis_git_hash", "experiment_id",
             "experiment_name", "experiment_comment", "num_slices", "slice_comment", "station",
-            "num_sequences", "rx_sample_rate", "pulse_phase_offset",
+            "num_sequences", "lost_sequences", "rx_sample_rate", "pulse_phase_offset",
             "scan_start_marker", "int_time", "tx_pulse_len", "tau_spacing",
             "main_antenna_count", "intf_antenna_count", "freq", "samples_data_type",
             "pulses", "blanked_samples", "sqn_timestamps", "beam_nums", "beam_azms",
@@ -970,7 +1350,7 @@ class DataWrite(object):
 
                 parameters['num_samps'] = np.uint32(bfiq[slice_id]['num_samps'])
                 parameters['data_dimensions'] = np.array([num_antenna_arrays,
-                                                          aveperiod_meta.num_sequences,
+                                                          parameters['num_sequences'],
                                                           len(parameters['beam_nums']),
                                                           parameters['num_samps']], dtype=np.uint32)
 
@@ -998,7 +1378,7 @@ class DataWrite(object):
 
             needed_fields = ["borealis_git_hash", "experiment_id",
             "experiment_name", "experiment_comment", "num_slices", "slice_comment", "station",
-            "num_sequences", "rx_sample_rate", "scan_start_marker", "int_time", "tx_pulse_len", "tau_spacing",
+            "num_sequences", "lost_sequences", "rx_sample_rate", "scan_start_marker", "int_time", "tx_pulse_len", "tau_spacing",
             "main_antenna_count", "intf_antenna_count", "freq", "samples_data_type",
             "pulses", "sqn_timestamps", "beam_nums", "beam_azms", "data_dimensions", "data_descriptors",
             "antenna_arrays_order", "data", "num_samps", "pulse_phase_offset", "noise_at_freq",
@@ -1047,7 +1427,7 @@ class DataWrite(object):
                     num_ants = len(parameters['antenna_arrays_order'])
 
                     parameters['data_dimensions'] = np.array([num_ants,
-                                                              aveperiod_meta.num_sequences,
+                                                              parameters['num_sequences'],
                                                               parameters['num_samps']],
                                                              dtype=np.uint32)
 
@@ -1089,7 +1469,7 @@ class DataWrite(object):
 
             needed_fields = ["borealis_git_hash", "experiment_id",
             "experiment_name", "experiment_comment", "num_slices", "station",
-            "num_sequences", "rx_sample_rate", "scan_start_marker", "int_time",
+            "num_sequences", "lost_sequences", "rx_sample_rate", "scan_start_marker", "int_time",
             "main_antenna_count", "intf_antenna_count", "samples_data_type",
             "sqn_timestamps", "data_dimensions", "data_descriptors", "data", "num_samps",
             "rx_center_freq", "blanked_samples", "scheduling_mode", "gps_locked",
@@ -1172,8 +1552,21 @@ class DataWrite(object):
 
                 write_file(output_file, tx_data, self.tx_data_two_hr_name)
 
+        # Sequences lost before data_write are left out of the data, and their indices in the
+        # averaging period are recorded.
+        first_sequence_num = aveperiod_meta.last_sqn_num - aveperiod_meta.num_sequences + 1
+        lost_sequences = np.array([sequence_num - first_sequence_num
+                                   for sequence_num in data_parsing.lost_sequences],
+                                  dtype=np.uint32)
+        num_sequences = aveperiod_meta.num_sequences - len(lost_sequences)
+
         parameters_holder = {}
-        for meta in aveperiod_meta.sequences:
+        num_sequence_types = len(aveperiod_meta.sequences)
+        for sequence_index, meta in enumerate(aveperiod_meta.sequences):
+            # The sequences of an averaging period take turns, so this Sequence's encodings are
+            # those of every num_sequence_types-th sequence. Leave out the lost ones, like the data.
+            lost_encodings = {int(lost) // num_sequence_types for lost in lost_sequences
+                              if lost % num_sequence_types == sequence_index}
             for rx_freq in meta.rx_channels:
                 parameters = DATA_TEMPLATE.copy()
                 parameters['borealis_git_hash'] = self.git_hash.decode('utf-8')
@@ -1187,7 +1580,8 @@ class DataWrite(object):
                 parameters['slice_interfacing'] = rx_freq.interfacing        # string
                 parameters['num_slices'] = len(aveperiod_meta.sequences) * len(meta.rx_channels)
                 parameters['station'] = self.options.site_id
-                parameters['num_sequences'] = aveperiod_meta.num_sequences
+                parameters['num_sequences'] = num_sequences
+                parameters['lost_sequences'] = lost_sequences
                 parameters['num_ranges'] = np.uint32(rx_freq.num_ranges)
                 parameters['range_sep'] = np.float32(rx_freq.range_sep)
                 # time to first range and back. convert to meters, div by c then convert to us
@@ -1207,7 +1601,9 @@ class DataWrite(object):
                 parameters['pulses'] = np.array(rx_freq.ptab, dtype=np.uint32)
 
                 encodings = []
-                for encoding in rx_freq.sequence_encodings:
+                for i, encoding in enumerate(rx_freq.sequence_encodings):
+                    if i in lost_encodings:
+                        continue
                     encoding = np.array(encoding, dtype=np.float32)
                     encodings.append(encoding)
 
@@ -1230,7 +1626,8 @@ class DataWrite(object):
                     parameters['beam_nums'].append(np.uint32(beam.beam_num))
                     parameters['beam_azms'].append(beam.beam_azimuth)
 
-                parameters['noise_at_freq'] = [0.0] * aveperiod_meta.num_sequences  # TODO update. should come from data_parsing
+                parameters['noise_at_freq'] = np.array(data_parsing.noise_at_freq[rx_freq.slice_id],
+                                                       dtype=np.float64)
 
                 parameters['gps_locked'] = data_parsing.gps_locked
                 parameters['gps_to_system_time_diff'] = data_parsing.gps_to_system_time_diff
@@ -1261,9 +1658,7 @@ class DataWrite(object):
             else:
                 for rf_samples_location in data_parsing.rawrf_locations:
                     if rf_samples_location is not None:
-                        shm = shared_memory.SharedMemory(name=rf_samples_location)
-                        shm.close()
-                        shm.unlink()
+                        unlink_shm(rf_samples_location)
 
         if write_tx:
             write_tx_data()
@@ -1287,6 +1682,10 @@ def main():
                         action='store_true')
     parser.add_argument('--enable-tx', help='Save tx samples and metadata. Requires HDF5.',
                         action='store_true')
+    parser.add_argument('--array-format', help='Write HDF5 rawacf, bfiq and antennas_iq files in '
+                                               'array format instead of site format. rawrf and '
+                                               'tx data are still written in site format.',
+                        action='store_true')
     args = parser.parse_args()
 
     options = dwo.DataWriteOptions()
@@ -1305,18 +1704,39 @@ def main():
     if __debug__:
         dw_print("Socket connected")
 
-    data_parsing = ParseData(options)
+    metrics = MetricsRegistry("data_write", options.metrics_address)
+    reorder_depth = metrics.gauge('reorder_depth', 'Processed sequences held waiting for an '
+                                                   'earlier sequence')
+    sequences_lost = metrics.counter('sequences_lost', 'Sequences declared lost and skipped')
+    sequences_late = metrics.counter('sequences_late', 'Sequences dropped for arriving after '
+                                                       'they were declared lost')
+    aveperiods_pending = metrics.gauge('aveperiods_pending',
+                                       'Averaging period metadata waiting for its sequences')
+    shm_outstanding = metrics.gauge('shm_segments_outstanding',
+                                    'Shared memory segments not yet unlinked')
+    # Scanning /dev/shm is too slow to do for every sequence, so it is done for each snapshot.
+    shm_outstanding.set_function(count_shm_segments)
+    parse_latency = metrics.histogram('parse_ms', 'Time to parse one processed sequence')
+    metrics.start()
+
+    products = {product for product, enabled in zip(DATA_PRODUCTS,
+                                                    (args.enable_raw_acfs, args.enable_bfiq,
+                                                     args.enable_antenna_iq, args.enable_raw_rf))
+                if enabled}
+    data_parsing = ParseData(options, products)
 
     current_experiment = None
     data_write = None
     first_time = True
-    expected_sqn_num = 0
-    queued_sqns = []
+    last_sequence_num = None
+    reorder_buffer = ReorderBuffer(options.reorder_window, options.reorder_timeout)
     aveperiod_metadata_dict = dict()
     while True:
 
+        # Wake up in time to declare a missing sequence lost even if nothing else arrives.
+        timeout = reorder_buffer.time_to_timeout()
         try:
-            socks = dict(poller.poll())
+            socks = dict(poller.poll(None if timeout is None else int(timeout * 1000) + 1))
         except KeyboardInterrupt:
             sys.exit()
 
@@ -1332,41 +1752,26 @@ def main():
 
             processed_data = pickle.loads(data)
 
-            queued_sqns.append(processed_data)
-            # Check if any data processing finished out of order.
+            if not reorder_buffer.push(processed_data):
+                dw_print("Sequence #{} arrived after it was declared lost, dropping it".format(
+                         processed_data.sequence_num))
+                sequences_late.inc()
 
-            if processed_data.sequence_num != expected_sqn_num:
-                continue
+            aveperiods_pending.set(len(aveperiod_metadata_dict))
 
-            sorted_q = sorted(queued_sqns, key=lambda x: x.sequence_num)
+        for sequence_num, pd in reorder_buffer.pop():
+            if not first_time:
+                if last_sequence_num in aveperiod_metadata_dict:
+                    data_parsing.numpify_arrays()
+                    aveperiod_metadata = aveperiod_metadata_dict.pop(last_sequence_num)
 
-            # This is needed to check that if we have a backlog, there are no more
-            # skipped sequence numbers we are still waiting for.
-            break_now = False
-            for i, pd in enumerate(sorted_q):
-                if pd.sequence_num != expected_sqn_num + i:
-                    expected_sqn_num += i
-                    break_now = True
-                    break
-            if break_now:
-                if len(sorted_q) > 20:
-                    # TODO error out correctly
-                    dw_print("Lost sequence #{}. Exiting.".format(expected_sqn_num))
-                    sys.exit()
-                continue
-
-            expected_sqn_num = sorted_q[-1].sequence_num + 1
-
-            for pd in sorted_q:
-                if not first_time:
-                    if data_parsing.sequence_num in aveperiod_metadata_dict:
-                        data_parsing.numpify_arrays()
-                        aveperiod_metadata = aveperiod_metadata_dict.pop(data_parsing.sequence_num)
-
-                        if aveperiod_metadata.experiment_name != current_experiment:
-                            data_write = DataWrite(options)
-                            current_experiment = aveperiod_metadata.experiment_name
+                    if aveperiod_metadata.experiment_name != current_experiment:
+                        if data_write is not None:
+                            data_write.close_array_files()
+                        data_write = DataWrite(options, metrics)
+                        current_experiment = aveperiod_metadata.experiment_name
 
+                    if data_parsing.timestamps:
                         kwargs = dict(write_bfiq=args.enable_bfiq,
                                       write_antenna_iq=args.enable_antenna_iq,
                                       write_raw_rf=args.enable_raw_rf,
@@ -1376,20 +1781,32 @@ def main():
                                       data_parsing=data_parsing,
                                       rt_dw={"socket": realtime_to_data_write,
                                              "iden": options.rt_to_dw_identity},
-                                      write_rawacf=args.enable_raw_acfs)
+                                      write_rawacf=args.enable_raw_acfs,
+                                      array_format=args.array_format)
                         thread = threading.Thread(target=data_write.output_data, kwargs=kwargs)
                         thread.daemon = True
                         thread.start()
-                        data_parsing = ParseData(options)
+                    else:
+                        dw_print("All sequences of the averaging period ending with #{} were "
+                                 "lost, not writing it".format(last_sequence_num))
+                    data_parsing = ParseData(options, products)
+
+            first_time = False
+            last_sequence_num = sequence_num
 
-                first_time = False
+            if pd is None:
+                dw_print("Lost sequence #{}, skipping it".format(sequence_num))
+                data_parsing.lost_sequence(sequence_num)
+                sequences_lost.inc()
+                continue
 
-                start = time.time()
-                data_parsing.update(pd)
-                end = time.time()
-                dw_print("Time to parse: {:.6f} ms".format((end - start) * 1000))
+            start = time.time()
+            data_parsing.update(pd)
+            end = time.time()
+            dw_print("Time to parse: {:.6f} ms".format((end - start) * 1000))
+            parse_latency.observe((end - start) * 1000)
 
-            queued_sqns = []
+        reorder_depth.set(reorder_buffer.depth)
 
 
 if __name__ == '__main__':
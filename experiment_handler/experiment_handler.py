@@ -23,6 +23,7 @@ import inspect
 import importlib
 import threading
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 
 BOREALISPATH = os.environ['BOREALISPATH']
 sys.path.append(BOREALISPATH)
@@ -31,6 +32,8 @@ from utils.experiment_options.experimentoptions import ExperimentOptions
 from utils.zmq_borealis_helpers import socket_operations
 from experiment_prototype.experiment_exception import ExperimentException
 from experiment_prototype.experiment_prototype import ExperimentPrototype
+from experiment_prototype.experiment_cache import build_serialized_experiment, \
+    rebuild_serialized_experiment
 
 
 def printing(msg):
@@ -134,6 +137,22 @@ def retrieve_experiment(experiment_module_name):
     return Experiment
 
 
+def parse_kwargs_string(kwargs_string):
+    """
+    Parse the experiment keyword arguments given on the command line.
+
+    :param kwargs_string: string of comma separated key=value pairs, or an empty string.
+    :returns: dictionary of keyword arguments for the experiment.
+    """
+    kwargs = {}
+    if kwargs_string:
+        kwargs_list = kwargs_string.split(',')
+        for element in kwargs_list:
+            kwarg = element.split('=')
+            kwargs[kwarg[0]] = kwarg[1]
+    return kwargs
+
+
 def send_experiment(exp_handler_to_radar_control, iden, serialized_exp):
     """
     Send the experiment to radar_control module.
@@ -148,6 +167,79 @@ def send_experiment(exp_handler_to_radar_control, iden, serialized_exp):
         pass  # TODO handle this. Shutdown and restart all modules.
 
 
+class ExperimentBuilder(object):
+    """
+    Builds experiments in a separate process, so that a build never holds up the replies to
+    radar_control. Only the pickled experiment comes back, and it is sent on as is. Builds go
+    through the experiment cache if it is configured, so restarts and schedule switches to an
+    experiment that has been built (or prebuilt, see scheduler/prebuild_experiments.py) before
+    only have to load it.
+
+    :param experiment_name: The name of the experiment class, for printing.
+    """
+
+    def __init__(self, experiment_name):
+        super(ExperimentBuilder, self).__init__()
+        self.experiment_name = experiment_name
+        self._executor = ProcessPoolExecutor(max_workers=1)
+        self._pending_build = None
+
+    @property
+    def pending(self):
+        """Whether an updated experiment is being built, or is built and not taken yet."""
+        return self._pending_build is not None
+
+    def build(self, Experiment, kwargs, scheduling_mode_type, cache_dir=None):
+        """
+        Build an experiment and wait for it.
+
+        :param Experiment: The experiment class, inherited from ExperimentPrototype.
+        :param kwargs: Dictionary of keyword arguments for the experiment.
+        :param scheduling_mode_type: The scheduling mode of this run, e.g. common.
+        :param cache_dir: The experiment cache directory, or None to always build.
+        :returns: The pickled experiment.
+        :raises: Any exception raised by the build, e.g. ExperimentException.
+        """
+        return self._finish(self._executor.submit(build_serialized_experiment, Experiment,
+                                                  kwargs, scheduling_mode_type, cache_dir))
+
+    def rebuild(self, exp):
+        """
+        Start building an experiment again after its update method changed it. Take it with
+        take once it is done.
+
+        :param exp: The updated experiment.
+        """
+        self._pending_build = self._executor.submit(rebuild_serialized_experiment, exp)
+
+    def take(self, wait=False):
+        """
+        Take the experiment started with rebuild, if it is done.
+
+        :param wait: Wait for the build if it is not done yet.
+        :returns: The pickled experiment, or None if there is no build pending or it is not done
+                  and wait is False.
+        :raises: Any exception raised by the build, e.g. ExperimentException. The build is
+                 taken either way.
+        """
+        if self._pending_build is None or not (wait or self._pending_build.done()):
+            return None
+        build = self._pending_build
+        self._pending_build = None
+        return self._finish(build)
+
+    def shutdown(self):
+        """Stop the build process, once any build in progress is done."""
+        self._executor.shutdown()
+
+    def _finish(self, build):
+        serialized_exp, from_cache, build_time = build.result()
+        printing("Successful experiment {exp} {how} in {t:.2f} s ({size:.1f} kB)".format(
+                 exp=self.experiment_name, how="loaded from cache" if from_cache else "built",
+                 t=build_time, size=len(serialized_exp) / 1e3))
+        return serialized_exp
+
+
 def experiment_handler(semaphore, args):
     """
     Run the experiment. This is the main process when this program is called.
@@ -158,9 +250,12 @@ def experiment_handler(semaphore, args):
 
     This process begins with setup of sockets and retrieving the experiment class from the module.
     It then waits for a message of type RadarStatus to come in from the radar_control block. If
-    the status is 'EXPNEEDED', meaning an experiment is needed, experiment_handler will build the
-    scan iterable objects (of class ScanClassBase) and will pass them to radar_control. Other
-    statuses will be implemented in the future.
+    the status is 'EXPNEEDED', meaning an experiment is needed, experiment_handler will pass the
+    experiment with its scan iterable objects (of class ScanClassBase) built to radar_control. The
+    experiment is built in a separate process, and the first build is waited for before listening
+    to radar_control. A rebuilt experiment is passed on in reply to the first 'NOERROR' status
+    (sent once per averaging period) after it is ready. Other statuses will be implemented in the
+    future.
 
     In the future, the update method will be implemented where the experiment can be modified by
     the incoming data.
@@ -186,19 +281,22 @@ def experiment_handler(semaphore, args):
         if experiment_update:
             printing("Experiment has an updated method.")
 
-    if args.kwargs_string:
-        # parse kwargs and pass to experiment
-        kwargs = {}
-        kwargs_list = args.kwargs_string.split(',')
-        for element in kwargs_list:
-            kwarg = element.split('=')
-            kwargs[kwarg[0]] = kwarg[1]
-        exp = Experiment(**kwargs)
-    else:
-        exp = Experiment()
+    # parse kwargs and pass to experiment
+    kwargs = parse_kwargs_string(args.kwargs_string)
+
+    builder = ExperimentBuilder(Experiment.__name__)
+    no_experiment = pickle.dumps(None, protocol=pickle.HIGHEST_PROTOCOL)
 
-    exp._set_scheduling_mode(scheduling_mode_type)
-    change_flag = True
+    # Wait for the first build, so that an experiment that does not build fails here at startup
+    # rather than when radar_control asks for it.
+    try:
+        serialized_exp = builder.build(Experiment, kwargs, scheduling_mode_type,
+                                       options.experiment_cache_directory or None)
+    except Exception:
+        builder.shutdown()
+        raise
+    # The experiment running, only unpickled if it has an update method.
+    exp = pickle.loads(serialized_exp) if experiment_update else None
 
     def update_experiment():
         # Recv complete processed data from DSP or datawrite? TODO
@@ -216,25 +314,12 @@ def experiment_handler(semaphore, args):
         if change_flag:
             if __debug__:
                 printing("Building an updated experiment.")
-            exp.build_scans()
-            printing("Experiment {exp} with CPID {cp} successfully updated"
-                     .format(exp=exp.__class__.__name__, cp=exp.cpid))
+            builder.rebuild(exp)
         semaphore.release()
 
     update_thread = threading.Thread(target=update_experiment)
 
     while True:
-
-        if not change_flag:
-            serialized_exp = pickle.dumps(None, protocol=pickle.HIGHEST_PROTOCOL)
-        else:
-            exp.build_scans()
-            printing("Successful experiment {exp} built with CPID {cp}".format(
-                     exp=exp.__class__.__name__, cp=exp.cpid))
-            serialized_exp = pickle.dumps(exp, protocol=pickle.HIGHEST_PROTOCOL)
-            # use the newest, fastest protocol (currently version 4 in python 3.4+)
-            change_flag = False
-
         # WAIT until radar_control is ready to receive a changed experiment
         message = socket_operations.recv_request(exp_handler_to_radar_control,
                                                  options.radctrl_to_exphan_identity,
@@ -244,6 +329,12 @@ def experiment_handler(semaphore, args):
             printing(request_msg)
 
         semaphore.acquire()
+        # Only wait for a build if radar_control has no experiment to run, otherwise it is sent
+        # when radar_control asks after it is done.
+        new_serialized_exp = builder.take(wait=message == 'EXPNEEDED')
+        if new_serialized_exp is not None:
+            serialized_exp = new_serialized_exp
+
         if message == 'EXPNEEDED':
             printing("Sending new experiment from beginning")
             # starting anew
@@ -253,15 +344,20 @@ def experiment_handler(semaphore, args):
         elif message == 'NOERROR':
             # no errors
             send_experiment(exp_handler_to_radar_control,
-                            options.radctrl_to_exphan_identity, serialized_exp)
+                            options.radctrl_to_exphan_identity,
+                            new_serialized_exp if new_serialized_exp is not None else no_experiment)
 
         # TODO: handle errors with revert back to original experiment. requires another
         # message
         semaphore.release()
 
-        if experiment_update:
+        if experiment_update and new_serialized_exp is not None:
+            # update works on the experiment that is running now.
+            exp = pickle.loads(new_serialized_exp)
+
+        if experiment_update and exp is not None:
             # check if a thread is already running !!!
-            if not update_thread.isAlive():
+            if not update_thread.is_alive() and not builder.pending:
                 if __debug__:
                     printing("Updating experiment")
                 update_thread = threading.Thread(target=update_experiment)
@@ -2,7 +2,10 @@
 import os
 import sys
 import math
-from scipy.signal import firwin, remez, kaiserord, kaiser_beta
+import hashlib
+import tempfile
+from importlib import metadata
+import numpy as np
 
 BOREALISPATH = os.environ['BOREALISPATH']
 sys.path.append(BOREALISPATH)
@@ -11,6 +14,23 @@ from utils.experiment_options.experimentoptions import ExperimentOptions
 from experiment_prototype.experiment_exception import ExperimentException
 from functools import reduce
 
+# Filter designs are kept in this subdirectory of the experiment_cache_directory in config.ini,
+# so experiments that use the same filters (e.g. all those with the default scheme) do not design
+# them again in every process. scipy.signal is only imported when a design is not in the cache.
+# Bump FILTER_CACHE_VERSION to invalidate existing designs if the design functions change.
+FILTER_CACHE_SUBDIRECTORY = 'filters'
+FILTER_CACHE_VERSION = 1
+
+_filter_designs = {}  # designs used in this process, by cache key
+_filter_cache_directory = None
+
+# Designs can change between scipy versions, so the version is part of the cache key. Looked up
+# once here, as reading the package metadata is slow.
+try:
+    _scipy_version = metadata.version('scipy')
+except metadata.PackageNotFoundError:
+    _scipy_version = None
+
 
 class DecimationStage(object):
 
@@ -146,6 +166,204 @@ def create_default_scheme():
     return (DecimationScheme(5.0e6, 10.0e3/3, stages=all_stages))
 
 
+def decimation_scheme_cost(decimation_scheme, num_slices=1):
+    """
+    The number of complex multiply-adds the DSP does per output sample, per antenna, to filter and
+    decimate with a decimation scheme. Every stage is run once per slice (the first stage as a
+    bandpass filter mixed to the slice's frequency), and a stage only computes the samples it
+    keeps, so a stage costs its taps for each of its output samples.
+
+    :param decimation_scheme: the DecimationScheme.
+    :param num_slices: the number of slices (receive frequencies) processed.
+    :return: multiply-adds per output sample.
+    """
+    num_taps = [len(stage.filter_taps) for stage in decimation_scheme.stages]
+    return num_slices * _filtering_cost(num_taps, decimation_scheme.dm_rates)
+
+
+def _filtering_cost(num_taps, dm_rates):
+    # Each output sample of stage i takes the product of the later dm_rates output samples of i.
+    cost = 0
+    samples_per_output = 1
+    for taps, dm_rate in zip(reversed(num_taps), reversed(dm_rates)):
+        cost += taps * samples_per_output
+        samples_per_output *= dm_rate
+    return cost
+
+
+def _ordered_factorizations(number, max_factors):
+    """All ways to write number as an ordered product of at most max_factors integers >= 2."""
+    if number == 1:
+        yield ()
+        return
+    if max_factors == 0:
+        return
+    for factor in range(2, number + 1):
+        if number % factor == 0:
+            for rest in _ordered_factorizations(number // factor, max_factors - 1):
+                yield (factor,) + rest
+
+
+def design_decimation_scheme(rxrate, output_sample_rate, passband, stopband_attenuation,
+                             num_slices=1, scaling_factors=None, printing=True):
+    """
+    Design the decimation scheme that takes the fewest multiply-adds per output sample (see
+    decimation_scheme_cost) to decimate from rxrate to output_sample_rate.
+
+    Every way of splitting the total decimation into integer stages is tried, up to
+    max_number_of_filtering_stages stages. Each stage is a Kaiser windowed lowpass filter made by
+    create_firwin_filter_by_attenuation with cutoff passband and the given stopband
+    attenuation. Its transition band reaches from the passband up to where the band that
+    aliases onto the passband after decimation starts (the stage output rate minus passband), as
+    that is the widest transition, and so the fewest taps, that keeps the passband clean. Splits
+    that need more than max_number_of_filter_taps_per_stage taps in any stage are skipped.
+
+    :param rxrate: sampling rate of USRP, in Hz.
+    :param output_sample_rate: desired output rate of the data, to decimate to, in Hz. rxrate
+    must be an integer multiple of it.
+    :param passband: the edge of the passband, in Hz. The passband is -passband to passband, so
+    it must be less than half of output_sample_rate.
+    :param stopband_attenuation: the attenuation of every stage's stopband, in dB.
+    :param num_slices: the number of slices the experiment receives at once, which the cost is
+    multiplied by.
+    :param scaling_factors: the filter taps of each stage are multiplied by these, as in
+    create_default_scheme. If None, 10.0 for the first stage and 100.0 for the others, the same
+    as the default scheme.
+    :param printing: print the predicted cost of the design and of the default scheme.
+    :return DecimationScheme: the decimation scheme with the lowest predicted cost.
+    :raises ExperimentException: if the rates or passband are not possible, or no split fits in
+    the stage and tap limits.
+    """
+    from scipy.signal import kaiserord
+
+    options = ExperimentOptions()
+    total_dm_rate = int(round(rxrate / output_sample_rate))
+    if total_dm_rate < 1 or not math.isclose(rxrate / total_dm_rate, output_sample_rate,
+                                             rel_tol=1e-9):
+        errmsg = 'rxrate {} is not an integer multiple of output rate {}'.format(
+            rxrate, output_sample_rate)
+        raise ExperimentException(errmsg)
+    if not 0 < passband < output_sample_rate / 2:
+        errmsg = 'Passband {} Hz must be more than 0 and less than half of the output rate {}' \
+                 ''.format(passband, output_sample_rate)
+        raise ExperimentException(errmsg)
+
+    num_taps_cache = {}
+
+    def stage_num_taps(input_rate, dm_rate):
+        # Taps of a stage as create_firwin_filter_by_attenuation makes them, without making it.
+        if (input_rate, dm_rate) not in num_taps_cache:
+            transition_width = input_rate / dm_rate - 2 * passband
+            num_taps_cache[(input_rate, dm_rate)] = \
+                kaiserord(stopband_attenuation, transition_width / input_rate)[0]
+        return num_taps_cache[(input_rate, dm_rate)]
+
+    best = None
+    for dm_rates in _ordered_factorizations(total_dm_rate, options.max_number_of_filtering_stages):
+        dm_rates = dm_rates or (1,)
+        input_rates = [rxrate / reduce(lambda a, b: a * b, dm_rates[:stage], 1)
+                       for stage in range(len(dm_rates))]
+        num_taps = [stage_num_taps(rate, dm_rate) for rate, dm_rate in zip(input_rates, dm_rates)]
+        if max(num_taps) > options.max_number_of_filter_taps_per_stage:
+            continue
+        cost = _filtering_cost(num_taps, dm_rates)
+        # Ties go to the split with fewer stages.
+        if best is None or (cost, len(dm_rates)) < (best[0], len(best[1])):
+            best = (cost, dm_rates, input_rates)
+
+    if best is None:
+        errmsg = 'No decimation scheme from {} Hz to {} Hz fits in {} stages of at most {} ' \
+                 'filter taps'.format(rxrate, output_sample_rate,
+                                      options.max_number_of_filtering_stages,
+                                      options.max_number_of_filter_taps_per_stage)
+        raise ExperimentException(errmsg)
+
+    cost, dm_rates, input_rates = best
+    if scaling_factors is None:
+        scaling_factors = [10.0] + [100.0] * (len(dm_rates) - 1)
+
+    all_stages = []
+    for stage, (rate, dm_rate) in enumerate(zip(input_rates, dm_rates)):
+        transition_width = rate / dm_rate - 2 * passband
+        filter_taps = list(scaling_factors[stage] * create_firwin_filter_by_attenuation(
+            rate, transition_width, passband + transition_width / 2, stopband_attenuation))
+        all_stages.append(DecimationStage(stage, rate, dm_rate, filter_taps))
+    # Chain the rates the way the stages do, so the final rate matches exactly.
+    decimation_scheme = DecimationScheme(rxrate, all_stages[-1].output_rate, stages=all_stages)
+
+    if printing:
+        default_cost = decimation_scheme_cost(create_default_scheme(), num_slices)
+        print('Designed decimation scheme: dm_rates {}, filter taps {}, {} multiply-adds per '
+              'output sample per antenna (default scheme: {})'.format(
+                  list(dm_rates), [len(stage.filter_taps) for stage in all_stages],
+                  num_slices * cost, default_cost))
+
+    return decimation_scheme
+
+
+def _filter_cache_dir():
+    """The directory filter designs are kept in, or '' if they are only kept in memory."""
+    global _filter_cache_directory
+    if _filter_cache_directory is None:
+        try:
+            cache_dir = ExperimentOptions().experiment_cache_directory
+        except ExperimentException:
+            cache_dir = ''
+        _filter_cache_directory = os.path.join(cache_dir, FILTER_CACHE_SUBDIRECTORY) \
+            if cache_dir else ''
+    return _filter_cache_directory
+
+
+def _cached_filter(method, parameters, design):
+    """
+    Get filter taps from the filter cache, designing and storing them if they are not there.
+    Entries are written to a temporary file and renamed, so processes sharing the cache never
+    read a partial entry, and processes designing the same filter at once write the same taps.
+
+    :param method: the name of the design method.
+    :param parameters: tuple of everything the design depends on.
+    :param design: function that designs the filter and returns the taps.
+    :return: the filter taps, an ndarray the caller may modify.
+    """
+    key = hashlib.sha256(repr((FILTER_CACHE_VERSION, _scipy_version, method, parameters))
+                         .encode('utf-8')).hexdigest()
+
+    taps = _filter_designs.get(key)
+    if taps is None:
+        cache_dir = _filter_cache_dir()
+        path = os.path.join(cache_dir, '{}.{}.npy'.format(method, key)) if cache_dir else None
+        if path is not None:
+            try:
+                taps = np.load(path, allow_pickle=False)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                try:
+                    os.remove(path)  # a bad entry, design it again
+                except OSError:
+                    pass
+
+        if taps is None:
+            taps = np.asarray(design(), dtype=np.float64)
+            if path is not None:
+                tmp_path = None
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, taps, allow_pickle=False)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    # The filter can still be used, it will just be designed again next time.
+                    if tmp_path is not None and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+        taps.flags.writeable = False
+        _filter_designs[key] = taps
+
+    return taps.copy()
+
+
 def calculate_num_filter_taps(sampling_freq, trans_width, k):
     """
     Calculates the number of filter taps required for the filter, using the sampling rate,
@@ -170,8 +388,12 @@ def create_remez_filter(sampling_freq, cutoff_freq, trans_width):
 
     num_taps = calculate_num_filter_taps(sampling_freq, trans_width, 3)
 
-    lpass = remez(num_taps, [0, cutoff_freq, cutoff_freq + trans_width,
-                                    0.5 * sampling_freq], [1, 0], Hz=sampling_freq)
+    def design():
+        from scipy.signal import remez
+        return remez(num_taps, [0, cutoff_freq, cutoff_freq + trans_width,
+                                0.5 * sampling_freq], [1, 0], Hz=sampling_freq)
+
+    lpass = _cached_filter('remez', (sampling_freq, cutoff_freq, trans_width, num_taps), design)
 
     return lpass
 
@@ -191,16 +413,22 @@ def create_firwin_filter_by_attenuation(sample_rate, transition_width, cutoff_hz
     # relative to the Nyquist rate. '
     width_ratio = transition_width/nyq_rate
 
-    # Compute the order and Kaiser parameter for the FIR filter.
-    N, beta = kaiserord(ripple_db, width_ratio)
+    def design():
+        from scipy.signal import firwin, kaiserord
 
-    # Use firwin with a Kaiser window to create a lowpass FIR filter
-    if window_type == 'kaiser':
-        window = ('kaiser', beta)
-    else:
-        window = window_type
+        # Compute the order and Kaiser parameter for the FIR filter.
+        N, beta = kaiserord(ripple_db, width_ratio)
 
-    taps = firwin(N, 2*cutoff_hz/nyq_rate, window=window)
+        # Use firwin with a Kaiser window to create a lowpass FIR filter
+        if window_type == 'kaiser':
+            window = ('kaiser', beta)
+        else:
+            window = window_type
+
+        return firwin(N, 2*cutoff_hz/nyq_rate, window=window)
+
+    taps = _cached_filter('firwin_by_attenuation', (sample_rate, transition_width, cutoff_hz,
+                                                    ripple_db, window_type), design)
 
     return taps
 
@@ -220,7 +448,12 @@ def create_firwin_filter_by_num_taps(sample_rate, transition_width, cutoff_hz, n
     # relative to the Nyquist rate. '
     width_ratio = transition_width/nyq_rate
 
-    taps = firwin(num_taps, 2*cutoff_hz/nyq_rate, window=window_type)
+    def design():
+        from scipy.signal import firwin
+        return firwin(num_taps, 2*cutoff_hz/nyq_rate, window=window_type)
+
+    taps = _cached_filter('firwin_by_num_taps', (sample_rate, transition_width, cutoff_hz,
+                                                 num_taps, window_type), design)
 
     return taps
     
\ No newline at end of file
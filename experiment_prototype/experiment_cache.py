@@ -0,0 +1,316 @@
+#!/usr/bin/python
+
+"""
+    experiment_cache
+    ~~~~~~~~~~~~~~~~
+    An on-disk cache of built experiments, so that experiment_handler does not have to run
+    build_scans (slice checks, filter design and all the sequence and pulse building) every time
+    Borealis is restarted or the schedule switches experiments.
+
+    Entries are the pickled experiments sent to radar_control. They are content-addressed: the
+    key is a hash of everything the build depends on, i.e. the source of the experiment module
+    and of every Borealis module it uses, the experiment kwargs and scheduling mode, the
+    config.ini, hdw.dat and restrict.dat files, the Python version and whether Python is
+    optimized (-O). Changing any of them changes the key, so stale entries are never loaded,
+    and the least recently used entries are removed once there are too many.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import ast
+import hashlib
+import importlib.util
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from utils.experiment_options import experimentoptions
+from utils.experiment_options.experimentoptions import ExperimentOptions
+
+# Bump to invalidate all existing entries if the cache format changes.
+CACHE_VERSION = 1
+
+# Number of built experiments kept in the cache directory.
+EXPERIMENT_CACHE_SIZE = 16
+
+CACHE_SUFFIX = '.pickle'
+
+
+def build_experiment(Experiment, kwargs, scheduling_mode_type):
+    """
+    Build an experiment the way experiment_handler does, without the cache.
+
+    :param Experiment: the experiment class, inherited from ExperimentPrototype.
+    :param kwargs: dictionary of keyword arguments for the experiment.
+    :param scheduling_mode_type: the scheduling mode of this run, e.g. common.
+    :returns: the built experiment and its pickled form.
+    """
+    exp = Experiment(**kwargs)
+    exp._set_scheduling_mode(scheduling_mode_type)
+    exp.build_scans()
+    # use the newest, fastest protocol (currently version 4 in python 3.4+)
+    serialized_exp = pickle.dumps(exp, protocol=pickle.HIGHEST_PROTOCOL)
+    return exp, serialized_exp
+
+
+def build_serialized_experiment(Experiment, kwargs, scheduling_mode_type, cache_dir=None):
+    """
+    Build an experiment, through the cache in cache_dir if given, and return it pickled. This is
+    run in experiment_handler's build process, which only sends back the pickled experiment.
+
+    :param Experiment: the experiment class, inherited from ExperimentPrototype.
+    :param kwargs: dictionary of keyword arguments for the experiment.
+    :param scheduling_mode_type: the scheduling mode of this run, e.g. common.
+    :param cache_dir: the experiment cache directory, or None to always build.
+    :returns: the pickled experiment, whether it came from the cache, and the time taken in s.
+    """
+    start = time.perf_counter()
+    if cache_dir:
+        _, serialized_exp, from_cache = ExperimentCache(cache_dir).build(Experiment, kwargs,
+                                                                         scheduling_mode_type)
+    else:
+        _, serialized_exp = build_experiment(Experiment, kwargs, scheduling_mode_type)
+        from_cache = False
+    return serialized_exp, from_cache, time.perf_counter() - start
+
+
+def rebuild_serialized_experiment(exp):
+    """
+    Build an experiment again after its update method changed it, and return it pickled. This
+    is run in experiment_handler's build process.
+
+    :param exp: the updated experiment.
+    :returns: the pickled experiment, False (never from the cache), and the time taken in s.
+    """
+    start = time.perf_counter()
+    exp.build_scans()
+    serialized_exp = pickle.dumps(exp, protocol=pickle.HIGHEST_PROTOCOL)
+    return serialized_exp, False, time.perf_counter() - start
+
+
+def _imported_modules(module, path):
+    """
+    Find the modules a module's source imports. These include modules that only constants are
+    imported from (from module import CONSTANT), which leave nothing in the namespace of the
+    importing module that leads back to them.
+
+    :param module: the module.
+    :param path: its source file.
+    :returns: list of the imported modules that are loaded.
+    """
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            try:
+                names.append(importlib.util.resolve_name('.' * node.level + (node.module or ''),
+                                                         module.__package__))
+            except (ImportError, ValueError):
+                pass
+    return [sys.modules[name] for name in names if name in sys.modules]
+
+
+def experiment_source_files(Experiment):
+    """
+    Find the Borealis source files an experiment class depends on.
+
+    Starting from the module of the class, follows every module, class and function in the
+    module namespaces, and every module imported by the module sources, to the modules they come
+    from, keeping the ones inside BOREALISPATH. This gives the same files in any process that
+    imports the experiment. Modules imported some other way, e.g. with importlib, are not found.
+
+    :param Experiment: the experiment class.
+    :returns: sorted list of absolute paths.
+    """
+    borealis_path = os.path.abspath(os.environ['BOREALISPATH']) + os.sep
+
+    files = set()
+    seen = set()
+    pending = [sys.modules[Experiment.__module__]]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+
+        path = getattr(module, '__file__', None)
+        if path is None or not os.path.abspath(path).startswith(borealis_path):
+            continue
+        files.add(os.path.abspath(path))
+
+        pending.extend(_imported_modules(module, path))
+        for value in list(vars(module).values()):
+            if inspect.ismodule(value):
+                pending.append(value)
+            else:
+                dependency = sys.modules.get(getattr(value, '__module__', None) or '')
+                if dependency is not None:
+                    pending.append(dependency)
+
+    return sorted(files)
+
+
+class ExperimentCache(object):
+    """
+    A directory of built experiments.
+
+    :param cache_dir: the directory to keep the built experiments in. Created if needed.
+    :type cache_dir: str
+    :param max_entries: the number of built experiments to keep.
+    :type max_entries: int
+    :param options: the experiment options, used to find the site files. Read from config.ini
+                    if not given.
+    :type options: ExperimentOptions
+    """
+
+    def __init__(self, cache_dir, max_entries=EXPERIMENT_CACHE_SIZE, options=None):
+        super(ExperimentCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        if options is None:
+            options = ExperimentOptions()
+        self.site_files = [experimentoptions.config_file,
+                           experimentoptions.hdw_dat_file + options.site_id,
+                           experimentoptions.restricted_freq_file + options.site_id]
+
+    def key(self, Experiment, kwargs, scheduling_mode_type):
+        """
+        Get the cache key of an experiment build.
+
+        :param Experiment: the experiment class.
+        :param kwargs: dictionary of keyword arguments for the experiment.
+        :param scheduling_mode_type: the scheduling mode of this run.
+        :returns: the key, a hex digest.
+        """
+        borealis_path = os.path.abspath(os.environ['BOREALISPATH'])
+
+        key_hash = hashlib.sha256()
+        key_hash.update(repr((CACHE_VERSION, sys.version_info[:3], __debug__,
+                              Experiment.__module__, Experiment.__qualname__,
+                              sorted(kwargs.items()), scheduling_mode_type)).encode('utf-8'))
+
+        files = [(os.path.relpath(path, borealis_path), path)
+                 for path in experiment_source_files(Experiment)]
+        files.extend((os.path.basename(path), path) for path in self.site_files)
+        for name, path in files:
+            key_hash.update(name.encode('utf-8') + b'\0')
+            try:
+                with open(path, 'rb') as f:
+                    contents = f.read()
+            except IOError:
+                contents = b''
+            key_hash.update(hashlib.sha256(contents).digest())
+
+        return key_hash.hexdigest()
+
+    def path(self, Experiment, key):
+        return os.path.join(self.cache_dir, '{}.{}{}'.format(Experiment.__module__, key,
+                                                            CACHE_SUFFIX))
+
+    def load(self, Experiment, key):
+        """
+        Load a built experiment.
+
+        :param Experiment: the experiment class.
+        :param key: the cache key of the build.
+        :returns: the experiment and its pickled form, or None if it is not in the cache or
+                  cannot be loaded, in which case the entry is removed.
+        """
+        path = self.path(Experiment, key)
+        try:
+            with open(path, 'rb') as f:
+                serialized_exp = f.read()
+            exp = pickle.loads(serialized_exp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self._remove(path)
+            return None
+
+        if not isinstance(exp, Experiment):
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return exp, serialized_exp
+
+    def store(self, Experiment, key, serialized_exp):
+        """
+        Add a built experiment, then remove the least recently used entries over max_entries.
+        The entry is written to a temporary file and renamed, so readers never see a partial
+        entry.
+
+        :param Experiment: the experiment class.
+        :param key: the cache key of the build.
+        :param serialized_exp: the pickled experiment.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(serialized_exp)
+            os.replace(tmp_path, self.path(Experiment, key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+        self.prune()
+
+    def build(self, Experiment, kwargs, scheduling_mode_type):
+        """
+        Get a built experiment, from the cache if possible, otherwise building and storing it.
+
+        :param Experiment: the experiment class, inherited from ExperimentPrototype.
+        :param kwargs: dictionary of keyword arguments for the experiment.
+        :param scheduling_mode_type: the scheduling mode of this run, e.g. common.
+        :returns: the built experiment, its pickled form, and whether it came from the cache.
+        """
+        key = self.key(Experiment, kwargs, scheduling_mode_type)
+        cached = self.load(Experiment, key)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+        exp, serialized_exp = build_experiment(Experiment, kwargs, scheduling_mode_type)
+        try:
+            self.store(Experiment, key, serialized_exp)
+        except OSError:
+            pass  # The experiment can still run, it will just be built again next time.
+        return exp, serialized_exp, False
+
+    def prune(self):
+        """Remove the least recently used entries over max_entries."""
+        try:
+            names = [name for name in os.listdir(self.cache_dir) if name.endswith(CACHE_SUFFIX)]
+        except FileNotFoundError:
+            return
+
+        entries = []
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -85,7 +85,7 @@ Slices which are interfaced in this manner must share:
 """
 
 slice_key_set = frozenset(["slice_id", "cpid", "tx_antennas", "rx_main_antennas", "rx_int_antennas", "pulse_sequence",
-                           "pulse_phase_offset", "tau_spacing", "pulse_len", "num_ranges", "first_range", "intt",
+                           "pulse_phase_offset", "pulse_phase_offset_batch", "tau_spacing", "pulse_len", "num_ranges", "first_range", "intt",
                            "intn", "beam_angle", "tx_beam_order", "rx_beam_order", "scanbound", "freq", "align_sequences",
                            "clrfrqrange", "averaging_method", "acf", "xcf", "acfint", "wavetype", "seqoffset", "iwavetable",
                            "qwavetable", "comment", "range_sep", "lag_table", "tx_antenna_pattern", "wait_for_first_scanbound"])
@@ -145,7 +145,7 @@ rx_beam_order *required*
 
 clrfrqrange *required or freq required*
     range for clear frequency search, should be a list of length = 2, [min_freq, max_freq]
-    in kHz. **Not currently supported.**
+    in kHz. **Not currently supported**, slices with a clrfrqrange are refused.
 
 freq *required or clrfrqrange required*
     transmit/receive frequency, in kHz. Note if you specify clrfrqrange it won't be used.
@@ -196,6 +196,19 @@ pulse_phase_offset *defaults*
 
     Result is expected to be real and in degrees and will be converted to complex radians.
 
+pulse_phase_offset_batch *defaults*
+    a handle to a function that generates the phases of several sequences at once, in place of
+    pulse_phase_offset, so a slice cannot have both. The beam number, a numpy array of sequence
+    numbers, and the number of pulses in the sequence are passed as arguments. The default is None.
+
+    encode_batch_fn(beam_num, sequence_nums, num_pulses):
+        return np.ones(size=(len(sequence_nums), num_pulses))
+
+    The return value must be a numpy array of size [len(sequence_nums), num_pulses], where each
+    row is the phase shift for each pulse of that sequence, in degrees. Upcoming sequences are
+    encoded in batches, so this avoids a Python call per sequence for encodings that can be
+    vectorized.
+
 range_sep *defaults*
     a calculated value from pulse_len. If already set, it will be overwritten to be the correct
     value determined by the pulse_len. Used for acfs. This is the range gate separation,
@@ -1464,52 +1477,30 @@ class ExperimentPrototype(object):
                                        (self.rx_minfreq, self.rx_maxfreq))
                 raise ExperimentException(errmsg)
 
-            still_checking = True
-            while still_checking:
-                for freq_range in self.options.restricted_ranges:
-                    if ((exp_slice['clrfrqrange'][0] >= freq_range[0]) and
-                                                (exp_slice['clrfrqrange'][0] <= freq_range[1])):
-                        if ((exp_slice['clrfrqrange'][1] >= freq_range[0]) and
-                                                (exp_slice['clrfrqrange'][1] <= freq_range[1])):
-                            # the range is entirely within the restricted range.
-                            raise ExperimentException('clrfrqrange is entirely within restricted '
-                                                      'range {}'.format(freq_range))
-                        else:
-                            if __debug__:
-                                print('Clrfrqrange will be modified because it is partially in a ' +
-                                'restricted range.')
-                            # TODO Log warning, changing clrfrqrange because lower portion is in a
-                            # restricted frequency range.
-                            exp_slice['clrfrqrange'][0] = freq_range[1] + 1
-                            # outside of restricted range now.
-                            break  # we have changed the 'clrfrqrange' - must restart the
-                            # check in case it's in another range.
-                    else:
-                        # lower end is not in restricted frequency range.
-                        if ((exp_slice['clrfrqrange'][1] >= freq_range[0]) and
-                                                (exp_slice['clrfrqrange'][1] <= freq_range[1])):
-                            if __debug__:
-                                print('Clrfrqrange will be modified because it is partially in a ' +
-                                'restricted range.')
-                            # TODO Log warning, changing clrfrqrange because upper portion is in a
-                            # restricted frequency range.
-                            exp_slice['clrfrqrange'][1] = freq_range[0] - 1
-                            # outside of restricted range now.
-                            break  # we have changed the 'clrfrqrange' - must restart the for loop
-                            # checking in case it's in another range.
-                        else:  # neither end of clrfrqrange is inside the restricted range but
-                            # we should check if the range is inside the clrfrqrange.
-                            if ((freq_range[0] >= exp_slice['clrfrqrange'][0]) and
-                                                (freq_range[0] <= exp_slice['clrfrqrange'][1])):
-                                if __debug__:
-                                    print('There is a restricted range within the clrfrqrange - '
-                                          'STOP.')
-                                # TODO Log a warning that there is a restricted range in the middle
-                                # of the
-                                # clrfrqrange that will be avoided OR could make this an Error.
-                                # Still need to implement clear frequency searching.
-                else:  # no break, so no changes to the clrfrqrange
-                    still_checking = False
+            restricted_frequencies = self.options.restricted_frequencies
+            clrfrqrange = restricted_frequencies.trim(*exp_slice['clrfrqrange'])
+            if clrfrqrange is None:
+                raise ExperimentException('clrfrqrange is entirely within restricted range {}'
+                                          .format(restricted_frequencies.find(
+                                              exp_slice['clrfrqrange'][0])))
+            if list(clrfrqrange) != list(exp_slice['clrfrqrange']):
+                if __debug__:
+                    print('Clrfrqrange will be modified because it is partially in a ' +
+                          'restricted range.')
+                # TODO Log warning, changing clrfrqrange because a portion is in a restricted
+                # frequency range.
+                exp_slice['clrfrqrange'][0], exp_slice['clrfrqrange'][1] = clrfrqrange
+            if restricted_frequencies.overlaps(*clrfrqrange):
+                if __debug__:
+                    print('There is a restricted range within the clrfrqrange - STOP.')
+                # TODO Log a warning that there is a restricted range in the middle of the
+                # clrfrqrange that will be avoided OR could make this an Error.
+
+            # radar_control does not run a clear frequency search between averaging periods yet,
+            # so the slice would have no frequency to transmit and receive on.
+            errmsg = 'Slice cannot use clrfrqrange {}: clear frequency search is not supported ' \
+                     'yet, set freq instead'.format(exp_slice['clrfrqrange'])
+            raise ExperimentException(errmsg)
 
         elif exp_slice['rxonly']:  # RX only mode.
             # In this mode, freq is required.
@@ -1552,11 +1543,10 @@ class ExperimentPrototype(object):
                                        self.rx_bandwidth/1.0e3, transition_bandwidth/1.0e3)
                 raise ExperimentException(errmsg)
 
-            for freq_range in self.options.restricted_ranges:
-                if ((exp_slice['freq'] >= freq_range[0]) and
-                                                (exp_slice['freq'] <= freq_range[1])):
-                    errmsg = "freq is within a restricted frequency range {}".format(freq_range)
-                    raise ExperimentException(errmsg)
+            freq_range = self.options.restricted_frequencies.find(exp_slice['freq'])
+            if freq_range is not None:
+                errmsg = "freq is within a restricted frequency range {}".format(freq_range)
+                raise ExperimentException(errmsg)
 
     def set_slice_defaults(self, exp_slice):
         """
@@ -1579,6 +1569,8 @@ class ExperimentPrototype(object):
                 [i for i in self.options.interferometer_antennas]
         if 'pulse_phase_offset' not in exp_slice:
             slice_with_defaults['pulse_phase_offset'] = None
+        if 'pulse_phase_offset_batch' not in exp_slice:
+            slice_with_defaults['pulse_phase_offset_batch'] = None
         if 'scanbound' not in exp_slice:
             slice_with_defaults['scanbound'] = None
         if 'tx_antenna_pattern' not in exp_slice:
@@ -1695,8 +1687,8 @@ class ExperimentPrototype(object):
         keys and check values of keys that are needed, and set defaults of keys that are optional.
 
         The following are always able to be defaulted, so are optional:
-        "tx_antennas", "rx_main_antennas", "rx_int_antennas", "pulse_phase_offset", "scanboundflag",
-        "scanbound", "acf", "xcf", "acfint", "wavetype", "seqoffset", "averaging_method", "align_sequences",
+        "tx_antennas", "rx_main_antennas", "rx_int_antennas", "pulse_phase_offset",
+        "pulse_phase_offset_batch", "scanboundflag", "scanbound", "acf", "xcf", "acfint", "wavetype", "seqoffset", "averaging_method", "align_sequences",
         and "wait_for_first_scanbound".
 
         The following are always required for processing acf, xcf, and acfint which we will assume
@@ -1927,6 +1919,23 @@ class ExperimentPrototype(object):
                         error_list.append("Slice {} Phase encoding return dimension must be "
                                           "equal to number of pulses".format(exp_slice['slice_id']))
 
+        if exp_slice['pulse_phase_offset'] and exp_slice['pulse_phase_offset_batch']:
+            error_list.append("Slice {} cannot have both a pulse_phase_offset and a "
+                              "pulse_phase_offset_batch function".format(exp_slice['slice_id']))
+
+        if exp_slice['pulse_phase_offset_batch']:
+            num_pulses = len(exp_slice['pulse_sequence'])
+
+            # Test the batch encoding fn with beam iterator of 0 and the first two sequences.
+            phase_encodings = exp_slice['pulse_phase_offset_batch'](0, np.arange(2), num_pulses)
+
+            if not isinstance(phase_encodings, np.ndarray):
+                error_list.append("Slice {} Batch phase encoding return is not numpy array".format(
+                    exp_slice['slice_id']))
+            elif phase_encodings.shape != (2, num_pulses):
+                error_list.append("Slice {} Batch phase encoding return must be of shape "
+                                  "[sequences, number of pulses]".format(exp_slice['slice_id']))
+
         if exp_slice['tx_antenna_pattern']:
             if not callable(exp_slice['tx_antenna_pattern']):
                 error_list.append("Slice {} tx antenna pattern must be a function".format(exp_slice['slice_id']))
@@ -82,8 +82,8 @@ class AveragingPeriod(ScanClassBase):
                 self.clrfrqflag = True
                 self.clrfrqrange.append(self.slice_dict[slice_id]['clrfrqrange'])
 
-        # TODO: SET UP CLEAR FREQUENCY SEARCH CAPABILITY
-        # also note for when setting this up clrfrqranges may overlap
+        # Slices with a clrfrqrange are refused by check_slice_specific_requirements until
+        # radar_control runs the search in utils.clear_frequency_search between averaging periods.
 
         self.intt = self.slice_dict[self.slice_ids[0]]['intt']
         self.intn = self.slice_dict[self.slice_ids[0]]['intn']
@@ -118,6 +118,10 @@ class AveragingPeriod(ScanClassBase):
         for params in self.prep_for_nested_scan_class():
             self.sequences.append(Sequence(*params))
 
+        # The sequences take turns, so each one only gets every len(sequences)-th sequence number.
+        for sequence in self.sequences:
+            sequence.sequence_num_stride = len(self.sequences)
+
         self.one_pulse_only = False
 
         self.beam_iter = 0 # used to keep track of place in beam order.
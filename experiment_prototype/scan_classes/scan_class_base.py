@@ -118,87 +118,78 @@ class ScanClassBase(object):
         """
         Sort keys of a list of combinations so that keys only appear once in the list.
 
-        This function modifies the input list_of_combos so that all associated
-        slices are in the same list. For example, if input is
-        list_of_combos = [[0,1], [0,2], [0,4], [1,4], [2,4]] and all_keys = [0,1,2,4,5]
-        then the output should be [[0,1,2,4], [5]]. This is used to get the slice
-        dictionary for nested class instances. In the above example, we would then have
-        two instances of the nested class to create: one with slices 0,1,2,4 and another
+        This function groups the slices so that all associated slices are in the same list.
+        For example, if input is list_of_combos = [[0,1], [0,2], [0,4], [1,2], [1,4], [2,4]]
+        and all_keys = [0,1,2,4,5] then the output should be [[0,1,2,4], [5]]. This is used to
+        get the slice dictionary for nested class instances. In the above example, we would then
+        have two instances of the nested class to create: one with slices 0,1,2,4 and another
         with slice 5.
 
+        The groups are the connected components of the graph with the slices as nodes and the
+        combos as edges, found with a union-find. Every slice in a group must be combined with
+        every other slice in the group, otherwise the interfacing is not valid.
+
         :param list_of_combos: list of lists of length two associating two slices
          together.
         :param all_keys: list of all keys included in this object (scan, ave_period, or
          sequence).
         :return: list of combos that is sorted so that each key only appears once and
          the lists within the list are of however long necessary
+        :raises ExperimentException: if two combined slices do not interface the same with a
+         third slice.
         """
 
-        list_of_combos = sorted(list_of_combos)
-
-        # if [2,4] and [1,4], then also must be [1,2] in the list_of_combos
-        # Now we are going to modify the list of lists of length = 2 to be a list of length x so that if [1,2] and [2,4]
-        # and [1,4] are in list_of_combos, we want only one list element for this scan : [1,2,4] .
-
-        scan_i = 0  # TODO detailed explanation with examples. Consider changing to a graph traversal algorithm?
-        while scan_i < len(list_of_combos):  # i: element in list_of_combos (representing one scan)
-            slice_id_k = 0
-            while slice_id_k < len(list_of_combos[scan_i]):  # k: element in scan (representing a slice)
-                scan_j = scan_i + 1  # j: iterates through the other elements of list_of_combos, to combine them into
-                # the first, i, if they are in fact part of the same scan.
-                while scan_j < len(list_of_combos):
-                    if list_of_combos[scan_i][slice_id_k] == list_of_combos[scan_j][0]:
-                        # if an element (slice_id) inside the i scan is the same as a slice_id in the j scan (somewhere
-                        # further in the list_of_combos), then we need to combine that j scan into the i scan. We only
-                        # need to check the first element of the j scan because list_of_combos has been sorted and we
-                        # know the first slice_id in the scan is less than the second slice id.
-                        add_n_slice_id = list_of_combos[scan_j][1]  # the slice_id to add to the i scan from the j scan.
-                        list_of_combos[scan_i].append(add_n_slice_id)
-                        # Combine the indices if there are 3+ slices combining in same scan
-                        for m in range(0, len(list_of_combos[scan_i]) - 1):
-                            # if we have added z to scan_i, such that scan_i is now [x,y,z], we now have to remove from
-                            # the list_of_combos list [x,z], and [y,z].
-                            # If x,z existed as SCAN but y,z did not, we have an error.
-
-                            # Try all values in list_of_combos[i] except the last value, which is = to add_n.
-                            try:
-                                list_of_combos.remove([list_of_combos[scan_i][m], add_n_slice_id])
-                                # list_of_combos[j][1] is the known last value in list_of_combos[i]
-                            except ValueError:
-                                # This error would occur if e.g. you had set [x,y] and [x,z] to CONCURRENT but [y,z] to
-                                # SCAN. This means that we couldn't remove the scan_combo y,z from the list because it
-                                # was not added to list_of_combos because it wasn't a scan type, so the interfacing
-                                # would not make sense (conflict).
-                                errmsg = 'Interfacing not Valid: exp_slice {} and exp_slice {} are combined in-scan and do not \
-                                    interface the same with exp_slice {}'.format(
-                                    list_of_combos[scan_i][m],
-                                    list_of_combos[scan_i][slice_id_k],
-                                    add_n_slice_id)
-                                raise ExperimentException(errmsg)
-                        scan_j = scan_j - 1
-                        # This means that the former list_of_combos[j] has been deleted and there are new values at
-                        #   index j, so decrement before incrementing in the while loop.
-                        # The above for loop will delete more than one element of list_of_combos (min 2) but the
-                        # while scan_j < len(list_of_combos) will reevaluate the length of list_of_combos.
-                    scan_j = scan_j + 1
-                slice_id_k = slice_id_k + 1  # if interfacing has been properly set up, the loop will only ever find
-                # elements to add to scan_i when slice_id_k = 0. If there were errors though
-                # (ex. x,y and y,z = CONCURRENT but x,z did not) then iterating through the slice_id elements will allow
-                # us to find the error.
-            scan_i = scan_i + 1  # At this point, all elements in the just-finished scan_i will not be found anywhere
-            #  else in list_of_combos.
-
-        # Now list_of_combos is a list of lists,  where a slice_id occurs only once, within the nested list.
-
-        for slice_id in all_keys:
-            for combo in list_of_combos:
-                if slice_id in combo:
-                    break
-            else:  # no break
-                list_of_combos.append([slice_id])
-                # Append the slice on its own, it is in its own object.
-
-        list_of_combos = sorted(list_of_combos)
-        return list_of_combos
+        parent = {slice_id: slice_id for slice_id in all_keys}
+
+        def find(slice_id):
+            while parent[slice_id] != slice_id:
+                parent[slice_id] = parent[parent[slice_id]]  # path halving
+                slice_id = parent[slice_id]
+            return slice_id
+
+        pairs = {tuple(sorted(combo)) for combo in list_of_combos}
+        for first, second in pairs:
+            root_0 = find(parent.setdefault(first, first))
+            root_1 = find(parent.setdefault(second, second))
+            if root_0 != root_1:
+                parent[max(root_0, root_1)] = min(root_0, root_1)
+
+        groups = {}
+        for slice_id in parent:
+            groups.setdefault(find(slice_id), []).append(slice_id)
+
+        # A group of n slices is only valid if all n * (n - 1) / 2 of its pairs are combined.
+        num_pairs = dict.fromkeys(groups, 0)
+        for first, second in pairs:
+            if first != second:
+                num_pairs[find(first)] += 1
+        for root, group in groups.items():
+            if num_pairs[root] != len(group) * (len(group) - 1) // 2:
+                ScanClassBase._raise_interfacing_conflict(sorted(group), pairs)
 
+        return sorted(sorted(group) for group in groups.values())
 
+    @staticmethod
+    def _raise_interfacing_conflict(group, pairs):
+        """
+        Find two combined slices of a group that do not interface the same with a third slice of
+        the group, and raise the error. Such slices exist in any group that is not fully combined.
+
+        :param group: sorted list of the slices of a group.
+        :param pairs: set of the combined (smaller_id, larger_id) slice pairs.
+        :raises ExperimentException: always.
+        """
+        neighbours = {slice_id: set() for slice_id in group}
+        for first, second in pairs:
+            if first in neighbours and first != second:
+                neighbours[first].add(second)
+                neighbours[second].add(first)
+
+        for first in group:
+            for second in sorted(neighbours[first]):
+                missing = sorted(neighbours[second] - neighbours[first] - {first})
+                if missing:
+                    errmsg = 'Interfacing not Valid: exp_slice {} and exp_slice {} are combined ' \
+                             'in-scan and do not interface the same with exp_slice {}' \
+                             ''.format(first, second, missing[0])
+                    raise ExperimentException(errmsg)
@@ -22,7 +22,7 @@ import sys
 import os
 from functools import reduce
 
-from sample_building.sample_building import get_samples, get_phase_shift
+from sample_building.sample_building import get_samples, get_phase_shift, get_phase_shifts
 from experiment_prototype.scan_classes.scan_class_base import ScanClassBase
 from experiment_prototype.experiment_exception import ExperimentException
 
@@ -31,6 +31,18 @@ import utils.shared_macros.shared_macros as sm
 
 sequence_print = sm.MODULE_PRINT("sequence building", "magenta")
 
+# Number of distinct transmit sequences (combinations of tx beams and phase encodings) kept in
+# each Sequence's cache. Each entry holds the samples of every pulse in the sequence for the main
+# antennas, so the memory cost is roughly size * main_antennas * pulse samples * 8 bytes.
+SEQUENCE_CACHE_SIZE = 32
+
+# Number of upcoming sequences that are prepared together when a slice is phase encoded.
+ENCODING_BATCH_SIZE = 8
+
+# Number of beam_iters whose prepared sequences are kept: the averaging period running and the
+# next one, which radar_control prepares while the first is still running.
+PREPARED_BEAM_ITERS = 2
+
 
 class Sequence(ScanClassBase):
     """
@@ -56,10 +68,18 @@ class Sequence(ScanClassBase):
     blanks
         A list of sample indices that should not be used for acfs because they were samples
         taken when transmitting.
+    rx_beam_phases
+        A dictionary of the receive phases of each slice for every beam direction, for all the
+        main ('main') and interferometer ('intf') antennas. [beam_angles, antennas]
+    rx_phase_tables
+        A dictionary of the receive phases of each slice for each beam_iter, in the layout sent to
+        DSP: a read-only array [beams, rx main antennas + rx intf antennas].
     basic_slice_pulses
         A dictionary that holds pre-computed tx samples for each slice. Each dictionary value is a
         multi-dimensional array that holds a beamformed set of samples for each antenna for all
-        beam directions.
+        beam directions. These are by far the largest part of a built experiment, so they are
+        not pickled. The phase shifts, pulse samples and scaling they are made from are pickled
+        instead and the arrays are made again when unpickled.
     combined_pulses_metadata
         This list holds dictionary metadata for all pulses in the sequence. This metadata holds all
         the info needed to combine pulses if pulses are mixed.
@@ -70,9 +90,30 @@ class Sequence(ScanClassBase):
             component_info - a list of all the pre-combined pulse components
                         (incl their length and start time) that are in the combined pulseAlso in us.
             pulse_transmit_data - dictionary hold the transmit metadata that will be sent to driver.
+    scatter_plan
+        Precomputed placement of every slice's pulses, used by make_sequence to build a sequence
+        with one vectorized add per pulse for a whole batch of sequences. Sequences are built in
+        a compact buffer that only holds the transmit window of each pulse (the pulse plus the tr
+        window on either side) for the main antennas. Keys are slice ids and values are dicts of:
+            antennas - the tx antennas of the slice that are main antennas, indexing the
+                       basic_slice_pulses.
+            rows - the compact buffer rows of those antennas, a slice if they are contiguous.
+            pulses - the index (in the slice's pulse_sequence) of each placed pulse.
+            columns - the [start, end) compact buffer columns of each placed pulse.
+    pulse_windows
+        The [start, end) compact buffer columns of each combined pulse's samples_array.
     output_encodings
         This dict will hold a list of all the encodings used during an aveperiod for each slice.
         These will be used for data write later.
+    encoded
+        True if any slice in the sequence has a pulse_phase_offset or pulse_phase_offset_batch.
+    sequence_num_stride
+        The difference between consecutive sequence numbers this sequence is run with, i.e. the
+        number of sequences in its averaging period. Used to prepare the right sequences ahead.
+    sequence_cache_size
+        The maximum number of transmit sequences kept in the cache used by make_sequence. The
+        transmitted samples only depend on the tx beam and phase encoding of each slice, so a
+        sequence with a combination seen recently is not rebuilt. Set to 0 to disable the cache.
     """
 
     def __init__(self, seqn_keys, sequence_slice_dict, sequence_interface, transmit_metadata):
@@ -104,9 +145,25 @@ class Sequence(ScanClassBase):
         dm_rate = self.transmit_metadata['dm_rate']
 
         self.basic_slice_pulses = {}
+        # The phase shift [beams, antennas] and pulse samples of each tx slice, and the amplitude
+        # scaling applied to its basic_slice_pulses, if any.
+        self._tx_pulse_factors = {}
+        self._tx_pulse_scaling = {}
         self.rx_beam_phases = {}
+        self.rx_phase_tables = {}
         single_pulse_timing = []
 
+        # Compute the phase tables of the main and intf arrays for all slices up front, with one
+        # vectorized call over all frequencies per beam_angle list. The calls to get_phase_shift
+        # below are then served from the shared cache, as are those of other sequences.
+        slice_freqs = collections.defaultdict(list)
+        for slice_id in self.slice_ids:
+            exp_slice = self.slice_dict[slice_id]
+            slice_freqs[tuple(exp_slice['beam_angle'])].append(float(exp_slice['freq']))
+        for beam_angle, freqs in slice_freqs.items():
+            get_phase_shifts(beam_angle, freqs, main_antenna_count, main_antenna_spacing)
+            get_phase_shifts(beam_angle, freqs, intf_antenna_count, intf_antenna_spacing, intf_offset[0])
+
         # For each slice calculate beamformed samples and place into the basic_slice_pulses dictionary.
         # Also populate the pulse timing metadata and place into single_pulse_timing
         for slice_id in self.slice_ids:
@@ -134,14 +191,11 @@ class Sequence(ScanClassBase):
                     tx_main_phase_shift = get_phase_shift(exp_slice['beam_angle'], freq_khz, main_antenna_count,
                                                           main_antenna_spacing)
 
-                # main_phase_shift: [num_beams, num_antennas]
-                # basic_samples:    [num_samples]
-                # phased_samps_for_beams: [num_beams, num_antennas, num_samples]
                 sequence_print('Main tx antenna complex phases: {}'.format(tx_main_phase_shift))
                 sequence_print('Main tx antenna magnitudes: {}'.format(np.abs(tx_main_phase_shift)))
                 sequence_print('Main tx antenna angles: {}'.format(np.rad2deg(np.angle(tx_main_phase_shift))))
-                phased_samps_for_beams = np.einsum('ij,k->ijk', tx_main_phase_shift, basic_samples)
-                self.basic_slice_pulses[slice_id] = phased_samps_for_beams
+                self._tx_pulse_factors[slice_id] = (tx_main_phase_shift, basic_samples)
+                self.basic_slice_pulses[slice_id] = self._make_basic_slice_pulses(slice_id)
             else:
                 self.basic_slice_pulses[slice_id] = []
 
@@ -153,7 +207,24 @@ class Sequence(ScanClassBase):
 
             self.rx_beam_phases[slice_id] = {'main': rx_main_phase_shift, 'intf': rx_intf_phase_shift}
 
-            for pulse_time in exp_slice['pulse_sequence']:
+            # The receive phases for each beam_iter, in the layout sent to DSP: for each beam, the
+            # phases of the slice's rx main antennas followed by its rx intf antennas. beam_iters
+            # with the same beams share a table, and the tables are read-only so they can be
+            # passed around without copying.
+            rx_phases = np.hstack((rx_main_phase_shift[:, exp_slice['rx_main_antennas']],
+                                   rx_intf_phase_shift[:, exp_slice['rx_int_antennas']]))
+            tables = {}
+            self.rx_phase_tables[slice_id] = []
+            for beam_num in exp_slice['rx_beam_order']:
+                if not isinstance(beam_num, list):
+                    beam_num = [beam_num]
+                if tuple(beam_num) not in tables:
+                    table = rx_phases[beam_num, :]
+                    table.flags.writeable = False
+                    tables[tuple(beam_num)] = table
+                self.rx_phase_tables[slice_id].append(tables[tuple(beam_num)])
+
+            for pulse_index, pulse_time in enumerate(exp_slice['pulse_sequence']):
                 pulse_timing_us = pulse_time * exp_slice['tau_spacing'] + exp_slice['seqoffset']
                 pulse_sample_start = round((pulse_timing_us * 1e-6) * txrate)
 
@@ -163,6 +234,7 @@ class Sequence(ScanClassBase):
                                             'pulse_len_us': exp_slice['pulse_len'],
                                             'pulse_sample_start': pulse_sample_start,
                                             'pulse_num_samps': pulse_num_samps,
+                                            'pulse_index': pulse_index,
                                             'slice_id': slice_id})
 
         single_pulse_timing = sorted(single_pulse_timing, key=lambda d: d['start_time_us'])
@@ -274,7 +346,8 @@ class Sequence(ScanClassBase):
         all_antennas = []
         for slice_id in self.slice_ids:
             if not exp_slice['rxonly']:
-                self.basic_slice_pulses[slice_id] *= max_usrp_dac_amplitude / power_divider[slice_id]
+                self._tx_pulse_scaling[slice_id] = max_usrp_dac_amplitude / power_divider[slice_id]
+                self.basic_slice_pulses[slice_id] *= self._tx_pulse_scaling[slice_id]
 
                 slice_tx_antennas = self.slice_dict[slice_id]['tx_antennas']
                 all_antennas.extend(slice_tx_antennas)
@@ -309,6 +382,8 @@ class Sequence(ScanClassBase):
 
         self.combined_pulses_metadata = combined_pulses_metadata
 
+        self._make_scatter_plan()
+
         # FIND the max scope sync time
         # The gc214 receiver card in the old system required 19 us for sample delay and another 10 us
         # as empirically discovered. in that case delay = (num_ranges + 19 + 10) * pulse_len.
@@ -353,6 +428,21 @@ class Sequence(ScanClassBase):
 
         self.output_encodings = collections.defaultdict(list)
 
+        # Cache of built sequences, keyed on the tx beam and encoding of each slice. Least recently
+        # used entries are dropped first.
+        self.sequence_cache_size = SEQUENCE_CACHE_SIZE
+        self._sequence_cache = collections.OrderedDict()
+
+        # Sequences made ahead of time by prepare_sequences, by beam_iter then sequence_num. The
+        # most recently prepared beam_iter is last.
+        self._prepared_sequences = collections.OrderedDict()
+        self.encoded = any(self.slice_dict[slice_id]['pulse_phase_offset'] or
+                           self.slice_dict[slice_id]['pulse_phase_offset_batch']
+                           for slice_id in self.slice_ids)
+        # Sequence numbers in an averaging period are shared by all its sequences, which take
+        # turns, so this sequence only sees every sequence_num_stride-th one.
+        self.sequence_num_stride = 1
+
         # create debug dict for tx samples.
         debug_dict = {'txrate': txrate,
                       'txctrfreq': txctrfreq,
@@ -384,6 +474,43 @@ class Sequence(ScanClassBase):
         if self.align_sequences:
             sequence_print("Aligning sequences to 0.1 second boundaries.")
 
+    def __getstate__(self):
+        """
+        Pickle the sequence without its basic_slice_pulses, which __setstate__ makes again from
+        their factors, and without the sequences built at run time.
+        """
+        state = self.__dict__.copy()
+        state['basic_slice_pulses'] = {slice_id: pulses for slice_id, pulses
+                                       in self.basic_slice_pulses.items()
+                                       if slice_id not in self._tx_pulse_factors}
+        state['output_encodings'] = collections.defaultdict(list)
+        state['_sequence_cache'] = collections.OrderedDict()
+        state['_prepared_sequences'] = collections.OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for slice_id in self._tx_pulse_factors:
+            self.basic_slice_pulses[slice_id] = self._make_basic_slice_pulses(slice_id)
+            if slice_id in self._tx_pulse_scaling:
+                self.basic_slice_pulses[slice_id] *= self._tx_pulse_scaling[slice_id]
+
+    def _make_basic_slice_pulses(self, slice_id):
+        """
+        Beamform a slice's pulse samples for all its beams, before scaling.
+
+        :param      slice_id:  The tx slice.
+        :type       slice_id:  int
+
+        :returns:   The samples [beams, antennas, samples].
+        :rtype:     ndarray
+        """
+        # main_phase_shift: [num_beams, num_antennas]
+        # basic_samples:    [num_samples]
+        # phased_samps_for_beams: [num_beams, num_antennas, num_samples]
+        tx_main_phase_shift, basic_samples = self._tx_pulse_factors[slice_id]
+        return np.einsum('ij,k->ijk', tx_main_phase_shift, basic_samples)
+
     def make_sequence(self, beam_iter, sequence_num):
         """
         Create the samples needed for each pulse in the sequence. This function is optimized to
@@ -392,6 +519,12 @@ class Sequence(ScanClassBase):
         dictionaries needed for this sequence for
         radar_control to use in operation.
 
+        Sequences are cached on the tx beam and phase encoding of each slice, so only a
+        combination that is not in the cache is built from scratch. The samples arrays of cached
+        sequences are shared between calls and must not be modified. If any slice is phase
+        encoded, the next ENCODING_BATCH_SIZE sequences are prepared together, see
+        prepare_sequences.
+
         :param      beam_iter:     The beam iterator
         :type       beam_iter:     int
         :param      sequence_num:  The sequence number in the ave period
@@ -406,85 +539,274 @@ class Sequence(ScanClassBase):
         main_antennas = self.transmit_metadata['main_antennas']
         txrate = self.transmit_metadata['txrate']
 
-        buffer_len = int(txrate * self.sstime * 1e-6)
-        # This is going to act as buffer for mixing pulses. It is the length of the receive samples
-        # since we know this will be large enough to hold samples at any pulse position. There will
-        # be a buffer for each antenna.
-        sequence = np.zeros([main_antenna_count, buffer_len], dtype=np.complex64)
-
-        for slice_id in self.slice_ids:
-            exp_slice = self.slice_dict[slice_id]
-            if exp_slice['rxonly']:
-                continue
-            beam_num = exp_slice['tx_beam_order'][beam_iter]
-            basic_samples = self.basic_slice_pulses[slice_id][beam_num]  # num_antennas x num_samps
+        if sequence_num not in self._prepared_sequences.get(beam_iter, ()):
+            if self.encoded:
+                # Prepare the next batch of sequences this Sequence will run in one go.
+                sequence_nums = sequence_num + self.sequence_num_stride * np.arange(ENCODING_BATCH_SIZE)
+            else:
+                sequence_nums = [sequence_num]
+            self.prepare_sequences(beam_iter, sequence_nums)
 
-            num_pulses = len(exp_slice['pulse_sequence'])
-            encode_fn = exp_slice['pulse_phase_offset']
-            if encode_fn:
-                # Must return 1D array of length [pulses].
-                phase_encoding = encode_fn(beam_num, sequence_num, num_pulses)
+        slice_encodings, pulse_samples, pulse_repeats = \
+            self._prepared_sequences[beam_iter].pop(sequence_num)
 
-                # dimensions: [pulses]
-                # Append list of phase encodings for this sequence, one per pulse.
-                # output_encodings contains a list of lists for each slice id
+        # Append list of phase encodings for this sequence, one per pulse.
+        # output_encodings contains a list of lists for each slice id
+        for slice_id, phase_encoding in slice_encodings.items():
+            if phase_encoding is not None:
                 self.output_encodings[slice_id].append(phase_encoding)
 
-                # phase_encoding: [pulses]
-                # basic_samples: [antennas, samples]
-                # samples: [pulses, antennas, samples]
-                phase_encoding = np.radians(phase_encoding)
-                phase_encoding = np.exp(1j * phase_encoding)
-                samples = np.einsum('i,jk->ijk', phase_encoding, basic_samples)
-
-            else:  # no encodings, all pulses in the slice are all the same
-                samples = np.repeat(basic_samples[np.newaxis, :, :], num_pulses, axis=0)
-
-            # sum the samples into their position in the sequence buffer. Find where the relative
-            # timing of each pulse matches the sample number in the buffer. Directly sum the samples
-            # for each pulse into the buffer position. If any pulses overlap, this is how they will
-            # be mixed.
-            for i, pulse in enumerate(self.combined_pulses_metadata):
-                for component_info in pulse['component_info']:
-                    if component_info['slice_id'] == slice_id:
-                        pulse_sample_start = component_info['pulse_sample_start']
-                        pulse_samples_len = component_info['pulse_num_samps']
-                        tx_antennas = self.slice_dict[slice_id]['tx_antennas']
-
-                        start = pulse['tr_window_num_samps'] + pulse_sample_start
-                        end = start + pulse_samples_len
-                        sequence[tx_antennas, start:end] += samples[i, tx_antennas, :]
-
-        # copy the encoded and combined samples into the metadata for the sequence.
+        # The pulse_transmit_data templates only hold immutable values and the sequence antenna
+        # list, which is never modified, so a shallow copy is enough.
         pulse_data = []
         for i, pulse in enumerate(self.combined_pulses_metadata):
-            pulse_sample_start = pulse['pulse_sample_start']
-
-            num_samples = pulse['total_num_samps']
-            start = pulse_sample_start
-            end = start + num_samples + 2 * pulse['tr_window_num_samps']
-            samples = sequence[main_antennas, start:end]    # Only keep around the samples for active N200s
-
-            new_pulse_info = copy.deepcopy(pulse['pulse_transmit_data'])
-            new_pulse_info['samples_array'] = samples
-
-            if i != 0:
-                last_pulse = pulse_data[i - 1]['samples_array']
-                if samples.shape == last_pulse.shape:
-                    if np.isclose(samples, last_pulse).all():
-                        new_pulse_info['isarepeat'] = True
-
+            new_pulse_info = dict(pulse['pulse_transmit_data'])
+            new_pulse_info['samples_array'] = pulse_samples[i]
+            new_pulse_info['isarepeat'] = pulse_repeats[i]
             pulse_data.append(new_pulse_info)
 
         if __debug__:
+            # Expand the pulse windows back out to the full sequence.
+            buffer_len = int(txrate * self.sstime * 1e-6)
+            full_sequence = np.zeros([main_antenna_count, buffer_len], dtype=np.complex64)
+            for i, pulse in enumerate(self.combined_pulses_metadata):
+                start = pulse['pulse_sample_start']
+                end = start + pulse_samples[i].shape[-1]
+                full_sequence[main_antennas, start:end] = pulse_samples[i]
             debug_dict = copy.deepcopy(self.debug_dict)
-            debug_dict['sequence_samples'] = sequence
-            debug_dict['decimated_samples'] = sequence[main_antennas, ::debug_dict['dmrate']]
+            debug_dict['sequence_samples'] = full_sequence
+            debug_dict['decimated_samples'] = full_sequence[main_antennas, ::debug_dict['dmrate']]
         else:
             debug_dict = None
 
         return pulse_data, debug_dict
 
+    def _make_scatter_plan(self):
+        """
+        Precompute where every pulse of every slice is placed in a sequence, so that make_sequence
+        does not need to walk the pulse metadata. See scatter_plan and pulse_windows.
+        """
+        main_antennas = self.transmit_metadata['main_antennas']
+
+        # Each combined pulse is sent to the driver as a window of samples starting at its first
+        # sample and including the tr window on either side. The windows are packed back to back
+        # in the compact buffer, merging any that overlap so they see the same samples.
+        windows = []
+        for pulse in self.combined_pulses_metadata:
+            start = pulse['pulse_sample_start']
+            end = start + pulse['total_num_samps'] + 2 * pulse['tr_window_num_samps']
+            windows.append((start, end))
+
+        segments = []   # [start, end, compact offset] in sequence samples
+        compact_len = 0
+        for start, end in sorted(windows):
+            if segments and start < segments[-1][1]:
+                if end > segments[-1][1]:
+                    compact_len += end - segments[-1][1]
+                    segments[-1][1] = end
+            else:
+                segments.append([start, end, compact_len])
+                compact_len += end - start
+
+        def to_compact(sample):
+            for seg_start, seg_end, offset in segments:
+                if seg_start <= sample < seg_end:
+                    return sample - seg_start + offset
+            raise ExperimentException("Sample {} is outside all pulse windows".format(sample))
+
+        self.pulse_windows = [(to_compact(start), to_compact(start) + end - start)
+                              for start, end in windows]
+        self.compact_buffer_len = compact_len
+
+        main_antenna_rows = {antenna: row for row, antenna in enumerate(main_antennas)}
+
+        scatter_plan = {}
+        for slice_id in self.slice_ids:
+            exp_slice = self.slice_dict[slice_id]
+            if exp_slice['rxonly']:
+                continue
+
+            antennas = [a for a in exp_slice['tx_antennas'] if a in main_antenna_rows]
+            pulses = []
+            columns = []
+            for pulse in self.combined_pulses_metadata:
+                for component_info in pulse['component_info']:
+                    if component_info['slice_id'] == slice_id:
+                        start = pulse['tr_window_num_samps'] + component_info['pulse_sample_start']
+                        compact_start = to_compact(start)
+                        pulses.append(component_info['pulse_index'])
+                        columns.append((compact_start,
+                                        compact_start + component_info['pulse_num_samps']))
+
+            # A slice whose tx antennas are all disabled gets no rows, so nothing is added for it.
+            rows = [main_antenna_rows[a] for a in antennas]
+            if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+                # A basic slice keeps the adds in place instead of going through a copy.
+                rows = slice(rows[0], rows[0] + len(rows))
+            else:
+                rows = np.array(rows, dtype=np.intp)
+            scatter_plan[slice_id] = {'antennas': np.array(antennas, dtype=np.intp),
+                                      'rows': rows,
+                                      'pulses': pulses,
+                                      'columns': columns}
+
+        self.scatter_plan = scatter_plan
+
+    def prepare_sequences(self, beam_iter, sequence_nums):
+        """
+        Get the phase encodings and build the transmit samples of several upcoming sequences at
+        once, for make_sequence to pick up. The encodings of all sequences come from one call to
+        the slice's pulse_phase_offset_batch function if it has one, and all the sequences that
+        are not already in the cache are built in a single vectorized step.
+
+        Any sequences prepared earlier for this beam_iter and not yet used are dropped. Those of
+        other beam_iters are kept, e.g. the ones of the averaging period running while the next one
+        is prepared, up to PREPARED_BEAM_ITERS beam_iters.
+
+        :param      beam_iter:      The beam iterator
+        :type       beam_iter:      int
+        :param      sequence_nums:  The sequence numbers (in the ave period) to prepare.
+        :type       sequence_nums:  list or ndarray of int
+        """
+        sequence_nums = [int(n) for n in sequence_nums]
+        num_sequences = len(sequence_nums)
+
+        prepared = {}
+        self._prepared_sequences.pop(beam_iter, None)
+        self._prepared_sequences[beam_iter] = prepared
+        while len(self._prepared_sequences) > PREPARED_BEAM_ITERS:
+            self._prepared_sequences.popitem(last=False)
+
+        # The transmitted samples only depend on the beam and the phase encoding of each slice,
+        # so those make up the key to the cache of previously built sequences.
+        slice_beams = {}
+        slice_encodings = {}    # [sequences, pulses] or None for each slice
+        for slice_id in self.slice_ids:
+            exp_slice = self.slice_dict[slice_id]
+            if exp_slice['rxonly']:
+                continue
+            beam_num = exp_slice['tx_beam_order'][beam_iter]
+            slice_beams[slice_id] = beam_num
+
+            num_pulses = len(exp_slice['pulse_sequence'])
+            if exp_slice['pulse_phase_offset_batch']:
+                # Must return 2D array of size [sequences, pulses].
+                encodings = exp_slice['pulse_phase_offset_batch'](beam_num, np.array(sequence_nums),
+                                                                  num_pulses)
+                slice_encodings[slice_id] = np.asarray(encodings)
+            elif exp_slice['pulse_phase_offset']:
+                # Must return 1D array of length [pulses].
+                encode_fn = exp_slice['pulse_phase_offset']
+                slice_encodings[slice_id] = np.array([encode_fn(beam_num, n, num_pulses)
+                                                      for n in sequence_nums])
+            else:
+                slice_encodings[slice_id] = None
+
+        def sequence_encodings(i):
+            return {slice_id: None if encodings is None else encodings[i]
+                    for slice_id, encodings in slice_encodings.items()}
+
+        cache_keys = []
+        for i in range(num_sequences):
+            cache_keys.append(tuple((slice_id, slice_beams[slice_id],
+                                     None if encoding is None else tuple(encoding.ravel().tolist()))
+                                    for slice_id, encoding in sequence_encodings(i).items()))
+
+        # Build every sequence that is not cached, once even if it appears more than once.
+        to_build = []
+        for i, cache_key in enumerate(cache_keys):
+            if cache_key not in self._sequence_cache and \
+                    cache_key not in [cache_keys[j] for j in to_build]:
+                to_build.append(i)
+
+        built = {}
+        if to_build:
+            build_encodings = {slice_id: None if encodings is None else encodings[to_build]
+                               for slice_id, encodings in slice_encodings.items()}
+            sequences = self._build_sequences(slice_beams, build_encodings, len(to_build))
+
+            for sequence, i in zip(sequences, to_build):
+                # slice out the encoded and combined samples for each pulse, and find the pulses
+                # that are the same as the one before so the driver can reuse them.
+                pulse_samples = []
+                pulse_repeats = []
+                for j, (start, end) in enumerate(self.pulse_windows):
+                    samples = sequence[:, start:end]
+
+                    isarepeat = False
+                    if j != 0:
+                        last_pulse = pulse_samples[j - 1]
+                        if samples.shape == last_pulse.shape:
+                            # Most pulses differ, which shows up at the middle sample of the
+                            # pulse (the edges are tr window zeros), so check that before the
+                            # whole pulse.
+                            mid = samples.shape[-1] // 2
+                            if np.isclose(samples[:, mid], last_pulse[:, mid]).all() and \
+                                    np.isclose(samples, last_pulse).all():
+                                isarepeat = True
+
+                    pulse_samples.append(samples)
+                    pulse_repeats.append(isarepeat)
+
+                built[cache_keys[i]] = (pulse_samples, pulse_repeats)
+
+        for i, (sequence_num, cache_key) in enumerate(zip(sequence_nums, cache_keys)):
+            if cache_key in built:
+                entry = built[cache_key]
+                if self.sequence_cache_size > 0:
+                    self._sequence_cache[cache_key] = entry
+            else:
+                entry = self._sequence_cache[cache_key]
+                self._sequence_cache.move_to_end(cache_key)
+            prepared[sequence_num] = (sequence_encodings(i),) + entry
+
+        while len(self._sequence_cache) > self.sequence_cache_size:
+            self._sequence_cache.popitem(last=False)
+
+    def _build_sequences(self, slice_beams, slice_encodings, num_sequences):
+        """
+        Build the compact transmit buffers of several sequences with the same beams.
+
+        :param      slice_beams:      The tx beam number for each transmitting slice.
+        :type       slice_beams:      dict
+        :param      slice_encodings:  The phase encodings (degrees, [sequences, pulses]) for each
+                                      transmitting slice, or None if the slice is not encoded.
+        :type       slice_encodings:  dict
+        :param      num_sequences:    The number of sequences to build.
+        :type       num_sequences:    int
+
+        :returns:   The samples for each main antenna in every pulse window of every sequence.
+        :rtype:     ndarray [num_sequences, len(main_antennas), compact_buffer_len]
+        """
+        main_antennas = self.transmit_metadata['main_antennas']
+
+        # This is going to act as buffer for mixing pulses. Only the pulse windows are kept.
+        sequences = np.zeros([num_sequences, len(main_antennas), self.compact_buffer_len],
+                             dtype=np.complex64)
+
+        for slice_id, beam_num in slice_beams.items():
+            plan = self.scatter_plan[slice_id]
+            # basic_samples: [antennas, samples]
+            basic_samples = self.basic_slice_pulses[slice_id][beam_num][plan['antennas']]
+
+            phase_encoding = slice_encodings[slice_id]
+            if phase_encoding is not None:
+                # phase_encoding: [sequences, pulses]
+                phase_encoding = np.exp(1j * np.radians(phase_encoding))
+
+            # Add each pulse into its position in every sequence at once. If pulses overlap,
+            # this is how they are mixed.
+            for pulse_index, (start, end) in zip(plan['pulses'], plan['columns']):
+                if phase_encoding is not None:
+                    # samples: [sequences, antennas, samples]
+                    samples = (basic_samples[np.newaxis, :, :] *
+                               phase_encoding[:, pulse_index, np.newaxis, np.newaxis])
+                else:  # no encodings, all pulses in the slice are all the same
+                    samples = basic_samples
+                sequences[:, plan['rows'], start:end] += samples
+
+        return sequences
+
     def find_blanks(self):
         """
         Finds the blanked samples after all pulse positions are calculated.
@@ -512,15 +834,7 @@ class Sequence(ScanClassBase):
         :type       beam_iter:  int
 
         :returns:   The receive phases.
-        :rtype:     Dict for both main and intf that contains an array of phases for each possible beam for each antenna.
+        :rtype:     Dict of the read-only rx_phase_tables array [beams, main + intf antennas] for
+                    each slice.
         """
-
-        temp_dict = copy.deepcopy(self.rx_beam_phases)
-        for k, v in temp_dict.items():
-            beam_num = self.slice_dict[k]['rx_beam_order'][beam_iter]
-            if not isinstance(beam_num, list):
-                beam_num = [beam_num]
-            v['main'] = v['main'][beam_num, :]
-            v['intf'] = v['intf'][beam_num, :]
-
-        return temp_dict
+        return {slice_id: tables[beam_iter] for slice_id, tables in self.rx_phase_tables.items()}
@@ -21,8 +21,8 @@ import experiments.superdarn_common_fields as scf
 from experiment_prototype.experiment_prototype import ExperimentPrototype
 from experiment_prototype.decimation_scheme.decimation_scheme import DecimationStage, DecimationScheme
 
-def phase_encode(beam_iter, sequence_num, num_pulses):
-    return np.random.uniform(-180.0, 180, num_pulses)
+def phase_encode_batch(beam_iter, sequence_nums, num_pulses):
+    return np.random.uniform(-180.0, 180, (len(sequence_nums), num_pulses))
 
 class ImptTest(ExperimentPrototype):
 
@@ -43,7 +43,7 @@ class ImptTest(ExperimentPrototype):
         }
 
         impt_slice = copy.deepcopy(default_slice)
-        impt_slice['pulse_phase_offset'] = phase_encode
+        impt_slice['pulse_phase_offset_batch'] = phase_encode_batch
 
         super(ImptTest, self).__init__(cpid, comment_string="Reimer IMPT Experiment")
 
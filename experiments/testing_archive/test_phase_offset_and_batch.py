@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+# write an experiment that raises an exception
+
+import sys
+import os
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+import experiments.superdarn_common_fields as scf
+from experiment_prototype.experiment_prototype import ExperimentPrototype
+
+
+class TestExperiment(ExperimentPrototype):
+
+    def __init__(self):
+        cpid = 1
+        super(TestExperiment, self).__init__(cpid)
+
+        if scf.IS_FORWARD_RADAR:
+            beams_to_use = scf.STD_24_FORWARD_BEAM_ORDER
+        else:
+            beams_to_use = scf.STD_24_REVERSE_BEAM_ORDER
+
+        if scf.opts.site_id in ["cly", "rkn", "inv"]:
+            num_ranges = scf.POLARDARN_NUM_RANGES
+        if scf.opts.site_id in ["sas", "pgr", "wal"]:
+            num_ranges = scf.STD_NUM_RANGES
+
+        slice_1 = {  # slice_id = 0, there is only one slice.
+            "pulse_sequence": scf.SEQUENCE_7P,
+            "tau_spacing": scf.TAU_SPACING_7P,
+            "pulse_len": scf.PULSE_LEN_45KM,
+            "num_ranges": num_ranges,
+            "first_range": scf.STD_FIRST_RANGE,
+            "intt": 3500,  # duration of an integration, in ms
+            "beam_angle": scf.STD_24_BEAM_ANGLE,
+            "rx_beam_order": beams_to_use,
+            "tx_beam_order": beams_to_use,
+            "scanbound": [i * 3.5 for i in range(len(beams_to_use))], #1 min scan
+            "freq" : scf.COMMON_MODE_FREQ_1, #kHz
+            "acf": True,
+            "xcf": True,  # cross-correlation processing
+            "acfint": True,  # interferometer acfs
+            "pulse_phase_offset": lambda beam_num, sequence_num, num_pulses: np.zeros(num_pulses),
+            "pulse_phase_offset_batch": lambda beam_num, sequence_nums, num_pulses:
+                np.zeros((len(sequence_nums), num_pulses)),
+        }
+        self.add_slice(slice_1)
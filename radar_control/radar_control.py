@@ -18,10 +18,13 @@ import time
 from datetime import datetime, timedelta
 import os
 import zmq
+import copy
 import pickle
+import queue
 import threading
+import collections
 import numpy as np
-from functools import reduce
+from functools import partial, reduce
 
 sys.path.append(os.environ["BOREALISPATH"])
 from experiment_prototype.experiment_exception import ExperimentException
@@ -30,6 +33,7 @@ from utils.experiment_options.experimentoptions import ExperimentOptions
 import utils.message_formats.message_formats as messages
 import utils.shared_macros.shared_macros as sm
 from utils.zmq_borealis_helpers import socket_operations
+from utils.metrics.metrics import MetricsRegistry
 
 if __debug__:
     from build.debug.utils.protobuf.driverpacket_pb2 import DriverPacket
@@ -41,6 +45,343 @@ TIME_PROFILE = False
 rad_ctrl_print = sm.MODULE_PRINT("radar control", "green")
 
 
+class PipelineJob(object):
+    """
+    A unit of work submitted to a PipelineStage.
+
+    :param function: The function to run.
+    :param args: Positional arguments to the function.
+    :param kwargs: Keyword arguments to the function.
+    """
+
+    def __init__(self, function, args, kwargs):
+        super(PipelineJob, self).__init__()
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        self._result = None
+        self._exception = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self._result = self._function(*self._args, **self._kwargs)
+        except Exception as e:
+            self._exception = e
+
+    def finish(self):
+        self._done.set()
+
+    def wait(self):
+        """
+        Wait for the job to be run.
+
+        :returns: The return value of the function.
+        :raises: Any exception raised by the function.
+        """
+        self._done.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class PipelineStage(object):
+    """
+    A long-lived worker thread that runs the jobs submitted to it one at a time, in the order
+    they were submitted. The sequence loop hands work to the stages through their queues instead
+    of starting a thread per sequence, and every job is timed by the stage.
+
+    :param name: The name of the stage, used for the thread and time profile output.
+    :param histogram: Histogram to observe the time of each job in (ms). Optional.
+    """
+
+    def __init__(self, name, histogram=None):
+        super(PipelineStage, self).__init__()
+        self.name = name
+        self._histogram = histogram
+        self._jobs = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a function to be run by the stage.
+
+        :returns: The PipelineJob, which can be waited on.
+        :raises RuntimeError: if the stage has been stopped.
+        """
+        if self._stopped:
+            raise RuntimeError('Pipeline stage {} is stopped'.format(self.name))
+        job = PipelineJob(function, args, kwargs)
+        self._jobs.put(job)
+        return job
+
+    def stop(self):
+        """
+        Stop the stage once the jobs already submitted have been run, and wait for its thread to
+        end.
+        """
+        self._stopped = True
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            start = time.perf_counter()
+            job.run()
+            job_time = (time.perf_counter() - start) * 1e3
+            if self._histogram is not None:
+                self._histogram.observe(job_time)
+            if TIME_PROFILE:
+                rad_ctrl_print('Time for {}: {:.3f} ms'.format(self.name, job_time))
+            job.finish()
+
+
+class SequenceProducer(object):
+    """
+    Builds the transmit sequences of averaging periods ahead of time on a long-lived thread.
+
+    The sequences are made in the order they are run, alternating between the Sequences of the
+    averaging period, and up to lookahead of them are queued so the next one is ready as soon as
+    the current one has been sent. Whenever the current averaging period's queue is full, the
+    thread works on the averaging period expected to run next, so its first sequences and
+    metadata are ready when the boundary comes. All sequences are built on the one thread, so the
+    Sequences are never used from two threads at once.
+
+    Each queued sequence is a dict of:
+        sequence_index - the index of the Sequence in the averaging period.
+        sequence_num - the sequence number in the averaging period.
+        pulse_data - the transmit data for each pulse, from Sequence.make_sequence.
+        debug - the debug dict from Sequence.make_sequence.
+        encodings - the phase encoding of each encoded slice in the sequence.
+        metadata - the return of metadata_fn for the Sequence at the averaging period's beam_iter.
+
+    :param lookahead: The number of sequences to build ahead of the one being sent.
+    :param metadata_fn: Function of (sequence, beam_iter) that prepares the metadata of a
+                        Sequence that is the same for every sequence it sends at that beam_iter.
+                        Called once per Sequence per averaging period. Optional.
+    :param histogram: Histogram to observe the time to make each sequence in (ms). Optional.
+    """
+
+    def __init__(self, lookahead, metadata_fn=None, histogram=None):
+        super(SequenceProducer, self).__init__()
+        self.lookahead = max(1, lookahead)
+        self._metadata_fn = metadata_fn
+        self._histogram = histogram
+        self._condition = threading.Condition()
+        self._current = None
+        self._next = None
+        self._thread = threading.Thread(target=self._run, name='make_sequences', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _request(aveperiod, beam_iter, metadata_fn=None):
+        return {'aveperiod': aveperiod,
+                'beam_iter': beam_iter,
+                'metadata_fn': metadata_fn,
+                'stopped': False,
+                'failed': False,
+                'sequence_num': 0,
+                'metadata': None,
+                'sequences': collections.deque()}
+
+    def start_aveperiod(self, aveperiod):
+        """
+        Start sending the sequences of an averaging period, at the averaging period's current
+        beam_iter. Building for any previous averaging period stops.
+
+        :param aveperiod: The AveragingPeriod to build sequences for.
+        :returns: True if the averaging period was prepared ahead with prepare_aveperiod.
+        """
+        with self._condition:
+            if self._current is not None:
+                self._current['stopped'] = True
+
+            upcoming = self._next
+            prepared = (upcoming is not None and upcoming['aveperiod'] is aveperiod and
+                        upcoming['beam_iter'] == aveperiod.beam_iter)
+            if prepared:
+                self._current = upcoming
+            else:
+                self._current = self._request(aveperiod, aveperiod.beam_iter)
+            self._next = None
+            self._condition.notify_all()
+        return prepared
+
+    def prepare_aveperiod(self, aveperiod, beam_iter, metadata_fn=None):
+        """
+        Prepare the averaging period that is expected to run after the current one, in the
+        background. Replaces any averaging period prepared before.
+
+        :param aveperiod: The AveragingPeriod expected next.
+        :param beam_iter: The beam_iter it will run at.
+        :param metadata_fn: Used instead of the producer's metadata_fn for this averaging period,
+                            e.g. when it belongs to an experiment that is not running yet.
+                            Optional.
+        """
+        with self._condition:
+            if self._next is not None:
+                self._next['stopped'] = True
+            self._next = self._request(aveperiod, beam_iter, metadata_fn)
+            self._condition.notify_all()
+
+    def stop(self):
+        """
+        Stop building sequences for the current averaging period.
+        """
+        with self._condition:
+            if self._current is not None:
+                self._current['stopped'] = True
+                self._current = None
+
+    def next_sequence(self):
+        """
+        Get the next sequence of the current averaging period, waiting for it to be built.
+
+        :returns: The sequence dict.
+        """
+        with self._condition:
+            request = self._current
+            while not request['sequences']:
+                self._condition.wait()
+            item = request['sequences'].popleft()
+            self._condition.notify_all()
+
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    @property
+    def ready(self):
+        """The number of sequences of the current averaging period built and waiting."""
+        with self._condition:
+            if self._current is None:
+                return 0
+            return len(self._current['sequences'])
+
+    def _pick(self):
+        # The current averaging period always comes first.
+        for request in (self._current, self._next):
+            if request is not None and not request['stopped'] and not request['failed'] and \
+                    len(request['sequences']) < self.lookahead:
+                return request
+        return None
+
+    def _make(self, request):
+        aveperiod = request['aveperiod']
+        if request['metadata'] is None:
+            metadata_fn = request['metadata_fn'] or self._metadata_fn
+            request['metadata'] = [None if metadata_fn is None else
+                                   metadata_fn(sequence, request['beam_iter'])
+                                   for sequence in aveperiod.sequences]
+
+        sequence_num = request['sequence_num']
+        sequence_index = sequence_num % len(aveperiod.sequences)
+        sequence = aveperiod.sequences[sequence_index]
+
+        start = time.perf_counter()
+        pulse_data, debug_dict = sequence.make_sequence(request['beam_iter'], sequence_num)
+        encodings = {slice_id: slice_encodings[-1] for slice_id, slice_encodings
+                     in sequence.output_encodings.items() if slice_encodings}
+        sequence.output_encodings.clear()
+        if self._histogram is not None:
+            self._histogram.observe((time.perf_counter() - start) * 1e3)
+
+        request['sequence_num'] += 1
+        return {'sequence_index': sequence_index,
+                'sequence_num': sequence_num,
+                'pulse_data': pulse_data,
+                'debug': debug_dict,
+                'encodings': encodings,
+                'metadata': request['metadata'][sequence_index]}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                request = self._pick()
+                while request is None:
+                    self._condition.wait()
+                    request = self._pick()
+
+            try:
+                item = self._make(request)
+            except Exception as e:
+                request['failed'] = True
+                item = e
+
+            with self._condition:
+                request['sequences'].append(item)
+                self._condition.notify_all()
+
+
+class ExperimentReceiver(object):
+    """
+    Asks experiment_handler for a new experiment on a background thread, once per averaging
+    period as radar_control always has, so that a new experiment is received and unpickled while
+    the current one keeps running. The radar loop calls request at the start of each averaging
+    period and takes the experiment at the next averaging period boundary. Once started, the
+    receiver thread is the only user of the socket to experiment_handler.
+
+    :param radar_control_to_exp_handler: The socket to experiment_handler.
+    :param exphan_to_radctrl_iden: The identity of experiment_handler.
+    """
+
+    def __init__(self, radar_control_to_exp_handler, exphan_to_radctrl_iden):
+        super(ExperimentReceiver, self).__init__()
+        self._socket = radar_control_to_exp_handler
+        self._iden = exphan_to_radctrl_iden
+        self._requested = threading.Event()
+        self._lock = threading.Lock()
+        self._experiment = None
+        self._received_time = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='receive_experiment', daemon=True)
+        self._thread.start()
+
+    def take(self):
+        """
+        Take the newest experiment received, if any. Raises any error the receiver thread had.
+
+        :returns: The experiment and the time.perf_counter() it was received at, or None if no
+                  new experiment has been received since the last take.
+        """
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._experiment is None:
+                return None
+            received = self._experiment, self._received_time
+            self._experiment = None
+            self._received_time = None
+        return received
+
+    def request(self):
+        """
+        Ask experiment_handler for a new experiment. Only one request is outstanding at a time,
+        so this does nothing if the last one has not been sent yet.
+        """
+        self._requested.set()
+
+    def _run(self):
+        try:
+            while True:
+                self._requested.wait()
+                self._requested.clear()
+                new_experiment_received, experiment = search_for_experiment(self._socket,
+                                                                            self._iden, 'NOERROR')
+                if new_experiment_received:
+                    with self._lock:
+                        self._experiment = experiment
+                        self._received_time = time.perf_counter()
+        except Exception as e:
+            with self._lock:
+                self._error = e
+
+
 def setup_driver(radctrl_to_driver, driver_to_radctrl_iden, txctrfreq, rxctrfreq,
                  txrate, rxrate):
     """ First packet sent to driver for setup.
@@ -69,10 +410,10 @@ def data_to_driver(radctrl_to_driver, driver_to_radctrl_iden, samples_array,
     """ Place data in the driver packet and send it via zeromq to the driver.
         :param radctrl_to_driver: the sender socket for sending the driverpacket
         :param driver_to_radctrl_iden: the reciever socket identity on the driver side
-        :param samples_array: this is a list of length main_antenna_count from the config file. It contains one
-            numpy array of complex values per antenna. If the antenna will not be transmitted on, it contains a
-            numpy array of zeros of the same length as the rest. All arrays will have the same length according to
-            the pulse length.
+        :param samples_array: this is a 2D numpy array of shape [main_antenna_count, num_samples]. It contains one
+            row of complex values per antenna. If the antenna will not be transmitted on, its row is all zeros.
+            All rows have the same length according to the pulse length. The samples are sent to the driver
+            packed as complex64 bytes, antenna-major.
         :param txctrfreq: the transmit center frequency to tune to.
         :param rxctrfreq: the receive center frequency to tune to. With rx_sample_rate from config.ini file, this
             determines the received signal band.
@@ -110,14 +451,11 @@ def data_to_driver(radctrl_to_driver, driver_to_radctrl_iden, samples_array,
             rad_ctrl_print(msg)
     else:
         # SETUP data to send to driver for transmit.
-        for ant_idx in range(samples_array.shape[0]):
-            sample_add = driverpacket.channel_samples.add()
-            # Add one Samples message for each channel possible in config.
-            # Any unused channels will be sent zeros.
-            # Protobuf expects types: int, long, or float, will reject numpy types and
-            # throw a TypeError so we must convert the numpy arrays to lists
-            sample_add.real.extend(samples_array[ant_idx, :].real.tolist())
-            sample_add.imag.extend(samples_array[ant_idx, :].imag.tolist())
+        # One row of samples for each channel possible in config. Any unused channels will be
+        # sent zeros. The rows are packed back to back as raw complex64, which the driver copies
+        # straight into its sample buffers.
+        driverpacket.num_channels = samples_array.shape[0]
+        driverpacket.packed_samples = np.ascontiguousarray(samples_array, dtype=np.complex64).tobytes()
         driverpacket.txcenterfreq = txctrfreq * 1000  # convert to Hz
         driverpacket.rxcenterfreq = rxctrfreq * 1000  # convert to Hz
         driverpacket.txrate = txrate
@@ -130,101 +468,109 @@ def data_to_driver(radctrl_to_driver, driver_to_radctrl_iden, samples_array,
     socket_operations.send_pulse(radctrl_to_driver, driver_to_radctrl_iden, driverpacket.SerializeToString())
 
 
-def send_dsp_metadata(radctrl_to_dsp, dsp_radctrl_iden, radctrl_to_brian,
-                      brian_radctrl_iden, rxrate, output_sample_rate, seqnum, slice_ids,
-                      slice_dict, beam_dict, sequence_time, first_rx_sample_start,
-                      rxctrfreq, pulse_phase_offsets, decimation_scheme=None):
-    """ Place data in the receiver packet and send it via zeromq to the signal processing unit and brian.
-        Happens every sequence.
-        :param radctrl_to_dsp: The sender socket for sending data to dsp
-        :param dsp_radctrl_iden: The receiver socket identity on the dsp side
+def make_dsp_metadata_template(rxrate, output_sample_rate, slice_ids, slice_dict, beam_dict,
+                               sequence_time, first_rx_sample_start, rxctrfreq):
+    """ Build the sequence metadata for the signal processing unit and brian that is the same for
+        every sequence of a Sequence at a given beam_iter. send_dsp_metadata fills in the rest.
         :param rxrate: The receive sampling rate (Hz).
         :param output_sample_rate: The output sample rate desired for the output data (Hz).
-        :param seqnum: the sequence number. This is a unique identifier for the sequence that is always increasing
-             with increasing sequences while radar_control is running. It is only reset when program restarts.
         :param slice_ids: The identifiers of the slices that are combined in this sequence. These IDs tell us where to
              look in the beam dictionary and slice dictionary for frequency information and beam direction information
              about this sequence to give to the signal processing unit.
         :param slice_dict: The slice dictionary, which contains information about all slices and will be referenced for
              information about the slices in this sequence. Namely, we get the frequency we want to receive at, the
              number of ranges and the first range information.
-        :param beam_dict: The dictionary containing beam directions for each slice.
+        :param beam_dict: The rx phases [beams, main + intf antennas] for each slice, from
+             Sequence.get_rx_phases.
         :param sequence_time: entire duration of sequence, including receive time after all
              transmissions.
         :param first_rx_sample_start: The sample where the first rx sample will start relative to the
              tx data.
         :param rxctrfreq: the center frequency of receiving.
-        :param pulse_phase_offsets: Phase offsets (degrees) applied to each pulse in the sequence
-        :param decimation_scheme: object of type DecimationScheme that has all decimation and
-             filtering data.
-
+        :returns: The SequenceMetadataMessage without a sequence number or decimation stages, and
+             with no phase offsets for the lags.
     """
-    # TODO: does the for loop below need to happen every time. Could be only updated
-    #  as necessary to make it more efficient.
-
     message = messages.SequenceMetadataMessage()
     message.sequence_time = sequence_time
-    message.sequence_num = seqnum
     message.offset_to_first_rx_sample = first_rx_sample_start
     message.rx_rate = rxrate
     message.output_sample_rate = output_sample_rate
     message.rx_ctr_freq = rxctrfreq * 1.0e3
 
-    if decimation_scheme is not None:
-        for stage in decimation_scheme.stages:
-            dm_stage_add = messages.DecimationStageMessage(stage.stage_num, stage.input_rate, stage.dm_rate,
-                                                           stage.filter_taps)
-            message.add_decimation_stage(dm_stage_add)
-
     for slice_id in slice_ids:
         chan_add = messages.RxChannel(slice_id)
         chan_add.tau_spacing = slice_dict[slice_id]['tau_spacing']
 
         # send the translational frequencies to dsp in order to bandpass filter correctly.
-        if slice_dict[slice_id]['clrfrqflag']:
-            pass  # TODO - get freq from clear frequency search.
-        else:
-            chan_add.rx_freq = slice_dict[slice_id]['freq'] * 1.0e3
+        # Slices with a clrfrqrange are refused when the experiment is built, so all have a freq.
+        chan_add.rx_freq = slice_dict[slice_id]['freq'] * 1.0e3
         chan_add.num_ranges = slice_dict[slice_id]['num_ranges']
         chan_add.first_range = slice_dict[slice_id]['first_range']
         chan_add.range_sep = slice_dict[slice_id]['range_sep']
 
-        main_bms = beam_dict[slice_id]['main']
-        intf_bms = beam_dict[slice_id]['intf']
-
-        beams = []
-        for i in range(main_bms.shape[0]):
-            # Don't need to send channel numbers, will always send beamdir with length = total antennas.
-            # Beam directions are formated e^i*phi so that a 0 will indicate not
-            # to receive on that channel.
-            mains = slice_dict[slice_id]['rx_main_antennas']
-            intfs = slice_dict[slice_id]['rx_int_antennas']
-            temp_main = main_bms[i][mains]
-            temp_intf = intf_bms[i][intfs]
-
-            # Combine main and intf such that for a given beam all main phases come first.
-            beams.append(np.hstack((temp_main, temp_intf)))
-        chan_add.beam_phases = np.array(beams)
+        # Beam directions are formated e^i*phi, for the slice's rx main antennas followed by its
+        # rx intf antennas, for each beam. The table is shared and read-only.
+        chan_add.beam_phases = beam_dict[slice_id]
 
         for lag in slice_dict[slice_id]['lag_table']:
             lag_add = messages.Lag(lag[0], lag[1], int(lag[1] - lag[0]))
-
-            # Get the phase offset for this pulse combination
-            if len(pulse_phase_offsets[slice_id]) != 0:
-                pulse_phase_offset = pulse_phase_offsets[slice_id][-1]
-                lag0_idx = slice_dict[slice_id]['pulse_sequence'].index(lag[0])
-                lag1_idx = slice_dict[slice_id]['pulse_sequence'].index(lag[1])
-                phase_in_rad = np.radians(pulse_phase_offset[lag0_idx] - pulse_phase_offset[lag1_idx])
-                phase_offset = np.exp(1j * np.array(phase_in_rad, np.float32))
-            # Catch case where no pulse phase offsets are specified
-            else:
-                phase_offset = 1.0 + 0.0j
-
+            phase_offset = 1.0 + 0.0j
             lag_add.phase_offset_real = np.real(phase_offset)
             lag_add.phase_offset_imag = np.imag(phase_offset)
             chan_add.add_lag(lag_add)
         message.add_rx_channel(chan_add)
 
+    return message
+
+
+def send_dsp_metadata(radctrl_to_dsp, dsp_radctrl_iden, radctrl_to_brian, brian_radctrl_iden,
+                      template, seqnum, slice_dict, pulse_phase_offsets, decimation_scheme=None):
+    """ Place data in the receiver packet and send it via zeromq to the signal processing unit and brian.
+        Happens every sequence.
+        :param radctrl_to_dsp: The sender socket for sending data to dsp
+        :param dsp_radctrl_iden: The receiver socket identity on the dsp side
+        :param template: The metadata for the Sequence at this beam_iter, from
+             make_dsp_metadata_template. It is not modified.
+        :param seqnum: the sequence number. This is a unique identifier for the sequence that is always increasing
+             with increasing sequences while radar_control is running. It is only reset when program restarts.
+        :param slice_dict: The slice dictionary, for the pulse sequence of each slice.
+        :param pulse_phase_offsets: Phase offsets (degrees) applied to each pulse in this sequence,
+             for each slice that is phase encoded.
+        :param decimation_scheme: object of type DecimationScheme that has all decimation and
+             filtering data.
+
+    """
+    message = copy.copy(template)
+    message.sequence_num = seqnum
+    message.decimation_stages = []
+    message.rx_channels = []
+
+    if decimation_scheme is not None:
+        for stage in decimation_scheme.stages:
+            dm_stage_add = messages.DecimationStageMessage(stage.stage_num, stage.input_rate, stage.dm_rate,
+                                                           stage.filter_taps)
+            message.add_decimation_stage(dm_stage_add)
+
+    for rx_channel in template.rx_channels:
+        slice_id = rx_channel.slice_id
+        if slice_id in pulse_phase_offsets:
+            # Get the phase offset for each pulse combination
+            pulse_phase_offset = pulse_phase_offsets[slice_id]
+            chan_add = copy.copy(rx_channel)
+            chan_add.lags = []
+            for lag in rx_channel.lags:
+                lag_add = messages.Lag(lag.pulse_1, lag.pulse_2, lag.lag_num)
+                lag0_idx = slice_dict[slice_id]['pulse_sequence'].index(lag.pulse_1)
+                lag1_idx = slice_dict[slice_id]['pulse_sequence'].index(lag.pulse_2)
+                phase_in_rad = np.radians(pulse_phase_offset[lag0_idx] - pulse_phase_offset[lag1_idx])
+                phase_offset = np.exp(1j * np.array(phase_in_rad, np.float32))
+                lag_add.phase_offset_real = np.real(phase_offset)
+                lag_add.phase_offset_imag = np.imag(phase_offset)
+                chan_add.add_lag(lag_add)
+        else:
+            chan_add = rx_channel
+        message.add_rx_channel(chan_add)
+
     # Brian requests sequence metadata for timeouts
     if TIME_PROFILE:
         time_waiting = datetime.utcnow()
@@ -275,13 +621,17 @@ def search_for_experiment(radar_control_to_exp_handler,
         errmsg = "ZMQ ERROR"
         raise [ExperimentException(errmsg), e]
 
+    load_start = time.perf_counter()
     new_exp = pickle.loads(serialized_exp)  # protocol detected automatically
+    load_time = time.perf_counter() - load_start
 
     if isinstance(new_exp, ExperimentPrototype):
         experiment = new_exp
         new_experiment_received = True
         if __debug__:
             rad_ctrl_print("NEW EXPERIMENT FOUND")
+        rad_ctrl_print("Received experiment {} ({:.1f} kB), loaded in {:.1f} ms".format(
+            experiment.experiment_name, len(serialized_exp) / 1e3, load_time * 1e3))
     elif new_exp is not None:
         if __debug__:
             rad_ctrl_print("RECEIVED AN EXPERIMENT NOT OF TYPE EXPERIMENT_PROTOTYPE. CANNOT RUN.")
@@ -298,7 +648,7 @@ def send_datawrite_metadata(radctrl_to_datawrite, datawrite_radctrl_iden,
                             seqnum, num_sequences, scan_flag, inttime, sequences, beam_iter,
                             experiment_id, experiment_name, scheduling_mode, output_sample_rate,
                             experiment_comment, filter_scaling_factors, rx_center_freq,
-                            debug_samples=None):
+                            sequence_encodings, debug_samples=None):
     """
     Send the metadata about this averaging period to datawrite so that it can be recorded.
     :param radctrl_to_datawrite: The socket to send the packet on.
@@ -320,6 +670,8 @@ def send_datawrite_metadata(radctrl_to_datawrite, datawrite_radctrl_iden,
     :param filter_scaling_factors: The decimation scheme scaling factors used for the experiment,
     to get the scaling for the data for accurate power measurements between experiments.
     :param rx_center_freq: The receive center frequency (kHz)
+    :param sequence_encodings: The phase encodings of the sequences that were sent, for each
+    Sequence in the AveragingPeriod. Each is a dictionary of slice id to the list of encodings.
     :param debug_samples: the debug samples for this averaging period, to be written to the
     file if debug is set. This is a list of dictionaries for each Sequence in the
     AveragingPeriod. The dictionary is set up in the sample_building module function
@@ -367,11 +719,8 @@ def send_datawrite_metadata(radctrl_to_datawrite, datawrite_radctrl_iden,
             rxchannel.rx_freq = sequence.slice_dict[slice_id]['freq']
             rxchannel.ptab = sequence.slice_dict[slice_id]['pulse_sequence']
 
-            # We always build one sequence in advance, so we trim the last one from when radar
-            # control stops processing the averaging period.
-            for encoding in sequence.output_encodings[slice_id][:num_sequences]:
+            for encoding in sequence_encodings[sequence_index].get(slice_id, []):
                 rxchannel.add_sqn_encodings(encoding.flatten().tolist())
-            sequence.output_encodings[slice_id] = []
 
             rxchannel.rx_main_antennas = sequence.slice_dict[slice_id]['rx_main_antennas']
             rxchannel.rx_intf_antennas = sequence.slice_dict[slice_id]['rx_int_antennas']
@@ -407,6 +756,39 @@ def send_datawrite_metadata(radctrl_to_datawrite, datawrite_radctrl_iden,
                                  pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
 
 
+def next_aveperiod(experiment, scan_num, scan_iter):
+    """
+    Find the averaging period that will run after the current one, assuming the experiment is not
+    changed. Follows the way radar() steps through the scans and averaging periods.
+
+    :param experiment: The experiment that is running.
+    :param scan_num: The index of the current scan in the experiment.
+    :param scan_iter: The index of the current averaging period in the scan.
+    :returns: The next AveragingPeriod and the beam_iter it will run at.
+    """
+    scan = experiment.scan_objects[scan_num]
+    aveperiod = scan.aveperiods[scan.aveperiod_iter]
+
+    def beam_iter_after(candidate):
+        # Only the current averaging period's beam_iter moves on at the end of it.
+        if candidate is aveperiod:
+            return (aveperiod.beam_iter + 1) % aveperiod.num_beams_in_scan
+        return candidate.beam_iter
+
+    aveperiod_iter = (scan.aveperiod_iter + 1) % len(scan.aveperiods)
+    if scan_iter + 1 < scan.num_aveperiods_in_scan:
+        upcoming = scan.aveperiods[aveperiod_iter]
+        return upcoming, beam_iter_after(upcoming)
+
+    next_scan = experiment.scan_objects[(scan_num + 1) % len(experiment.scan_objects)]
+    if next_scan is not scan:
+        aveperiod_iter = next_scan.aveperiod_iter
+    upcoming = next_scan.aveperiods[aveperiod_iter]
+    if next_scan.scanbound and next_scan.align_scan_to_beamorder:
+        return upcoming, 0
+    return upcoming, beam_iter_after(upcoming)
+
+
 def round_up_time(dt=None, round_to=60):
     """Round a datetime object to any time lapse in seconds
     dt : datetime.datetime object, default now.
@@ -467,6 +849,87 @@ def radar():
     radar_control_to_brian = sockets_list[3]
     radar_control_to_dw = sockets_list[4]
 
+    metrics = MetricsRegistry("radar_control", options.metrics_address)
+    sequences_sent = metrics.counter('sequences_sent', 'Sequences sent to the driver')
+    sequence_time = metrics.histogram('sequence_time_ms',
+                                      'Time to send pulses, DSP metadata and build the next sequence')
+    sequence_rate = metrics.gauge('sequence_rate_hz', 'Sequence rate of the last averaging period')
+    sequences_per_aveperiod = metrics.gauge('sequences_per_aveperiod',
+                                            'Number of sequences in the last averaging period')
+    aveperiod_gap = metrics.histogram('aveperiod_gap_ms',
+                                      'Time between the last sequence of an averaging period and '
+                                      'the first of the next, not counting waits for boundaries')
+    aveperiods_prepared = metrics.counter('aveperiods_prepared',
+                                          'Averaging periods that were prepared ahead of time')
+    aveperiods_unprepared = metrics.counter('aveperiods_unprepared',
+                                            'Averaging periods that were not prepared ahead, e.g. '
+                                            'after a new experiment')
+    samples_wait_time = metrics.histogram('samples_wait_ms',
+                                          'Time spent waiting for the next sequence to be built')
+    sequences_ready = metrics.gauge('sequences_ready',
+                                    'Sequences built ahead when the next one was needed')
+    experiments_switched = metrics.counter('experiments_switched',
+                                           'New experiments switched to while running')
+    experiment_switch_gap = metrics.histogram('experiment_switch_gap_ms',
+                                              'Time between the last sequence of an experiment and '
+                                              'the first of the next, not counting waits for '
+                                              'boundaries')
+    metrics.start()
+
+    # Long-lived workers for each stage of sending a sequence. The transmit samples are built
+    # ahead of time by the producer while the current sequence is being sent.
+    def dsp_metadata_template(sequence, beam_iter, exp=None):
+        exp = exp or experiment
+        return make_dsp_metadata_template(exp.rxrate, exp.output_rx_rate,
+                                          sequence.slice_ids, exp.slice_dict,
+                                          sequence.get_rx_phases(beam_iter), sequence.seqtime,
+                                          sequence.first_rx_sample_start, exp.rxctrfreq)
+
+    producer = SequenceProducer(options.sequence_lookahead, dsp_metadata_template,
+                                metrics.histogram('make_sequence_ms', 'Time to build a sequence'))
+    driver_stage = PipelineStage('send_pulses',
+                                 metrics.histogram('send_pulses_ms',
+                                                   'Time to send a sequence to the driver'))
+    dsp_stage = PipelineStage('send_dsp_meta',
+                              metrics.histogram('send_dsp_meta_ms',
+                                                'Time to send sequence metadata to DSP and Brian'))
+    dw_stage = PipelineStage('send_dw',
+                             metrics.histogram('send_dw_ms',
+                                               'Time to send averaging period metadata to '
+                                               'data_write'))
+
+    dw_job = None
+    last_sequence_end = None
+    switch_start = None  # last_sequence_end of the experiment that was switched from
+
+    def send_pulses(pulse_data, seqnum, sequence):
+        for pulse_transmit_data in pulse_data:
+            data_to_driver(radar_control_to_driver,
+                           options.driver_to_radctrl_identity,
+                           pulse_transmit_data['samples_array'],
+                           experiment.txctrfreq,
+                           experiment.rxctrfreq, experiment.txrate,
+                           experiment.rxrate,
+                           sequence.numberofreceivesamples,
+                           sequence.seqtime,
+                           pulse_transmit_data['startofburst'],
+                           pulse_transmit_data['endofburst'],
+                           pulse_transmit_data['timing'],
+                           seqnum,
+                           sequence.align_sequences,
+                           repeat=pulse_transmit_data['isarepeat'])
+
+    def send_dsp_meta(seqnum, template, encodings, decimation_scheme):
+        send_dsp_metadata(radar_control_to_dsp,
+                          options.dsp_to_radctrl_identity,
+                          radar_control_to_brian,
+                          options.brian_to_radctrl_identity,
+                          template,
+                          seqnum,
+                          experiment.slice_dict,
+                          encodings,
+                          decimation_scheme)
+
     # seqnum is used as a identifier in all packets while
     # radar is running so set it up here.
     # seqnum will get increased by num_sequences (number of averages or sequences in the averaging period)
@@ -482,7 +945,11 @@ def radar():
             'EXPNEEDED')
 
     new_experiment_waiting = False
-    new_experiment_loaded = True
+
+    # From here on, new experiments are received in the background and switched to at the end
+    # of an averaging period.
+    experiment_receiver = ExperimentReceiver(radar_control_to_exp_handler,
+                                             options.exphan_to_radctrl_identity)
 
     # Flag for starting the radar on the minute boundary
     wait_for_first_scanbound = experiment.slice_dict.get("wait_for_first_scanbound")
@@ -512,7 +979,10 @@ def radar():
                 raise ExperimentException(errmsg)
             new_experiment_waiting = False
             new_experiment = None
-            new_experiment_loaded = True
+            switch_start = last_sequence_end
+            experiments_switched.inc()
+            rad_ctrl_print("Switching to experiment {} received {:.2f} s ago".format(
+                experiment.experiment_name, time.perf_counter() - new_experiment_received_time))
 
         for scan_num, scan in enumerate(experiment.scan_objects):
             if __debug__:
@@ -581,15 +1051,34 @@ def radar():
                 if TIME_PROFILE:
                     time_start_of_aveperiod = datetime.utcnow()
 
-                # get new experiment here, before starting a new averaging period.
-                # If new_experiment_waiting is set here, implement new_experiment after this
-                # averaging period. There may be a new experiment waiting, or a new experiment.
-                if not new_experiment_waiting and not new_experiment_loaded:
-                    new_experiment_waiting, new_experiment = search_for_experiment(
-                        radar_control_to_exp_handler,
-                        options.exphan_to_radctrl_identity, 'NOERROR')
-                elif new_experiment_loaded:
-                    new_experiment_loaded = False
+                # Start sending this averaging period's sequences. The first ones will already
+                # be built if it was prepared during the last averaging period, otherwise they
+                # are built while waiting for the boundary. Then prepare the next one.
+                if producer.start_aveperiod(aveperiod):
+                    aveperiods_prepared.inc()
+                else:
+                    aveperiods_unprepared.inc()
+                boundary_wait = 0.0
+
+                # If a new experiment has been received, switch to it after this averaging
+                # period, and prepare its first averaging period instead of this experiment's
+                # next one.
+                received = experiment_receiver.take()
+                if received is not None:
+                    new_experiment, new_experiment_received_time = received
+                    new_experiment_waiting = True
+                    first_scan = new_experiment.scan_objects[0]
+                    upcoming = first_scan.aveperiods[first_scan.aveperiod_iter]
+                    if first_scan.scanbound and first_scan.align_scan_to_beamorder:
+                        upcoming_beam_iter = 0
+                    else:
+                        upcoming_beam_iter = upcoming.beam_iter
+                    producer.prepare_aveperiod(upcoming, upcoming_beam_iter,
+                                               partial(dsp_metadata_template, exp=new_experiment))
+                else:
+                    producer.prepare_aveperiod(*next_aveperiod(experiment, scan_num, scan_iter))
+                    # Ask for an experiment change, to take at the next averaging period.
+                    experiment_receiver.request()
 
                 if __debug__:
                     rad_ctrl_print("New AveragingPeriod")
@@ -617,6 +1106,7 @@ def radar():
                                 rad_ctrl_print(msg)
                             # TODO: reduce sleep if we want to use GPS timestamped transmissions
                             time.sleep(time_diff.total_seconds())
+                            boundary_wait = time_diff.total_seconds()
                         else:
                             if __debug__:
                                 # TODO: This will be wrong if the start time is in the past.
@@ -686,113 +1176,67 @@ def radar():
                 #  Time to start averaging in the below loop
 
                 num_sequences = 0
-                time_remains = True
-                pulse_transmit_data_tracker = {}
-                debug_samples = []
-
-                while time_remains:
-                    for sequence_index, sequence in enumerate(aveperiod.sequences):
-
-                        # Alternating sequences if there are multiple in the averaging_period.
-                        start_time = datetime.utcnow()
-                        if intt_break:
-                            if start_time >= averaging_period_done_time:
-                                time_remains = False
-                                averaging_period_time = (start_time - averaging_period_start_time)
-                                break
-                        else:  # break at a certain number of sequences
-                            if num_sequences == ending_number_of_sequences:
-                                time_remains = False
-                                averaging_period_time = start_time - averaging_period_start_time
-                                break
-
-                        # on first sequence, we make the first set of samples.
-                        if sequence_index not in pulse_transmit_data_tracker:
-                            pulse_transmit_data_tracker[sequence_index] = {}
-                            sqn, dbg = sequence.make_sequence(aveperiod.beam_iter, num_sequences)
-                            if dbg:
-                                debug_samples.append(dbg)
-                            pulse_transmit_data_tracker[sequence_index][num_sequences] = sqn
-
-                        def send_pulses():
-                            for pulse_transmit_data in pulse_transmit_data_tracker[sequence_index][num_sequences]:
-                                data_to_driver(radar_control_to_driver,
-                                               options.driver_to_radctrl_identity,
-                                               pulse_transmit_data['samples_array'],
-                                               experiment.txctrfreq,
-                                               experiment.rxctrfreq, experiment.txrate,
-                                               experiment.rxrate,
-                                               sequence.numberofreceivesamples,
-                                               sequence.seqtime,
-                                               pulse_transmit_data['startofburst'],
-                                               pulse_transmit_data['endofburst'],
-                                               pulse_transmit_data['timing'],
-                                               seqnum_start + num_sequences,
-                                               sequence.align_sequences,
-                                               repeat=pulse_transmit_data['isarepeat'])
-
-                            if TIME_PROFILE:
-
-                                pulses_to_driver_time = datetime.utcnow() - start_time
-                                output = 'Time for pulses to driver: {}'.format(pulses_to_driver_time)
-                                rad_ctrl_print(output)
-
-                        def send_dsp_meta():
-                            rx_beam_phases = sequence.get_rx_phases(aveperiod.beam_iter)
-                            send_dsp_metadata(radar_control_to_dsp,
-                                              options.dsp_to_radctrl_identity,
-                                              radar_control_to_brian,
-                                              options.brian_to_radctrl_identity,
-                                              experiment.rxrate,
-                                              experiment.output_rx_rate,
-                                              seqnum_start + num_sequences,
-                                              sequence.slice_ids, experiment.slice_dict,
-                                              rx_beam_phases, sequence.seqtime,
-                                              sequence.first_rx_sample_start,
-                                              experiment.rxctrfreq,
-                                              sequence.output_encodings,
-                                              decimation_scheme)
-
-                            if TIME_PROFILE:
-
-                                sequence_metadata_time = datetime.utcnow() - start_time
-                                output = 'Time to send meta to DSP: {}'.format(sequence_metadata_time)
-                                rad_ctrl_print(output)
-
-                        def make_next_samples():
-                            sqn, dbg = sequence.make_sequence(aveperiod.beam_iter, num_sequences + 1)
-                            if dbg:
-                                debug_samples.append(dbg)
-                            pulse_transmit_data_tracker[sequence_index][num_sequences+1] = sqn
-
-                            if TIME_PROFILE:
-
-                                new_sequence_time = datetime.utcnow() - start_time
-                                output = 'Time to make new sequence: {}'.format(new_sequence_time)
-                                rad_ctrl_print(output)
-
-                        # These three things can happen simultaneously. We can spawn them as
-                        # threads.
-                        threads = [threading.Thread(target=send_pulses),
-                                   threading.Thread(target=send_dsp_meta),
-                                   threading.Thread(target=make_next_samples)]
-
-                        for thread in threads:
-                            thread.daemon = True
-                            thread.start()
-
-                        for thread in threads:
-                            thread.join()
-
-                        num_sequences += 1
-
-                        if first_aveperiod:
-                            decimation_scheme = None
-                            first_aveperiod = False
-
-                        # Sequence is done
-                        if __debug__:
-                            time.sleep(1)
+                sequence_encodings = [collections.defaultdict(list) for _ in aveperiod.sequences]
+                debug_samples = {}
+
+                while True:
+                    # Alternating sequences if there are multiple in the averaging_period.
+                    start_time = datetime.utcnow()
+                    if intt_break:
+                        if start_time >= averaging_period_done_time:
+                            averaging_period_time = (start_time - averaging_period_start_time)
+                            break
+                    else:  # break at a certain number of sequences
+                        if num_sequences == ending_number_of_sequences:
+                            averaging_period_time = start_time - averaging_period_start_time
+                            break
+
+                    sequences_ready.set(producer.ready)
+                    with samples_wait_time.time():
+                        next_sequence = producer.next_sequence()
+                    sequence_index = next_sequence['sequence_index']
+                    sequence = aveperiod.sequences[sequence_index]
+
+                    for slice_id, encoding in next_sequence['encodings'].items():
+                        sequence_encodings[sequence_index][slice_id].append(encoding)
+                    if next_sequence['debug'] and sequence_index not in debug_samples:
+                        debug_samples[sequence_index] = next_sequence['debug']
+
+                    # Sending the pulses and the metadata can happen simultaneously, while the
+                    # producer builds the upcoming sequences.
+                    seqnum = seqnum_start + num_sequences
+                    jobs = [driver_stage.submit(send_pulses, next_sequence['pulse_data'], seqnum,
+                                                sequence),
+                            dsp_stage.submit(send_dsp_meta, seqnum, next_sequence['metadata'],
+                                             next_sequence['encodings'], decimation_scheme)]
+                    if num_sequences == 0 and last_sequence_end is not None:
+                        gap = time.perf_counter() - last_sequence_end - boundary_wait
+                        aveperiod_gap.observe(gap * 1e3)
+                        if TIME_PROFILE:
+                            rad_ctrl_print('Time between averaging periods: {:.3f} ms'.format(
+                                gap * 1e3))
+                    if num_sequences == 0 and switch_start is not None:
+                        gap = time.perf_counter() - switch_start - boundary_wait
+                        experiment_switch_gap.observe(gap * 1e3)
+                        rad_ctrl_print('Time to switch experiments: {:.3f} ms'.format(gap * 1e3))
+                        switch_start = None
+                    for job in jobs:
+                        job.wait()
+
+                    sequence_time.observe((datetime.utcnow() - start_time).total_seconds() * 1e3)
+                    sequences_sent.inc()
+                    num_sequences += 1
+
+                    if first_aveperiod:
+                        decimation_scheme = None
+                        first_aveperiod = False
+
+                    # Sequence is done
+                    if __debug__:
+                        time.sleep(1)
+
+                producer.stop()
+                last_sequence_end = time.perf_counter()
 
                 if TIME_PROFILE:
                     time_at_end_aveperiod = datetime.utcnow()
@@ -801,6 +1245,10 @@ def radar():
                 msg = msg.format(sm.COLOR("magenta", num_sequences))
                 rad_ctrl_print(msg)
 
+                sequences_per_aveperiod.set(num_sequences)
+                if averaging_period_time.total_seconds() > 0:
+                    sequence_rate.set(num_sequences / averaging_period_time.total_seconds())
+
                 if scan.aveperiod_iter == 0 and aveperiod.beam_iter == 0:
                     # This is the first averaging period in the scan object.
                     # if scanbound is aligned to beamorder, the scan_iter will also = 0 at this point.
@@ -810,21 +1258,20 @@ def radar():
 
                 last_sequence_num = seqnum_start + num_sequences - 1
 
-                def send_dw():
-                    send_datawrite_metadata(radar_control_to_dw,
-                                            options.dw_to_radctrl_identity, last_sequence_num,
-                                            num_sequences, scan_flag, averaging_period_time,
-                                            aveperiod.sequences, aveperiod.beam_iter,
-                                            experiment.cpid, experiment.experiment_name,
-                                            experiment.scheduling_mode,
-                                            experiment.output_rx_rate, experiment.comment_string,
-                                            experiment.decimation_scheme.filter_scaling_factors,
-                                            experiment.rxctrfreq,
-                                            debug_samples=debug_samples)
-
-                thread = threading.Thread(target=send_dw)
-                thread.daemon = True
-                thread.start()
+                # Surface any error from sending the last averaging period's metadata.
+                if dw_job is not None:
+                    dw_job.wait()
+                dw_job = dw_stage.submit(send_datawrite_metadata, radar_control_to_dw,
+                                         options.dw_to_radctrl_identity, last_sequence_num,
+                                         num_sequences, scan_flag, averaging_period_time,
+                                         aveperiod.sequences, aveperiod.beam_iter,
+                                         experiment.cpid, experiment.experiment_name,
+                                         experiment.scheduling_mode,
+                                         experiment.output_rx_rate, experiment.comment_string,
+                                         experiment.decimation_scheme.filter_scaling_factors,
+                                         experiment.rxctrfreq, sequence_encodings,
+                                         debug_samples=[debug_samples[i] for i in
+                                                        sorted(debug_samples)])
                 # end of the averaging period loop - move onto the next averaging period.
                 # Increment the sequence number by the number of sequences that were in this
                 # averaging period.
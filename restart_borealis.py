@@ -59,6 +59,9 @@ if __name__ == "__main__":
         print('Cannot open config file at {0}'.format(config_path))
         sys.exit(1)
 
+    sys.path.append(borealis_path + '/utils/')
+    import record_index.record_index as record_index
+
     #####################################
     # Borealis data check               #
     #####################################
@@ -73,6 +76,15 @@ if __name__ == "__main__":
     else:
         newest_file = max(today_data_files, key=os.path.getmtime)
         new_file_write_time = os.path.getmtime(newest_file)
+        # If the newest file is an index, use the time of its last record, which data_write only
+        # adds once the record is written.
+        if newest_file.endswith(record_index.INDEX_SUFFIX):
+            try:
+                entry = record_index.last_entry(newest_file[:-len(record_index.INDEX_SUFFIX)])
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                new_file_write_time = entry['timestamp'] / 1000.0
     now_utc_seconds = float(dt.utcnow().strftime("%s"))
 
     # How many seconds ago was the last write to a data file?
@@ -14,6 +14,14 @@ except ImportError:
 else:
     cupy_available = True
 
+# Fraction of the quietest beamformed samples of a sequence averaged for its noise estimate.
+NOISE_SAMPLES_FRACTION = 0.1
+
+# The power of noise samples is exponentially distributed, so the mean of the quietest fraction q
+# of them is (1 + (1 - q) / q * ln(1 - q)) times the mean noise power.
+NOISE_SAMPLES_BIAS = 1.0 + (1.0 - NOISE_SAMPLES_FRACTION) / NOISE_SAMPLES_FRACTION * \
+                     math.log(1.0 - NOISE_SAMPLES_FRACTION)
+
 
 def windowed_view(ndarray, window_len, step):
     """
@@ -211,6 +219,37 @@ class DSP(object):
 
         self.shared_mem['bfiq'] = bf_shm
 
+    @staticmethod
+    def noise_from_samples(beamformed_samples, slice_index_details):
+        """
+        Estimate the noise at the receive frequency of each slice from its beamformed samples.
+        The noise of a beam is the mean power of its quietest NOISE_SAMPLES_FRACTION of samples,
+        which leaves out the transmitted pulses and any echoes, corrected for the bias of taking
+        the quietest samples. The noise of a slice is the mean over its beams.
+
+        :param      beamformed_samples:    The beamformed samples.
+        :type       beamformed_samples:    ndarray [num_slices, num_beams, num_samples]
+        :param      slice_index_details:   Details of each slice, for its number of beams.
+        :type       slice_index_details:   list
+
+        :returns:   The noise power of each slice.
+        :rtype:     ndarray [num_slices]
+        """
+        num_samples = beamformed_samples.shape[-1]
+        num_quiet = max(1, int(num_samples * NOISE_SAMPLES_FRACTION))
+
+        # [num_slices, num_beams, num_samples]
+        power = beamformed_samples.real ** 2 + beamformed_samples.imag ** 2
+        quietest = np.partition(power, num_quiet - 1, axis=-1)[..., :num_quiet]
+
+        # [num_slices, num_beams]
+        beam_noise = np.mean(quietest, axis=-1, dtype=np.float64) / NOISE_SAMPLES_BIAS
+
+        # Slices with fewer beams are padded with zero beams, which are left out.
+        num_beams = np.array([s['num_beams'] for s in slice_index_details])
+        real_beams = np.arange(beam_noise.shape[1]) < num_beams[:, np.newaxis]
+        return np.sum(beam_noise * real_beams, axis=1) / num_beams
+
     @staticmethod
     def correlations_from_samples(beamformed_samples_1, beamformed_samples_2, output_sample_rate, slice_index_details):
         """
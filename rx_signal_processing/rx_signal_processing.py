@@ -38,6 +38,7 @@ from message_formats.message_formats import ProcessedSequenceMessage, DebugDataS
 import signal_processing_options.signal_processing_options as spo
 from zmq_borealis_helpers import socket_operations as so
 import shared_macros.shared_macros as sm
+from metrics.metrics import MetricsRegistry
 
 pprint = sm.MODULE_PRINT("rx signal processing", "magenta")
 
@@ -88,6 +89,8 @@ def fill_datawrite_message(processed_data, slice_details, data_outputs):
             output_dataset.intf_acf_shm = add_array(intf_corrs)
             output_dataset.xcf_shm = add_array(cross_corrs)
 
+        output_dataset.noise_at_freq = float(data_outputs['noise'][sd['slice_num']])
+
         processed_data.add_output_dataset(output_dataset)
 
 
@@ -100,6 +103,23 @@ def main():
     dsp_to_radar_control = sockets[0]
     dsp_to_driver = sockets[1]
 
+    metrics = MetricsRegistry("rx_signal_processing", sig_options.metrics_address)
+    sequences_processed = metrics.counter('sequences_processed', 'Sequences fully processed')
+    copy_latency = metrics.histogram('copy_samples_ms', 'Ring buffer to DSP copy time')
+    main_dsp_latency = metrics.histogram('main_filter_beamform_ms',
+                                         'Main array filtering, decimation and beamforming time')
+    intf_dsp_latency = metrics.histogram('intf_filter_beamform_ms',
+                                         'Interferometer filtering, decimation and beamforming time')
+    correlations_latency = metrics.histogram('correlations_ms', 'Time to compute all correlations')
+    kernel_latency = metrics.histogram('kernel_ms', 'Total processing time reported to brian')
+    output_latency = metrics.histogram('output_ms', 'Time to fill shared memory and send the '
+                                                    'processed data message')
+    ringbuffer_headroom = metrics.gauge('ringbuffer_headroom_s',
+                                        'Approximate time left before the samples being copied '
+                                        'are overwritten in the ring buffer')
+    sequences_in_flight = metrics.gauge('sequences_in_flight', 'Sequence worker threads running')
+    metrics.start()
+
     ringbuffer = None
 
     total_antennas = len(sig_options.main_antennas) + len(sig_options.intf_antennas)
@@ -256,7 +276,7 @@ def main():
         processed_data.gps_locked = rx_metadata.gps_locked
 
         # This work is done in a thread
-        def sequence_worker(**kwargs):
+        def process_sequence(**kwargs):
             sequence_num = kwargs['sequence_num']
             main_beam_angles = kwargs['main_beam_angles']
             intf_beam_angles = kwargs['intf_beam_angles']
@@ -285,6 +305,11 @@ def main():
 
             start = time.time()
 
+            # The driver keeps writing to the ring buffer, so these samples are overwritten one
+            # buffer length after the sequence started.
+            ringbuffer_headroom.set(ringbuffer.shape[1] / rx_rate -
+                                    (start - processed_data.sequence_start_time))
+
             indices = np.arange(start_sample, start_sample + samples_needed)
 
             # x.take makes a copy of the array. We want to avoid making a copy using Cupy so that
@@ -307,6 +332,7 @@ def main():
 
             copy_end = time.time()
             time_diff = (copy_end - start) * 1000
+            copy_latency.observe(time_diff)
             pprint("Time to copy samples for #{}: {}ms".format(sequence_num, time_diff))
             reply_packet = {}
             reply_packet['sequence_num'] = sequence_num
@@ -318,20 +344,28 @@ def main():
             # Process main samples
             main_sequence_samples = sequence_samples[:len(sig_options.main_antennas), :]
             pprint("Main buffer shape: {}".format(main_sequence_samples.shape))
-            processed_main_samples = dsp.DSP(main_sequence_samples, rx_rate, dm_rates,
-                                             dm_scheme_taps, mixing_freqs, main_beam_angles)
+            with main_dsp_latency.time():
+                processed_main_samples = dsp.DSP(main_sequence_samples, rx_rate, dm_rates,
+                                                 dm_scheme_taps, mixing_freqs, main_beam_angles)
+            corrs_start = time.time()
             main_corrs = dsp.DSP.correlations_from_samples(processed_main_samples.beamformed_samples,
                                                            processed_main_samples.beamformed_samples,
                                                            output_sample_rate,
                                                            slice_details)
+            corrs_time = time.time() - corrs_start
+
+            noise = dsp.DSP.noise_from_samples(processed_main_samples.beamformed_samples,
+                                               slice_details)
 
             # If interferometer is used, process those samples too.
             if sig_options.intf_antenna_count > 0:
                 intf_sequence_samples = sequence_samples[len(sig_options.main_antennas):, :]
                 pprint("Intf buffer shape: {}".format(intf_sequence_samples.shape))
-                processed_intf_samples = dsp.DSP(intf_sequence_samples, rx_rate, dm_rates,
-                                                 dm_scheme_taps, mixing_freqs, intf_beam_angles)
+                with intf_dsp_latency.time():
+                    processed_intf_samples = dsp.DSP(intf_sequence_samples, rx_rate, dm_rates,
+                                                     dm_scheme_taps, mixing_freqs, intf_beam_angles)
 
+                corrs_start = time.time()
                 intf_corrs = dsp.DSP.correlations_from_samples(processed_intf_samples.beamformed_samples,
                                                                processed_intf_samples.beamformed_samples,
                                                                output_sample_rate,
@@ -340,10 +374,13 @@ def main():
                                                                 processed_main_samples.beamformed_samples,
                                                                 output_sample_rate,
                                                                 slice_details)
+                corrs_time += time.time() - corrs_start
             end = time.time()
+            correlations_latency.observe(corrs_time * 1000)
 
             time_diff = (end - copy_end) * 1000
             reply_packet['kerneltime'] = time_diff
+            kernel_latency.observe(time_diff)
             msg = pickle.dumps(reply_packet, protocol=pickle.HIGHEST_PROTOCOL)
 
             pprint("Time to decimate, beamform and correlate for #{}: {}ms".format(sequence_num,
@@ -439,6 +476,7 @@ def main():
             processed_main_samples.shared_mem['bfiq'].close()
 
             data_outputs['main_corrs'] = main_corrs
+            data_outputs['noise'] = noise
 
             if sig_options.intf_antenna_count > 0:
                 data_outputs['cross_corrs'] = cross_corrs
@@ -459,6 +497,15 @@ def main():
             pprint("Time to serialize and send processed data for #{}: {}ms".format(sequence_num,
                                                                                     time_diff))
             so.send_bytes(dsp_to_dw, sig_options.dw_dsp_identity, sqn_message)
+            output_latency.observe(time_diff)
+            sequences_processed.inc()
+
+        def sequence_worker(**kwargs):
+            # A worker that fails must not be counted as in flight forever.
+            try:
+                process_sequence(**kwargs)
+            finally:
+                sequences_in_flight.dec()
 
         args = {"sequence_num": copy.deepcopy(sqn_meta_message.sequence_num),
                 "main_beam_angles": copy.deepcopy(main_beam_angles),
@@ -471,6 +518,7 @@ def main():
 
         seq_thread = threading.Thread(target=sequence_worker, kwargs=args)
         seq_thread.daemon = True
+        sequences_in_flight.inc()
         seq_thread.start()
 
         threads.append(seq_thread)
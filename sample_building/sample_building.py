@@ -10,8 +10,21 @@
 from scipy.constants import speed_of_light
 import numpy as np
 import math
+import functools
+import collections
 from experiment_prototype.experiment_exception import ExperimentException
 
+# Number of basic pulses kept by get_samples. Slices, sequences and rebuilt experiments with the
+# same pulse parameters share them.
+BASIC_PULSE_CACHE_SIZE = 64
+
+# Number of beam phase tables kept by get_phase_shifts. One table is kept per
+# (beam_angle, freq, num_antennas, antenna_spacing, centre_offset) and is shared by every sequence
+# using it, for tx and rx alike.
+PHASE_SHIFT_CACHE_SIZE = 256
+
+_phase_shift_cache = collections.OrderedDict()
+
 
 def resolve_imaging_directions(beamdirs_list, num_antennas, antenna_spacing):
     """
@@ -44,6 +57,8 @@ def get_phase_shift(beam_angle, freq, num_antennas, antenna_spacing, centre_offs
     a specified extra phase shift if there is any, the number of antennas in the array, and the spacing
     between antennas.
 
+    The phases are shared through the cache of get_phase_shifts, so the returned array is read-only.
+
     :param beam_angle: list of azimuthal direction of the beam off boresight, in degrees, positive beamdir being to
         the right of the boresight (looking along boresight from ground). This is for this antenna.
     :param freq: transmit frequency in kHz
@@ -56,31 +71,68 @@ def get_phase_shift(beam_angle, freq, num_antennas, antenna_spacing, centre_offs
     :returns phase_shift: a 2D array of beam_phases x antennas in radians.
     """
 
-    freq_hz = freq * 1000.0  # convert to Hz.
+    return get_phase_shifts(beam_angle, [freq], num_antennas, antenna_spacing, centre_offset)[0]
+
+
+def get_phase_shifts(beam_angle, freqs, num_antennas, antenna_spacing, centre_offset=0.0):
+    """
+    Find the phase shifts of an array for a list of beam directions at several frequencies.
+
+    Same as get_phase_shift, for each frequency in freqs. Tables are cached on all the
+    parameters, and the ones that are not cached are computed together in one vectorized pass
+    over frequencies, beams and antennas. The returned tables are read-only.
+
+    :param beam_angle: list of azimuthal directions of the beams off boresight, in degrees.
+    :param freqs: list of transmit frequencies in kHz
+    :param num_antennas: number of antennas in this array
+    :param antenna_spacing: distance between antennas in this array, in meters
+    :param centre_offset: the phase reference for the midpoint of the array, in metres.
+
+    :returns phase_shifts: a list with a 2D array of beam_phases x antennas for each frequency.
+    """
+
+    beam_key = tuple(beam_angle)
+    keys = [(beam_key, float(freq), num_antennas, antenna_spacing, centre_offset) for freq in freqs]
+
+    missing = [key for key in dict.fromkeys(keys) if key not in _phase_shift_cache]
+    if missing:
+        freqs_hz = np.array([key[1] for key in missing]) * 1000.0  # convert to Hz.
 
-    # convert the beam angles to rads
-    beam_rads = (np.pi / 180) * np.array(beam_angle, dtype=np.float32)
+        # convert the beam angles to rads
+        beam_rads = (np.pi / 180) * np.array(beam_angle, dtype=np.float32)
 
-    antennas = np.arange(num_antennas)
-    x = ((num_antennas - 1) / 2.0 - antennas) * antenna_spacing + centre_offset
-    x *= 2 * np.pi * freq_hz
+        antennas = np.arange(num_antennas)
+        x = ((num_antennas - 1) / 2.0 - antennas) * antenna_spacing + centre_offset
+        x = x[np.newaxis, :] * (2 * np.pi * freqs_hz)[:, np.newaxis]  # freqs by antenna
 
-    y = np.cos(np.pi / 2.0 - beam_rads) / speed_of_light
-    # split up the calculations for beams and antennas. Outer multiply of the two
-    # vectors will yield all antenna phases needed for each beam.
-    # If there are N antennas and M beams
-    # Eventual matrix is now:
-    # [antenna0beam0 .. antenna1beam0 .... ... antennaN-1beam0
-    # antenna0beam1 ... antenna1beam1 .... ... antennaN-1beam1
-    # ...
-    # ...
-    # antenna0beamM-1 ... antenna1beamM-1... ... anteannaN-1beamM-1]
-    phase_shift = np.fmod(np.outer(y, x), 2.0 * np.pi) # beams by antenna
-    phase_shift = np.exp(1j * phase_shift)
+        y = np.cos(np.pi / 2.0 - beam_rads) / speed_of_light
+        # split up the calculations for beams and antennas. Outer multiply of the two
+        # vectors will yield all antenna phases needed for each beam, for each frequency.
+        # If there are N antennas and M beams
+        # Eventual matrix for each frequency is now:
+        # [antenna0beam0 .. antenna1beam0 .... ... antennaN-1beam0
+        # antenna0beam1 ... antenna1beam1 .... ... antennaN-1beam1
+        # ...
+        # ...
+        # antenna0beamM-1 ... antenna1beamM-1... ... anteannaN-1beamM-1]
+        phase_shifts = np.fmod(y[np.newaxis, :, np.newaxis] * x[:, np.newaxis, :], 2.0 * np.pi)
+        phase_shifts = np.exp(1j * phase_shifts)  # freqs by beams by antenna
 
+        # Pointing to right of boresight, use point in middle (hypothetically antenna 7.5) as phshift=0
+        for key, phase_shift in zip(missing, phase_shifts):
+            phase_shift.flags.writeable = False
+            _phase_shift_cache[key] = phase_shift
+
+    tables = []
+    for key in keys:
+        _phase_shift_cache.move_to_end(key)
+        tables.append(_phase_shift_cache[key])
+
+    while len(_phase_shift_cache) > PHASE_SHIFT_CACHE_SIZE:
+        _phase_shift_cache.popitem(last=False)
+
+    return tables
 
-    # Pointing to right of boresight, use point in middle (hypothetically antenna 7.5) as phshift=0
-    return phase_shift
 
 def get_wavetables(wavetype):
     """
@@ -136,6 +188,9 @@ def get_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_tabl
     (s), and wavetables (list containing single cycle of waveform). Will shift for
     beam later. No need to use wavetable if just a sine wave.
 
+    Pulses are memoized on all the parameters, so the returned samples array is shared and
+    read-only.
+
     :param rate: tx sampling rate, in Hz.
     :param wave_freq: frequency offset from the centre frequency on the USRP, given in
      Hz. To be mixed with the centre frequency before transmitting. (ex. centre = 12
@@ -155,8 +210,20 @@ def get_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_tabl
      be equal to the requested wave_freq param.
     """
 
-    wave_freq = float(wave_freq)
-    rate = float(rate)
+    if iwave_table is not None:
+        iwave_table = tuple(iwave_table)
+    if qwave_table is not None:
+        qwave_table = tuple(qwave_table)
+
+    return _make_samples(float(rate), float(wave_freq), pulse_len, ramp_time, max_amplitude,
+                         iwave_table, qwave_table)
+
+
+@functools.lru_cache(maxsize=BASIC_PULSE_CACHE_SIZE)
+def _make_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_table, qwave_table):
+    """
+    Make the samples for get_samples. The wavetables are tuples so they can be hashed.
+    """
 
     if iwave_table is None and qwave_table is None:
         sampling_freq = 2 * math.pi * wave_freq / rate
@@ -188,7 +255,6 @@ def get_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_tabl
         # Number of samples in ramp-up, ramp-down
 
         sampleslen = int(rate * pulse_len + 2 * rampsampleslen)
-        samples = np.empty([sampleslen], dtype=np.complex64)
 
         # sample at wave_freq with given phase shift
         f_norm = wave_freq / rate
@@ -199,30 +265,23 @@ def get_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_tabl
 
         actual_wave_freq = (float(sample_skip) / float(wave_table_len)) * rate
         # This is the actual frequency given the sample_skip
-        for i in range(0, rampsampleslen):
-            amp = max_amplitude * float(i + 1) / float(rampsampleslen)  # rampup is linear
-            if sample_skip < 0:
-                ind = -1 * ((abs(sample_skip * i)) % wave_table_len)
-            else:
-                ind = (sample_skip * i) % wave_table_len
-            samples[i] = (amp * iwave_table[ind] + amp * qwave_table[ind] * 1j)
-            # qsamples[chi,i]=amp*qwave_table[ind]
-        for i in range(rampsampleslen, sampleslen - rampsampleslen):
-            amp = max_amplitude
-            if sample_skip < 0:
-                ind = -1 * ((abs(sample_skip * i)) % wave_table_len)
-            else:
-                ind = (sample_skip * i) % wave_table_len
-            samples[i] = (amp * iwave_table[ind] + amp * qwave_table[ind] * 1j)
-            # qsamples[chi,i]=qwave_table[ind]
-        for i in range(sampleslen - rampsampleslen, sampleslen):
-            amp = max_amplitude * float(sampleslen - i) / float(rampsampleslen)
-            if sample_skip < 0:
-                ind = -1 * ((abs(sample_skip * i)) % wave_table_len)
-            else:
-                ind = (sample_skip * i) % wave_table_len
-            samples[i] = (amp * iwave_table[ind] + amp * qwave_table[ind] * 1j)
-            # qsamples[chi,i]=amp*qwave_table[ind]
+
+        # Wavetable index of every sample. Negative skips step backwards from the end of the table.
+        sample_nums = np.arange(sampleslen)
+        ind = np.abs(sample_skip * sample_nums) % wave_table_len
+        if sample_skip < 0:
+            ind = -ind
+
+        # Linear ramp up and ramp down, which takes precedence if they overlap.
+        ramp_nums = np.arange(rampsampleslen)
+        amp = np.full(sampleslen, float(max_amplitude))
+        amp[:rampsampleslen] = max_amplitude * (ramp_nums + 1).astype(float) / float(rampsampleslen)
+        amp[sampleslen - rampsampleslen:] = \
+            max_amplitude * (rampsampleslen - ramp_nums).astype(float) / float(rampsampleslen)
+
+        iwave = np.asarray(iwave_table, dtype=np.float64)[ind]
+        qwave = np.asarray(qwave_table, dtype=np.float64)[ind]
+        samples = (amp * iwave + amp * qwave * 1j).astype(np.complex64)
 
     else:
         errmsg = "Error: only one wavetable passed"
@@ -230,6 +289,5 @@ def get_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude, iwave_tabl
 
     # Samples is an array of complex samples
     # NOTE: phasing will be done in shift_samples function
+    samples.flags.writeable = False
     return samples, actual_wave_freq
-
-
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# prebuild_experiments.py
+# Build experiments into the experiment_handler cache ahead of time.
+#
+# Building an experiment can take a while, and experiment_handler otherwise does it every time
+# Borealis is started. This builds the given experiment, or the experiments scheduled to run in
+# the next few hours, into the experiment cache (experiment_cache_directory in config.ini), so
+# that experiment_handler only has to load them. Run it with the same python options as
+# experiment_handler (-O for release mode), since that is part of the cache key.
+
+import argparse
+import datetime
+import os
+import sys
+import time
+import traceback
+
+sys.path.append(os.environ['BOREALISPATH'])
+
+from experiment_handler.experiment_handler import retrieve_experiment, parse_kwargs_string
+from experiment_prototype.experiment_cache import ExperimentCache
+from utils.experiment_options.experimentoptions import ExperimentOptions
+import scd_utils
+
+
+def scheduled_experiments(scd_file, hours):
+    """
+    Get the experiments in a schedule that run within the next number of hours.
+
+    :param scd_file: the schedule file.
+    :param hours: how far ahead to look.
+    :returns: list of (experiment, scheduling_mode, kwargs_string), without duplicates, in the
+              order they are scheduled.
+    """
+    now = datetime.datetime.utcnow()
+    scd_util = scd_utils.SCDUtils(scd_file)
+    lines = scd_util.get_relevant_lines(now.strftime("%Y%m%d"), now.strftime("%H:%M"))
+
+    epoch = datetime.datetime.utcfromtimestamp(0)
+    horizon_ms = ((now - epoch).total_seconds() + hours * 3600) * 1000
+
+    experiments = []
+    for line in lines:
+        if line['timestamp'] > horizon_ms:
+            continue
+        experiment = (line['experiment'], line['scheduling_mode'], line['kwargs_string'])
+        if experiment not in experiments:
+            experiments.append(experiment)
+    return experiments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build experiments into the experiment_handler "
+                                                 "cache ahead of time.")
+    parser.add_argument('experiment_module', nargs='?',
+                        help="The experiment to build, e.g. normalscan. Required unless "
+                             "--scd-file is given.")
+    parser.add_argument('scheduling_mode_type', nargs='?', default='common',
+                        help="The scheduling mode it will run in, e.g. common (default).")
+    parser.add_argument('--kwargs_string', default='',
+                        help="String of keyword arguments for the experiment.")
+    parser.add_argument('--scd-file', help="Build the experiments scheduled in this scd file.")
+    parser.add_argument('--hours', type=float, default=24.0,
+                        help="With --scd-file, how many hours ahead to look (default 24).")
+    args = parser.parse_args()
+
+    if args.scd_file:
+        experiments = scheduled_experiments(args.scd_file, args.hours)
+    elif args.experiment_module:
+        experiments = [(args.experiment_module, args.scheduling_mode_type, args.kwargs_string)]
+    else:
+        parser.error("either experiment_module or --scd-file is required")
+
+    options = ExperimentOptions()
+    if not options.experiment_cache_directory:
+        print("experiment_cache_directory is not set in config.ini, nothing to do")
+        return 0
+    cache = ExperimentCache(options.experiment_cache_directory, options=options)
+
+    failures = 0
+    for experiment, scheduling_mode, kwargs_string in experiments:
+        description = "{} {} {}".format(experiment, scheduling_mode, kwargs_string).strip()
+        start = time.perf_counter()
+        try:
+            Experiment = retrieve_experiment(experiment)
+            kwargs = parse_kwargs_string(kwargs_string)
+            _, serialized_exp, from_cache = cache.build(Experiment, kwargs, scheduling_mode)
+        except Exception:
+            failures += 1
+            print("Failed to build {}:".format(description))
+            traceback.print_exc()
+            continue
+        print("{} {} ({:.1f} kB) in {:.2f} s".format(
+              description, "already cached" if from_cache else "built",
+              len(serialized_exp) / 1e3, time.perf_counter() - start))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
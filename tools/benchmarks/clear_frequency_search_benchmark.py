@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+    clear_frequency_search_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmark and check of the clear frequency search on a synthetic ring buffer. The ring buffer
+    holds noise on every antenna plus a set of interferers at known frequencies, and a window
+    wrapping around its end is searched for slices with overlapping clrfrqranges, some of which
+    cover restricted frequencies. Checks that every pick is clear of the interferers, the
+    restricted frequencies and the other picks, and that the slices share one spectrum. Reports
+    the time for a cold search (computing the spectrum) and a cached one.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.environ["BOREALISPATH"])
+from utils.clear_frequency_search.clear_frequency_search import ClearFrequencySearch
+from utils.frequency_ranges.frequency_ranges import FrequencyRanges
+
+
+def make_ringbuffer(num_antennas, num_samples, rx_rate, rx_ctr_freq, interferers, rng):
+    """
+    Make a ring buffer of unit power noise with interferers.
+
+    :param interferers: list of (frequency in kHz, power) tones.
+    :returns: complex64 ring buffer, [num_antennas, num_samples].
+    """
+    shape = (num_antennas, num_samples)
+    ringbuffer = (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)) / np.sqrt(2)
+    t = np.arange(num_samples) / rx_rate
+    for freq, power in interferers:
+        offset = (freq - rx_ctr_freq) * 1.0e3
+        phases = rng.uniform(0, 2 * np.pi, (num_antennas, 1))
+        ringbuffer += np.sqrt(power) * np.exp(1j * (2 * np.pi * offset * t + phases))
+    return ringbuffer.astype(np.complex64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--antennas', type=int, default=20, help='Antennas in the ring buffer')
+    parser.add_argument('--rx-rate', type=float, default=5.0e6, help='Sampling rate (Hz)')
+    parser.add_argument('--ctr-freq', type=float, default=12000.0, help='Centre frequency (kHz)')
+    parser.add_argument('--window', type=float, default=0.02, help='Search window (s)')
+    parser.add_argument('--interferers', type=int, default=200, help='Number of interferers')
+    parser.add_argument('--repeats', type=int, default=5, help='Searches per timing')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the noise and interferers')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    half_span = args.rx_rate / 2.0e3 * 0.8
+    low, high = args.ctr_freq - half_span, args.ctr_freq + half_span
+
+    window_samples = int(args.window * args.rx_rate)
+    ringbuffer_samples = 2 * window_samples
+    interferers = [(freq, 10.0 ** rng.uniform(1, 4))
+                   for freq in rng.uniform(low, high, args.interferers)]
+    ringbuffer = make_ringbuffer(args.antennas, ringbuffer_samples, args.rx_rate, args.ctr_freq,
+                                 interferers, rng)
+    restricted = FrequencyRanges([(args.ctr_freq - 300, args.ctr_freq - 100),
+                                  (args.ctr_freq + 50, args.ctr_freq + 120)])
+
+    # Overlapping clrfrqranges, of 3.3 kHz (300 us pulse) and 10 kHz (100 us pulse) slices.
+    requests = {slice_id: ((args.ctr_freq - 400 + 150 * slice_id,
+                            args.ctr_freq - 400 + 150 * slice_id + 500), bandwidth)
+                for slice_id, bandwidth in enumerate((10.0 / 3, 10.0 / 3, 10.0, 10.0 / 3))}
+
+    # The window wraps around the end of the ring buffer.
+    end_sample = ringbuffer_samples + window_samples // 2
+
+    search = ClearFrequencySearch(args.rx_rate, args.ctr_freq, restricted)
+    start = time.perf_counter()
+    frequencies = search.search(ringbuffer, end_sample, window_samples, requests)
+    cold = time.perf_counter() - start
+    if len(search._spectra) != 1:
+        raise RuntimeError("Slices did not share a spectrum")
+
+    picked = []
+    for slice_id, freq in frequencies.items():
+        clrfrqrange, bandwidth = requests[slice_id]
+        band = (freq - bandwidth / 2, freq + bandwidth / 2)
+        if not clrfrqrange[0] <= freq <= clrfrqrange[1]:
+            raise RuntimeError("Slice {} picked {} kHz, outside its clrfrqrange".format(
+                slice_id, freq))
+        if restricted.overlaps(*band):
+            raise RuntimeError("Slice {} picked restricted {} kHz".format(slice_id, freq))
+        for interferer, _ in interferers:
+            if band[0] - 1 <= interferer <= band[1] + 1:
+                raise RuntimeError("Slice {} picked {} kHz, next to an interferer at {:.1f} kHz"
+                                   .format(slice_id, freq, interferer))
+        for other in picked:
+            if band[0] <= other[1] and other[0] <= band[1]:
+                raise RuntimeError("Slice {} picked {} kHz, overlapping another slice".format(
+                    slice_id, freq))
+        picked.append(band)
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        search.search(ringbuffer, end_sample, window_samples, requests)
+    cached = (time.perf_counter() - start) / args.repeats
+
+    print("{} antennas, {:.0f} ms window, {} interferers".format(
+          args.antennas, args.window * 1e3, args.interferers))
+    for slice_id, freq in frequencies.items():
+        print("  slice {}: clrfrqrange {}, picked {} kHz".format(
+              slice_id, [int(f) for f in requests[slice_id][0]], freq))
+    print("cold search {:.1f} ms, cached search {:.2f} ms".format(cold * 1e3, cached * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+    data_write_compression_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmark of the data_write compression settings. Synthetic antennas_iq and rawacf records
+    are made the way Borealis makes them: int16 ADC noise with a few narrowband signals, low pass
+    filtered and decimated to float32 samples, and for rawacf the lag products averaged over the
+    sequences. The records are written the way data_write writes them, in site format (one file
+    per record through deepdish) and in array format (appended to one file), with each codec and
+    level given and each number of blosc threads. Reports the write bandwidth, in MB/s of
+    uncompressed data, and the compression ratio.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import tables
+
+sys.path.append(os.environ["BOREALISPATH"] + '/utils/')
+from array_write.array_write import ArrayFile, CHUNK_BYTES
+from data_write_options.data_write_options import DataWriteOptions
+
+
+def make_samples(shape, rng, decimation=15):
+    """Make filtered, decimated complex samples from int16 ADC noise and a few signals."""
+    num_samps = shape[-1] * decimation
+    t = np.arange(num_samps)
+    adc = rng.normal(scale=300.0, size=shape[:-1] + (num_samps, 2))
+    for _ in range(3):
+        freq = rng.uniform(-0.02, 0.02)
+        adc[..., 0] += 1000.0 * np.cos(2 * np.pi * freq * t)
+        adc[..., 1] += 1000.0 * np.sin(2 * np.pi * freq * t)
+    adc = np.round(adc).astype(np.int16)
+    samples = (adc[..., 0] + 1j * adc[..., 1]).astype(np.complex64) / 32768.0
+
+    taps = np.hamming(4 * decimation).astype(np.float32)
+    taps /= taps.sum()
+    filtered = np.apply_along_axis(lambda x: np.convolve(x, taps, mode='same'), -1, samples)
+    return filtered[..., ::decimation].astype(np.complex64)
+
+
+def make_records(product, args, rng):
+    """Make synthetic records of a product."""
+    base = {'experiment_name': 'Normalscan', 'station': 'sas', 'slice_id': np.uint32(0),
+            'pulses': np.array([0, 9, 12, 20, 22, 26, 27], dtype=np.uint32)}
+    records = []
+    for i in range(args.records):
+        record = dict(base)
+        record['num_sequences'] = args.sequences
+        record['sqn_timestamps'] = 1.6e9 + 3.5 * i + 0.1 * np.arange(args.sequences)
+        if product == 'antennas_iq':
+            dims = (args.antennas, args.sequences, args.samples)
+            record['data_dimensions'] = np.array(dims, dtype=np.uint32)
+            record['data'] = make_samples(dims, rng).flatten()
+        else:
+            samples = make_samples((args.sequences, args.beams, args.ranges + 30), rng)
+            lags = np.arange(23)
+            acfs = np.stack([samples[..., :args.ranges] *
+                             np.conj(samples[..., lag:lag + args.ranges]) for lag in lags], -1)
+            dims = (args.beams, args.ranges, len(lags))
+            record['correlation_dimensions'] = np.array(dims, dtype=np.uint32)
+            record['main_acfs'] = acfs.mean(axis=0).astype(np.complex64).flatten()
+        records.append(record)
+    return records
+
+
+def write_site(records, directory, compression):
+    import deepdish as dd
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+    size = 0
+    for i, record in enumerate(records):
+        filename = os.path.join(directory, '{}.site.hdf5'.format(i))
+        dd.io.save(filename, {str(i): record}, compression=compression)
+        size += os.path.getsize(filename)
+    return size
+
+
+def write_array(records, directory, compression, product):
+    filters = None
+    if compression is not None:
+        filters = tables.Filters(complib=compression[0], complevel=compression[1], shuffle=True)
+    filename = os.path.join(directory, 'array.hdf5')
+    array_file = ArrayFile(filename, filters=filters, chunk_bytes=CHUNK_BYTES[product])
+    for record in records:
+        array_file.append(record)
+    array_file.close()
+    return os.path.getsize(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--codecs', nargs='+',
+                        default=['none', 'zlib:1', 'lz4:1', 'lz4:5', 'zstd:1', 'zstd:3',
+                                 'blosc:5'],
+                        help='Compression settings, as in data_compression in config.ini')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4],
+                        help='Numbers of blosc threads')
+    parser.add_argument('--records', type=int, default=20, help='Records per product')
+    parser.add_argument('--antennas', type=int, default=20, help='Antennas (antennas_iq)')
+    parser.add_argument('--sequences', type=int, default=30, help='Sequences per record')
+    parser.add_argument('--samples', type=int, default=300, help='Samples (antennas_iq)')
+    parser.add_argument('--beams', type=int, default=1, help='Beams (rawacf)')
+    parser.add_argument('--ranges', type=int, default=75, help='Ranges (rawacf)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("{:>11} {:>8} {:>7} {:>7} | {:>10} {:>7}".format('product', 'codec', 'threads',
+                                                           'format', 'MB/s', 'ratio'))
+    for product in ('antennas_iq', 'rawacf'):
+        records = make_records(product, args, rng)
+        data_field = 'data' if product == 'antennas_iq' else 'main_acfs'
+        data_bytes = sum(record[data_field].nbytes for record in records)
+
+        for setting in args.codecs:
+            compression = DataWriteOptions.parse_compression(setting)
+            uses_threads = compression is not None and compression[0].startswith('blosc')
+            for threads in (args.threads if uses_threads else args.threads[:1]):
+                tables.set_blosc_max_threads(threads)
+                for file_format in ('site', 'array'):
+                    with tempfile.TemporaryDirectory() as directory:
+                        start = time.perf_counter()
+                        if file_format == 'site':
+                            size = write_site(records, directory, compression)
+                        else:
+                            size = write_array(records, directory, compression, product)
+                        elapsed = time.perf_counter() - start
+                    print("{:>11} {:>8} {:>7} {:>7} | {:>10.1f} {:>7.2f}".format(
+                        product, setting, threads, file_format, data_bytes / elapsed / 1e6,
+                        data_bytes / size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+    data_write_parse_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmark of data_write parsing the processed sequences of an averaging period. Synthetic
+    ProcessedSequenceMessages are made with shared memory segments the size that
+    rx_signal_processing makes in release mode (antennas_iq, bfiq and correlations, no filter
+    stages or rawrf), and parsed by ParseData with every product enabled and with only rawacf, the
+    usual production setting. Reports the parse time per sequence, the memory held by the
+    accumulators at the end of the averaging period, and checks that no segment is left behind.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+sys.path.append(os.environ["BOREALISPATH"])
+from data_write.data_write import ParseData, DATA_PRODUCTS
+from utils.data_write_options.data_write_options import DataWriteOptions
+from utils.message_formats.message_formats import ProcessedSequenceMessage, DebugDataStage, \
+    OutputDataset
+
+
+def make_shm(shape, rng):
+    """Make a shared memory segment holding random complex64 samples, and return its name."""
+    array = (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)).astype(np.complex64)
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(shape, dtype=np.complex64, buffer=shm.buf)[...] = array
+    name = shm.name
+    shm.close()
+    # The segments belong to rx_signal_processing in Borealis, and data_write unlinks them.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return name
+
+
+def make_sequence(sequence_num, options, args, rng):
+    """Make a processed sequence the way rx_signal_processing does in release mode."""
+    main_antennas = len(options.main_antennas)
+    intf_antennas = len(options.intf_antennas)
+
+    message = ProcessedSequenceMessage(sequence_num=sequence_num, rx_sample_rate=5.0e6,
+                                       output_sample_rate=3333.3, initialization_time=0.0,
+                                       sequence_start_time=time.time(),
+                                       gps_to_system_time_diff=0.0, agc_status_bank_h=0,
+                                       lp_status_bank_h=0, agc_status_bank_l=0,
+                                       lp_status_bank_l=0, gps_locked=True,
+                                       max_num_beams=args.beams, num_samps=args.samples)
+
+    stage = DebugDataStage('antennas', num_samps=args.samples)
+    stage.main_shm = make_shm((args.slices, main_antennas, args.samples), rng)
+    if intf_antennas:
+        stage.intf_shm = make_shm((args.slices, intf_antennas, args.samples), rng)
+    message.add_debug_data(stage)
+
+    message.bfiq_main_shm = make_shm((args.slices, args.beams, args.samples), rng)
+    if intf_antennas:
+        message.bfiq_intf_shm = make_shm((args.slices, args.beams, args.samples), rng)
+
+    acf_shape = (args.beams, args.ranges, args.lags)
+    for slice_id in range(args.slices):
+        data_set = OutputDataset(slice_id, args.beams, args.ranges, args.lags,
+                                 noise_at_freq=1.0)
+        data_set.main_acf_shm = make_shm(acf_shape, rng)
+        if intf_antennas:
+            data_set.intf_acf_shm = make_shm(acf_shape, rng)
+            data_set.xcf_shm = make_shm(acf_shape, rng)
+        message.add_output_dataset(data_set)
+    return message
+
+
+def run(products, options, args):
+    """Parse an averaging period of sequences, returning the parse time per sequence in s and
+    the memory held by the accumulators in bytes."""
+    rng = np.random.default_rng(0)
+    sequences = [make_sequence(i, options, args, rng) for i in range(args.sequences)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    data_parsing = ParseData(options, products)
+    start = time.perf_counter()
+    for sequence in sequences:
+        data_parsing.update(sequence)
+    data_parsing.numpify_arrays()
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return elapsed / args.sequences, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sequences', type=int, default=30, help='Sequences per averaging period')
+    parser.add_argument('--slices', type=int, default=1, help='Slices per sequence')
+    parser.add_argument('--beams', type=int, default=1, help='Beams per slice')
+    parser.add_argument('--samples', type=int, default=300, help='Output samples per sequence')
+    parser.add_argument('--ranges', type=int, default=75, help='Range gates per slice')
+    parser.add_argument('--lags', type=int, default=23, help='Lags per slice')
+    args = parser.parse_args()
+
+    options = DataWriteOptions()
+    segments_before = set(glob.glob('/dev/shm/psm_*'))
+
+    print("{:>30} | {:>12} {:>12}".format('products', 'parse (ms)', 'held (kB)'))
+    for products in (DATA_PRODUCTS, ('rawacf',)):
+        per_sequence, held = run(products, options, args)
+        print("{:>30} | {:>12.3f} {:>12.1f}".format(','.join(products), per_sequence * 1e3,
+                                                    held / 1e3))
+
+    leftover = set(glob.glob('/dev/shm/psm_*')) - segments_before
+    if leftover:
+        raise RuntimeError("{} shared memory segments were not unlinked".format(len(leftover)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""
+    dmap_write_benchmark
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Benchmark of data_write writing averaging period records as DMAP and as HDF5. Synthetic
+    Borealis rawacf and bfiq records are appended to a two hour DMAP file the way data_write does
+    with --file-type dmap, and written the way the HDF5 path does, i.e. each record saved to its
+    own file with deepdish and then copied into the two hour file with h5copy (if it is
+    installed). Reports the time per record and the write throughput of each.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import os
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+sys.path.append(os.environ["BOREALISPATH"] + '/utils/')
+import dmap_write.dmap_write as dmap
+
+
+def make_record(product, args, rng):
+    """Make a synthetic Borealis record of the given product."""
+    pulses = np.array([0, 9, 12, 20, 22, 26, 27], dtype=np.uint32)
+    lags = np.array([[0, 0], [26, 27], [20, 22], [9, 12], [22, 26], [22, 27], [20, 26], [20, 27],
+                     [12, 20], [0, 9], [12, 22], [9, 20], [0, 12], [9, 22], [12, 26], [12, 27],
+                     [9, 26], [9, 27], [27, 27]], dtype=np.uint32)
+    record = {
+        'borealis_git_hash': 'v0.5-120-gabc1234', 'experiment_id': np.int16(151),
+        'experiment_name': 'Normalscan', 'experiment_comment': '', 'slice_comment': '',
+        'slice_id': np.uint32(0), 'station': 'sas', 'num_sequences': args.sequences,
+        'range_sep': np.float32(44.96887), 'first_range': np.float32(180.0),
+        'first_range_rtt': np.float32(1200.6923), 'rx_sample_rate': 3333.3333333333335,
+        'scan_start_marker': False, 'int_time': np.float32(3.5), 'tx_pulse_len': np.uint32(300),
+        'tau_spacing': np.uint32(2400), 'freq': np.uint32(10500), 'pulses': pulses, 'lags': lags,
+        'blanked_samples': pulses * 8, 'beam_nums': np.arange(args.beams, dtype=np.uint32),
+        'beam_azms': np.linspace(-20.0, 20.0, args.beams),
+        'sqn_timestamps': time.time() + 0.1 * np.arange(args.sequences),
+        'noise_at_freq': np.ones(args.sequences), 'agc_status_word': np.uint32(0),
+        'lp_status_word': np.uint32(0),
+    }
+
+    def samples(*shape):
+        return (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)).astype(np.complex64)
+
+    if product == 'rawacf':
+        record['correlation_dimensions'] = np.array([args.beams, args.ranges, len(lags)],
+                                                    dtype=np.uint32)
+        record['main_acfs'] = samples(args.beams * args.ranges * len(lags))
+        record['intf_acfs'] = samples(args.beams * args.ranges * len(lags))
+        record['xcfs'] = samples(args.beams * args.ranges * len(lags))
+    else:
+        dims = (2, args.sequences, args.beams, args.samples)
+        record['data_dimensions'] = np.array(dims, dtype=np.uint32)
+        record['antenna_arrays_order'] = ['main', 'intf']
+        record['num_samps'] = np.uint32(args.samples)
+        record['num_ranges'] = np.uint32(args.ranges)
+        record['pulse_phase_offset'] = np.zeros((args.sequences, 0), dtype=np.float32)
+        record['data'] = samples(int(np.prod(dims)))
+    return record
+
+
+def write_dmap(records, product, directory):
+    filename = os.path.join(directory, 'two_hr.{}.dmap'.format(dmap.DMAP_PRODUCTS[product][0]))
+    for record in records:
+        dmap.append_records(filename, dmap.DMAP_PRODUCTS[product][1](record, 'two_hr'))
+    return os.path.getsize(filename)
+
+
+def write_hdf5(records, directory, h5copy):
+    import deepdish as dd
+    import tables
+    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+
+    two_hr_file = os.path.join(directory, 'two_hr.hdf5.site')
+    size = 0
+    for i, record in enumerate(records):
+        key = str(1600000000000 + i)
+        tmp_file = os.path.join(directory, '{}.hdf5'.format(key))
+        dd.io.save(tmp_file, {key: record}, compression=None)
+        size += os.path.getsize(tmp_file)
+        if h5copy:
+            sp.call([h5copy, '-i', tmp_file, '-o', two_hr_file, '-s', key, '-d', key])
+        os.remove(tmp_file)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=50, help='Records per product')
+    parser.add_argument('--beams', type=int, default=1, help='Beams per record')
+    parser.add_argument('--ranges', type=int, default=75, help='Number of ranges')
+    parser.add_argument('--sequences', type=int, default=30, help='Sequences per record (bfiq)')
+    parser.add_argument('--samples', type=int, default=300, help='Samples per sequence (bfiq)')
+    parser.add_argument('--no-hdf5', action='store_true', help='Only time the DMAP path')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    h5copy = shutil.which('h5copy')
+    if not args.no_hdf5 and h5copy is None:
+        print("h5copy not found, HDF5 times do not include copying to the two hour file")
+
+    print("{:>8} {:>6} | {:>10} {:>10} | {:>10} {:>10}".format(
+        'product', 'format', 'ms/record', 'MB/s', 'file (MB)', 'vs dmap'))
+    for product in dmap.DMAP_PRODUCTS:
+        records = [make_record(product, args, rng) for _ in range(args.records)]
+        writers = [('dmap', lambda d: write_dmap(records, product, d))]
+        if not args.no_hdf5:
+            writers.append(('hdf5', lambda d: write_hdf5(records, d, h5copy)))
+
+        times = []
+        for file_format, writer in writers:
+            with tempfile.TemporaryDirectory() as directory:
+                start = time.perf_counter()
+                size = writer(directory)
+                elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            print("{:>8} {:>6} | {:>10.2f} {:>10.1f} | {:>10.2f} {:>9.1f}x".format(
+                product, file_format, elapsed / args.records * 1e3, size / elapsed / 1e6,
+                size / 1e6, elapsed / times[0]))
+
+
+if __name__ == '__main__':
+    main()
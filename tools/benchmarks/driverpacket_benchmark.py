@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+    driverpacket_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Micro-benchmark of the two ways radar_control can put tx samples in a DriverPacket: the
+    repeated float channel_samples fields, filled from Python lists, and the packed complex64
+    packed_samples bytes field, filled straight from the numpy buffer. Reports the encode time
+    (filling the packet and serializing it) and the serialized packet size of each.
+
+    Requires the protobuf modules from a Borealis build (build/debug or build/release).
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.environ["BOREALISPATH"])
+if __debug__:
+    from build.debug.utils.protobuf.driverpacket_pb2 import DriverPacket
+else:
+    from build.release.utils.protobuf.driverpacket_pb2 import DriverPacket
+
+
+def encode_lists(samples_array):
+    """The original encoding, one repeated float per sample per real/imag part."""
+    driverpacket = DriverPacket()
+    for ant_idx in range(samples_array.shape[0]):
+        sample_add = driverpacket.channel_samples.add()
+        sample_add.real.extend(samples_array[ant_idx, :].real.tolist())
+        sample_add.imag.extend(samples_array[ant_idx, :].imag.tolist())
+    return driverpacket.SerializeToString()
+
+
+def encode_packed(samples_array):
+    """The packed encoding, as used by radar_control.data_to_driver."""
+    driverpacket = DriverPacket()
+    driverpacket.num_channels = samples_array.shape[0]
+    driverpacket.packed_samples = np.ascontiguousarray(samples_array, dtype=np.complex64).tobytes()
+    return driverpacket.SerializeToString()
+
+
+def decode_packed(serialized):
+    """Decode a packed packet the same way the driver does, for checking the round trip."""
+    driverpacket = DriverPacket()
+    driverpacket.ParseFromString(serialized)
+    samples = np.frombuffer(driverpacket.packed_samples, dtype=np.complex64)
+    return samples.reshape(driverpacket.num_channels, -1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--antennas', type=int, default=16, help='Number of tx antennas')
+    parser.add_argument('--samples', type=int, nargs='+', default=[400, 1600, 6400],
+                        help='Number of samples per antenna in a pulse')
+    parser.add_argument('--repeats', type=int, default=200, help='Encodes per timing')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    print("{:>8} {:>8} | {:>12} {:>12} {:>8} | {:>12} {:>12}".format(
+        'antennas', 'samples', 'lists (us)', 'packed (us)', 'speedup', 'lists (B)', 'packed (B)'))
+    for num_samples in args.samples:
+        shape = (args.antennas, num_samples)
+        samples_array = (rng.standard_normal(shape) +
+                         1j * rng.standard_normal(shape)).astype(np.complex64)
+
+        decoded = decode_packed(encode_packed(samples_array))
+        if not np.array_equal(decoded, samples_array):
+            raise RuntimeError("Packed samples did not survive the round trip")
+
+        lists_time = min(timeit.repeat(lambda: encode_lists(samples_array), number=args.repeats,
+                                       repeat=3)) / args.repeats
+        packed_time = min(timeit.repeat(lambda: encode_packed(samples_array), number=args.repeats,
+                                        repeat=3)) / args.repeats
+        lists_size = len(encode_lists(samples_array))
+        packed_size = len(encode_packed(samples_array))
+
+        print("{:>8} {:>8} | {:>12.1f} {:>12.1f} {:>7.1f}x | {:>12} {:>12}".format(
+            args.antennas, num_samples, lists_time * 1e6, packed_time * 1e6,
+            lists_time / packed_time, lists_size, packed_size))
+
+
+if __name__ == '__main__':
+    main()
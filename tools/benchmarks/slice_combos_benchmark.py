@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+    slice_combos_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Micro-benchmark of the slice grouping done while building an experiment. Synthetic
+    experiments with dozens of slices are interfaced at random into scans, averaging periods,
+    sequences and concurrent slices, and the slices are grouped level by level the way
+    build_scans does: by scan, then by averaging period within each scan, then by sequence within
+    each averaging period. Reports the time taken with the union-find ScanClassBase.
+    slice_combos_sorter and with the pairwise merge it replaced, after checking that both give
+    the same groups.
+
+    :copyright: 2021 SuperDARN Canada
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.environ["BOREALISPATH"])
+sys.path.append(os.path.join(os.environ["BOREALISPATH"], 'tools/testing_utils/experiments'))
+from experiment_prototype.scan_classes.scan_class_base import ScanClassBase
+from slice_combos_unittests import merge_combos_pairwise
+
+INTERFACE_TYPES = ('SCAN', 'AVEPERIOD', 'SEQUENCE', 'CONCURRENT')
+
+
+def make_interface(num_slices, rng):
+    """
+    Make the interfacing dictionary of a synthetic experiment. Each slice is put in a random
+    scan, averaging period and sequence, and slices sharing all three are CONCURRENT.
+    """
+    num_groups = max(1, int(num_slices ** 0.5) // 2)
+    placement = [(rng.randrange(num_groups), rng.randrange(num_groups), rng.randrange(num_groups))
+                 for _ in range(num_slices)]
+    interface = {}
+    for first, second in itertools.combinations(range(num_slices), 2):
+        shared = 0
+        while shared < 3 and placement[first][shared] == placement[second][shared]:
+            shared += 1
+        interface[(first, second)] = INTERFACE_TYPES[shared]
+    return interface
+
+
+def group_slices(interface, slice_ids, sorter):
+    """Group the slices into scans, averaging periods and sequences using the given sorter."""
+    def nested_interface(ids):
+        return {combo: interface[combo] for combo in itertools.combinations(ids, 2)}
+
+    groups = []
+    scans = sorter([list(k) for k, v in interface.items() if v != 'SCAN'], slice_ids)
+    for scan in scans:
+        aveperiods = sorter([list(k) for k, v in nested_interface(scan).items()
+                             if v in ('CONCURRENT', 'SEQUENCE')], scan)
+        for aveperiod in aveperiods:
+            sequences = sorter([list(k) for k, v in nested_interface(aveperiod).items()
+                                if v == 'CONCURRENT'], aveperiod)
+            groups.append((scan, aveperiod, sequences))
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slices', type=int, nargs='+', default=[12, 24, 48, 96],
+                        help='Number of slices in the synthetic experiments')
+    parser.add_argument('--repeats', type=int, default=20, help='Groupings per timing')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random interfacing')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sorters = (('union-find', ScanClassBase.slice_combos_sorter),
+               ('pairwise', merge_combos_pairwise))
+
+    print("{:>8} {:>8} | {:>14} {:>14} {:>8}".format('slices', 'groups', 'union-find (ms)',
+                                                      'pairwise (ms)', 'speedup'))
+    for num_slices in args.slices:
+        interface = make_interface(num_slices, rng)
+        slice_ids = list(range(num_slices))
+
+        results = [group_slices(interface, slice_ids, sorter) for _, sorter in sorters]
+        if results[0] != results[1]:
+            raise RuntimeError("Groupings differ for {} slices".format(num_slices))
+
+        times = []
+        for _, sorter in sorters:
+            times.append(min(timeit.repeat(lambda: group_slices(interface, slice_ids, sorter),
+                                           number=args.repeats, repeat=3)) / args.repeats)
+
+        num_groups = sum(len(sequences) for _, _, sequences in results[0])
+        print("{:>8} {:>8} | {:>14.3f} {:>14.3f} {:>7.1f}x".format(
+            num_slices, num_groups, times[0] * 1e3, times[1] * 1e3, times[1] / times[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# metrics_viewer.py
+# Command line viewer for the runtime metrics published by the Borealis modules.
+#
+# Usage:
+#   python3 metrics_viewer.py                 # refreshing table of all modules
+#   python3 metrics_viewer.py --text          # print the plain text exposition format
+#   python3 metrics_viewer.py --textfile FILE # keep FILE updated for a scraper
+
+import argparse as ap
+import json
+import os
+import sys
+import time
+
+import zmq
+
+borealis_path = os.environ['BOREALISPATH']
+if not borealis_path:
+    raise ValueError("BOREALISPATH env variable not set")
+
+sys.path.append(borealis_path + '/utils/')
+import metrics.metrics as metrics
+import shared_macros.shared_macros as sm
+
+
+def format_table(snapshots):
+    """
+    Format the latest snapshot of each module as a table.
+
+    :param snapshots: Latest snapshot per module name.
+    :type snapshots: dict
+    :returns: The table.
+    :rtype: str
+    """
+    now = time.time()
+    lines = []
+    for module in sorted(snapshots.keys()):
+        snapshot = snapshots[module]
+        age = now - snapshot['time']
+        header = "{} (uptime {:.0f}s, updated {:.1f}s ago)".format(module.upper(),
+                                                                   snapshot['uptime'], age)
+        lines.append(sm.COLOR('yellow' if age > 5.0 else 'green', header))
+        for name, metric in sorted(snapshot['metrics'].items()):
+            if metric['type'] == 'histogram':
+                if metric['count'] == 0:
+                    value = "no samples"
+                else:
+                    p50 = metrics.histogram_quantile(metric, 0.5)
+                    p99 = metrics.histogram_quantile(metric, 0.99)
+                    value = "n={} last={:.3f} mean={:.3f} p50={:.3f} p99={:.3f} max={:.3f}".format(
+                        metric['count'], metric['last'], metric['sum'] / metric['count'], p50,
+                        p99, metric['max'])
+            elif isinstance(metric['value'], float):
+                value = "{:.3f}".format(metric['value'])
+            else:
+                value = str(metric['value'])
+            lines.append("    {:<36} {}".format(name, value))
+    return "\n".join(lines)
+
+
+def main():
+    parser = ap.ArgumentParser(description='View the runtime metrics published by Borealis')
+    parser.add_argument('--address', help='Address to listen on. Defaults to metrics_address '
+                                          'from config.ini')
+    parser.add_argument('--module', help='Only show this module', default='')
+    parser.add_argument('--text', action='store_true',
+                        help='Print the text exposition format instead of a table')
+    parser.add_argument('--textfile', help='Write the text exposition format of all modules '
+                                           'to this file, atomically, on every update')
+    parser.add_argument('--once', action='store_true',
+                        help='Exit after the first snapshot is received')
+    args = parser.parse_args()
+
+    address = args.address
+    if address is None:
+        with open(borealis_path + "/config.ini", 'r') as config_data:
+            address = json.load(config_data)["metrics_address"]
+
+    context = zmq.Context().instance()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, args.module.encode('utf-8'))
+    socket.bind(address)
+
+    snapshots = {}
+    while True:
+        try:
+            topic, payload = socket.recv_multipart()
+        except KeyboardInterrupt:
+            break
+
+        snapshot = json.loads(payload.decode('utf-8'))
+        snapshots[snapshot['module']] = snapshot
+
+        if args.textfile:
+            tmp_file = args.textfile + '.tmp'
+            with open(tmp_file, 'w') as f:
+                for module in sorted(snapshots.keys()):
+                    f.write(metrics.to_text(snapshots[module]))
+            os.replace(tmp_file, args.textfile)
+        elif args.text:
+            sys.stdout.write(metrics.to_text(snapshot))
+            sys.stdout.flush()
+        else:
+            # Clear the terminal and redraw.
+            sys.stdout.write("\033[2J\033[H" + format_table(snapshots) + "\n")
+            sys.stdout.flush()
+
+        if args.once:
+            break
+
+
+if __name__ == '__main__':
+    main()
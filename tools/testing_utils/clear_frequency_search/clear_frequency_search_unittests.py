@@ -0,0 +1,130 @@
+"""
+Test module for the clear frequency search (utils/clear_frequency_search).
+It is run simply via 'python3 clear_frequency_search_unittests.py'.
+
+The searches are run on a synthetic ring buffer of unit power noise with strong tones injected
+every 2 kHz, except in a quiet gap, checking the spectrum, the window wrap around, and that the
+picks avoid the tones, the restricted frequencies and each other.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_prototype.experiment_exception import ExperimentException
+from utils.clear_frequency_search.clear_frequency_search import ClearFrequencySearch, \
+    power_spectrum, ringbuffer_window
+from utils.frequency_ranges.frequency_ranges import FrequencyRanges
+
+RX_RATE = 500.0e3  # Hz
+CTR_FREQ = 12000.0  # kHz
+NUM_SAMPLES = 100000
+GAP = (12018, 12030)  # kHz, no tones in between
+TONES = [f for f in range(11900, 12100, 2) if not GAP[0] <= f <= GAP[1]]
+BANDWIDTH = 1.0e3 / 300  # kHz, of a 300 us pulse
+
+
+def make_ringbuffer(tones, seed=0, num_antennas=2):
+    """Unit power noise with a tone of power 1000 at each of the tones (kHz)."""
+    rng = np.random.default_rng(seed)
+    shape = (num_antennas, NUM_SAMPLES)
+    ringbuffer = (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)) / np.sqrt(2)
+    t = np.arange(NUM_SAMPLES) / RX_RATE
+    for freq in tones:
+        phases = rng.uniform(0, 2 * np.pi, (num_antennas, 1))
+        ringbuffer += np.sqrt(1000.0) * np.exp(1j * (2 * np.pi * (freq - CTR_FREQ) * 1.0e3 * t +
+                                                     phases))
+    return ringbuffer.astype(np.complex64)
+
+
+class TestClearFrequencySearch(unittest.TestCase):
+    """
+    A unittest class to test the clear frequency search.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ringbuffer = make_ringbuffer(TONES)
+
+    def test_window(self):
+        """Windows wrapping around the end of the ring buffer are joined in order."""
+        ringbuffer = np.arange(20).reshape(2, 10)
+        np.testing.assert_array_equal(ringbuffer_window(ringbuffer, 6, 4), ringbuffer[:, 2:6])
+        np.testing.assert_array_equal(ringbuffer_window(ringbuffer, 13, 5),
+                                      ringbuffer[:, [8, 9, 0, 1, 2]])
+        with self.assertRaises(ValueError):
+            ringbuffer_window(ringbuffer, 5, 11)
+
+    def test_spectrum(self):
+        """The noise density is 1 / rx_rate, and a tone shows up at its frequency."""
+        noise = make_ringbuffer([], seed=1)
+        freqs, power = power_spectrum(noise, RX_RATE)
+        self.assertAlmostEqual(np.mean(power) * RX_RATE, 1.0, delta=0.05)
+
+        freqs, power = power_spectrum(make_ringbuffer([12040.0], seed=1), RX_RATE)
+        self.assertAlmostEqual(freqs[np.argmax(power)], 40.0e3, delta=RX_RATE / 8192)
+
+    def test_quietest_frequency(self):
+        """The pick is in the gap between the tones, with the power of the noise."""
+        search = ClearFrequencySearch(RX_RATE, CTR_FREQ)
+        spectrum = search.spectrum(self.ringbuffer, NUM_SAMPLES, NUM_SAMPLES)
+        freq, power = search.quietest_frequency(spectrum, (11950, 12050), BANDWIDTH)
+        self.assertTrue(GAP[0] + BANDWIDTH / 2 < freq < GAP[1] - BANDWIDTH / 2)
+        self.assertLess(power * RX_RATE, 2.0)
+
+        # Outside the gap, every band has a tone.
+        freq, power = search.quietest_frequency(spectrum, (11950, 12010), BANDWIDTH)
+        self.assertGreater(power * RX_RATE, 10.0)
+
+    def test_restricted(self):
+        """Restricted frequencies are not picked, and no clear frequency gives None."""
+        search = ClearFrequencySearch(RX_RATE, CTR_FREQ, FrequencyRanges([(GAP[0], 12024)]))
+        spectrum = search.spectrum(self.ringbuffer, NUM_SAMPLES, NUM_SAMPLES)
+        freq, _ = search.quietest_frequency(spectrum, (11950, 12050), BANDWIDTH)
+        self.assertGreater(freq - BANDWIDTH / 2, 12024)
+
+        search = ClearFrequencySearch(RX_RATE, CTR_FREQ, FrequencyRanges([(11900, 12100)]))
+        spectrum = search.spectrum(self.ringbuffer, NUM_SAMPLES, NUM_SAMPLES)
+        self.assertIsNone(search.quietest_frequency(spectrum, (11950, 12050), BANDWIDTH))
+
+    def test_next_lap(self):
+        """The same window position one lap later holds new samples, so gets a new spectrum."""
+        ringbuffer = self.ringbuffer.copy()
+        search = ClearFrequencySearch(RX_RATE, CTR_FREQ)
+        first = search.spectrum(ringbuffer, 30000, 20000)
+
+        ringbuffer *= 10
+        second = search.spectrum(ringbuffer, 30000 + NUM_SAMPLES, 20000)
+        self.assertIsNot(second, first)
+        np.testing.assert_allclose(second[1], first[1] * 100, rtol=1e-3)
+
+    def test_search(self):
+        """Slices get separate bands, from one spectrum of a window that wraps around."""
+        search = ClearFrequencySearch(RX_RATE, CTR_FREQ)
+        end_sample = NUM_SAMPLES + 30000
+        requests = {0: ((11950, 12050), BANDWIDTH), 1: ((12000, 12100), BANDWIDTH)}
+        frequencies = search.search(self.ringbuffer, end_sample, 50000, requests)
+        self.assertEqual(set(frequencies), {0, 1})
+        self.assertGreater(abs(frequencies[0] - frequencies[1]), BANDWIDTH)
+        for freq in frequencies.values():
+            self.assertTrue(GAP[0] < freq < GAP[1])
+
+        spectrum = search.spectrum(self.ringbuffer, end_sample, 50000)
+        self.assertIs(search.spectrum(self.ringbuffer, end_sample, 50000), spectrum)
+
+        # The only candidate is the band picked for slice 0.
+        requests[2] = ((frequencies[0], frequencies[0]), BANDWIDTH)
+        with self.assertRaisesRegex(ExperimentException, "No clear frequency"):
+            search.search(self.ringbuffer, end_sample, 50000, requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Test module for the array file writer used by data_write (utils/array_write).
+It is run simply via 'python3 array_write_unittests.py'.
+
+Synthetic Borealis records are appended to array files and read back, checking that shared
+fields are written once, per record fields get a row per record and are padded when records
+differ in size, and that a change in shared fields is refused.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import tables
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/utils/')
+
+from array_write.array_write import ArrayFile, read_array_file, chunk_shape
+from dmap_unittests import make_rawacf_record, make_bfiq_record
+
+
+class TestArrayWrite(unittest.TestCase):
+    """
+    A unittest class to test writing array files.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'test.rawacf.hdf5')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def rawacf_record(self, num_beams, num_sequences, seed):
+        record = make_rawacf_record(num_beams=num_beams, seed=seed)
+        record['num_sequences'] = num_sequences
+        record['sqn_timestamps'] = 1.6e9 + seed + 0.1 * np.arange(num_sequences)
+        record['noise_at_freq'] = np.arange(num_sequences, dtype=np.float64)
+        record['lost_sequences'] = np.array([1], dtype=np.uint32) if seed == 1 else \
+            np.array([], dtype=np.uint32)
+        record['correlation_descriptors'] = ['num_beams', 'num_ranges', 'num_lags']
+        record['slice_interfacing'] = str({1: 'CONCURRENT'} if seed else {})
+        return record
+
+    def test_rawacf_rows(self):
+        records = [self.rawacf_record(1, 30, 0), self.rawacf_record(2, 31, 1),
+                   self.rawacf_record(1, 29, 2)]
+        array_file = ArrayFile(self.filename)
+        for record in records:
+            self.assertTrue(array_file.append(record))
+        array_file.close()
+        fields = read_array_file(self.filename)
+
+        # Shared fields are written once.
+        self.assertEqual(fields['station'], 'sas')
+        np.testing.assert_array_equal(fields['lags'], records[0]['lags'])
+        self.assertEqual(list(fields['correlation_descriptors']),
+                         ['num_records', 'max_num_beams', 'num_ranges', 'num_lags'])
+        self.assertNotIn('correlation_dimensions', fields)
+
+        # Per record fields have a row per record, padded to the largest record.
+        num_ranges, num_lags = records[0]['correlation_dimensions'][1:]
+        self.assertEqual(fields['main_acfs'].shape, (3, 2, num_ranges, num_lags))
+        self.assertEqual(fields['sqn_timestamps'].shape, (3, 31))
+        np.testing.assert_array_equal(fields['num_beams'], [1, 2, 1])
+        np.testing.assert_array_equal(fields['num_sequences'], [30, 31, 29])
+        np.testing.assert_array_equal(fields['num_lost_sequences'], [0, 1, 0])
+        np.testing.assert_array_equal(fields['lost_sequences'], [[0], [1], [0]])
+        self.assertEqual(list(fields['slice_interfacing']),
+                         ['{}', "{1: 'CONCURRENT'}", "{1: 'CONCURRENT'}"])
+        for i, record in enumerate(records):
+            num_beams = len(record['beam_nums'])
+            acfs = record['main_acfs'].reshape(record['correlation_dimensions'])
+            np.testing.assert_array_equal(fields['main_acfs'][i, :num_beams], acfs)
+            np.testing.assert_array_equal(fields['main_acfs'][i, num_beams:], 0)
+            np.testing.assert_array_equal(fields['sqn_timestamps'][i, :record['num_sequences']],
+                                          record['sqn_timestamps'])
+            np.testing.assert_array_equal(fields['sqn_timestamps'][i, record['num_sequences']:], 0)
+
+    def test_reopen(self):
+        """Records can be appended to an existing file, e.g. after data_write restarts."""
+        array_file = ArrayFile(self.filename)
+        array_file.append(self.rawacf_record(1, 30, 0))
+        array_file.close()
+        array_file = ArrayFile(self.filename)
+        self.assertTrue(array_file.append(self.rawacf_record(1, 30, 1)))
+        record = self.rawacf_record(1, 30, 2)
+        record['experiment_name'] = 'Otherscan'
+        self.assertFalse(array_file.append(record))
+        array_file.close()
+        self.assertEqual(read_array_file(self.filename)['int_time'].shape, (2,))
+
+    def test_bfiq_rows(self):
+        record = make_bfiq_record(num_beams=2, num_sequences=5, num_arrays=2, num_samps=100)
+        record['pulse_phase_offset'] = np.zeros((5, 0), dtype=np.float32)
+        array_file = ArrayFile(self.filename)
+        self.assertTrue(array_file.append(record))
+        self.assertTrue(array_file.append(record))
+        array_file.close()
+        fields = read_array_file(self.filename)
+        self.assertEqual(fields['data'].shape, (2, 2, 5, 2, 100))
+        np.testing.assert_array_equal(fields['data'][1],
+                                      record['data'].reshape(record['data_dimensions']))
+        self.assertEqual(fields['pulse_phase_offset'].shape, (0,))
+        self.assertEqual(list(fields['antenna_arrays_order']), ['main', 'intf'])
+
+    def test_compressed(self):
+        record = make_bfiq_record(num_beams=1, num_sequences=5, num_arrays=2, num_samps=100)
+        filters = tables.Filters(complib='blosc:lz4', complevel=5, shuffle=True)
+        array_file = ArrayFile(self.filename, filters=filters, chunk_bytes=4096)
+        self.assertTrue(array_file.append(record))
+        array_file.close()
+        with tables.open_file(self.filename) as f:
+            self.assertEqual(f.root.data.filters.complib, 'blosc:lz4')
+            self.assertEqual(f.root.data.chunkshape, (1, 1, 5, 1, 100))
+        np.testing.assert_array_equal(read_array_file(self.filename)['data'][0],
+                                      record['data'].reshape(record['data_dimensions']))
+
+    def test_chunk_shape(self):
+        """Large rows are split evenly along their outer dimensions."""
+        self.assertEqual(chunk_shape((20, 30, 300), 8, 1 << 20), (1, 10, 30, 300))
+        self.assertEqual(chunk_shape((75, 19), 8, 1 << 16), (5, 75, 19))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+"""
+Test module for the DMAP writer used by data_write (utils/dmap_write).
+It is run simply via 'python3 dmap_unittests.py'.
+
+Synthetic Borealis rawacf and bfiq records are written to DMAP and read back with a reference
+reader written here from the DMAP format, independently of the numpy record layout used by the
+writer. Records appended from several threads at once are found at the offsets the writer gives
+for them. If pyDARNio is installed, the files are also read back with it.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/utils/')
+
+import dmap_write.dmap_write as dmap
+
+try:
+    import pydarnio
+except ImportError:
+    pydarnio = None
+
+# DMAP type code: struct format, for the reference reader.
+STRUCT_FORMATS = {1: 'b', 2: 'h', 3: 'i', 4: 'f', 8: 'd', 10: 'q', 16: 'B', 17: 'H', 18: 'I',
+                  19: 'Q'}
+
+
+def read_string(buf, offset):
+    end = buf.index(b'\0', offset)
+    return buf[offset:end].decode('ascii'), end + 1
+
+
+def read_dmap(buf):
+    """
+    Reference DMAP reader.
+
+    :param buf: the contents of a DMAP file, bytes.
+    :returns: list of records, dicts of name: value, with arrays as numpy arrays in C order.
+    """
+    records = []
+    offset = 0
+    while offset < len(buf):
+        code, size, num_scalars, num_arrays = struct.unpack_from('<iiii', buf, offset)
+        if code != dmap.DMAP_CODE:
+            raise ValueError("Bad record code {} at {}".format(code, offset))
+        end = offset + size
+        offset += 16
+        record = {}
+        for _ in range(num_scalars):
+            name, offset = read_string(buf, offset)
+            type_code = buf[offset]
+            offset += 1
+            if type_code == 9:
+                record[name], offset = read_string(buf, offset)
+            else:
+                fmt = '<' + STRUCT_FORMATS[type_code]
+                record[name] = struct.unpack_from(fmt, buf, offset)[0]
+                offset += struct.calcsize(fmt)
+        for _ in range(num_arrays):
+            name, offset = read_string(buf, offset)
+            type_code = buf[offset]
+            num_dims = struct.unpack_from('<i', buf, offset + 1)[0]
+            dims = struct.unpack_from('<{}i'.format(num_dims), buf, offset + 5)
+            offset += 5 + 4 * num_dims
+            count = int(np.prod(dims))
+            fmt = '<{}{}'.format(count, STRUCT_FORMATS[type_code])
+            values = struct.unpack_from(fmt, buf, offset)
+            offset += struct.calcsize(fmt)
+            # The first dimension varies fastest.
+            record[name] = np.array(values).reshape(dims[::-1])
+        if offset != end:
+            raise ValueError("Record size {} does not match its contents".format(size))
+        records.append(record)
+    return records
+
+
+def make_record(num_beams=2, num_sequences=5):
+    """Make the fields shared by synthetic Borealis rawacf and bfiq records."""
+    lags = np.array([[0, 0], [26, 27], [20, 22], [9, 12], [22, 26], [22, 27], [20, 26], [20, 27],
+                     [12, 20], [0, 9], [12, 22], [9, 20], [0, 12], [9, 22], [12, 26], [12, 27],
+                     [9, 26], [9, 27], [27, 27]], dtype=np.uint32)
+    pulses = np.array([0, 9, 12, 20, 22, 26, 27], dtype=np.uint32)
+    blanks = np.concatenate([np.arange(p * 8, p * 8 + 2) for p in pulses]).astype(np.uint32)
+    return {
+        'borealis_git_hash': 'v0.5-120-gabc1234',
+        'experiment_id': np.int16(151),
+        'experiment_name': 'Normalscan',
+        'experiment_comment': 'test',
+        'slice_comment': 'slice 0',
+        'slice_id': np.uint32(0),
+        'station': 'sas',
+        'num_sequences': num_sequences,
+        'range_sep': np.float32(44.96887),
+        'first_range': np.float32(180.0),
+        'first_range_rtt': np.float32(1200.6923),
+        'rx_sample_rate': 3333.3333333333335,
+        'scan_start_marker': True,
+        'int_time': np.float32(3.25),
+        'tx_pulse_len': np.uint32(300),
+        'tau_spacing': np.uint32(2400),
+        'freq': np.uint32(10500),
+        'pulses': pulses,
+        'lags': lags,
+        'blanked_samples': blanks,
+        'sqn_timestamps': 1.6e9 + 0.1 * np.arange(num_sequences) + 0.123456,
+        'beam_nums': [np.uint32(b) for b in range(num_beams)],
+        'beam_azms': [-20.0 + 3.24 * b for b in range(num_beams)],
+        'noise_at_freq': np.arange(num_sequences, dtype=np.float64) + 10.0,
+        'agc_status_word': np.uint32(0),
+        'lp_status_word': np.uint32(0),
+        'gps_locked': True,
+    }
+
+
+def make_rawacf_record(num_beams=2, num_ranges=75, xcfs=True, seed=0):
+    rng = np.random.default_rng(seed)
+    record = make_record(num_beams)
+    num_lags = record['lags'].shape[0]
+    size = num_beams * num_ranges * num_lags
+    record['correlation_dimensions'] = np.array([num_beams, num_ranges, num_lags], np.uint32)
+    record['main_acfs'] = (rng.normal(size=size) + 1j * rng.normal(size=size)).astype(np.complex64)
+    if xcfs:
+        record['xcfs'] = (rng.normal(size=size) + 1j * rng.normal(size=size)).astype(np.complex64)
+    return record
+
+
+def make_bfiq_record(num_beams=2, num_sequences=5, num_arrays=2, num_samps=300, seed=0):
+    rng = np.random.default_rng(seed)
+    record = make_record(num_beams, num_sequences)
+    dims = (num_arrays, num_sequences, num_beams, num_samps)
+    record['data_dimensions'] = np.array(dims, dtype=np.uint32)
+    record['antenna_arrays_order'] = ['main', 'intf'][:num_arrays]
+    record['num_samps'] = np.uint32(num_samps)
+    record['num_ranges'] = np.uint32(75)
+    record['pulse_phase_offset'] = np.zeros((num_sequences, 0), dtype=np.float32)
+    data = rng.normal(size=dims) + 1j * rng.normal(size=dims)
+    record['data'] = (1e3 * data).astype(np.complex64).flatten()
+    return record
+
+
+class TestDmapWrite(unittest.TestCase):
+    """
+    A unittest class to test writing DMAP records.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, product, borealis_records):
+        filename = os.path.join(self.tmp_dir.name, 'test.dmap')
+        for record in borealis_records:
+            dmap.append_records(filename, dmap.DMAP_PRODUCTS[product][1](record, 'test.rawacf'))
+        with open(filename, 'rb') as f:
+            return filename, read_dmap(f.read())
+
+    def test_scalar_types(self):
+        """Each scalar type is written with its type code and value."""
+        scalars = [('c', 'c', -5), ('h', 'h', -300), ('i', 'i', 70000), ('f', 'f', 1.5),
+                   ('d', 'd', 2.25), ('s', 's', 'hello'), ('q', 'q', 2 ** 40), ('B', 'B', 255),
+                   ('H', 'H', 60000), ('I', 'I', 2 ** 31), ('Q', 'Q', 2 ** 63)]
+        record = read_dmap(dmap.encode_record(scalars, []))[0]
+        self.assertEqual(record, {name: value for name, _, value in scalars})
+
+    def test_array_dimensions(self):
+        """Arrays are read back with their C shape, so dimensions are stored reversed."""
+        array = np.arange(24, dtype=np.int32).reshape(2, 3, 4)
+        buf = dmap.encode_record([], [('a', 'i', array)])
+        self.assertEqual(struct.unpack_from('<3i', buf, 16 + 2 + 1 + 4), (4, 3, 2))
+        np.testing.assert_array_equal(read_dmap(buf)[0]['a'], array)
+
+    def test_char_wraps(self):
+        """Version numbers of 255 are written to chars as 0xff, as in RST."""
+        record = read_dmap(dmap.encode_record([('v', 'c', 255)], []))[0]
+        self.assertEqual(record['v'], -1)
+
+    def test_rawacf_round_trip(self):
+        borealis = make_rawacf_record()
+        _, records = self.write('rawacf', [borealis, make_rawacf_record(seed=1)])
+        self.assertEqual(len(records), 4)
+
+        num_beams, num_ranges, num_lags = borealis['correlation_dimensions']
+        acfs = borealis['main_acfs'].reshape(num_beams, num_ranges, num_lags)
+        xcfs = borealis['xcfs'].reshape(num_beams, num_ranges, num_lags)
+        for beam, record in enumerate(records[:2]):
+            self.assertEqual(record['stid'], 5)
+            self.assertEqual(record['cp'], 151)
+            self.assertEqual(record['bmnum'], beam)
+            self.assertEqual(record['nave'], 5)
+            self.assertEqual(record['nrang'], num_ranges)
+            self.assertEqual(record['mplgs'], num_lags)
+            self.assertEqual(record['mppul'], 7)
+            self.assertEqual(record['smsep'], 300)
+            self.assertEqual(record['lagfr'], 1201)
+            self.assertEqual(record['frang'], 180)
+            self.assertEqual(record['rsep'], 45)
+            self.assertEqual(record['intt.sc'], 3)
+            self.assertEqual(record['intt.us'], 250000)
+            self.assertEqual(record['xcf'], 1)
+            self.assertEqual((record['radar.revision.major'], record['radar.revision.minor']),
+                             (0, 5))
+            self.assertEqual(record['time.yr'], 2020)
+            self.assertEqual(record['time.us'], 123456)
+            self.assertAlmostEqual(record['noise.search'], 10.0)
+            self.assertIn('beam {}'.format(beam), record['combf'])
+            np.testing.assert_array_equal(record['ptab'], borealis['pulses'])
+            np.testing.assert_array_equal(record['ltab'], borealis['lags'])
+            np.testing.assert_array_equal(record['slist'], np.arange(num_ranges))
+            np.testing.assert_allclose(record['pwr0'], np.abs(acfs[beam, :, 0]), rtol=1e-6)
+            np.testing.assert_array_equal(record['acfd'][..., 0], acfs[beam].real)
+            np.testing.assert_array_equal(record['acfd'][..., 1], acfs[beam].imag)
+            np.testing.assert_array_equal(record['xcfd'][..., 0], xcfs[beam].real)
+            np.testing.assert_array_equal(record['xcfd'][..., 1], xcfs[beam].imag)
+
+    def test_rawacf_without_xcfs(self):
+        _, records = self.write('rawacf', [make_rawacf_record(xcfs=False)])
+        self.assertEqual(records[0]['xcf'], 0)
+        self.assertNotIn('xcfd', records[0])
+
+    def test_iqdat_round_trip(self):
+        borealis = make_bfiq_record()
+        _, records = self.write('bfiq', [borealis])
+        self.assertEqual(len(records), 2)
+
+        num_arrays, num_sequences, num_beams, num_samps = borealis['data_dimensions']
+        samples = borealis['data'].reshape(num_arrays, num_sequences, num_beams, num_samps)
+        for beam, record in enumerate(records):
+            self.assertEqual(record['seqnum'], num_sequences)
+            self.assertEqual(record['chnnum'], num_arrays)
+            self.assertEqual(record['smpnum'], num_samps)
+            self.assertEqual(record['skpnum'], 5)
+            # iqdat samples are a flat array of [seqnum, chnnum, smpnum, I/Q], as in RST.
+            self.assertEqual(record['data'].shape, (num_sequences * num_arrays * num_samps * 2,))
+            data = record['data'].reshape(num_sequences, num_arrays, num_samps, 2)
+            np.testing.assert_array_equal(record['toff'],
+                                          np.arange(num_sequences) * 2 * num_arrays * num_samps)
+            np.testing.assert_array_equal(record['tsc'], np.full(num_sequences, 1600000000))
+
+            # The samples are scaled to shorts, so compare them scaled back.
+            expected = samples[:, :, beam, :].transpose(1, 0, 2)
+            expected = np.stack((expected.real, expected.imag), axis=-1)
+            scale = 32767 / np.max(np.abs(expected))
+            self.assertEqual(np.max(np.abs(data)), 32767)
+            np.testing.assert_allclose(data / scale, expected, atol=1 / scale)
+
+    def test_not_convertible(self):
+        record = make_bfiq_record()
+        record['pulse_phase_offset'] = np.ones((5, 7), dtype=np.float32)
+        with self.assertRaises(ValueError):
+            dmap.iqdat_records(record)
+
+        record = make_rawacf_record()
+        record['blanked_samples'] = np.arange(0, 160, 10, dtype=np.uint32)
+        with self.assertRaises(ValueError):
+            dmap.rawacf_records(record)
+
+        record = make_rawacf_record()
+        record['station'] = 'xyz'
+        with self.assertRaises(ValueError):
+            dmap.rawacf_records(record)
+
+    def test_append_offsets(self):
+        """Each append gives the offset and size of its records, with other threads appending."""
+        filename = os.path.join(self.tmp_dir.name, 'test.dmap')
+        records = dmap.rawacf_records(make_rawacf_record(), 'first')
+        first_size = dmap.append_records(filename, records)[1]
+        self.assertEqual(first_size, os.path.getsize(filename))
+        self.assertEqual(dmap.append_records(filename, records), (first_size, first_size))
+
+        appends = []
+
+        def append(writer):
+            for i in range(20):
+                name = 'writer{}.{}'.format(writer, i)
+                records = dmap.rawacf_records(make_rawacf_record(seed=i), name)
+                appends.append((name,) + dmap.append_records(filename, records))
+
+        threads = [threading.Thread(target=append, args=(writer,)) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(filename, 'rb') as f:
+            buf = f.read()
+        self.assertEqual(len(appends), 80)
+        self.assertEqual(sum(size for _, _, size in appends) + 2 * first_size, len(buf))
+        for name, offset, size in appends:
+            beams = read_dmap(buf[offset:offset + size])
+            self.assertEqual(len(beams), 2)
+            for beam in beams:
+                self.assertTrue(beam['combf'].startswith(
+                    'Converted from Borealis file: {} beam'.format(name)))
+
+    @unittest.skipIf(pydarnio is None, "pyDARNio is not installed")
+    def test_pydarnio_reads(self):
+        filename, records = self.write('rawacf', [make_rawacf_record()])
+        pydarnio_records = pydarnio.SDarnRead(filename).read_rawacf()
+        self.assertEqual(len(pydarnio_records), len(records))
+        np.testing.assert_array_equal(pydarnio_records[0]['acfd'], records[0]['acfd'])
+
+        filename, records = self.write('bfiq', [make_bfiq_record()])
+        pydarnio_records = pydarnio.SDarnRead(filename).read_iqdat()
+        self.assertEqual(len(pydarnio_records), len(records))
+        np.testing.assert_array_equal(pydarnio_records[0]['data'], records[0]['data'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Test module for the record index of two hour files written by data_write (utils/record_index).
+It is run simply via 'python3 record_index_unittests.py'.
+
+Synthetic Borealis records are indexed and the index is read back, checking the entries, time
+lookups, reading only the last entry, and that an incomplete entry at the end is ignored.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/utils/')
+
+import record_index.record_index as record_index
+from dmap_unittests import make_rawacf_record
+
+
+class TestRecordIndex(unittest.TestCase):
+    """
+    A unittest class to test the record index.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'test.rawacf.hdf5.site')
+        self.times = [1600000000000 + 3700 * i for i in range(10)]
+        for i, timestamp in enumerate(self.times):
+            record = make_rawacf_record(num_beams=i % 3 + 1)
+            record_index.append_entry(self.filename, record, timestamp, timestamp, 1000 + i)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_entries(self):
+        """Each record gets an entry with its time, location, size, frequency and beams."""
+        entries = record_index.read_index(self.filename)
+        self.assertEqual(len(entries), len(self.times))
+        np.testing.assert_array_equal(entries['timestamp'], self.times)
+        np.testing.assert_array_equal(entries['location'], self.times)
+        np.testing.assert_array_equal(entries['size'], 1000 + np.arange(len(self.times)))
+        self.assertTrue(np.all(entries['freq'] == 10500))
+        self.assertTrue(np.all(entries['num_sequences'] == 5))
+        np.testing.assert_array_equal(record_index.beam_nums(entries[4]), [0, 1])
+
+    def test_find(self):
+        """Time ranges and nearest records are found."""
+        entries = record_index.read_index(self.filename)
+        found = record_index.find_records(entries, self.times[2], self.times[5])
+        np.testing.assert_array_equal(found['timestamp'], self.times[2:6])
+        found = record_index.find_records(entries, self.times[2] + 1)
+        np.testing.assert_array_equal(found['timestamp'], self.times[3:])
+        self.assertEqual(record_index.nearest_record(entries, self.times[3] + 1000)['timestamp'],
+                         self.times[3])
+        self.assertEqual(record_index.nearest_record(entries, self.times[3] + 3000)['timestamp'],
+                         self.times[4])
+        self.assertEqual(record_index.nearest_record(entries, 0)['timestamp'], self.times[0])
+        self.assertEqual(record_index.nearest_record(entries, self.times[-1] * 2)['timestamp'],
+                         self.times[-1])
+
+    def test_last_entry(self):
+        """The last entry is read on its own, and an incomplete entry at the end is ignored."""
+        self.assertEqual(record_index.last_entry(self.filename)['timestamp'], self.times[-1])
+        with open(record_index.index_filename(self.filename), 'ab') as f:
+            f.write(b'\x01' * (record_index.INDEX_DTYPE.itemsize // 2))
+        self.assertEqual(record_index.last_entry(self.filename)['timestamp'], self.times[-1])
+        self.assertEqual(len(record_index.read_index(self.filename)), len(self.times))
+
+    def test_out_of_order(self):
+        """Entries appended out of time order are read back in order."""
+        record_index.append_entry(self.filename, make_rawacf_record(), self.times[0] + 1, 0, 0)
+        entries = record_index.read_index(self.filename)
+        self.assertTrue(np.all(np.diff(entries['timestamp']) >= 0))
+        self.assertEqual(entries['timestamp'][1], self.times[0] + 1)
+
+    def test_not_an_index(self):
+        """A file that is not an index is refused."""
+        with open(record_index.index_filename(self.filename), 'wb') as f:
+            f.write(b'\x00' * 100)
+        with self.assertRaises(ValueError):
+            record_index.read_index(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Test module for the buffer that puts processed sequences back in order in data_write
+(data_write.ReorderBuffer). It is run simply via 'python3 reorder_buffer_unittests.py'.
+
+Sequences are pushed out of order with explicit arrival times, checking that they come out in
+order, that missing sequences are declared lost when the window fills or the timeout passes,
+that late and duplicate sequences are dropped with their shared memory unlinked, and that the
+buffer starts from the first sequence it sees.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import types
+import unittest
+from multiprocessing import shared_memory
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/data_write/')
+
+from data_write import ReorderBuffer
+
+
+def make_sequence(sequence_num, shm_name=''):
+    """A stand in for a ProcessedSequenceMessage, with the fields ReorderBuffer uses."""
+    return types.SimpleNamespace(sequence_num=sequence_num, bfiq_main_shm=shm_name,
+                                 bfiq_intf_shm='', rawrf_shm='', debug_data=[],
+                                 output_datasets=[])
+
+
+def make_shm():
+    shm = shared_memory.SharedMemory(create=True, size=16)
+    shm.close()
+    return shm
+
+
+def shm_exists(shm):
+    try:
+        shared_memory.SharedMemory(name=shm.name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class TestReorderBuffer(unittest.TestCase):
+    """
+    A unittest class to test ReorderBuffer.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def numbers(self, ready):
+        return [(sequence_num, None if data is None else data.sequence_num)
+                for sequence_num, data in ready]
+
+    def test_in_order(self):
+        """Sequences that arrive out of order come out in order."""
+        buffer = ReorderBuffer(window=10, timeout=1.0, first_sequence_num=0)
+        buffer.push(make_sequence(2), now=0.0)
+        self.assertEqual(buffer.pop(now=0.0), [])
+        self.assertEqual(buffer.depth, 1)
+        buffer.push(make_sequence(0), now=0.1)
+        self.assertEqual(self.numbers(buffer.pop(now=0.1)), [(0, 0)])
+        buffer.push(make_sequence(1), now=0.2)
+        self.assertEqual(self.numbers(buffer.pop(now=0.2)), [(1, 1), (2, 2)])
+        self.assertEqual(buffer.depth, 0)
+        self.assertEqual(buffer.lost, 0)
+
+    def test_window_loss(self):
+        """A missing sequence is lost once window sequences are held after it."""
+        buffer = ReorderBuffer(window=3, timeout=10.0, first_sequence_num=0)
+        for sequence_num in (1, 2):
+            buffer.push(make_sequence(sequence_num), now=0.0)
+        self.assertEqual(buffer.pop(now=0.0), [])
+        buffer.push(make_sequence(3), now=0.0)
+        self.assertEqual(self.numbers(buffer.pop(now=0.0)), [(0, None), (1, 1), (2, 2), (3, 3)])
+        self.assertEqual(buffer.lost, 1)
+
+    def test_timeout_loss(self):
+        """A missing sequence is lost once the sequence after it has waited timeout seconds."""
+        buffer = ReorderBuffer(window=10, timeout=0.5, first_sequence_num=0)
+        self.assertIsNone(buffer.time_to_timeout(now=0.0))
+        buffer.push(make_sequence(1), now=1.0)
+        self.assertEqual(buffer.pop(now=1.4), [])
+        self.assertAlmostEqual(buffer.time_to_timeout(now=1.4), 0.1)
+        self.assertEqual(self.numbers(buffer.pop(now=1.5)), [(0, None), (1, 1)])
+        self.assertEqual(buffer.lost, 1)
+        self.assertEqual(buffer.time_to_timeout(now=1.5), None)
+
+    def test_late(self):
+        """A sequence arriving after it was declared lost is dropped and unlinked."""
+        buffer = ReorderBuffer(window=1, timeout=10.0, first_sequence_num=0)
+        buffer.push(make_sequence(1), now=0.0)
+        self.assertEqual(self.numbers(buffer.pop(now=0.0)), [(0, None), (1, 1)])
+
+        shm = make_shm()
+        self.assertTrue(shm_exists(shm))
+        self.assertFalse(buffer.push(make_sequence(0, shm.name), now=0.1))
+        self.assertEqual(buffer.late, 1)
+        self.assertFalse(shm_exists(shm))
+
+    def test_duplicate(self):
+        """A second copy of a sequence is dropped, whether the first was taken or is held."""
+        buffer = ReorderBuffer(window=10, timeout=10.0, first_sequence_num=0)
+        buffer.push(make_sequence(0), now=0.0)
+        buffer.pop(now=0.0)
+        self.assertFalse(buffer.push(make_sequence(0), now=0.0))
+
+        shm = make_shm()
+        buffer.push(make_sequence(2), now=0.0)
+        buffer.push(make_sequence(2, shm.name), now=0.0)
+        buffer.push(make_sequence(1), now=0.0)
+        self.assertEqual(self.numbers(buffer.pop(now=0.0)), [(1, 1), (2, 2)])
+        self.assertEqual(buffer.late, 2)
+        self.assertEqual(buffer.depth, 0)
+        self.assertFalse(shm_exists(shm))
+
+    def test_startup_sync(self):
+        """Without a first sequence number, the buffer starts at the first sequence pushed."""
+        buffer = ReorderBuffer(window=10, timeout=10.0)
+        buffer.push(make_sequence(1000), now=0.0)
+        self.assertEqual(self.numbers(buffer.pop(now=0.0)), [(1000, 1000)])
+        self.assertEqual(buffer.expected_sequence_num, 1001)
+        self.assertEqual(buffer.lost, 0)
+
+        # With one, the sequences before the first pushed are waited for.
+        buffer = ReorderBuffer(window=10, timeout=10.0, first_sequence_num=998)
+        buffer.push(make_sequence(1000), now=0.0)
+        self.assertEqual(buffer.pop(now=0.0), [])
+        self.assertEqual(self.numbers(buffer.pop(now=10.0)), [(998, None), (999, None),
+                                                               (1000, 1000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""
+Test module for designing decimation schemes and caching filter designs
+(experiment_prototype/decimation_scheme/decimation_scheme.py).
+It is run simply via 'python3 decimation_scheme_unittests.py'.
+
+The designed scheme is checked against every other way of splitting the decimation, built stage
+by stage, and the filter cache is pointed at a temporary directory to check that designs are
+stored, read back instead of designed again, and designed again when an entry is bad.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+import experiment_prototype.decimation_scheme.decimation_scheme as decimation_scheme
+from experiment_prototype.decimation_scheme.decimation_scheme import DecimationScheme, \
+    DecimationStage, create_default_scheme, create_firwin_filter_by_attenuation, \
+    decimation_scheme_cost, design_decimation_scheme
+from experiment_prototype.experiment_exception import ExperimentException
+from utils.experiment_options.experimentoptions import ExperimentOptions
+
+RX_RATE = 1.2e6
+OUTPUT_RATE = 10.0e3
+PASSBAND = 3.0e3
+ATTENUATION = 60.0
+
+
+def build_scheme(dm_rates):
+    """Build a scheme with the stages design_decimation_scheme would use for these dm_rates."""
+    stages = []
+    rate = RX_RATE
+    for stage_num, dm_rate in enumerate(dm_rates):
+        transition_width = rate / dm_rate - 2 * PASSBAND
+        taps = create_firwin_filter_by_attenuation(rate, transition_width,
+                                                   PASSBAND + transition_width / 2, ATTENUATION)
+        stages.append(DecimationStage(stage_num, rate, dm_rate, list(taps)))
+        rate /= dm_rate
+    return DecimationScheme(RX_RATE, rate, stages=stages)
+
+
+class TestDecimationScheme(unittest.TestCase):
+    """
+    A unittest class to test designing decimation schemes.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def test_factorizations(self):
+        """Every ordered split into at most max_factors factors is found, once."""
+        splits = list(decimation_scheme._ordered_factorizations(12, 3))
+        self.assertEqual(sorted(splits), sorted([(12,), (2, 6), (6, 2), (3, 4), (4, 3),
+                                                 (2, 2, 3), (2, 3, 2), (3, 2, 2)]))
+        self.assertEqual(list(decimation_scheme._ordered_factorizations(1, 3)), [()])
+
+    def test_cost(self):
+        """A stage costs its taps for each of its output samples per final output sample."""
+        scheme = create_default_scheme()
+        num_taps = [len(stage.filter_taps) for stage in scheme.stages]
+        expected = num_taps[0] * 5 * 6 * 5 + num_taps[1] * 6 * 5 + num_taps[2] * 5 + num_taps[3]
+        self.assertEqual(decimation_scheme_cost(scheme), expected)
+        self.assertEqual(decimation_scheme_cost(scheme, num_slices=3), 3 * expected)
+
+    def test_design(self):
+        """The design is the cheapest split that fits in the stage and tap limits."""
+        options = ExperimentOptions()
+        designed = design_decimation_scheme(RX_RATE, OUTPUT_RATE, PASSBAND, ATTENUATION,
+                                            printing=False)
+        self.assertEqual(np.prod(designed.dm_rates), RX_RATE / OUTPUT_RATE)
+        self.assertEqual(designed.output_sample_rate, OUTPUT_RATE)
+        designed_cost = decimation_scheme_cost(designed)
+
+        num_splits = 0
+        total_dm_rate = int(RX_RATE / OUTPUT_RATE)
+        for dm_rates in decimation_scheme._ordered_factorizations(
+                total_dm_rate, options.max_number_of_filtering_stages):
+            scheme = build_scheme(dm_rates)
+            if max(len(stage.filter_taps) for stage in scheme.stages) > \
+                    options.max_number_of_filter_taps_per_stage:
+                continue
+            num_splits += 1
+            self.assertGreaterEqual(decimation_scheme_cost(scheme), designed_cost, dm_rates)
+            if list(dm_rates) == list(designed.dm_rates):
+                # The taps predicted for the search are the taps of the stages.
+                for stage, built in zip(designed.stages, scheme.stages):
+                    self.assertEqual(len(stage.filter_taps), len(built.filter_taps))
+        self.assertGreater(num_splits, 1)
+
+    def test_design_errors(self):
+        """Rates that are not integer multiples and impossible passbands are refused."""
+        with self.assertRaisesRegex(ExperimentException, 'not an integer multiple'):
+            design_decimation_scheme(RX_RATE, 7.0e3, PASSBAND, ATTENUATION, printing=False)
+        with self.assertRaisesRegex(ExperimentException, 'Passband'):
+            design_decimation_scheme(RX_RATE, OUTPUT_RATE, OUTPUT_RATE / 2, ATTENUATION,
+                                     printing=False)
+
+
+class TestFilterCache(unittest.TestCase):
+    """
+    A unittest class to test the filter design cache.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.saved = (decimation_scheme._filter_cache_directory,
+                      dict(decimation_scheme._filter_designs))
+        decimation_scheme._filter_cache_directory = os.path.join(self.tmp_dir.name, 'filters')
+        decimation_scheme._filter_designs.clear()
+        self.designs = 0
+
+    def tearDown(self):
+        decimation_scheme._filter_cache_directory = self.saved[0]
+        decimation_scheme._filter_designs.clear()
+        decimation_scheme._filter_designs.update(self.saved[1])
+        self.tmp_dir.cleanup()
+
+    def design(self):
+        self.designs += 1
+        return [1.0, 2.0, 3.0]
+
+    def cache_files(self):
+        return glob.glob(os.path.join(decimation_scheme._filter_cache_directory, '*'))
+
+    def test_memory(self):
+        """A design is made once per process, and callers get their own copy."""
+        taps = decimation_scheme._cached_filter('test', (1, 2), self.design)
+        taps[0] = 100.0
+        again = decimation_scheme._cached_filter('test', (1, 2), self.design)
+        self.assertEqual(self.designs, 1)
+        np.testing.assert_array_equal(again, [1.0, 2.0, 3.0])
+
+        decimation_scheme._cached_filter('test', (1, 3), self.design)
+        self.assertEqual(self.designs, 2)
+
+    def test_disk(self):
+        """Designs are stored on disk and read back by a process that has not made them."""
+        decimation_scheme._cached_filter('test', (1, 2), self.design)
+        self.assertEqual(len(self.cache_files()), 1)
+        self.assertTrue(self.cache_files()[0].endswith('.npy'))
+
+        decimation_scheme._filter_designs.clear()
+        taps = decimation_scheme._cached_filter('test', (1, 2), self.design)
+        self.assertEqual(self.designs, 1)
+        np.testing.assert_array_equal(taps, [1.0, 2.0, 3.0])
+
+    def test_bad_entry(self):
+        """A bad entry is designed again and replaced."""
+        decimation_scheme._cached_filter('test', (1, 2), self.design)
+        path = self.cache_files()[0]
+        with open(path, 'wb') as f:
+            f.write(b'not a numpy file')
+
+        decimation_scheme._filter_designs.clear()
+        taps = decimation_scheme._cached_filter('test', (1, 2), self.design)
+        self.assertEqual(self.designs, 2)
+        np.testing.assert_array_equal(taps, [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(np.load(path), [1.0, 2.0, 3.0])
+
+    def test_filters(self):
+        """Cached filters are the same as designed ones."""
+        taps = create_firwin_filter_by_attenuation(RX_RATE, 100.0e3, 60.0e3, ATTENUATION)
+        decimation_scheme._filter_designs.clear()
+        cached = create_firwin_filter_by_attenuation(RX_RATE, 100.0e3, 60.0e3, ATTENUATION)
+        np.testing.assert_array_equal(taps, cached)
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_no_directory(self):
+        """Without a cache directory, designs are only kept in memory."""
+        decimation_scheme._filter_cache_directory = ''
+        decimation_scheme._cached_filter('test', (1, 2), self.design)
+        decimation_scheme._cached_filter('test', (1, 2), self.design)
+        self.assertEqual(self.designs, 1)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+Test module for the cache of built experiments (experiment_prototype/experiment_cache.py).
+It is run simply via 'python3 experiment_cache_unittests.py'.
+
+A small experiment class is written to a temporary directory that stands in for BOREALISPATH,
+along with a helper module it imports a constant from and a module it imports. Checks that
+changing any source file, the kwargs, a site file or CACHE_VERSION changes the cache key, that bad
+entries are built again, that the least recently used entries are pruned, and that concurrent
+builds leave one valid entry.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import types
+import unittest
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_prototype import experiment_cache
+from experiment_prototype.experiment_cache import ExperimentCache, experiment_source_files
+
+EXPERIMENT_SOURCE = '''
+import time
+
+import cachetest_module
+from cachetest_helper import NUM_RANGES
+
+
+class CacheTestExperiment(object):
+
+    def __init__(self, freq=10500):
+        self.freq = freq
+        self.built = False
+
+    def _set_scheduling_mode(self, scheduling_mode_type):
+        self.scheduling_mode = scheduling_mode_type
+
+    def build_scans(self):
+        time.sleep(cachetest_module.BUILD_TIME)
+        self.num_ranges = NUM_RANGES
+        self.built = True
+'''
+
+SOURCES = {
+    'cachetest_experiment.py': EXPERIMENT_SOURCE,
+    'cachetest_helper.py': 'NUM_RANGES = 75\n',
+    'cachetest_module.py': 'BUILD_TIME = 0.0\n',
+}
+
+
+def concurrent_build(cache_dir, site_files, build_time):
+    import cachetest_module
+    from cachetest_experiment import CacheTestExperiment
+    cachetest_module.BUILD_TIME = build_time
+    cache = ExperimentCache(cache_dir, options=types.SimpleNamespace(site_id='tst'))
+    cache.site_files = site_files
+    cache.build(CacheTestExperiment, {}, 'common')
+
+
+class TestExperimentCache(unittest.TestCase):
+    """
+    A unittest class to test the experiment cache.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.source_dir = tempfile.TemporaryDirectory()
+        for filename, source in SOURCES.items():
+            with open(os.path.join(cls.source_dir.name, filename), 'w') as f:
+                f.write(source)
+        sys.path.insert(0, cls.source_dir.name)
+        from cachetest_experiment import CacheTestExperiment
+        cls.Experiment = CacheTestExperiment
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(cls.source_dir.name)
+        cls.source_dir.cleanup()
+
+    def setUp(self):
+        self.borealis_path = os.environ['BOREALISPATH']
+        os.environ['BOREALISPATH'] = self.source_dir.name
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.site_files = []
+        for filename in ('config.ini', 'hdw.dat.tst', 'restrict.dat.tst'):
+            path = os.path.join(self.tmp_dir.name, filename)
+            with open(path, 'w') as f:
+                f.write(filename + '\n')
+            self.site_files.append(path)
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        os.environ['BOREALISPATH'] = self.borealis_path
+        self.tmp_dir.cleanup()
+
+    def make_cache(self, max_entries=experiment_cache.EXPERIMENT_CACHE_SIZE):
+        cache = ExperimentCache(self.cache_dir, max_entries=max_entries,
+                                options=types.SimpleNamespace(site_id='tst'))
+        cache.site_files = self.site_files
+        return cache
+
+    def key(self, **kwargs):
+        return self.cache.key(self.Experiment, kwargs, 'common')
+
+    def entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def check_file_changes_key(self, path):
+        with open(path) as f:
+            contents = f.read()
+        key = self.key()
+        try:
+            with open(path, 'a') as f:
+                f.write('# changed\n')
+            self.assertNotEqual(self.key(), key, path)
+        finally:
+            with open(path, 'w') as f:
+                f.write(contents)
+        self.assertEqual(self.key(), key)
+
+    def test_source_files(self):
+        """Modules imported for a constant and modules imported whole are both found."""
+        files = [os.path.basename(path) for path in experiment_source_files(self.Experiment)]
+        self.assertEqual(sorted(files), sorted(SOURCES))
+
+    def test_key(self):
+        """Every source file, the kwargs, site files and CACHE_VERSION are in the key."""
+        self.assertEqual(self.key(), self.key())
+        for filename in SOURCES:
+            self.check_file_changes_key(os.path.join(self.source_dir.name, filename))
+        for path in self.site_files:
+            self.check_file_changes_key(path)
+
+        self.assertNotEqual(self.key(freq=12000), self.key())
+        self.assertNotEqual(self.cache.key(self.Experiment, {}, 'discretionary'), self.key())
+
+        key = self.key()
+        version = experiment_cache.CACHE_VERSION
+        experiment_cache.CACHE_VERSION = version + 1
+        try:
+            self.assertNotEqual(self.key(), key)
+        finally:
+            experiment_cache.CACHE_VERSION = version
+
+    def test_build(self):
+        """The second build comes from the cache, and a changed source builds again."""
+        exp, serialized_exp, from_cache = self.cache.build(self.Experiment, {}, 'common')
+        self.assertFalse(from_cache)
+        self.assertTrue(exp.built)
+        cached, cached_serialized, from_cache = self.cache.build(self.Experiment, {}, 'common')
+        self.assertTrue(from_cache)
+        self.assertEqual(cached_serialized, serialized_exp)
+        self.assertEqual(cached.num_ranges, 75)
+
+        helper = os.path.join(self.source_dir.name, 'cachetest_helper.py')
+        try:
+            with open(helper, 'w') as f:
+                f.write('NUM_RANGES = 100\n')
+            _, _, from_cache = self.cache.build(self.Experiment, {}, 'common')
+            self.assertFalse(from_cache)
+        finally:
+            with open(helper, 'w') as f:
+                f.write(SOURCES['cachetest_helper.py'])
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_bad_entry(self):
+        """Truncated, corrupt and wrong type entries are built again and replaced."""
+        _, serialized_exp, _ = self.cache.build(self.Experiment, {}, 'common')
+        path = self.cache.path(self.Experiment, self.key())
+        for contents in (serialized_exp[:len(serialized_exp) // 2], b'not a pickle',
+                         pickle.dumps({'not': 'an experiment'})):
+            with open(path, 'wb') as f:
+                f.write(contents)
+            exp, _, from_cache = self.cache.build(self.Experiment, {}, 'common')
+            self.assertFalse(from_cache)
+            self.assertTrue(exp.built)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), serialized_exp)
+
+    def test_prune(self):
+        """The least recently used entries, by modification time, are removed."""
+        cache = self.make_cache(max_entries=2)
+        paths = []
+        for i, freq in enumerate((10500, 11000, 11500)):
+            cache.build(self.Experiment, {'freq': freq}, 'common')
+            paths.append(cache.path(self.Experiment, cache.key(self.Experiment, {'freq': freq},
+                                                               'common')))
+            os.utime(paths[-1], (1000 + i, 1000 + i))
+        self.assertEqual(len(self.entries()), 2)
+        self.assertFalse(os.path.exists(paths[0]))
+
+        # Loading the older of the two marks it as recently used, so the other is removed next.
+        os.utime(paths[2], (2000, 2000))
+        cache.build(self.Experiment, {'freq': 11000}, 'common')
+        cache.build(self.Experiment, {'freq': 12000}, 'common')
+        self.assertTrue(os.path.exists(paths[1]))
+        self.assertFalse(os.path.exists(paths[2]))
+
+    def test_concurrent(self):
+        """Builders running at once leave one valid entry and no temporary files."""
+        context = multiprocessing.get_context('fork')
+        builders = [context.Process(target=concurrent_build,
+                                    args=(self.cache_dir, self.site_files, 0.5))
+                    for _ in range(2)]
+        for builder in builders:
+            builder.start()
+        for builder in builders:
+            builder.join()
+            self.assertEqual(builder.exitcode, 0)
+
+        self.assertEqual(self.entries(), [os.path.basename(self.cache.path(self.Experiment,
+                                                                           self.key()))])
+        _, _, from_cache = self.cache.build(self.Experiment, {}, 'common')
+        self.assertTrue(from_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+Test module for building experiments in experiment_handler's build process
+(experiment_handler.ExperimentBuilder).
+It is run simply via 'python3 experiment_handler_unittests.py'.
+
+Small experiment classes stand in for real experiments, so the tests do not depend on the site
+configuration. Checks that builds and rebuilds are run in another process, that a build failing
+there raises its ExperimentException in experiment_handler, and that a rebuilt experiment is only
+taken once its build is done, unless it is waited for.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+import time
+import unittest
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_prototype.experiment_exception import ExperimentException
+from experiment_handler.experiment_handler import ExperimentBuilder
+
+TIMEOUT = 10.0
+
+
+class BuilderTestExperiment(object):
+    """
+    An experiment that records the process it was built in. If gate is given, build_scans waits
+    for that file to exist, so the test controls when the build is done.
+    """
+
+    def __init__(self, freq=10500, gate=None, fail=False):
+        self.freq = freq
+        self.gate = gate
+        self.fail = fail
+        self.scheduling_mode = None
+        self.build_pids = []
+
+    def _set_scheduling_mode(self, scheduling_mode_type):
+        self.scheduling_mode = scheduling_mode_type
+
+    def build_scans(self):
+        if self.gate is not None:
+            end = time.perf_counter() + TIMEOUT
+            while not os.path.exists(self.gate) and time.perf_counter() < end:
+                time.sleep(0.01)
+        if self.fail:
+            raise ExperimentException('Slice 0 frequency {} is restricted'.format(self.freq))
+        self.build_pids.append(os.getpid())
+
+
+class TestExperimentBuilder(unittest.TestCase):
+    """
+    A unittest class to test ExperimentBuilder.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.builder = ExperimentBuilder('BuilderTestExperiment')
+        self.addCleanup(self.builder.shutdown)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.gate = os.path.join(self.tmp_dir.name, 'gate')
+
+    def open_gate(self):
+        with open(self.gate, 'w'):
+            pass
+
+    def test_build(self):
+        """The experiment is built in another process and comes back pickled."""
+        serialized_exp = self.builder.build(BuilderTestExperiment, {'freq': 12000}, 'common')
+        exp = pickle.loads(serialized_exp)
+        self.assertEqual(exp.freq, 12000)
+        self.assertEqual(exp.scheduling_mode, 'common')
+        self.assertEqual(len(exp.build_pids), 1)
+        self.assertNotEqual(exp.build_pids[0], os.getpid())
+        self.assertFalse(self.builder.pending)
+
+    def test_build_failure(self):
+        """An ExperimentException in the build process is raised by build."""
+        with self.assertRaisesRegex(ExperimentException, 'Slice 0 frequency 13000 is restricted'):
+            self.builder.build(BuilderTestExperiment, {'freq': 13000, 'fail': True}, 'common')
+
+        # The build process is still usable.
+        serialized_exp = self.builder.build(BuilderTestExperiment, {}, 'common')
+        self.assertEqual(pickle.loads(serialized_exp).freq, 10500)
+
+    def test_rebuild(self):
+        """A rebuilt experiment is only taken once it is done, unless it is waited for."""
+        exp = pickle.loads(self.builder.build(BuilderTestExperiment, {}, 'common'))
+        self.assertIsNone(self.builder.take())
+        self.assertIsNone(self.builder.take(wait=True))
+
+        exp.freq = 11000
+        exp.gate = self.gate
+        self.builder.rebuild(exp)
+        self.assertTrue(self.builder.pending)
+        time.sleep(0.1)
+        self.assertIsNone(self.builder.take())
+        self.assertTrue(self.builder.pending)
+
+        self.open_gate()
+        end = time.perf_counter() + TIMEOUT
+        serialized_exp = self.builder.take()
+        while serialized_exp is None and time.perf_counter() < end:
+            time.sleep(0.01)
+            serialized_exp = self.builder.take()
+        rebuilt = pickle.loads(serialized_exp)
+        self.assertEqual(rebuilt.freq, 11000)
+        self.assertEqual(len(rebuilt.build_pids), 2)
+        self.assertNotEqual(rebuilt.build_pids[1], os.getpid())
+        self.assertFalse(self.builder.pending)
+        self.assertIsNone(self.builder.take(wait=True))
+
+    def test_rebuild_wait(self):
+        """Waiting for a rebuild gives the experiment once its build is done."""
+        exp = BuilderTestExperiment(freq=11500, gate=self.gate)
+        self.builder.rebuild(exp)
+        self.open_gate()
+        self.assertEqual(pickle.loads(self.builder.take(wait=True)).freq, 11500)
+        self.assertFalse(self.builder.pending)
+
+    def test_rebuild_failure(self):
+        """A failed rebuild is raised when it is taken, and is not taken again."""
+        self.builder.rebuild(BuilderTestExperiment(freq=14000, fail=True))
+        with self.assertRaisesRegex(ExperimentException, 'frequency 14000'):
+            self.builder.take(wait=True)
+        self.assertFalse(self.builder.pending)
+        self.assertIsNone(self.builder.take(wait=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+"""
+Test module for building transmit sequences (experiment_prototype/scan_classes/sequences.py).
+It is run simply via 'python3 sequences_unittests.py'.
+
+Sequences of single, concurrent and phase encoded slices are checked against a reference that
+builds every sequence from scratch the way make_sequence used to, before the sequence cache,
+the batched encodings and the scatter plan. Also checks that encodings are prepared in batches,
+that the prepared sequences of one averaging period survive preparing the next one, and that
+cached sequences are reused, that slices on disabled antennas are left out, and that a pickled
+sequence builds the same pulses.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import contextlib
+import io
+import os
+import pickle
+import sys
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_prototype.scan_classes.sequences import Sequence, ENCODING_BATCH_SIZE, \
+    PREPARED_BEAM_ITERS
+
+TRANSMIT_METADATA = {'txrate': 5.0e6, 'txctrfreq': 12000, 'main_antenna_count': 16,
+                     'main_antennas': list(range(16)), 'main_antenna_spacing': 15.24,
+                     'intf_antenna_count': 4, 'intf_antenna_spacing': 15.24,
+                     'pulse_ramp_time': 10.0e-6, 'max_usrp_dac_amplitude': 0.99,
+                     'tr_window_time': 60.0e-6, 'intf_offset': [0, -100, 0], 'dm_rate': 10,
+                     'minimum_pulse_separation': 125, 'rx_sample_rate': 5.0e6}
+
+PULSES_8P = [0, 14, 22, 24, 27, 31, 42, 43]
+
+
+class CountingEncoder(object):
+    """A pulse_phase_offset function with random phases per beam and sequence, counting calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, beam_num, sequence_num, num_pulses):
+        self.calls += 1
+        return np.random.default_rng(sequence_num * 100 + beam_num).uniform(-180, 180, num_pulses)
+
+
+def batch_encoder(encoder):
+    """A pulse_phase_offset_batch function giving the same phases as encoder."""
+    def encode(beam_num, sequence_nums, num_pulses):
+        encode.calls += 1
+        return np.array([encoder(beam_num, int(n), num_pulses) for n in sequence_nums])
+    encode.calls = 0
+    return encode
+
+
+def make_slice(freq, seqoffset=0, tx_antennas=None, encoder=None, batch=None,
+               pulse_sequence=PULSES_8P):
+    return {'freq': freq, 'rxonly': False, 'pulse_len': 300, 'iwavetable': None,
+            'qwavetable': None, 'tx_antenna_pattern': None,
+            'beam_angle': [-10.0, 0.0, 10.0, 20.0],
+            'tx_antennas': tx_antennas or list(range(16)), 'pulse_sequence': list(pulse_sequence),
+            'tau_spacing': 1500, 'seqoffset': seqoffset, 'first_range': 180, 'range_sep': 45,
+            'num_ranges': 75, 'align_sequences': False, 'tx_beam_order': [0, 1, 2, 3],
+            'rx_beam_order': [0, 1, 2, [2, 3]], 'pulse_phase_offset': encoder,
+            'pulse_phase_offset_batch': batch, 'rx_main_antennas': list(range(16)),
+            'rx_int_antennas': list(range(4))}
+
+
+def make_sequence(slices, transmit_metadata=TRANSMIT_METADATA):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Sequence(list(slices), slices, {(0, 1): 'CONCURRENT'}, transmit_metadata)
+
+
+def reference_pulses(sequence, beam_iter, sequence_num, encoders):
+    """
+    Build the pulses of a sequence from scratch in a full length buffer.
+
+    :param encoders: the pulse_phase_offset function of each slice, or None.
+    :returns: list of (samples, isarepeat) of each combined pulse.
+    """
+    main_antennas = sequence.transmit_metadata['main_antennas']
+    buffer_len = int(sequence.transmit_metadata['txrate'] * sequence.sstime * 1e-6)
+    full_sequence = np.zeros([sequence.transmit_metadata['main_antenna_count'], buffer_len],
+                             dtype=np.complex64)
+
+    for slice_id in sequence.slice_ids:
+        exp_slice = sequence.slice_dict[slice_id]
+        beam_num = exp_slice['tx_beam_order'][beam_iter]
+        basic_samples = sequence.basic_slice_pulses[slice_id][beam_num]
+        num_pulses = len(exp_slice['pulse_sequence'])
+        if encoders.get(slice_id):
+            phases = np.exp(1j * np.radians(encoders[slice_id](beam_num, sequence_num,
+                                                               num_pulses)))
+        else:
+            phases = np.ones(num_pulses)
+
+        tx_antennas = exp_slice['tx_antennas']
+        for pulse in sequence.combined_pulses_metadata:
+            for component_info in pulse['component_info']:
+                if component_info['slice_id'] == slice_id:
+                    start = pulse['tr_window_num_samps'] + component_info['pulse_sample_start']
+                    end = start + component_info['pulse_num_samps']
+                    full_sequence[tx_antennas, start:end] += \
+                        phases[component_info['pulse_index']] * basic_samples[tx_antennas]
+
+    pulses = []
+    for pulse in sequence.combined_pulses_metadata:
+        start = pulse['pulse_sample_start']
+        end = start + pulse['total_num_samps'] + 2 * pulse['tr_window_num_samps']
+        samples = full_sequence[main_antennas, start:end]
+        isarepeat = bool(pulses) and samples.shape == pulses[-1][0].shape and \
+            np.isclose(samples, pulses[-1][0]).all()
+        pulses.append((samples, isarepeat))
+    return pulses
+
+
+class TestSequences(unittest.TestCase):
+    """
+    A unittest class to test building transmit sequences.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def check_against_reference(self, slices, encoders, transmit_metadata=TRANSMIT_METADATA):
+        sequence = make_sequence(slices, transmit_metadata)
+        for beam_iter in range(4):
+            for sequence_num in range(ENCODING_BATCH_SIZE + 2):
+                pulse_data, _ = sequence.make_sequence(beam_iter, sequence_num)
+                reference = reference_pulses(sequence, beam_iter, sequence_num, encoders)
+                self.assertEqual(len(pulse_data), len(reference))
+                for pulse, (samples, isarepeat) in zip(pulse_data, reference):
+                    np.testing.assert_allclose(pulse['samples_array'], samples, rtol=1e-5,
+                                               atol=1e-6)
+                    self.assertEqual(pulse['isarepeat'], isarepeat)
+        return sequence
+
+    def test_single(self):
+        """A single slice, without encodings, matches the reference."""
+        self.check_against_reference({0: make_slice(10500)}, {})
+
+    def test_concurrent(self):
+        """Overlapping concurrent slices on different antennas are mixed as in the reference."""
+        slices = {0: make_slice(10500), 1: make_slice(13000, seqoffset=50,
+                                                      tx_antennas=[0, 2, 4, 6, 8])}
+        sequence = self.check_against_reference(slices, {})
+        # Slice 1 does not use consecutive rows, so it is scattered with an index array.
+        self.assertIsInstance(sequence.scatter_plan[0]['rows'], slice)
+        np.testing.assert_array_equal(sequence.scatter_plan[1]['rows'], [0, 2, 4, 6, 8])
+
+    def test_main_antenna_subset(self):
+        """Only the enabled main antennas are built, even if a slice has none of them."""
+        transmit_metadata = dict(TRANSMIT_METADATA,
+                                 main_antennas=list(range(8)) + list(range(12, 16)))
+        encoders = {0: CountingEncoder(), 1: CountingEncoder()}
+        slices = {0: make_slice(10500, encoder=encoders[0], tx_antennas=[6, 7, 8, 9, 12]),
+                  1: make_slice(13000, seqoffset=50, encoder=encoders[1],
+                                tx_antennas=[8, 9, 10, 11])}
+        sequence = self.check_against_reference(slices, encoders, transmit_metadata)
+        self.assertEqual(sequence.scatter_plan[0]['rows'], slice(6, 9))
+        self.assertEqual(len(sequence.scatter_plan[1]['rows']), 0)
+
+    def test_encoded(self):
+        """Encoded slices match the reference, and their encodings are recorded."""
+        encoders = {0: CountingEncoder(), 1: CountingEncoder()}
+        slices = {0: make_slice(10500, encoder=encoders[0]),
+                  1: make_slice(13000, seqoffset=600, encoder=encoders[1])}
+        sequence = self.check_against_reference(slices, encoders)
+        self.assertEqual(len(sequence.output_encodings[0]), 4 * (ENCODING_BATCH_SIZE + 2))
+        np.testing.assert_allclose(sequence.output_encodings[1][-1],
+                                   encoders[1](3, ENCODING_BATCH_SIZE + 1, len(PULSES_8P)))
+
+    def test_batch_function(self):
+        """pulse_phase_offset_batch is called once per batch and matches the reference."""
+        encoder = CountingEncoder()
+        batch = batch_encoder(encoder)
+        sequence = self.check_against_reference({0: make_slice(10500, batch=batch)},
+                                                {0: encoder})
+        # Two batches per beam_iter for ENCODING_BATCH_SIZE + 2 sequences.
+        self.assertEqual(batch.calls, 4 * 2)
+
+    def test_batches(self):
+        """Encoded sequences are prepared ENCODING_BATCH_SIZE at a time."""
+        encoder = CountingEncoder()
+        sequence = make_sequence({0: make_slice(10500, encoder=encoder)})
+        sequence.make_sequence(0, 0)
+        self.assertEqual(encoder.calls, ENCODING_BATCH_SIZE)
+        for sequence_num in range(1, ENCODING_BATCH_SIZE):
+            sequence.make_sequence(0, sequence_num)
+        self.assertEqual(encoder.calls, ENCODING_BATCH_SIZE)
+        sequence.make_sequence(0, ENCODING_BATCH_SIZE)
+        self.assertEqual(encoder.calls, 2 * ENCODING_BATCH_SIZE)
+
+    def test_next_aveperiod(self):
+        """Preparing the next averaging period keeps the sequences prepared for this one."""
+        encoder = CountingEncoder()
+        sequence = make_sequence({0: make_slice(10500, encoder=encoder)})
+        sequence.make_sequence(0, 0)
+        sequence.prepare_sequences(1, range(ENCODING_BATCH_SIZE))
+        calls = encoder.calls
+        for sequence_num in range(1, ENCODING_BATCH_SIZE):
+            sequence.make_sequence(0, sequence_num)
+        sequence.make_sequence(1, 0)
+        self.assertEqual(encoder.calls, calls)
+
+        # Only the most recently prepared beam_iters are kept.
+        for beam_iter in range(2, 2 + PREPARED_BEAM_ITERS):
+            sequence.prepare_sequences(beam_iter, range(ENCODING_BATCH_SIZE))
+        calls = encoder.calls
+        sequence.make_sequence(1, 1)
+        self.assertEqual(encoder.calls, calls + ENCODING_BATCH_SIZE)
+
+    def test_cache(self):
+        """Unencoded sequences are built once and then come from the cache."""
+        sequence = make_sequence({0: make_slice(10500)})
+        first, _ = sequence.make_sequence(2, 0)
+        second, _ = sequence.make_sequence(2, 1)
+        for pulse, cached in zip(first, second):
+            self.assertIs(pulse['samples_array'], cached['samples_array'])
+
+        sequence.sequence_cache_size = 0
+        sequence._sequence_cache.clear()
+        first, _ = sequence.make_sequence(2, 2)
+        second, _ = sequence.make_sequence(2, 3)
+        self.assertIsNot(first[0]['samples_array'], second[0]['samples_array'])
+
+    def test_pickle(self):
+        """A pickled sequence makes the same pulses again, without its run time caches."""
+        encoder = CountingEncoder()
+        slices = {0: make_slice(10500, encoder=encoder),
+                  1: make_slice(13000, seqoffset=50, tx_antennas=[0, 2, 4, 6, 8])}
+        sequence = make_sequence(slices)
+        pulses = {(beam_iter, sequence_num): sequence.make_sequence(beam_iter, sequence_num)[0]
+                  for beam_iter in range(4) for sequence_num in range(3)}
+
+        state = sequence.__getstate__()
+        self.assertEqual(state['basic_slice_pulses'], {})
+        self.assertFalse(state['_sequence_cache'] or state['_prepared_sequences'] or
+                         state['output_encodings'])
+
+        copy = pickle.loads(pickle.dumps(sequence))
+        self.assertEqual(sorted(copy.basic_slice_pulses), [0, 1])
+        for slice_id in slices:
+            np.testing.assert_array_equal(copy.basic_slice_pulses[slice_id],
+                                          sequence.basic_slice_pulses[slice_id])
+        for (beam_iter, sequence_num), pulse_data in pulses.items():
+            copy_data, _ = copy.make_sequence(beam_iter, sequence_num)
+            self.assertEqual(len(copy_data), len(pulse_data))
+            for pulse, copy_pulse in zip(pulse_data, copy_data):
+                np.testing.assert_array_equal(copy_pulse['samples_array'], pulse['samples_array'])
+                self.assertEqual(copy_pulse['isarepeat'], pulse['isarepeat'])
+                self.assertEqual(copy_pulse['timing'], pulse['timing'])
+        self.assertEqual(len(copy.output_encodings[0]), len(pulses))
+
+
+if __name__ == '__main__':
+    unittest.main()
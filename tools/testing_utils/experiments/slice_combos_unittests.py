@@ -0,0 +1,233 @@
+"""
+Test module for grouping interfaced slices into scans, averaging periods and sequences
+(ScanClassBase.slice_combos_sorter in experiment_prototype/scan_classes/scan_class_base.py).
+It is run simply via 'python3 slice_combos_unittests.py'.
+
+The union-find grouping is checked against the pairwise merge it replaced (merge_combos_pairwise,
+kept here), on the experiments of the repository that can be built with this site's config and
+on random interfacing. Where the pairwise merge gives a slice more
+than one group, the union-find raises the interfacing error instead.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import contextlib
+import copy
+import io
+import itertools
+import os
+import random
+import sys
+import unittest
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_handler.experiment_handler import retrieve_experiment
+from experiment_prototype.experiment_exception import ExperimentException
+from experiment_prototype.scan_classes.scan_class_base import ScanClassBase
+
+INTERFACE_TYPES = ('SCAN', 'AVEPERIOD', 'SEQUENCE', 'CONCURRENT')
+
+
+def merge_combos_pairwise(list_of_combos, all_keys):
+    """
+    Merge the combos pair by pair, the way ScanClassBase.slice_combos_sorter did before it used a
+    union-find. Kept to check slice_combos_sorter against, here and in
+    tools/benchmarks/slice_combos_benchmark.py. It is O(n^3) in the number of combos, and it
+    modifies the combos it is given.
+
+    :param list_of_combos: list of lists of length two associating two slices
+     together.
+    :param all_keys: list of all keys included in this object (scan, ave_period, or
+     sequence).
+    :return: list of combos that is sorted so that each key only appears once and
+     the lists within the list are of however long necessary
+    """
+
+    list_of_combos = sorted(list_of_combos)
+
+    # if [2,4] and [1,4], then also must be [1,2] in the list_of_combos
+    # Now we are going to modify the list of lists of length = 2 to be a list of length x so that if [1,2] and [2,4]
+    # and [1,4] are in list_of_combos, we want only one list element for this scan : [1,2,4] .
+
+    scan_i = 0
+    while scan_i < len(list_of_combos):  # i: element in list_of_combos (representing one scan)
+        slice_id_k = 0
+        while slice_id_k < len(list_of_combos[scan_i]):  # k: element in scan (representing a slice)
+            scan_j = scan_i + 1  # j: iterates through the other elements of list_of_combos, to combine them into
+            # the first, i, if they are in fact part of the same scan.
+            while scan_j < len(list_of_combos):
+                if list_of_combos[scan_i][slice_id_k] == list_of_combos[scan_j][0]:
+                    # if an element (slice_id) inside the i scan is the same as a slice_id in the j scan (somewhere
+                    # further in the list_of_combos), then we need to combine that j scan into the i scan. We only
+                    # need to check the first element of the j scan because list_of_combos has been sorted and we
+                    # know the first slice_id in the scan is less than the second slice id.
+                    add_n_slice_id = list_of_combos[scan_j][1]  # the slice_id to add to the i scan from the j scan.
+                    list_of_combos[scan_i].append(add_n_slice_id)
+                    # Combine the indices if there are 3+ slices combining in same scan
+                    for m in range(0, len(list_of_combos[scan_i]) - 1):
+                        # if we have added z to scan_i, such that scan_i is now [x,y,z], we now have to remove from
+                        # the list_of_combos list [x,z], and [y,z].
+                        # If x,z existed as SCAN but y,z did not, we have an error.
+
+                        # Try all values in list_of_combos[i] except the last value, which is = to add_n.
+                        try:
+                            list_of_combos.remove([list_of_combos[scan_i][m], add_n_slice_id])
+                            # list_of_combos[j][1] is the known last value in list_of_combos[i]
+                        except ValueError:
+                            # This error would occur if e.g. you had set [x,y] and [x,z] to CONCURRENT but [y,z] to
+                            # SCAN. This means that we couldn't remove the scan_combo y,z from the list because it
+                            # was not added to list_of_combos because it wasn't a scan type, so the interfacing
+                            # would not make sense (conflict).
+                            errmsg = 'Interfacing not Valid: exp_slice {} and exp_slice {} are combined in-scan and do not \
+                                interface the same with exp_slice {}'.format(
+                                list_of_combos[scan_i][m],
+                                list_of_combos[scan_i][slice_id_k],
+                                add_n_slice_id)
+                            raise ExperimentException(errmsg)
+                    scan_j = scan_j - 1
+                    # This means that the former list_of_combos[j] has been deleted and there are new values at
+                    #   index j, so decrement before incrementing in the while loop.
+                    # The above for loop will delete more than one element of list_of_combos (min 2) but the
+                    # while scan_j < len(list_of_combos) will reevaluate the length of list_of_combos.
+                scan_j = scan_j + 1
+            slice_id_k = slice_id_k + 1  # if interfacing has been properly set up, the loop will only ever find
+            # elements to add to scan_i when slice_id_k = 0. If there were errors though
+            # (ex. x,y and y,z = CONCURRENT but x,z did not) then iterating through the slice_id elements will allow
+            # us to find the error.
+        scan_i = scan_i + 1  # At this point, all elements in the just-finished scan_i will not be found anywhere
+        #  else in list_of_combos.
+
+    # Now list_of_combos is a list of lists,  where a slice_id occurs only once, within the nested list.
+
+    for slice_id in all_keys:
+        for combo in list_of_combos:
+            if slice_id in combo:
+                break
+        else:  # no break
+            list_of_combos.append([slice_id])
+            # Append the slice on its own, it is in its own object.
+
+    list_of_combos = sorted(list_of_combos)
+    return list_of_combos
+
+
+def pairwise(list_of_combos, all_keys):
+    return merge_combos_pairwise(copy.deepcopy(list_of_combos), all_keys)
+
+
+def group_slices(interface, slice_ids, sorter):
+    """Group the slices into scans, averaging periods and sequences, the way build_scans does."""
+    def nested_interface(ids):
+        return {combo: interface[combo] for combo in itertools.combinations(ids, 2)}
+
+    groups = []
+    scans = sorter([list(k) for k, v in interface.items() if v != 'SCAN'], slice_ids)
+    for scan in scans:
+        aveperiods = sorter([list(k) for k, v in nested_interface(scan).items()
+                             if v in ('CONCURRENT', 'SEQUENCE')], scan)
+        for aveperiod in aveperiods:
+            sequences = sorter([list(k) for k, v in nested_interface(aveperiod).items()
+                                if v == 'CONCURRENT'], aveperiod)
+            groups.append((scan, aveperiod, sequences))
+    return groups
+
+
+def random_interface(num_slices, rng):
+    """Interfacing of slices put in a random scan, averaging period and sequence each."""
+    num_groups = max(1, int(num_slices ** 0.5))
+    placement = [tuple(rng.randrange(num_groups) for _ in range(3)) for _ in range(num_slices)]
+    interface = {}
+    for first, second in itertools.combinations(range(num_slices), 2):
+        shared = 0
+        while shared < 3 and placement[first][shared] == placement[second][shared]:
+            shared += 1
+        interface[(first, second)] = INTERFACE_TYPES[shared]
+    return interface
+
+
+def built_experiments():
+    """The experiments of the repository that can be made with this site's config."""
+    experiments = []
+    experiments_dir = os.path.join(BOREALISPATH, 'experiments')
+    for directory, prefix in ((experiments_dir, ''),
+                              (os.path.join(experiments_dir, 'testing_archive'),
+                               'testing_archive.')):
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.py') or filename == '__init__.py':
+                continue
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    experiments.append(retrieve_experiment(prefix + filename[:-3])())
+            except Exception:
+                continue  # not an experiment, or not valid at this site
+    return experiments
+
+
+class TestSliceCombosSorter(unittest.TestCase):
+    """
+    A unittest class to test grouping interfaced slices.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def test_example(self):
+        """Combined slices are grouped, and slices without combos are on their own."""
+        combos = [[0, 1], [0, 2], [0, 4], [1, 2], [1, 4], [2, 4]]
+        self.assertEqual(ScanClassBase.slice_combos_sorter(combos, [0, 1, 2, 4, 5]),
+                         [[0, 1, 2, 4], [5]])
+        self.assertEqual(ScanClassBase.slice_combos_sorter([], [3, 1]), [[1], [3]])
+
+    def test_conflict(self):
+        """Slices combined with one slice of a group but not another are not valid."""
+        for combos in ([[0, 1], [1, 2]], [[0, 2], [0, 3]], [[0, 1], [0, 2], [1, 2], [2, 3]]):
+            with self.assertRaisesRegex(ExperimentException, 'Interfacing not Valid'):
+                ScanClassBase.slice_combos_sorter(combos, [0, 1, 2, 3])
+            with self.assertRaisesRegex(ExperimentException, 'Interfacing not Valid'):
+                pairwise(combos, [0, 1, 2, 3])
+
+    def test_repo_experiments(self):
+        """The experiments of the repository are grouped as by the pairwise merge."""
+        experiments = built_experiments()
+        self.assertGreater(len(experiments), 0)
+        for experiment in experiments:
+            self.assertEqual(group_slices(experiment.interface, experiment.slice_ids,
+                                          ScanClassBase.slice_combos_sorter),
+                             group_slices(experiment.interface, experiment.slice_ids, pairwise),
+                             experiment.experiment_name)
+
+    def test_random_experiments(self):
+        """Random valid interfacing is grouped as by the pairwise merge."""
+        rng = random.Random(0)
+        for num_slices in (1, 2, 5, 12, 30, 60):
+            for _ in range(5):
+                interface = random_interface(num_slices, rng)
+                slice_ids = list(range(num_slices))
+                self.assertEqual(group_slices(interface, slice_ids,
+                                              ScanClassBase.slice_combos_sorter),
+                                 group_slices(interface, slice_ids, pairwise))
+
+    def test_random_combos(self):
+        """Random combos, mostly not valid, give the same groups or errors as the pairwise merge."""
+        rng = random.Random(0)
+        for _ in range(2000):
+            keys = list(range(rng.randrange(1, 9)))
+            probability = rng.random()
+            combos = [list(combo) for combo in itertools.combinations(keys, 2)
+                      if rng.random() < probability]
+            rng.shuffle(combos)
+            try:
+                expected = pairwise(combos, keys)
+            except ExperimentException:
+                expected = None
+
+            if expected is not None and sorted(itertools.chain(*expected)) == keys:
+                self.assertEqual(ScanClassBase.slice_combos_sorter(combos, keys), expected)
+            else:
+                # The pairwise merge also misses some conflicts, giving a slice several groups.
+                with self.assertRaisesRegex(ExperimentException, 'Interfacing not Valid'):
+                    ScanClassBase.slice_combos_sorter(combos, keys)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Test module for the sorted index of frequency ranges (utils/frequency_ranges), used for the
+restricted frequencies of restrict.dat.
+It is run simply via 'python3 frequency_ranges_unittests.py'.
+
+Checks that overlapping and touching ranges are merged, that contains and find include both edges
+of a range, that overlaps agrees with a check of every band against every range, and how trim
+moves the ends of a band out of the ranges.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/utils/')
+
+from frequency_ranges.frequency_ranges import FrequencyRanges
+
+# Restricted ranges in kHz as they could be given in restrict.dat: unsorted, overlapping, touching
+# and one given high end first.
+RESTRICTED = [(12000, 12100), (10000, 10500), (10400, 11000), (11000, 11200), (13000, 13000),
+              (12050, 12080), (14500, 14400), (15000, 15100), (15101, 15200)]
+
+MERGED = [(10000, 11200), (12000, 12100), (13000, 13000), (14400, 14500), (15000, 15100),
+          (15101, 15200)]
+
+
+class TestFrequencyRanges(unittest.TestCase):
+    """
+    A unittest class to test FrequencyRanges.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.ranges = FrequencyRanges(RESTRICTED)
+
+    def test_merge(self):
+        """Overlapping, nested and touching ranges are merged, others are kept apart."""
+        self.assertEqual(self.ranges.ranges, MERGED)
+        self.assertEqual(len(self.ranges), len(MERGED))
+        self.assertEqual(FrequencyRanges(reversed(RESTRICTED)).ranges, MERGED)
+        self.assertEqual(FrequencyRanges().ranges, [])
+
+    def test_contains(self):
+        """Both edges of a range are inside it, anything past them is not."""
+        for low, high in MERGED:
+            self.assertTrue(self.ranges.contains(low))
+            self.assertTrue(self.ranges.contains(high))
+            self.assertFalse(self.ranges.contains(low - 0.5))
+            self.assertFalse(self.ranges.contains(high + 0.5))
+        self.assertTrue(self.ranges.contains(10750))
+        self.assertFalse(self.ranges.contains(9000))
+        self.assertFalse(self.ranges.contains(20000))
+
+        freqs = np.array([[9999, 10000, 11200], [11201, 13000, 15100.5]])
+        np.testing.assert_array_equal(self.ranges.contains(freqs),
+                                      [[False, True, True], [False, True, False]])
+        self.assertFalse(FrequencyRanges().contains(10000))
+        self.assertEqual(FrequencyRanges().contains([10000, 11000]).tolist(), [False, False])
+
+    def test_find(self):
+        """find gives the merged range a frequency is in, including at its edges."""
+        self.assertEqual(self.ranges.find(10000), (10000, 11200))
+        self.assertEqual(self.ranges.find(11000), (10000, 11200))
+        self.assertEqual(self.ranges.find(11200), (10000, 11200))
+        self.assertEqual(self.ranges.find(13000), (13000, 13000))
+        self.assertEqual(self.ranges.find(15100), (15000, 15100))
+        self.assertEqual(self.ranges.find(15101), (15101, 15200))
+        self.assertIsNone(self.ranges.find(9999))
+        self.assertIsNone(self.ranges.find(11201))
+        self.assertIsNone(self.ranges.find(15100.5))
+        self.assertIsNone(self.ranges.find(15201))
+        self.assertIsNone(FrequencyRanges().find(10000))
+
+    def test_overlaps(self):
+        """overlaps matches checking every band against every range, for arrays and scalars."""
+        rng = np.random.default_rng(0)
+        lows = rng.uniform(9000, 16000, 500)
+        highs = lows + rng.choice([0, 1, 50, 1000], 500)
+        expected = [any(low <= range_high and high >= range_low for range_low, range_high in MERGED)
+                    for low, high in zip(lows, highs)]
+        np.testing.assert_array_equal(self.ranges.overlaps(lows, highs), expected)
+
+        # Bands touching a range edge, in a gap, and around a whole range.
+        lows = np.array([9000, 11200, 11201, 12500, 13500])
+        np.testing.assert_array_equal(self.ranges.overlaps(lows, lows + [1000, 10, 10, 1000, 100]),
+                                      [True, True, False, True, False])
+
+        # The band edges broadcast, giving one row per width.
+        overlap = self.ranges.overlaps(lows, lows + np.array([[0], [1000]]))
+        self.assertEqual(overlap.shape, (2, 5))
+        np.testing.assert_array_equal(overlap[1], [True, True, True, True, True])
+
+        self.assertIs(self.ranges.overlaps(11300, 11900), False)
+        self.assertIs(self.ranges.overlaps(11300, 12000), True)
+        self.assertFalse(FrequencyRanges().overlaps(lows, lows + 1000).any())
+
+    def test_trim(self):
+        """trim moves each end in a range to just past it, and keeps ranges in the middle."""
+        # The band is inside a range.
+        self.assertIsNone(self.ranges.trim(10100, 11100))
+        self.assertIsNone(self.ranges.trim(13000, 13000))
+        # A range in the middle of the band is left in it.
+        self.assertEqual(self.ranges.trim(11500, 12500), (11500, 12500))
+        # Each end is in a different range.
+        self.assertEqual(self.ranges.trim(11000, 12050), (11201, 11999))
+        self.assertEqual(self.ranges.trim(12050, 14450), (12101, 14399))
+        # The low end steps past one range into the next.
+        self.assertEqual(self.ranges.trim(15050, 16000), (15201, 16000))
+        self.assertEqual(self.ranges.trim(15050, 16000, step=0.5), (15100.5, 16000))
+        # Nothing is left between two ranges a step apart.
+        self.assertIsNone(self.ranges.trim(15050, 15150))
+        self.assertEqual(FrequencyRanges().trim(10000, 12000), (10000, 12000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Test module for the runtime metrics shared by the Borealis modules (utils/metrics).
+It is run simply via 'python3 metrics_unittests.py'.
+
+Checks counting from several threads, gauges read from a function, the bucketing of histogram
+observations, the registry, the Prometheus text rendering of a snapshot and the quantile
+estimates of the viewer.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/utils/')
+
+from metrics.metrics import Counter, Gauge, Histogram, MetricsRegistry, to_text, \
+    histogram_quantile
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    A unittest class to test the metrics.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def test_counter(self):
+        """Counters add up increments from several threads and refuse to decrease."""
+        counter = Counter('sequences', 'Sequences sent')
+
+        def count():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(5)
+        self.assertEqual(counter.value, 4005)
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+        self.assertEqual(counter.snapshot(), {'type': 'counter', 'description': 'Sequences sent',
+                                              'value': 4005})
+
+    def test_gauge(self):
+        """Gauges go up and down, or are read from a function for each snapshot."""
+        gauge = Gauge('depth')
+        gauge.set(3)
+        gauge.inc()
+        gauge.dec(2)
+        self.assertEqual(gauge.value, 2)
+
+        calls = []
+        gauge.set_function(lambda: calls.append(None) or len(calls))
+        self.assertEqual(calls, [])
+        self.assertEqual(gauge.snapshot()['value'], 1)
+        self.assertEqual(gauge.snapshot()['value'], 2)
+
+    def test_histogram(self):
+        """Observations go in the first bucket whose bound they do not exceed."""
+        histogram = Histogram('latency', buckets=(4.0, 1.0, 2.0))
+        self.assertEqual(histogram.buckets, (1.0, 2.0, 4.0))
+        for value in (0.5, 1.0, 1.5, 3.0, 10.0):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['counts'], [2, 1, 1, 1])
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['sum'], 16.0)
+        self.assertEqual((snapshot['min'], snapshot['max'], snapshot['last']), (0.5, 10.0, 10.0))
+
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.count, 6)
+        self.assertLess(histogram.snapshot()['last'], 1000.0)
+
+    def test_registry(self):
+        """Metrics are created once per name, and a name keeps its type."""
+        registry = MetricsRegistry('Test Module')
+        counter = registry.counter('sent', 'Sent')
+        self.assertIs(registry.counter('sent'), counter)
+        with self.assertRaises(TypeError):
+            registry.gauge('sent')
+        registry.histogram('latency').observe(1.0)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['module'], 'Test Module')
+        self.assertEqual(set(snapshot['metrics']), {'sent', 'latency'})
+        self.assertGreaterEqual(snapshot['uptime'], 0.0)
+        # Without an address nothing is published.
+        registry.start()
+        self.assertIsNone(registry._thread)
+
+    def test_to_text(self):
+        """Snapshots render with cumulative histogram buckets, in the Prometheus format."""
+        registry = MetricsRegistry('Test Module')
+        registry.counter('sent', 'Sequences sent').inc(3)
+        histogram = registry.histogram('latency', buckets=(1.0, 2.0))
+        for value in (0.5, 1.5, 1.5, 5.0):
+            histogram.observe(value)
+
+        lines = to_text(registry.snapshot()).splitlines()
+        self.assertEqual(lines, [
+            '# TYPE borealis_test_module_latency histogram',
+            'borealis_test_module_latency_bucket{le="1.0"} 1',
+            'borealis_test_module_latency_bucket{le="2.0"} 3',
+            'borealis_test_module_latency_bucket{le="+Inf"} 4',
+            'borealis_test_module_latency_sum 8.5',
+            'borealis_test_module_latency_count 4',
+            '# HELP borealis_test_module_sent Sequences sent',
+            '# TYPE borealis_test_module_sent counter',
+            'borealis_test_module_sent 3',
+        ])
+
+    def test_histogram_quantile(self):
+        """Quantiles interpolate within their bucket, bounded by the observed extremes."""
+        histogram = Histogram('latency', buckets=(1.0, 2.0, 4.0))
+        self.assertIsNone(histogram_quantile(histogram.snapshot(), 0.5))
+
+        for value in (0.5, 1.5, 1.5, 3.0, 10.0):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertAlmostEqual(histogram_quantile(snapshot, 0.0), 0.5)
+        self.assertAlmostEqual(histogram_quantile(snapshot, 0.1), 0.75)
+        self.assertAlmostEqual(histogram_quantile(snapshot, 0.5), 1.75)
+        self.assertAlmostEqual(histogram_quantile(snapshot, 0.7), 3.0)
+        self.assertAlmostEqual(histogram_quantile(snapshot, 1.0), 10.0)
+
+        # A single observation is every quantile.
+        histogram = Histogram('latency', buckets=(1.0, 2.0, 4.0))
+        histogram.observe(1.2)
+        for quantile in (0.0, 0.5, 0.99):
+            self.assertAlmostEqual(histogram_quantile(histogram.snapshot(), quantile), 1.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,15 @@
 #!/usr/bin/env python3
 
 import sys
-import deepdish
-import random
 import numpy as np
 import matplotlib.pyplot as plt
-from plotting_borealis_data_utils import plot_antennas_iq_data
+from plotting_borealis_data_utils import plot_antennas_iq_data, load_record
 
 filename = sys.argv[1]
+record_time = sys.argv[2] if len(sys.argv) > 2 else None
 
-data = deepdish.io.load(filename)
-
-record_name = random.choice(list(data.keys()))
+record_name, antennas_iq = load_record(filename, record_time)
 print(record_name)
-antennas_iq = data[record_name]
 
 
 plot_antennas_iq_data(antennas_iq, 'antennas_iq')
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import deepdish
 import random
@@ -8,6 +9,42 @@ import matplotlib.pyplot as plt
 from scipy.fftpack import fft
 import math
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../utils/'))
+import record_index.record_index as record_index
+
+
+def load_record(filename, record_time=None):
+    """
+    Load one record of a site format two hour file.
+
+    If data_write indexed the file, the record is found in the index and only that record is
+    read, otherwise the whole file is read.
+
+    :param filename: the site format hdf5 file.
+    :param record_time: the record name (epoch milliseconds) to load, or the nearest one to it.
+                        A random record if None.
+    :returns: the record name and the dict of the record.
+    """
+    try:
+        entries = record_index.read_index(filename)
+    except (OSError, ValueError):
+        entries = []
+
+    if len(entries):
+        if record_time is None:
+            entry = random.choice(entries)
+        else:
+            entry = record_index.nearest_record(entries, int(record_time))
+        record_name = str(entry['timestamp'])
+        return record_name, deepdish.io.load(filename, '/' + record_name)
+
+    data = deepdish.io.load(filename)
+    if record_time is None:
+        record_name = random.choice(list(data.keys()))
+    else:
+        record_name = min(data.keys(), key=lambda name: abs(int(name) - int(record_time)))
+    return record_name, data[record_name]
+
 
 def reshape_bfiq_data(record_dict):
     """
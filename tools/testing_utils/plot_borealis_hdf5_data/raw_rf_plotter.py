@@ -1,20 +1,15 @@
 #!/usr/bin/env python3
 
 import sys
-import deepdish
-import random
 import numpy as np
 import matplotlib.pyplot as plt
 
-from plotting_borealis_data_utils import plot_output_raw_data
+from plotting_borealis_data_utils import plot_output_raw_data, load_record
 
 filename = sys.argv[1]
+record_time = sys.argv[2] if len(sys.argv) > 2 else None  # e.g. '1547660180625'
 
-data = deepdish.io.load(filename)
-
-record_name = random.choice(list(data.keys()))
-#record_name = '1547660180625'
+record_name, raw_rf_data = load_record(filename, record_time)
 print(record_name)
-raw_rf_data = data[record_name]
 
 plot_output_raw_data(raw_rf_data, 'raw_rf_data',start_sample=0, end_sample=430000)
@@ -1,19 +1,15 @@
 #!/usr/bin/env python3
 
 import sys
-import deepdish
-import random
 import numpy as np
 import matplotlib.pyplot as plt
 
-from plotting_borealis_data_utils import plot_output_tx_data
+from plotting_borealis_data_utils import plot_output_tx_data, load_record
 
 filename = sys.argv[1]
+record_time = sys.argv[2] if len(sys.argv) > 2 else None
 
-data = deepdish.io.load(filename)
-
-record_name = random.choice(list(data.keys()))
+record_name, tx = load_record(filename, record_time)
 print(record_name)
-tx = data[record_name]
 
 plot_output_tx_data(tx, 'tx_data')
\ No newline at end of file
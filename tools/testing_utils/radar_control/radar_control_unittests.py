@@ -0,0 +1,341 @@
+"""
+Test module for the sequence pipeline of radar_control (radar_control/radar_control.py).
+It is run simply via 'python3 radar_control_unittests.py'.
+
+Checks that the pipeline stages run their jobs in order on their own threads, pass exceptions on
+to whoever waits on the job and can be stopped. Checks that the sequence producer builds the
+sequences of an averaging period in order, at most lookahead ahead, then works on the next
+averaging period, and that a failure in building a sequence surfaces from next_sequence. Also
+steps through fake experiments the way radar() does, checking that next_aveperiod predicts every
+averaging period across scan and experiment boundaries.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+from experiment_prototype.experiment_exception import ExperimentException
+from radar_control.radar_control import PipelineStage, SequenceProducer, next_aveperiod
+
+TIMEOUT = 5.0
+
+
+def wait_until(condition):
+    """Wait for condition() to be true, failing after TIMEOUT seconds."""
+    end = time.perf_counter() + TIMEOUT
+    while not condition():
+        if time.perf_counter() > end:
+            raise AssertionError('Timed out waiting for {}'.format(condition))
+        time.sleep(0.001)
+
+
+class FakeSequence(object):
+    """A stand in for a Sequence, recording the sequences it is asked to make."""
+
+    def __init__(self, name, fail_at=None):
+        self.name = name
+        self.fail_at = fail_at
+        self.calls = []
+        self.threads = set()
+        self.output_encodings = collections.defaultdict(list)
+
+    def make_sequence(self, beam_iter, sequence_num):
+        self.calls.append((beam_iter, sequence_num))
+        self.threads.add(threading.current_thread().name)
+        if sequence_num == self.fail_at:
+            raise ExperimentException('Sequence {} failed'.format(sequence_num))
+        self.output_encodings[0].append((beam_iter, sequence_num))
+        return (self.name, beam_iter, sequence_num), {}
+
+
+def make_aveperiod(name, num_sequences=1, beam_iter=0, num_beams=4, fail_at=None):
+    sequences = [FakeSequence('{}{}'.format(name, i), fail_at) for i in range(num_sequences)]
+    return types.SimpleNamespace(name=name, sequences=sequences, beam_iter=beam_iter,
+                                 num_beams_in_scan=num_beams)
+
+
+def make_scan(aveperiods, num_aveperiods_in_scan, scanbound=None, align=False):
+    return types.SimpleNamespace(aveperiods=aveperiods, aveperiod_iter=0, scanbound=scanbound,
+                                 align_scan_to_beamorder=align,
+                                 num_aveperiods_in_scan=num_aveperiods_in_scan)
+
+
+def run_experiment(experiment, num_aveperiods):
+    """
+    Step through the averaging periods of an experiment the way radar() does.
+
+    :returns: list of (aveperiod, beam_iter, next_aveperiod's prediction) of each averaging
+              period run.
+    """
+    run = []
+    while True:
+        for scan_num, scan in enumerate(experiment.scan_objects):
+            scan_iter = 0
+            if scan.scanbound and scan.align_scan_to_beamorder:
+                for aveperiod in scan.aveperiods:
+                    aveperiod.beam_iter = 0
+
+            while scan_iter < scan.num_aveperiods_in_scan:
+                aveperiod = scan.aveperiods[scan.aveperiod_iter]
+                run.append((aveperiod, aveperiod.beam_iter,
+                            next_aveperiod(experiment, scan_num, scan_iter)))
+                if len(run) == num_aveperiods:
+                    return run
+
+                aveperiod.beam_iter += 1
+                if aveperiod.beam_iter == aveperiod.num_beams_in_scan:
+                    aveperiod.beam_iter = 0
+                scan_iter += 1
+                scan.aveperiod_iter += 1
+                if scan.aveperiod_iter == len(scan.aveperiods):
+                    scan.aveperiod_iter = 0
+
+
+class TestPipelineStage(unittest.TestCase):
+    """
+    A unittest class to test PipelineStage.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.times = []
+        self.stage = PipelineStage('test_stage', types.SimpleNamespace(observe=self.times.append))
+        self.addCleanup(self.stage.stop)
+
+    def test_order(self):
+        """Jobs run one at a time on the stage's thread, in the order they were submitted."""
+        done = []
+
+        def job(i):
+            done.append((i, threading.current_thread().name))
+            return i * 2
+
+        jobs = [self.stage.submit(job, i) for i in range(50)]
+        self.assertEqual([job.wait() for job in jobs], list(range(0, 100, 2)))
+        self.assertEqual(done, [(i, 'test_stage') for i in range(50)])
+        self.assertEqual(len(self.times), 50)
+
+    def test_stages_independent(self):
+        """A stage busy with a job does not hold up another stage."""
+        release = threading.Event()
+        other = PipelineStage('other_stage')
+        self.addCleanup(other.stop)
+
+        blocked = self.stage.submit(release.wait, TIMEOUT)
+        self.assertEqual(other.submit(sum, [1, 2, 3]).wait(), 6)
+        queued = self.stage.submit(lambda: 'queued')
+        self.assertFalse(queued._done.is_set())
+
+        release.set()
+        self.assertTrue(blocked.wait())
+        self.assertEqual(queued.wait(), 'queued')
+
+    def test_exception(self):
+        """An exception in a job is raised by its wait, and the stage carries on."""
+        def fail():
+            raise ExperimentException('failed')
+
+        failed = self.stage.submit(fail)
+        after = self.stage.submit(lambda: 'after')
+        with self.assertRaisesRegex(ExperimentException, 'failed'):
+            failed.wait()
+        self.assertEqual(after.wait(), 'after')
+        self.assertEqual(self.stage.submit(lambda: 'later').wait(), 'later')
+
+    def test_stop(self):
+        """Stopping a stage runs the jobs already submitted, then ends its thread."""
+        stage = PipelineStage('stopped_stage')
+        release = threading.Event()
+        done = []
+        stage.submit(release.wait, TIMEOUT)
+        jobs = [stage.submit(done.append, i) for i in range(3)]
+
+        stopper = threading.Thread(target=stage.stop)
+        stopper.start()
+        release.set()
+        stopper.join(TIMEOUT)
+        self.assertFalse(stopper.is_alive())
+        self.assertFalse(stage._thread.is_alive())
+        self.assertEqual(done, [0, 1, 2])
+        for job in jobs:
+            job.wait()
+        with self.assertRaises(RuntimeError):
+            stage.submit(done.append, 3)
+
+
+class TestSequenceProducer(unittest.TestCase):
+    """
+    A unittest class to test SequenceProducer.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.metadata_calls = []
+
+        def metadata_fn(sequence, beam_iter):
+            self.metadata_calls.append((sequence.name, beam_iter))
+            return 'metadata', sequence.name, beam_iter
+
+        self.producer = SequenceProducer(3, metadata_fn)
+        self.addCleanup(self.producer.stop)
+
+    def calls(self, aveperiod):
+        return sum(len(sequence.calls) for sequence in aveperiod.sequences)
+
+    def experiment(self, aveperiod):
+        return types.SimpleNamespace(scan_objects=[make_scan([aveperiod], 1)])
+
+    def test_order(self):
+        """Sequences alternate between the Sequences of the averaging period, in order."""
+        aveperiod = make_aveperiod('a', num_sequences=2, beam_iter=1)
+        self.assertFalse(self.producer.start_aveperiod(aveperiod))
+        for sequence_num in range(7):
+            item = self.producer.next_sequence()
+            name = 'a{}'.format(sequence_num % 2)
+            self.assertEqual(item['sequence_index'], sequence_num % 2)
+            self.assertEqual(item['sequence_num'], sequence_num)
+            self.assertEqual(item['pulse_data'], (name, 1, sequence_num))
+            self.assertEqual(item['encodings'], {0: (1, sequence_num)})
+            self.assertEqual(item['metadata'], ('metadata', name, 1))
+        self.assertEqual(self.metadata_calls, [('a0', 1), ('a1', 1)])
+        self.assertEqual(aveperiod.sequences[0].threads, {'make_sequences'})
+
+    def test_backpressure(self):
+        """At most lookahead sequences are built ahead, for this and the next averaging period."""
+        current = make_aveperiod('a')
+        upcoming = make_aveperiod('b', beam_iter=2)
+        self.producer.start_aveperiod(current)
+        wait_until(lambda: self.producer.ready == 3)
+        time.sleep(0.05)
+        self.assertEqual(self.calls(current), 3)
+        self.assertEqual(self.calls(upcoming), 0)
+
+        # With the current averaging period full, the next one is built.
+        self.producer.prepare_aveperiod(upcoming, 2)
+        wait_until(lambda: self.calls(upcoming) == 3)
+        time.sleep(0.05)
+        self.assertEqual(self.calls(upcoming), 3)
+
+        # Taking a sequence lets one more be built.
+        self.producer.next_sequence()
+        wait_until(lambda: self.calls(current) == 4)
+        self.assertEqual(self.producer.ready, 3)
+
+        # The next averaging period starts with the sequences built for it.
+        self.assertTrue(self.producer.start_aveperiod(upcoming))
+        self.assertEqual(self.producer.next_sequence()['pulse_data'], ('b0', 2, 0))
+        wait_until(lambda: self.calls(upcoming) == 4)
+        time.sleep(0.05)
+        self.assertEqual(self.calls(current), 4)
+        self.assertEqual(upcoming.sequences[0].calls, [(2, n) for n in range(4)])
+
+    def test_unprepared(self):
+        """An averaging period prepared at another beam_iter is built again at its own."""
+        upcoming = make_aveperiod('b', beam_iter=0)
+        self.producer.prepare_aveperiod(upcoming, 1)
+        wait_until(lambda: self.calls(upcoming) == 3)
+        self.assertFalse(self.producer.start_aveperiod(upcoming))
+        self.assertEqual(self.producer.next_sequence()['pulse_data'], ('b0', 0, 0))
+
+    def test_same_aveperiod(self):
+        """The averaging period being sent can be prepared to run again, e.g. a single beam."""
+        aveperiod = make_aveperiod('a', num_beams=1)
+        self.producer.start_aveperiod(aveperiod)
+        self.producer.prepare_aveperiod(*next_aveperiod(self.experiment(aveperiod), 0, 0))
+        for sequence_num in range(5):
+            self.assertEqual(self.producer.next_sequence()['sequence_num'], sequence_num)
+        self.producer.stop()
+
+        self.assertTrue(self.producer.start_aveperiod(aveperiod))
+        for sequence_num in range(5):
+            self.assertEqual(self.producer.next_sequence()['pulse_data'], ('a0', 0, sequence_num))
+        self.assertEqual(self.metadata_calls, [('a0', 0), ('a0', 0)])
+
+    def test_failure(self):
+        """A failed sequence is raised by next_sequence and nothing more is built for it."""
+        aveperiod = make_aveperiod('a', fail_at=1)
+        self.producer.start_aveperiod(aveperiod)
+        self.assertEqual(self.producer.next_sequence()['sequence_num'], 0)
+        with self.assertRaisesRegex(ExperimentException, 'Sequence 1 failed'):
+            self.producer.next_sequence()
+        time.sleep(0.05)
+        self.assertEqual(self.calls(aveperiod), 2)
+
+        # The producer carries on with the next averaging period.
+        other = make_aveperiod('b')
+        self.producer.start_aveperiod(other)
+        self.assertEqual(self.producer.next_sequence()['pulse_data'], ('b0', 0, 0))
+
+    def test_stop(self):
+        """Nothing more is built for an averaging period once it is stopped."""
+        aveperiod = make_aveperiod('a')
+        self.producer.start_aveperiod(aveperiod)
+        self.producer.next_sequence()
+        self.producer.stop()
+        self.assertEqual(self.producer.ready, 0)
+        calls = self.calls(aveperiod)
+        time.sleep(0.05)
+        self.assertEqual(self.calls(aveperiod), calls)
+
+
+class TestNextAveperiod(unittest.TestCase):
+    """
+    A unittest class to test next_aveperiod.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def check_predictions(self, experiment, num_aveperiods=60):
+        run = run_experiment(experiment, num_aveperiods)
+        for (_, _, predicted), (aveperiod, beam_iter, _) in zip(run, run[1:]):
+            self.assertIs(predicted[0], aveperiod)
+            self.assertEqual(predicted[1], beam_iter)
+        return run
+
+    def test_scans(self):
+        """Averaging periods are predicted within, across and after the scans."""
+        interleaved = [make_aveperiod('a', num_beams=3), make_aveperiod('b', num_beams=3)]
+        single_beam = make_aveperiod('c', num_beams=1)
+        uneven = [make_aveperiod('d', num_beams=4), make_aveperiod('e', num_beams=2)]
+        aligned = make_aveperiod('f', num_beams=4)
+        experiment = types.SimpleNamespace(scan_objects=[
+            make_scan(interleaved, 6),
+            make_scan([single_beam], 1),
+            make_scan(uneven, 3),
+            make_scan([aligned], 2, scanbound=[0, 3.5], align=True)])
+        run = self.check_predictions(experiment)
+        self.assertEqual([(aveperiod.name, beam_iter) for aveperiod, beam_iter, _ in run[:15]],
+                         [('a', 0), ('b', 0), ('a', 1), ('b', 1), ('a', 2), ('b', 2), ('c', 0),
+                          ('d', 0), ('e', 0), ('d', 1), ('f', 0), ('f', 1),
+                          ('a', 0), ('b', 0), ('a', 1)])
+        # The scan that does not use all of its averaging periods carries on where it left off,
+        # and the aligned scan starts at its first beam each time.
+        self.assertEqual([(aveperiod.name, beam_iter) for aveperiod, beam_iter, _ in run[19:24]],
+                         [('e', 1), ('d', 2), ('e', 0), ('f', 0), ('f', 1)])
+
+    def test_single_scan(self):
+        """In an experiment of one scan, the scan is followed by itself."""
+        aveperiods = [make_aveperiod('a', num_beams=3), make_aveperiod('b', num_beams=2)]
+        experiment = types.SimpleNamespace(scan_objects=[make_scan(aveperiods, 5)])
+        self.check_predictions(experiment)
+
+    def test_single_beam(self):
+        """A single beam scan is followed by the same averaging period at the same beam_iter."""
+        aveperiod = make_aveperiod('a', num_beams=1)
+        experiment = types.SimpleNamespace(scan_objects=[make_scan([aveperiod], 1)])
+        run = self.check_predictions(experiment, 5)
+        for _, beam_iter, predicted in run:
+            self.assertEqual(beam_iter, 0)
+            self.assertEqual(predicted, (aveperiod, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Test module for the noise estimate of rx_signal_processing (DSP.noise_from_samples).
+It is run simply via 'python3 dsp_unittests.py'.
+
+Beamformed samples of complex noise with a known power, with strong pulse and echo samples added,
+are given to the noise estimate, checking that the pulses and echoes are left out, that the bias
+of taking the quietest samples is corrected, and that the zero beams padding slices with fewer
+beams are not averaged in.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH + '/rx_signal_processing/')
+
+from dsp import DSP, NOISE_SAMPLES_FRACTION, NOISE_SAMPLES_BIAS
+
+NUM_SAMPLES = 20000
+
+
+def make_noise(rng, power, shape):
+    """Complex gaussian noise with a mean power of power."""
+    return (np.sqrt(power / 2.0) * (rng.standard_normal(shape) +
+                                    1j * rng.standard_normal(shape))).astype(np.complex64)
+
+
+def add_echoes(rng, samples, fraction, power):
+    """Add strong pulse or echo samples of the given power to a random fraction of each beam."""
+    num_echoes = int(samples.shape[-1] * fraction)
+    for beam in np.ndindex(samples.shape[:-1]):
+        indices = rng.choice(samples.shape[-1], num_echoes, replace=False)
+        samples[beam + (indices,)] += np.sqrt(power) * np.exp(1j * rng.uniform(0, 2 * np.pi,
+                                                                                num_echoes))
+
+
+class TestNoiseFromSamples(unittest.TestCase):
+    """
+    A unittest class to test the noise estimate from beamformed samples.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_noise_only(self):
+        """The estimate of plain noise is its power, which needs the bias correction."""
+        samples = make_noise(self.rng, 3.0, (1, 2, NUM_SAMPLES))
+        noise = DSP.noise_from_samples(samples, [{'num_beams': 2}])
+        self.assertEqual(noise.shape, (1,))
+        self.assertAlmostEqual(noise[0], 3.0, delta=0.1)
+
+        # Without the correction, the estimate is the mean power of the quietest samples, a small
+        # fraction of the noise power.
+        power = np.sort(np.abs(samples) ** 2, axis=-1)[..., :int(NUM_SAMPLES *
+                                                                NOISE_SAMPLES_FRACTION)]
+        self.assertAlmostEqual(noise[0] * NOISE_SAMPLES_BIAS, np.mean(power), places=4)
+        self.assertLess(np.mean(power), 0.1 * 3.0)
+
+    def test_pulses_and_echoes(self):
+        """Strong samples are left out, while the mean power is dominated by them."""
+        samples = make_noise(self.rng, 2.0, (1, 3, NUM_SAMPLES))
+        add_echoes(self.rng, samples, 0.05, 1.0e4)
+        noise = DSP.noise_from_samples(samples, [{'num_beams': 3}])
+        # Leaving out 5% of the noise samples raises the estimate by about 5%.
+        self.assertAlmostEqual(noise[0], 2.0, delta=0.2)
+        self.assertGreater(np.mean(np.abs(samples) ** 2), 100.0)
+
+    def test_padded_beams(self):
+        """Each slice averages only its own beams, with different noise per slice."""
+        samples = np.zeros((3, 4, NUM_SAMPLES), dtype=np.complex64)
+        samples[0] = make_noise(self.rng, 1.0, (4, NUM_SAMPLES))
+        samples[1, :1] = make_noise(self.rng, 5.0, (1, NUM_SAMPLES))
+        samples[2, :2] = make_noise(self.rng, 0.5, (2, NUM_SAMPLES))
+        add_echoes(self.rng, samples[2, :2], 0.02, 1.0e3)
+        slice_index_details = [{'num_beams': 4}, {'num_beams': 1}, {'num_beams': 2}]
+
+        noise = DSP.noise_from_samples(samples, slice_index_details)
+        np.testing.assert_allclose(noise, [1.0, 5.0, 0.5], rtol=0.06)
+
+    def test_few_samples(self):
+        """With fewer samples than 1 / NOISE_SAMPLES_FRACTION, the quietest one is used."""
+        num_samples = int(1 / NOISE_SAMPLES_FRACTION) - 1
+        samples = np.full((1, 1, num_samples), 10.0, dtype=np.complex64)
+        samples[0, 0, 3] = 1.0
+        noise = DSP.noise_from_samples(samples, [{'num_beams': 1}])
+        self.assertAlmostEqual(noise[0], 1.0 / NOISE_SAMPLES_BIAS, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+Test module for building the basic transmit pulses (sample_building/sample_building.py).
+It is run simply via 'python3 sample_building_unittests.py'.
+
+Wavetable pulses are checked against a reference that builds them sample by sample the way
+get_samples used to, for several ramp times, pulse lengths, rates and frequencies. Also checks
+that the memoized pulses cannot be changed by the callers sharing them, and that the cached beam
+phase tables match the tables get_phase_shift used to compute for one frequency at a time and
+are evicted least recently used first.
+
+:copyright: 2021 SuperDARN Canada
+"""
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+from scipy.constants import speed_of_light
+
+BOREALISPATH = os.environ['BOREALISPATH']
+sys.path.append(BOREALISPATH)
+
+import sample_building.sample_building as sample_building
+from sample_building.sample_building import get_samples, get_phase_shift, get_phase_shifts
+
+WAVE_TABLE_LEN = 8192
+IWAVE_TABLE = [math.cos(i * 2 * math.pi / WAVE_TABLE_LEN) for i in range(WAVE_TABLE_LEN)]
+QWAVE_TABLE = [math.sin(i * 2 * math.pi / WAVE_TABLE_LEN) for i in range(WAVE_TABLE_LEN)]
+
+
+def reference_wavetable_samples(rate, wave_freq, pulse_len, ramp_time, max_amplitude,
+                                iwave_table, qwave_table):
+    """Build a wavetable pulse one sample at a time, with a linear ramp up and down."""
+    wave_table_len = len(iwave_table)
+    rampsampleslen = int(rate * ramp_time)
+    sampleslen = int(rate * pulse_len + 2 * rampsampleslen)
+    samples = np.empty([sampleslen], dtype=np.complex64)
+
+    sample_skip = int(wave_freq / rate * wave_table_len)
+    actual_wave_freq = (float(sample_skip) / float(wave_table_len)) * rate
+
+    def sample(i, amp):
+        if sample_skip < 0:
+            ind = -1 * ((abs(sample_skip * i)) % wave_table_len)
+        else:
+            ind = (sample_skip * i) % wave_table_len
+        return amp * iwave_table[ind] + amp * qwave_table[ind] * 1j
+
+    # The ramp down is written last, so it wins where it overlaps the ramp up.
+    for i in range(0, rampsampleslen):
+        samples[i] = sample(i, max_amplitude * float(i + 1) / float(rampsampleslen))
+    for i in range(rampsampleslen, sampleslen - rampsampleslen):
+        samples[i] = sample(i, max_amplitude)
+    for i in range(sampleslen - rampsampleslen, sampleslen):
+        samples[i] = sample(i, max_amplitude * float(sampleslen - i) / float(rampsampleslen))
+    return samples, actual_wave_freq
+
+
+def reference_phase_shift(beam_angle, freq, num_antennas, antenna_spacing, centre_offset=0.0):
+    """Find the phase shifts of the beams of one frequency the way get_phase_shift used to."""
+    freq_hz = freq * 1000.0
+    beam_rads = (np.pi / 180) * np.array(beam_angle, dtype=np.float32)
+    antennas = np.arange(num_antennas)
+    x = ((num_antennas - 1) / 2.0 - antennas) * antenna_spacing + centre_offset
+    x *= 2 * np.pi * freq_hz
+    y = np.cos(np.pi / 2.0 - beam_rads) / speed_of_light
+    return np.exp(1j * np.fmod(np.outer(y, x), 2.0 * np.pi))
+
+
+class TestSampleBuilding(unittest.TestCase):
+    """
+    A unittest class to test building the basic transmit pulses.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def test_wavetable_samples(self):
+        """Wavetable pulses match the sample by sample reference."""
+        for rate in (5.0e6, 3.333e6, 1.0e7):
+            for wave_freq in (0.0, 1.2e6, -750.0e3, 2.4321e6):
+                for pulse_len, ramp_time in ((300e-6, 10e-6), (100e-6, 0.0), (300e-6, 2.5e-6),
+                                             (1e-6, 5e-6)):
+                    params = (rate, wave_freq, pulse_len, ramp_time, 0.99)
+                    samples, actual_wave_freq = get_samples(*params, IWAVE_TABLE, QWAVE_TABLE)
+                    reference, reference_freq = \
+                        reference_wavetable_samples(*params, IWAVE_TABLE, QWAVE_TABLE)
+                    with self.subTest(params=params):
+                        self.assertEqual(samples.dtype, np.complex64)
+                        np.testing.assert_allclose(samples, reference, rtol=1e-6, atol=1e-7)
+                        self.assertEqual(actual_wave_freq, reference_freq)
+
+    def test_sine_samples(self):
+        """Sine pulses are ramped linearly up and down at the requested frequency."""
+        samples, actual_wave_freq = get_samples(5.0e6, 1.0e6, 300e-6, 10e-6, 0.5)
+        self.assertEqual(actual_wave_freq, 1.0e6)
+        self.assertEqual(len(samples), 1500)
+        amplitude = np.full(1500, 0.5)
+        amplitude[:50] = 0.5 * np.arange(50) / 50
+        amplitude[-50:] = 0.5 * np.arange(50)[::-1] / 50
+        np.testing.assert_allclose(np.abs(samples), amplitude, atol=1e-12)
+        np.testing.assert_allclose(samples[60:61], 0.5 * np.exp(2j * np.pi * 60 / 5), atol=1e-12)
+
+    def test_cached_samples_read_only(self):
+        """The memoized pulses are shared and cannot be written to by a caller."""
+        iwave_table = list(IWAVE_TABLE)
+        for tables in ((), (iwave_table, QWAVE_TABLE)):
+            samples, _ = get_samples(5.0e6, 1.0e6, 300e-6, 10e-6, 0.99, *tables)
+            expected = samples.copy()
+            self.assertFalse(samples.flags.writeable)
+            with self.assertRaises(ValueError):
+                samples[0] = 0
+            with self.assertRaises(ValueError):
+                samples *= 2
+
+            again, _ = get_samples(5.0e6, 1.0e6, 300e-6, 10e-6, 0.99, *tables)
+            self.assertIs(again, samples)
+            np.testing.assert_array_equal(again, expected)
+
+        # Changing a wavetable after it was used gives new samples, not the cached ones.
+        iwave_table[:] = [-i for i in IWAVE_TABLE]
+        changed, _ = get_samples(5.0e6, 1.0e6, 300e-6, 10e-6, 0.99, iwave_table, QWAVE_TABLE)
+        self.assertIsNot(changed, samples)
+        np.testing.assert_allclose(changed.real, -expected.real, atol=1e-7)
+
+
+class TestPhaseShifts(unittest.TestCase):
+    """
+    A unittest class to test the beam phase tables and their cache.
+    All test methods must begin with the word 'test' to be run by unittest.
+    """
+
+    def setUp(self):
+        sample_building._phase_shift_cache.clear()
+        self.addCleanup(sample_building._phase_shift_cache.clear)
+
+    def test_phase_shifts(self):
+        """The tables of every frequency match the ones computed for one frequency at a time."""
+        beam_angle = [-26.25, -3.24, 0.0, 1.5, 19.44]
+        freqs = [10500, 12000.5, 13100, 10500]
+        for num_antennas, spacing, offset in ((16, 15.24, 0.0), (4, 15.24, -100.0), (1, 10.0, 5)):
+            tables = get_phase_shifts(beam_angle, freqs, num_antennas, spacing, offset)
+            self.assertEqual(len(tables), len(freqs))
+            for freq, table in zip(freqs, tables):
+                reference = reference_phase_shift(beam_angle, freq, num_antennas, spacing, offset)
+                self.assertEqual(table.shape, (len(beam_angle), num_antennas))
+                np.testing.assert_allclose(table, reference, rtol=1e-12, atol=1e-12)
+                np.testing.assert_array_equal(
+                    get_phase_shift(beam_angle, freq, num_antennas, spacing, offset), table)
+            self.assertIs(tables[0], tables[-1])
+
+    def test_cache(self):
+        """Tables are computed once, shared read-only, and keyed on every parameter."""
+        beam_angle = [-10.0, 0.0, 10.0]
+        first = get_phase_shift(beam_angle, 10500, 16, 15.24)
+        self.assertIs(get_phase_shift(beam_angle, 10500.0, 16, 15.24), first)
+        self.assertIs(get_phase_shifts(tuple(beam_angle), [12000, 10500], 16, 15.24)[1], first)
+        self.assertFalse(first.flags.writeable)
+        with self.assertRaises(ValueError):
+            first[0, 0] = 0
+
+        for other in (get_phase_shift(beam_angle + [20.0], 10500, 16, 15.24),
+                      get_phase_shift(beam_angle, 10501, 16, 15.24),
+                      get_phase_shift(beam_angle, 10500, 4, 15.24),
+                      get_phase_shift(beam_angle, 10500, 16, 15.0),
+                      get_phase_shift(beam_angle, 10500, 16, 15.24, -100.0)):
+            self.assertIsNot(other, first)
+        self.assertEqual(len(sample_building._phase_shift_cache), 7)
+
+    def test_eviction(self):
+        """Only PHASE_SHIFT_CACHE_SIZE tables are kept, the least recently used go first."""
+        size = sample_building.PHASE_SHIFT_CACHE_SIZE
+        beam_angle = [0.0, 10.0]
+        first = get_phase_shift(beam_angle, 10000, 16, 15.24)
+        second = get_phase_shift(beam_angle, 10001, 16, 15.24)
+        get_phase_shifts(beam_angle, range(10002, 10000 + size), 16, 15.24)
+        self.assertEqual(len(sample_building._phase_shift_cache), size)
+
+        # Using the first table makes the second the least recently used.
+        self.assertIs(get_phase_shift(beam_angle, 10000, 16, 15.24), first)
+        get_phase_shift(beam_angle, 20000, 16, 15.24)
+        self.assertEqual(len(sample_building._phase_shift_cache), size)
+        self.assertIs(get_phase_shift(beam_angle, 10000, 16, 15.24), first)
+        again = get_phase_shift(beam_angle, 10001, 16, 15.24)
+        self.assertIsNot(again, second)
+        np.testing.assert_array_equal(again, second)
+
+        # A batch larger than the cache still returns every table.
+        tables = get_phase_shifts(beam_angle, range(size + 10), 16, 15.24)
+        self.assertEqual(len(tables), size + 10)
+        np.testing.assert_allclose(tables[0], reference_phase_shift(beam_angle, 0, 16, 15.24))
+        self.assertEqual(len(sample_building._phase_shift_cache), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,7 @@
 #include <thread>
 #include <cstdlib>
 #include <cmath>
+#include <cstring>
 #include <tuple>
 #include <sys/mman.h>
 #include "utils/driver_options/driveroptions.hpp"
@@ -57,13 +58,40 @@ static clocks_t borealis_clocks;
  *
  * @return     A set of vectors of TX samples for each USRP channel.
  *
- * Values in a protobuffer have no contiguous underlying storage so values need to be
- * parsed into a vector.
+ * Samples are copied straight out of the packed_samples bytes field if it is set. Otherwise
+ * they are parsed from the repeated channel_samples fields, which have no contiguous underlying
+ * storage so values need to be parsed into a vector one by one.
  */
 std::vector<std::vector<std::complex<float>>> make_tx_samples(
                                                     const driverpacket::DriverPacket &driver_packet,
                                                     const DriverOptions &driver_options)
 {
+  if (!driver_packet.packed_samples().empty()) {
+    auto &packed = driver_packet.packed_samples();
+    auto num_channels = driver_packet.num_channels();
+    std::vector<std::vector<std::complex<float>>> samples(num_channels);
+    if (num_channels == 0) {
+      return samples;
+    }
+
+    auto num_samps = packed.size() / (num_channels * sizeof(std::complex<float>));
+    if (num_samps * num_channels * sizeof(std::complex<float>) != packed.size()) {
+      std::stringstream msg;
+      msg << "Packed samples of " << packed.size() << " bytes are not a whole number of "
+          << "complex64 samples for each of " << num_channels << " channels";
+      throw uhd::runtime_error(msg.str());
+    }
+
+    auto channel_bytes = num_samps * sizeof(std::complex<float>);
+    for (uint32_t channel=0; channel<num_channels; channel++) {
+      samples[channel].resize(num_samps);
+      // memcpy as the protobuf string has no alignment guarantees for std::complex<float>.
+      std::memcpy(samples[channel].data(), packed.data() + channel * channel_bytes, channel_bytes);
+    }
+
+    return samples;
+  }
+
   // channel_samples_size() will get you # of channels (protobuf in c++)
   std::vector<std::vector<std::complex<float>>> samples(driver_packet.channel_samples_size());
 
@@ -225,8 +253,9 @@ void transmit(zmq::context_t &driver_c, USRP &usrp_d, const DriverOptions &drive
                 pulses.clear();
               }
               //Parse new samples from driver packet if they exist.
-              if (driver_packet.channel_samples_size() > 0)
-              {  // ~700us to unpack 4x1600 samples
+              if (driver_packet.channel_samples_size() > 0 ||
+                  !driver_packet.packed_samples().empty())
+              {  // ~700us to unpack 4x1600 samples from channel_samples
                 last_pulse_sent = make_tx_samples(driver_packet, driver_options);
                 samples_set = true;
               }
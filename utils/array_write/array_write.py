@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# array_write.py
+# Write Borealis records directly to array files, one row per averaging period.
+#
+# Array files hold one dataset per field, named after the field, as described in the array file
+# sections of the rawacf, bfiq and antennas_iq docs. Fields that stay the same for the whole file
+# (experiment and slice metadata, pulses, lags...) are written once with the first record. Fields
+# that change per record are extendable datasets with a leading num_records dimension, appended
+# to once per averaging period. Records with fewer beams, sequences or blanked samples than the
+# largest seen so far are padded with zeros, and a dataset is grown (rewritten with larger
+# dimensions) when a record is larger than every earlier one, which only happens a few times at
+# the start of a file.
+
+import threading
+
+import numpy as np
+import tables
+
+# Fields with a value per record. Every other field is shared by all records of a file.
+PER_RECORD_FIELDS = frozenset([
+    'agc_status_word', 'beam_azms', 'beam_nums', 'blanked_samples', 'data', 'gps_locked',
+    'gps_to_system_time_diff', 'int_time', 'intf_acfs', 'lost_sequences', 'lp_status_word',
+    'main_acfs', 'noise_at_freq', 'num_beams', 'num_blanked_samples', 'num_lost_sequences',
+    'num_sequences', 'num_slices', 'scan_start_marker', 'slice_interfacing', 'sqn_timestamps',
+    'xcfs',
+])
+
+# Flattened data fields, and the field giving the dimensions of each record. The dimensions are
+# given by the array shapes in array files, so the dimension fields are not written.
+DATA_FIELDS = {
+    'main_acfs': 'correlation_dimensions',
+    'intf_acfs': 'correlation_dimensions',
+    'xcfs': 'correlation_dimensions',
+    'data': 'data_dimensions',
+}
+
+# Descriptor fields, and the array file names of the dimensions that are padded.
+DESCRIPTOR_FIELDS = ('correlation_descriptors', 'data_descriptors')
+PADDED_DIMENSIONS = {'num_beams': 'max_num_beams', 'num_sequences': 'max_num_sequences'}
+
+# Number of records in a two hour file, used to size the datasets.
+EXPECTED_RECORDS = 2400
+
+# Size to aim for in the chunks of the per record datasets, by data product. Small rows are
+# grouped into chunks of several records, and large rows are split along their outer dimensions,
+# e.g. a chunk per group of antennas of an antennas_iq record. Larger chunks compress better and
+# give blosc more blocks to share between its threads.
+CHUNK_BYTES = {
+    'rawacf': 64 * 1024,
+    'bfiq': 1024 * 1024,
+    'antennas_iq': 1024 * 1024,
+}
+DEFAULT_CHUNK_BYTES = 256 * 1024
+
+# Records copied at a time when growing a dataset.
+GROW_ROWS = 64
+
+# HDF5 is not thread safe, and data_write writes each averaging period from its own thread. Every
+# HDF5 write in data_write, including the site files written with deepdish, holds this lock.
+hdf5_lock = threading.Lock()
+
+
+def _to_array(value):
+    """Convert a field to a numpy array, with strings as bytes."""
+    if isinstance(value, str):
+        return np.array(value.encode('utf-8'))
+    array = np.asarray(value)
+    if array.dtype.kind == 'U':
+        array = np.char.encode(array, 'utf-8')
+    return array
+
+
+def split_record(record):
+    """
+    Split a Borealis record into the fields shared by all records of an array file and the row
+    of each per record field.
+
+    :param record: the Borealis record, as given to DataWrite.write_file.
+    :returns: dict of shared field: array, dict of per record field: array.
+    """
+    record = dict(record)
+    for field, dimensions_field in DATA_FIELDS.items():
+        if record.get(field) is not None and dimensions_field in record:
+            record[field] = np.asarray(record[field]).reshape(record[dimensions_field])
+    for field in set(DATA_FIELDS.values()):
+        record.pop(field, None)
+    for field in DESCRIPTOR_FIELDS:
+        if field in record:
+            record[field] = ['num_records'] + [PADDED_DIMENSIONS.get(d, d) for d in record[field]]
+
+    if 'beam_nums' in record:
+        record['num_beams'] = np.uint32(len(record['beam_nums']))
+    if 'blanked_samples' in record:
+        record['num_blanked_samples'] = np.uint32(len(record['blanked_samples']))
+    if 'lost_sequences' in record:
+        record['num_lost_sequences'] = np.uint32(len(record['lost_sequences']))
+
+    shared = {}
+    rows = {}
+    for field, value in record.items():
+        if value is None:
+            continue
+        (rows if field in PER_RECORD_FIELDS else shared)[field] = _to_array(value)
+
+    # Pulse phase offsets are given per sequence. They are shared if every sequence of every
+    # record uses the same ones, as is usual, and kept per record otherwise.
+    encodings = shared.get('pulse_phase_offset')
+    if encodings is not None and encodings.ndim == 2:
+        if encodings.size == 0:
+            shared['pulse_phase_offset'] = encodings.reshape(0)
+        elif np.all(encodings == encodings[0]):
+            shared['pulse_phase_offset'] = encodings[0]
+        else:
+            rows['pulse_phase_offset'] = shared.pop('pulse_phase_offset')
+    return shared, rows
+
+
+def chunk_shape(shape, itemsize, chunk_bytes):
+    """
+    Choose the chunk shape of a per record dataset.
+
+    :param shape: the shape of a row (one record).
+    :param itemsize: the size of a value in bytes.
+    :param chunk_bytes: the size to aim for.
+    :returns: the chunk shape, including the record dimension.
+    """
+    row_bytes = max(int(np.prod(shape)) * itemsize, 1)
+    if row_bytes <= chunk_bytes:
+        return (max(1, min(EXPECTED_RECORDS, chunk_bytes // row_bytes)),) + tuple(shape)
+
+    chunk = [1]
+    inner_bytes = row_bytes
+    for i, n in enumerate(shape):
+        inner_bytes //= max(n, 1)
+        if n * inner_bytes > chunk_bytes:
+            # Split the dimension into equal pieces, so the last chunk is not mostly empty.
+            pieces = -(-n // max(1, chunk_bytes // max(inner_bytes, 1)))
+            chunk.append(-(-n // pieces))
+            chunk.extend(shape[i + 1:])
+            break
+        chunk.append(n)
+    return tuple(chunk)
+
+
+def _same(first, second):
+    return first.shape == second.shape and np.array_equal(first, second)
+
+
+class ArrayFile(object):
+    """
+    An array file that records are appended to. The file is kept open between records, and
+    flushed after each one, until it is closed.
+
+    :param filename: the file. Created with the first record, or appended to if it exists.
+    :type filename: str
+    :param filters: the compression of the per record datasets, None for none.
+    :type filters: tables.Filters
+    :param chunk_bytes: the chunk size to aim for in the per record datasets.
+    :type chunk_bytes: int
+    """
+
+    def __init__(self, filename, filters=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+        super(ArrayFile, self).__init__()
+        self.filename = filename
+        self.filters = filters
+        self.chunk_bytes = chunk_bytes
+        self.file = None
+        self.shared = None
+        self.row_fields = None
+        self.num_records = None
+
+    def _open(self):
+        self.file = tables.open_file(self.filename, 'a')
+        self.shared = {}
+        self.row_fields = set()
+        for node in self.file.root:
+            if isinstance(node, tables.EArray):
+                self.row_fields.add(node.name)
+            else:
+                self.shared[node.name] = node.read()
+
+    def close(self):
+        with hdf5_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _create_row_dataset(self, field, row):
+        return self.file.create_earray(self.file.root, field,
+                                       atom=tables.Atom.from_dtype(row.dtype),
+                                       shape=(0,) + row.shape, expectedrows=EXPECTED_RECORDS,
+                                       chunkshape=chunk_shape(row.shape, row.dtype.itemsize,
+                                                              self.chunk_bytes),
+                                       filters=self.filters)
+
+    def _grow(self, node, shape, dtype):
+        """Rewrite a per record dataset with larger dimensions or dtype, padding with zeros."""
+        name = node.name
+        grown = self._create_row_dataset(name + '_grown', np.zeros(shape, dtype=dtype))
+        for start in range(0, node.nrows, GROW_ROWS):
+            rows = node[start:start + GROW_ROWS]
+            padded = np.zeros((len(rows),) + shape, dtype=dtype)
+            padded[tuple(slice(0, n) for n in rows.shape)] = rows
+            grown.append(padded)
+        node.remove()
+        grown.rename(name)
+        return grown
+
+    def _append_row(self, field, row, num_records):
+        if row.size == 0:
+            # Datasets cannot have empty dimensions, so empty rows are padded too, e.g. when no
+            # sequences were lost. The num_* fields give the number of values in each row.
+            row = np.zeros(tuple(max(n, 1) for n in row.shape), dtype=row.dtype)
+        if field not in self.row_fields:
+            node = self._create_row_dataset(field, row)
+            self.row_fields.add(field)
+            if num_records:
+                # The field is missing from the earlier records.
+                node.append(np.zeros((num_records,) + row.shape, dtype=row.dtype))
+        else:
+            node = self.file.root._f_get_child(field)
+        if node.ndim - 1 != row.ndim:
+            raise ValueError("{} has {} dimensions, not {}".format(field, row.ndim,
+                                                                    node.ndim - 1))
+
+        shape = tuple(max(n, m) for n, m in zip(node.shape[1:], row.shape))
+        dtype = np.promote_types(node.atom.dtype, row.dtype)
+        if shape != node.shape[1:] or dtype != node.atom.dtype:
+            node = self._grow(node, shape, dtype)
+        if row.shape != shape:
+            padded = np.zeros(shape, dtype=dtype)
+            padded[tuple(slice(0, n) for n in row.shape)] = row
+            row = padded
+        node.append(row[np.newaxis])
+
+    def append(self, record):
+        """
+        Append a record.
+
+        :param record: the Borealis record, as given to DataWrite.write_file.
+        :returns: True, or False if the record's shared fields differ from the file's, in which
+                  case it belongs in a new file and nothing is written.
+        """
+        shared, rows = split_record(record)
+        with hdf5_lock:
+            if self.file is None:
+                self._open()
+            root = self.file.root
+
+            num_records = root.num_sequences.nrows if 'num_sequences' in self.row_fields else 0
+            if num_records:
+                if set(shared) != set(self.shared) or \
+                        not all(_same(value, self.shared[field]) for field, value in shared.items()):
+                    return False
+            else:
+                for field, value in shared.items():
+                    if field in root:
+                        self.file.remove_node(root, field)
+                    self.file.create_array(root, field, obj=value)
+                self.shared = shared
+
+            for field, row in rows.items():
+                self._append_row(field, row, num_records)
+            # Fields missing from this record are padded.
+            for field in self.row_fields.difference(rows):
+                node = root._f_get_child(field)
+                node.append(np.zeros((1,) + node.shape[1:], dtype=node.atom.dtype))
+            self.file.flush()
+            self.num_records = num_records + 1
+        return True
+
+
+def read_array_file(filename):
+    """
+    Read an array file.
+
+    :param filename: the file.
+    :returns: dict of field: array, with strings decoded.
+    """
+    fields = {}
+    with hdf5_lock, tables.open_file(filename, 'r') as f:
+        for node in f.root:
+            value = node.read()
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            elif isinstance(value, np.ndarray) and value.dtype.kind == 'S':
+                value = np.char.decode(value, 'utf-8')
+            fields[node.name] = value
+    return fields
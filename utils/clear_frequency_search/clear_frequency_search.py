@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# clear_frequency_search.py
+# Find the quietest frequencies for slices with a clrfrqrange.
+#
+# The power spectrum of a receive-only window of the ring buffer is estimated with Welch's method
+# (Hann windowed FFTs of half-overlapping segments, averaged over the segments and antennas). For
+# each slice, every whole kHz in its clrfrqrange is a candidate, scored by the power in the
+# slice's receive bandwidth around it, and the quietest candidate whose band is clear of the
+# restricted frequencies is picked. Spectra are cached on their window, so all the slices searched
+# on the same window, with overlapping clrfrqranges or not, share one spectrum.
+
+import collections
+
+import numpy as np
+
+from experiment_prototype.experiment_exception import ExperimentException
+
+# Number of samples in each FFT of the Welch estimate. 8192 samples at 5 MHz gives 610 Hz bins.
+CLRFRQ_FFT_SIZE = 8192
+
+# Number of spectra kept in the cache.
+SPECTRUM_CACHE_SIZE = 8
+
+
+def ringbuffer_window(ringbuffer, end_sample, num_samples):
+    """
+    Get the samples of a window of the ring buffer, handling the wrap around.
+
+    :param ringbuffer: The ring buffer, [antennas, samples].
+    :param end_sample: The sample after the window, which may be past the end of the buffer.
+    :param num_samples: The length of the window.
+    :returns: The samples, [antennas, num_samples]. A view of the ring buffer if the window does
+              not wrap around.
+    """
+    buffer_len = ringbuffer.shape[1]
+    if num_samples > buffer_len:
+        raise ValueError('Window of {} samples is longer than the ring buffer'.format(num_samples))
+    start = (end_sample - num_samples) % buffer_len
+    if start + num_samples <= buffer_len:
+        return ringbuffer[:, start:start + num_samples]
+    return np.concatenate((ringbuffer[:, start:], ringbuffer[:, :start + num_samples - buffer_len]),
+                          axis=1)
+
+
+def power_spectrum(samples, rx_rate, fft_size=CLRFRQ_FFT_SIZE):
+    """
+    Estimate the power spectral density of complex samples with Welch's method.
+
+    :param samples: The samples, [antennas, samples] or [samples].
+    :param rx_rate: The sampling rate, in Hz.
+    :param fft_size: The number of samples in each segment.
+    :returns: The frequency offset of each bin from the centre frequency in Hz, increasing, and
+              the power spectral density in each bin, averaged over the antennas.
+    """
+    samples = np.atleast_2d(samples)
+    if samples.shape[-1] < fft_size:
+        raise ValueError('Need at least {} samples for the spectrum, got {}'.format(
+            fft_size, samples.shape[-1]))
+
+    step = fft_size // 2
+    segments = np.lib.stride_tricks.sliding_window_view(samples, fft_size, axis=-1)[:, ::step]
+    window = np.hanning(fft_size).astype(np.float32)
+    spectra = np.fft.fft(segments * window, axis=-1)
+    power = np.mean(spectra.real ** 2 + spectra.imag ** 2, axis=(0, 1))
+    power /= rx_rate * np.sum(window.astype(np.float64) ** 2)
+
+    freqs = np.fft.fftshift(np.fft.fftfreq(fft_size, 1.0 / rx_rate))
+    return freqs, np.fft.fftshift(power)
+
+
+def clear_frequency_requests(slice_dict, slice_ids):
+    """
+    Get the clear frequency search requests of the clrfrqflag slices among slice_ids.
+
+    :param slice_dict: The slice dictionary of the experiment.
+    :param slice_ids: The slices to search for, e.g. the slices of an averaging period.
+    :returns: OrderedDict of slice_id: (clrfrqrange, bandwidth in kHz). The bandwidth of a slice
+              is 1 / pulse_len.
+    """
+    return collections.OrderedDict(
+        (slice_id, (tuple(slice_dict[slice_id]['clrfrqrange']),
+                    1.0e3 / slice_dict[slice_id]['pulse_len']))
+        for slice_id in slice_ids if slice_dict[slice_id]['clrfrqflag'])
+
+
+class ClearFrequencySearch(object):
+    """
+    Clear frequency search on windows of the ring buffer.
+
+    :param rx_rate: The sampling rate of the ring buffer, in Hz.
+    :type rx_rate: float
+    :param rx_ctr_freq: The centre frequency of the ring buffer, in kHz.
+    :type rx_ctr_freq: float
+    :param restricted_frequencies: The restricted frequencies, in kHz, e.g.
+                                   ExperimentOptions.restricted_frequencies. Optional.
+    :type restricted_frequencies: FrequencyRanges
+    :param fft_size: The number of samples in each FFT of the spectrum.
+    :type fft_size: int
+    """
+
+    def __init__(self, rx_rate, rx_ctr_freq, restricted_frequencies=None,
+                 fft_size=CLRFRQ_FFT_SIZE):
+        super(ClearFrequencySearch, self).__init__()
+        self.rx_rate = rx_rate
+        self.rx_ctr_freq = rx_ctr_freq
+        self.restricted_frequencies = restricted_frequencies
+        self.fft_size = fft_size
+        self._spectra = collections.OrderedDict()
+
+    def spectrum(self, ringbuffer, end_sample, num_samples):
+        """
+        Get the power spectrum of a window of the ring buffer, from the cache if it has been
+        computed before.
+
+        :param ringbuffer: The ring buffer, [antennas, samples].
+        :param end_sample: The sample after the window, counted from the start of the ring
+                           buffer's first lap. The driver keeps overwriting the ring buffer, so
+                           the same position one lap later holds new samples.
+        :param num_samples: The length of the window.
+        :returns: The frequency of each bin in kHz, increasing, and the power in each bin.
+        """
+        key = (id(ringbuffer), end_sample, num_samples)
+        if key in self._spectra:
+            self._spectra.move_to_end(key)
+            return self._spectra[key]
+
+        samples = ringbuffer_window(ringbuffer, end_sample, num_samples)
+        freqs, power = power_spectrum(samples, self.rx_rate, self.fft_size)
+        spectrum = (self.rx_ctr_freq + freqs / 1.0e3, power)
+
+        self._spectra[key] = spectrum
+        while len(self._spectra) > SPECTRUM_CACHE_SIZE:
+            self._spectra.popitem(last=False)
+        return spectrum
+
+    def band_powers(self, spectrum, freqs, bandwidth):
+        """
+        Get the power in bands of a spectrum.
+
+        :param spectrum: The bin frequencies (kHz) and powers from spectrum.
+        :param freqs: The centre frequencies of the bands, in kHz, an array.
+        :param bandwidth: The width of the bands, in kHz.
+        :returns: The mean power of the bins in each band, an array. Bands without any bins are
+                  given the power of the closest bin.
+        """
+        bin_freqs, power = spectrum
+        cumulative = np.concatenate(([0.0], np.cumsum(power, dtype=np.float64)))
+        low = np.searchsorted(bin_freqs, freqs - bandwidth / 2.0, side='left')
+        high = np.searchsorted(bin_freqs, freqs + bandwidth / 2.0, side='right')
+        num_bins = high - low
+        closest = np.clip(np.searchsorted(bin_freqs, freqs), 0, len(power) - 1)
+        return np.where(num_bins > 0,
+                        (cumulative[high] - cumulative[low]) / np.maximum(num_bins, 1),
+                        power[closest])
+
+    def quietest_frequency(self, spectrum, clrfrqrange, bandwidth, exclude=()):
+        """
+        Find the quietest frequency of a clrfrqrange in a spectrum.
+
+        :param spectrum: The bin frequencies (kHz) and powers from spectrum.
+        :param clrfrqrange: The [low, high] range to search, in kHz. Every whole kHz in it whose
+                            band fits in the spectrum is a candidate.
+        :param bandwidth: The receive bandwidth of the slice, in kHz.
+        :param exclude: Bands (low, high) in kHz to keep the band of the frequency clear of, e.g.
+                        the bands already picked for other slices.
+        :returns: The frequency in kHz and the power in its band, or None if no candidate has a
+                  clear band.
+        """
+        bin_freqs = spectrum[0]
+        half_band = bandwidth / 2.0
+        low = max(int(np.ceil(clrfrqrange[0])), int(np.ceil(bin_freqs[0] + half_band)))
+        high = min(int(np.floor(clrfrqrange[1])), int(np.floor(bin_freqs[-1] - half_band)))
+        if low > high:
+            return None
+
+        candidates = np.arange(low, high + 1, dtype=np.float64)
+        allowed = np.ones(candidates.shape, dtype=bool)
+        if self.restricted_frequencies is not None:
+            allowed &= ~self.restricted_frequencies.overlaps(candidates - half_band,
+                                                             candidates + half_band)
+        for band_low, band_high in exclude:
+            allowed &= (candidates + half_band < band_low) | (candidates - half_band > band_high)
+        if not allowed.any():
+            return None
+
+        powers = self.band_powers(spectrum, candidates[allowed], bandwidth)
+        best = int(np.argmin(powers))
+        return int(candidates[allowed][best]), float(powers[best])
+
+    def search(self, ringbuffer, end_sample, num_samples, requests):
+        """
+        Pick the quietest frequency for each slice, from one spectrum of a window of the ring
+        buffer. Slices are searched in order, and each slice's band is kept clear of the bands
+        picked for the slices before it.
+
+        :param ringbuffer: The ring buffer, [antennas, samples].
+        :param end_sample: The sample after the window, which must be receive-only.
+        :param num_samples: The length of the window.
+        :param requests: dict of slice_id: (clrfrqrange, bandwidth in kHz), see
+                         clear_frequency_requests.
+        :returns: dict of slice_id: frequency in kHz.
+        :raises ExperimentException: if there is no clear frequency for a slice.
+        """
+        spectrum = self.spectrum(ringbuffer, end_sample, num_samples)
+        frequencies = {}
+        picked_bands = []
+        for slice_id, (clrfrqrange, bandwidth) in requests.items():
+            result = self.quietest_frequency(spectrum, clrfrqrange, bandwidth, picked_bands)
+            if result is None:
+                errmsg = 'No clear frequency in clrfrqrange {} of slice {}'.format(
+                    list(clrfrqrange), slice_id)
+                raise ExperimentException(errmsg)
+            frequencies[slice_id] = result[0]
+            picked_bands.append((result[0] - bandwidth / 2.0, result[0] + bandwidth / 2.0))
+        return frequencies
@@ -10,6 +10,15 @@
 import json
 import os
 
+# The compression codecs that can be used for data files, and their PyTables/HDF5 libraries.
+# lz4, zstd and blosc use the blosc meta-compressor, with byte shuffling and multiple threads.
+COMPRESSION_LIBRARIES = {
+    'zlib': 'zlib',
+    'lz4': 'blosc:lz4',
+    'zstd': 'blosc:zstd',
+    'blosc': 'blosc:blosclz',
+}
+
 class DataWriteOptions(object):
     """
     Parses the options from the config file that are relevant to data writing.
@@ -40,6 +49,12 @@ class DataWriteOptions(object):
         self._pulse_ramp_time = float(raw_config["pulse_ramp_time"])
         self._tr_window_time = float(raw_config["tr_window_time"])
         self._router_address = raw_config["router_address"]
+        self._metrics_address = raw_config["metrics_address"]
+        self._reorder_window = int(raw_config["reorder_window"])
+        self._reorder_timeout = float(raw_config["reorder_timeout"])
+        self._data_compression = {product: self.parse_compression(setting) for product, setting
+                                  in raw_config["data_compression"].items()}
+        self._compression_threads = int(raw_config["data_compression_threads"])
         self._main_antenna_count = int(raw_config["main_antenna_count"])
         self._intf_antenna_count = int(raw_config["interferometer_antenna_count"])
 
@@ -188,6 +203,79 @@ class DataWriteOptions(object):
         """
         return self._router_address
 
+    @property
+    def metrics_address(self):
+        """
+        Gets the socket address that runtime metrics are published to.
+
+        :return:    socket address that runtime metrics are published to.
+        :rtype:     str
+        """
+        return self._metrics_address
+
+    @property
+    def reorder_window(self):
+        """
+        Gets the number of processed sequences held while waiting for a missing one.
+
+        :return:    number of sequences held before the missing one is declared lost.
+        :rtype:     int
+        """
+        return self._reorder_window
+
+    @property
+    def reorder_timeout(self):
+        """
+        Gets how long to wait for a missing sequence while later ones are held.
+
+        :return:    time in seconds before the missing sequence is declared lost.
+        :rtype:     float
+        """
+        return self._reorder_timeout
+
+    @staticmethod
+    def parse_compression(setting):
+        """
+        Parses a compression setting of the form codec:level, e.g. zstd:3, or none.
+
+        :param setting: the compression setting.
+        :type setting:  str
+        :return:        the PyTables compression library and level, or None for no compression.
+        :rtype:         tuple or None
+        """
+        if setting == 'none':
+            return None
+        codec, _, level = setting.partition(':')
+        if codec not in COMPRESSION_LIBRARIES:
+            errmsg = 'Unknown compression codec {0}, must be none or one of {1}'.format(
+                codec, ', '.join(COMPRESSION_LIBRARIES))
+            raise ValueError(errmsg)
+        level = int(level) if level else 1
+        if not 0 <= level <= 9:
+            raise ValueError('Compression level {0} of {1} is not 0 to 9'.format(level, setting))
+        return COMPRESSION_LIBRARIES[codec], level
+
+    @property
+    def data_compression(self):
+        """
+        Gets the compression of each data product (rawacf, bfiq, antennas_iq, rawrf, txdata).
+
+        :return:    dict of data product: PyTables compression library and level, or None for no
+                    compression.
+        :rtype:     dict
+        """
+        return self._data_compression
+
+    @property
+    def compression_threads(self):
+        """
+        Gets the number of threads used to compress data with blosc.
+
+        :return:    number of compression threads.
+        :rtype:     int
+        """
+        return self._compression_threads
+
     @property
     def main_antenna_count(self):
         """
@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# dmap_write.py
+# Write Borealis rawacf and bfiq records as SuperDARN DMAP rawacf and iqdat records.
+#
+# A DMAP record is a header (code, size, number of scalars and arrays), the scalars (name, type,
+# value) and the arrays (name, type, dimensions, values), little-endian and packed. Each record is
+# laid out as one packed numpy structured dtype, with the array values as subarray fields, so it
+# is filled with one assignment per field and written with a single tobytes() rather than packed
+# value by value. Array dimensions are stored fastest varying first, as the RST DataMap library
+# does, so a C-ordered numpy array of shape (a, b, c) is stored with dimensions [c, b, a].
+#
+# The Borealis to SuperDARN field mapping follows docs/source/rawacf_mapping.rst and
+# iqdat_mapping.rst, with one DMAP record per beam.
+
+import datetime
+import functools
+import math
+import re
+
+import numpy as np
+
+# Record code of DMAP records.
+DMAP_CODE = 65537
+
+# DMAP type codes of the RST DataMap library and the numpy dtype of each, keyed by the format
+# characters used to describe the fields (as in struct, with 's' for a null-terminated string).
+DMAP_TYPES = {
+    'c': (1, np.dtype('i1')),
+    'h': (2, np.dtype('<i2')),
+    'i': (3, np.dtype('<i4')),
+    'f': (4, np.dtype('<f4')),
+    'd': (8, np.dtype('<f8')),
+    's': (9, None),
+    'q': (10, np.dtype('<i8')),
+    'B': (16, np.dtype('u1')),
+    'H': (17, np.dtype('<u2')),
+    'I': (18, np.dtype('<u4')),
+    'Q': (19, np.dtype('<u8')),
+}
+
+# SuperDARN station ids of the Borealis sites.
+STATION_IDS = {
+    'sas': 5,
+    'pgr': 6,
+    'wal': 32,
+    'bks': 33,
+    'inv': 64,
+    'rkn': 65,
+    'cly': 66,
+}
+
+# Written to origin.code, to flag records written by Borealis.
+BOREALIS_ORIGIN_CODE = 100
+
+
+def _encode_string(value):
+    return value.encode('ascii', errors='replace') if isinstance(value, str) else bytes(value)
+
+
+@functools.lru_cache(maxsize=64)
+def _record_dtype(layout):
+    """
+    Get the packed structured dtype of a DMAP record.
+
+    :param layout: tuple of the scalars, as (name, fmt, string length or None), and the arrays,
+                   as (name, fmt, shape), in a tuple each.
+    :returns: the dtype.
+    """
+    scalars, arrays = layout
+    fields = [('code', '<i4'), ('size', '<i4'), ('num_scalars', '<i4'), ('num_arrays', '<i4')]
+    for i, (name, fmt, length) in enumerate(scalars):
+        fields.append(('s{}_name'.format(i), 'S{}'.format(len(name) + 1)))
+        fields.append(('s{}_type'.format(i), 'u1'))
+        value_dtype = DMAP_TYPES[fmt][1] or 'S{}'.format(length + 1)
+        fields.append(('s{}_value'.format(i), value_dtype))
+    for i, (name, fmt, shape) in enumerate(arrays):
+        fields.append(('a{}_name'.format(i), 'S{}'.format(len(name) + 1)))
+        fields.append(('a{}_type'.format(i), 'u1'))
+        fields.append(('a{}_num_dims'.format(i), '<i4'))
+        fields.append(('a{}_dims'.format(i), '<i4', (len(shape),)))
+        fields.append(('a{}_values'.format(i), DMAP_TYPES[fmt][1], (int(np.prod(shape)),)))
+    return np.dtype(fields)
+
+
+def encode_record(scalars, arrays):
+    """
+    Encode a DMAP record.
+
+    :param scalars: list of (name, fmt, value), fmt being a key of DMAP_TYPES.
+    :param arrays: list of (name, fmt, array). String arrays are not supported, and empty arrays
+                   are left out.
+    :returns: the record, bytes.
+    """
+    scalars = [(name, fmt, _encode_string(value) if fmt == 's' else value)
+               for name, fmt, value in scalars]
+    arrays = [(name, fmt, np.asarray(array)) for name, fmt, array in arrays
+              if np.size(array) > 0]
+
+    layout = (tuple((name, fmt, len(value) if fmt == 's' else None)
+                    for name, fmt, value in scalars),
+              tuple((name, fmt, array.shape) for name, fmt, array in arrays))
+    dtype = _record_dtype(layout)
+
+    record = np.zeros((), dtype=dtype)
+    record['code'] = DMAP_CODE
+    record['size'] = dtype.itemsize
+    record['num_scalars'] = len(scalars)
+    record['num_arrays'] = len(arrays)
+    for i, (name, fmt, value) in enumerate(scalars):
+        record['s{}_name'.format(i)] = name.encode('ascii')
+        record['s{}_type'.format(i)] = DMAP_TYPES[fmt][0]
+        if fmt == 's':
+            record['s{}_value'.format(i)] = value
+        else:
+            # Casting wraps out of range values, e.g. 255 in a char is stored as 0xff.
+            record['s{}_value'.format(i)] = np.asarray(value).astype(DMAP_TYPES[fmt][1])
+    for i, (name, fmt, array) in enumerate(arrays):
+        record['a{}_name'.format(i)] = name.encode('ascii')
+        record['a{}_type'.format(i)] = DMAP_TYPES[fmt][0]
+        record['a{}_num_dims'.format(i)] = array.ndim
+        record['a{}_dims'.format(i)] = array.shape[::-1]
+        record['a{}_values'.format(i)] = array.ravel()
+    return record.tobytes()
+
+
+def _version(git_hash):
+    """Get the major and minor version from a git describe string, or 255 if it is untagged."""
+    match = re.match(r'v?(\d+)\.(\d+)', git_hash)
+    if match is None:
+        return 255, 255
+    return int(match.group(1)), int(match.group(2))
+
+
+def _common_scalars(record, beam_index, mplgs, nrang, xcf, borealis_file):
+    """
+    Get the scalars that rawacf and iqdat records share, for one beam of a Borealis record.
+
+    :param record: the Borealis record, as given to DataWrite.write_file.
+    :param beam_index: the index of the beam in the record.
+    :param mplgs: the number of lags.
+    :param nrang: the number of ranges.
+    :param xcf: whether the record has interferometer data.
+    :param borealis_file: the name of the Borealis file the record belongs to, for combf.
+    :returns: list of (name, fmt, value).
+    """
+    station = record['station']
+    if station not in STATION_IDS:
+        raise ValueError("No SuperDARN station id for site {}".format(station))
+
+    git_hash = record['borealis_git_hash']
+    major, minor = _version(git_hash)
+    record_time = datetime.datetime.utcfromtimestamp(record['sqn_timestamps'][0])
+    int_time = float(record['int_time'])
+    noise = record['noise_at_freq']
+
+    return [
+        ('radar.revision.major', 'c', major),
+        ('radar.revision.minor', 'c', minor),
+        ('origin.code', 'c', BOREALIS_ORIGIN_CODE),
+        ('origin.time', 's', datetime.datetime.utcnow().strftime('%c')),
+        ('origin.command', 's', 'Borealis {} {}'.format(git_hash, record['experiment_name'])),
+        ('cp', 'h', record['experiment_id']),
+        ('stid', 'h', STATION_IDS[station]),
+        ('time.yr', 'h', record_time.year),
+        ('time.mo', 'h', record_time.month),
+        ('time.dy', 'h', record_time.day),
+        ('time.hr', 'h', record_time.hour),
+        ('time.mt', 'h', record_time.minute),
+        ('time.sc', 'h', record_time.second),
+        ('time.us', 'i', record_time.microsecond),
+        ('txpow', 'h', -1),
+        ('nave', 'h', record['num_sequences']),
+        ('atten', 'h', 0),
+        ('lagfr', 'h', round(float(record['first_range_rtt']))),
+        ('smsep', 'h', round(1.0e6 / float(record['rx_sample_rate']))),
+        ('ercod', 'h', 0),
+        ('stat.agc', 'h', record['agc_status_word']),
+        ('stat.lopwr', 'h', record['lp_status_word']),
+        ('noise.search', 'f', noise[0] if len(noise) else 0.0),
+        ('noise.mean', 'f', 0.0),
+        ('channel', 'h', record['slice_id']),
+        ('bmnum', 'h', record['beam_nums'][beam_index]),
+        ('bmazm', 'f', record['beam_azms'][beam_index]),
+        ('scan', 'h', record['scan_start_marker']),
+        ('offset', 'h', 0),
+        ('rxrise', 'h', 0),
+        ('intt.sc', 'h', math.floor(int_time)),
+        ('intt.us', 'i', round(math.fmod(int_time, 1.0) * 1.0e6)),
+        ('txpl', 'h', record['tx_pulse_len']),
+        ('mpinc', 'h', record['tau_spacing']),
+        ('mppul', 'h', len(record['pulses'])),
+        ('mplgs', 'h', mplgs),
+        ('nrang', 'h', nrang),
+        ('frang', 'h', round(float(record['first_range']))),
+        ('rsep', 'h', round(float(record['range_sep']))),
+        ('xcf', 'h', int(xcf)),
+        ('tfreq', 'h', record['freq']),
+        ('mxpwr', 'i', -1),
+        ('lvmax', 'i', 20000),
+    ], 'Converted from Borealis file: {} beam {} ; Number of beams in record: {} ; {} ; {}'.format(
+        borealis_file, record['beam_nums'][beam_index], len(record['beam_nums']),
+        record['experiment_comment'], record['slice_comment'])
+
+
+def check_convertible(record):
+    """
+    Check that a Borealis record can be represented in DMAP. The samples blanked in the record
+    must only be those of its own pulses, i.e. there are no more runs of blanked samples than
+    pulses, and its pulses must not be phase encoded.
+
+    :param record: the Borealis record.
+    :raises ValueError: if the record cannot be represented.
+    """
+    blanks = np.asarray(record['blanked_samples'])
+    runs = 1 + np.count_nonzero(np.diff(blanks) != 1) if blanks.size else 0
+    if runs > len(record['pulses']):
+        raise ValueError("Samples are blanked for pulses of other slices")
+    if 'pulse_phase_offset' in record and np.any(np.asarray(record['pulse_phase_offset']) != 0):
+        raise ValueError("Pulses are phase encoded")
+
+
+def rawacf_records(record, borealis_file=''):
+    """
+    Map a Borealis rawacf record to SuperDARN rawacf DMAP records, one per beam.
+
+    :param record: the Borealis rawacf record, as given to DataWrite.write_file.
+    :param borealis_file: the name of the Borealis file the record belongs to, for combf.
+    :returns: list of (scalars, arrays) for encode_record.
+    :raises ValueError: if the record cannot be represented.
+    """
+    if record.get('main_acfs') is None:
+        raise ValueError("Record has no main array correlations")
+    check_convertible(record)
+    num_beams, num_ranges, num_lags = (int(x) for x in record['correlation_dimensions'])
+    shape = (num_beams, num_ranges, num_lags)
+
+    # [num_beams, num_ranges, num_lags, 2]
+    correlations = {}
+    for name, field in (('acfd', 'main_acfs'), ('xcfd', 'xcfs')):
+        if record.get(field) is not None and np.size(record[field]) > 0:
+            values = np.asarray(record[field]).reshape(shape)
+            correlations[name] = np.stack((values.real, values.imag), axis=-1).astype(np.float32)
+
+    pwr0 = np.abs(np.asarray(record['main_acfs']).reshape(shape)[..., 0]).astype(np.float32)
+    ptab = np.asarray(record['pulses'], dtype=np.int16)
+    ltab = np.asarray(record['lags'], dtype=np.int16)
+    slist = np.arange(num_ranges, dtype=np.int16)
+
+    records = []
+    for beam_index in range(num_beams):
+        scalars, combf = _common_scalars(record, beam_index, num_lags, num_ranges,
+                                         'xcfd' in correlations, borealis_file)
+        scalars += [
+            ('rawacf.revision.major', 'i', 255),
+            ('rawacf.revision.minor', 'i', 255),
+            ('combf', 's', combf),
+            ('thr', 'f', 0.0),
+        ]
+        arrays = [
+            ('ptab', 'h', ptab),
+            ('ltab', 'h', ltab),
+            ('pwr0', 'f', pwr0[beam_index]),
+            ('slist', 'h', slist),
+        ]
+        arrays += [(name, 'f', values[beam_index]) for name, values in correlations.items()]
+        records.append((scalars, arrays))
+    return records
+
+
+def iqdat_records(record, borealis_file=''):
+    """
+    Map a Borealis bfiq record to SuperDARN iqdat DMAP records, one per beam. The samples of each
+    record are scaled so that the largest I or Q value is the largest short.
+
+    :param record: the Borealis bfiq record, as given to DataWrite.write_file.
+    :param borealis_file: the name of the Borealis file the record belongs to, for combf.
+    :returns: list of (scalars, arrays) for encode_record.
+    :raises ValueError: if the record cannot be represented.
+    """
+    if record.get('data') is None:
+        raise ValueError("Record has no beamformed samples")
+    check_convertible(record)
+    num_arrays, num_sequences, num_beams, num_samps = (int(x) for x in record['data_dimensions'])
+
+    # [num_beams, num_sequences, num_arrays, num_samps, 2]
+    samples = np.asarray(record['data']).reshape(num_arrays, num_sequences, num_beams, num_samps)
+    samples = np.stack((samples.real, samples.imag), axis=-1).transpose(2, 1, 0, 3, 4)
+
+    timestamps = np.asarray(record['sqn_timestamps'], dtype=np.float64)
+    tsc = np.floor(timestamps).astype(np.int32)
+    tus = np.round((timestamps - tsc) * 1.0e6).astype(np.int32)
+    words = 2 * num_samps * num_arrays
+    toff = np.arange(num_sequences, dtype=np.int32) * words
+    tsze = np.full(num_sequences, words, dtype=np.int32)
+    tatten = np.zeros(num_sequences, dtype=np.int16)
+    tnoise = np.asarray(record['noise_at_freq'], dtype=np.float32)
+
+    ptab = np.asarray(record['pulses'], dtype=np.int16)
+    ltab = np.asarray(record['lags'], dtype=np.int16)
+    skpnum = math.ceil(float(record['first_range']) / float(record['range_sep']))
+    short_max = np.iinfo(np.int16).max
+
+    records = []
+    for beam_index in range(num_beams):
+        beam_samples = samples[beam_index]
+        peak = np.max(np.abs(beam_samples)) if beam_samples.size else 0.0
+        scale = short_max / peak if peak > 0 else 1.0
+        data = np.round(beam_samples * scale).astype(np.int16)
+
+        scalars, combf = _common_scalars(record, beam_index, len(ltab), record['num_ranges'],
+                                         num_arrays > 1, borealis_file)
+        scalars += [
+            ('iqdata.revision.major', 'i', 1),
+            ('iqdata.revision.minor', 'i', 0),
+            ('combf', 's', combf),
+            ('seqnum', 'i', num_sequences),
+            ('chnnum', 'i', num_arrays),
+            ('smpnum', 'i', num_samps),
+            ('skpnum', 'i', skpnum),
+        ]
+        arrays = [
+            ('ptab', 'h', ptab),
+            ('ltab', 'h', ltab),
+            ('tsc', 'i', tsc),
+            ('tus', 'i', tus),
+            ('tatten', 'h', tatten),
+            ('tnoise', 'f', tnoise),
+            ('toff', 'i', toff),
+            ('tsze', 'i', tsze),
+            ('data', 'h', data.ravel()),
+        ]
+        records.append((scalars, arrays))
+    return records
+
+
+# The DMAP file type and record mapping of each Borealis data product that has one.
+DMAP_PRODUCTS = {
+    'rawacf': ('rawacf', rawacf_records),
+    'bfiq': ('iqdat', iqdat_records),
+}
+
+
+def append_records(filename, records):
+    """
+    Encode DMAP records and append them to a file, with one write.
+
+    :param filename: the DMAP file. Created if needed.
+    :param records: list of (scalars, arrays) for encode_record.
+    :returns: the byte offset the records were written at, and the number of bytes written.
+    """
+    data = b''.join(encode_record(scalars, arrays) for scalars, arrays in records)
+    with open(filename, 'ab') as f:
+        f.write(data)
+        f.flush()
+        # Appends go to the end of the file as it is when they are written, and leave the file
+        # position after them, so this is where the records went even if the file was appended
+        # to since it was opened.
+        offset = f.tell() - len(data)
+    return offset, len(data)
@@ -11,6 +11,7 @@ import json
 import os
 
 from experiment_prototype.experiment_exception import ExperimentException
+from utils.frequency_ranges.frequency_ranges import FrequencyRanges
 
 borealis_path = os.environ['BOREALISPATH']
 config_file = borealis_path + '/config.ini'
@@ -62,6 +63,8 @@ class ExperimentOptions:
             # when adjusting the experiment during operations.
             self._max_number_of_filtering_stages = int(config['max_number_of_filtering_stages'])
             self._max_number_of_filter_taps_per_stage = int(config['max_number_of_filter_taps_per_stage'])
+            self._sequence_lookahead = int(config['sequence_lookahead'])
+            self._experiment_cache_directory = config['experiment_cache_directory']
             self._site_id = config['site_id']
             self._max_freq = float(config['max_freq'])  # Hz
             self._min_freq = float(config['min_freq'])  # Hz
@@ -74,6 +77,7 @@ class ExperimentOptions:
             self._minimum_pulse_separation = float(config['minimum_pulse_separation'])  # us
             self._usrp_master_clock_rate = float(config['usrp_master_clock_rate']) # Hz
             self._router_address = config['router_address']
+            self._metrics_address = config['metrics_address']
             self._radctrl_to_exphan_identity = str(config["radctrl_to_exphan_identity"])
             self._radctrl_to_dsp_identity = str(config["radctrl_to_dsp_identity"])
             self._radctrl_to_driver_identity = str(config["radctrl_to_driver_identity"])
@@ -193,6 +197,7 @@ class ExperimentOptions:
                 raise ValueError('Error parsing Restrict.Dat Frequency Ranges, Invalid Literal')
             restricted_range = tuple(splitup)
             self.__restricted_ranges.append(restricted_range)
+        self.__restricted_frequencies = FrequencyRanges(self.__restricted_ranges)
 
     def __repr__(self):
         return_str = """\n    main_antennas = {} \
@@ -307,6 +312,14 @@ class ExperimentOptions:
     def max_number_of_filter_taps_per_stage(self):
         return self._max_number_of_filter_taps_per_stage
 
+    @property
+    def sequence_lookahead(self):
+        return self._sequence_lookahead
+
+    @property
+    def experiment_cache_directory(self):
+        return self._experiment_cache_directory
+
     @property
     def site_id(self):
         return self._site_id
@@ -343,6 +356,10 @@ class ExperimentOptions:
     def router_address(self):
         return self._router_address
 
+    @property
+    def metrics_address(self):
+        return self._metrics_address
+
     @property
     def radctrl_to_exphan_identity(self):
         return self._radctrl_to_exphan_identity
@@ -508,3 +525,10 @@ class ExperimentOptions:
         """
         return self.__restricted_ranges
 
+    @property
+    def restricted_frequencies(self):
+        """
+        The restricted ranges as a FrequencyRanges index, sorted and merged, in kHz.
+        """
+        return self.__restricted_frequencies
+
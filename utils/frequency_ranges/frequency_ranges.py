@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# frequency_ranges.py
+# A sorted index of frequency ranges, e.g. the restricted frequencies of restrict.dat.
+#
+# The ranges are closed intervals, in the units they are given in (kHz for restrict.dat). They are
+# sorted and overlapping ranges are merged when the index is made, so every query is a binary
+# search. Queries take a single frequency or band, or arrays of them to check many candidates at
+# once, such as the steps of a frequency-agile mode or the bins of a clear frequency search.
+
+import numpy as np
+
+
+class FrequencyRanges(object):
+    """
+    A sorted, merged set of closed frequency ranges.
+
+    :param ranges: The (low, high) ranges, in any order and possibly overlapping.
+    :type ranges: iterable of pairs of numbers
+    """
+
+    def __init__(self, ranges=()):
+        super(FrequencyRanges, self).__init__()
+        merged = []
+        for low, high in sorted((min(r), max(r)) for r in ranges):
+            if merged and low <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+
+        self.ranges = [tuple(r) for r in merged]
+        self._lows = np.array([r[0] for r in merged], dtype=np.float64)
+        self._highs = np.array([r[1] for r in merged], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __repr__(self):
+        return 'FrequencyRanges({})'.format(self.ranges)
+
+    def _reaches(self, freqs, bounds):
+        # Whether the last range starting at or before each freq reaches up to each bound.
+        index = np.searchsorted(self._lows, freqs, side='right') - 1
+        if not len(self):
+            return np.zeros(index.shape, dtype=bool)
+        return (index >= 0) & (self._highs[np.maximum(index, 0)] >= bounds)
+
+    def contains(self, freqs):
+        """
+        Check whether frequencies are inside any of the ranges.
+
+        :param freqs: A frequency or an array of frequencies.
+        :returns: A bool, or a bool array of the shape of freqs.
+        """
+        freqs = np.asarray(freqs, dtype=np.float64)
+        inside = self._reaches(freqs, freqs)
+        return inside if inside.ndim else bool(inside)
+
+    def overlaps(self, lows, highs):
+        """
+        Check whether bands [low, high] overlap any of the ranges.
+
+        :param lows: The low end of a band or an array of them.
+        :param highs: The high end of a band or an array of them, broadcastable with lows.
+        :returns: A bool, or a bool array of the broadcast shape.
+        """
+        lows, highs = np.broadcast_arrays(np.asarray(lows, dtype=np.float64),
+                                          np.asarray(highs, dtype=np.float64))
+        # The ranges are disjoint and sorted, so the last one starting at or before the top of the
+        # band is the only one that can reach down into it.
+        overlap = self._reaches(highs, lows)
+        return overlap if overlap.ndim else bool(overlap)
+
+    def find(self, freq):
+        """
+        Get the range a frequency is in.
+
+        :param freq: The frequency.
+        :returns: The (low, high) range, or None if freq is not in any range.
+        """
+        index = int(np.searchsorted(self._lows, freq, side='right')) - 1
+        if index >= 0 and freq <= self.ranges[index][1]:
+            return self.ranges[index]
+        return None
+
+    def trim(self, low, high, step=1):
+        """
+        Shrink a band until neither end is inside a range, by moving each end that is inside a
+        range to step past it. Ranges in the middle of the band are left in it.
+
+        :param low: The low end of the band.
+        :param high: The high end of the band.
+        :param step: How far past a range to move an end to, e.g. 1 kHz for whole kHz ranges.
+        :returns: The trimmed (low, high), or None if nothing of the band is left.
+        """
+        inside = self.find(low)
+        while inside is not None and low <= high:
+            low = inside[1] + step
+            inside = self.find(low)
+        inside = self.find(high)
+        while inside is not None and low <= high:
+            high = inside[0] - step
+            inside = self.find(high)
+        if low > high:
+            return None
+        return low, high
@@ -29,6 +29,7 @@ class OutputDataset:
     main_acf_shm: str = None
     intf_acf_shm: str = None
     xcf_shm: str = None
+    noise_at_freq: float = None
 
 
 @dataclass
@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# metrics.py
+# Runtime metrics shared by the Borealis Python modules.
+#
+# Each process creates one MetricsRegistry, registers counters, gauges and latency histograms on
+# it, and the registry periodically publishes a snapshot over a ZMQ PUB socket. The publishers
+# connect to the metrics address from config.ini, and the viewer (tools/metrics_viewer) binds a SUB
+# socket there, so any number of modules can report to a single viewer. If nothing is listening
+# the PUB socket drops the snapshots, so leaving the metrics enabled costs next to nothing.
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import zmq
+
+# Upper bounds (in ms) of the latency histogram buckets. The last bucket is open ended.
+DEFAULT_LATENCY_BUCKETS_MS = (0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0,
+                              2500.0)
+
+
+class Counter(object):
+    """
+    A monotonically increasing count, such as the number of sequences sent.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param description: A short description of what is counted.
+    :type description: str
+    """
+
+    def __init__(self, name, description=''):
+        super(Counter, self).__init__()
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increment the counter.
+
+        :param amount: How much to increment by. Must not be negative.
+        :type amount: int or float
+        """
+        if amount < 0:
+            raise ValueError("Counter {} can only increase".format(self.name))
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return {'type': 'counter', 'description': self.description, 'value': self._value}
+
+
+class Gauge(object):
+    """
+    A value that can go up and down, such as a queue depth or the ring buffer headroom.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param description: A short description of the measured value.
+    :type description: str
+    """
+
+    def __init__(self, name, description=''):
+        super(Gauge, self).__init__()
+        self.name = name
+        self.description = description
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function):
+        """
+        Take the value from a function, called for each snapshot instead of on every change. For
+        values that are costly to measure, as snapshots are only taken on the publish interval.
+
+        :param function: Function of no arguments returning the value.
+        :type function: callable
+        """
+        self._function = function
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def snapshot(self):
+        return {'type': 'gauge', 'description': self.description, 'value': self.value}
+
+
+class Histogram(object):
+    """
+    A latency histogram with fixed bucket boundaries. Keeps the count, sum, min and max of all
+    observations, as well as the per-bucket counts, so that the viewer can estimate quantiles.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param description: A short description of the measured latency.
+    :type description: str
+    :param buckets: The ascending upper bounds of the buckets, in the unit of the observations.
+    :type buckets: tuple
+    """
+
+    def __init__(self, name, description='', buckets=DEFAULT_LATENCY_BUCKETS_MS):
+        super(Histogram, self).__init__()
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Record one observation.
+
+        :param value: The observed value, typically a latency in ms.
+        :type value: float
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._last = value
+            if self._min is None or value < self._min:
+                self._min = value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    @contextmanager
+    def time(self):
+        """
+        Context manager that observes the time spent inside the block, in ms.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000.0)
+
+    @property
+    def count(self):
+        return self._count
+
+    def snapshot(self):
+        with self._lock:
+            return {'type': 'histogram',
+                    'description': self.description,
+                    'buckets': list(self.buckets),
+                    'counts': list(self._counts),
+                    'count': self._count,
+                    'sum': self._sum,
+                    'min': self._min,
+                    'max': self._max,
+                    'last': self._last}
+
+
+class MetricsRegistry(object):
+    """
+    Holds all the metrics of one module and publishes them.
+
+    Metrics are created on first use and returned on subsequent calls with the same name, so the
+    instrumented code does not need to keep references around.
+
+    :param module_name: The module reporting these metrics, used as the ZMQ topic.
+    :type module_name: str
+    :param address: The ZMQ address to connect the PUB socket to. If None, nothing is published
+                    but the metrics can still be read with snapshot().
+    :type address: str
+    :param publish_interval: Seconds between published snapshots.
+    :type publish_interval: float
+    """
+
+    def __init__(self, module_name, address=None, publish_interval=1.0):
+        super(MetricsRegistry, self).__init__()
+        self.module_name = module_name
+        self.address = address
+        self.publish_interval = publish_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started = time.time()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise TypeError("Metric {} already registered as a {}".format(
+                    name, type(metric).__name__))
+            return metric
+
+    def counter(self, name, description=''):
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description=''):
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description='', buckets=DEFAULT_LATENCY_BUCKETS_MS):
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def snapshot(self):
+        """
+        Get the current value of all the metrics.
+
+        :returns: Dictionary with the module name, the time of the snapshot, the uptime of the
+                  registry and one entry per metric.
+        :rtype: dict
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        now = time.time()
+        return {'module': self.module_name,
+                'time': now,
+                'uptime': now - self._started,
+                'metrics': {m.name: m.snapshot() for m in metrics}}
+
+    def start(self):
+        """
+        Start the background thread that publishes snapshots. Does nothing if no address was
+        given or the thread is already running.
+        """
+        if self.address is None or self._thread is not None:
+            return
+
+        def publish():
+            context = zmq.Context().instance()
+            socket = context.socket(zmq.PUB)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.SNDHWM, 10)
+            socket.connect(self.address)
+            topic = self.module_name.encode('utf-8')
+            while True:
+                time.sleep(self.publish_interval)
+                payload = json.dumps(self.snapshot()).encode('utf-8')
+                try:
+                    socket.send_multipart([topic, payload], flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    pass
+
+        self._thread = threading.Thread(target=publish, daemon=True)
+        self._thread.start()
+
+
+def to_text(snapshot):
+    """
+    Render a snapshot in the plain text exposition format used by Prometheus, so that the
+    output of the viewer can be scraped (e.g. with the node_exporter textfile collector).
+
+    :param snapshot: A snapshot from MetricsRegistry.snapshot().
+    :type snapshot: dict
+    :returns: The text representation.
+    :rtype: str
+    """
+    module = snapshot['module'].lower().replace(' ', '_')
+    lines = []
+    for name, metric in sorted(snapshot['metrics'].items()):
+        full_name = "borealis_{}_{}".format(module, name)
+        if metric['description']:
+            lines.append("# HELP {} {}".format(full_name, metric['description']))
+        lines.append("# TYPE {} {}".format(full_name, metric['type']))
+        if metric['type'] == 'histogram':
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], metric['counts']):
+                cumulative += count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(full_name, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(full_name, metric['count']))
+            lines.append("{}_sum {}".format(full_name, metric['sum']))
+            lines.append("{}_count {}".format(full_name, metric['count']))
+        else:
+            lines.append("{} {}".format(full_name, metric['value']))
+    return "\n".join(lines) + "\n"
+
+
+def histogram_quantile(metric, quantile):
+    """
+    Estimate a quantile from a histogram snapshot, by linear interpolation within the bucket
+    the quantile falls in.
+
+    :param metric: A histogram snapshot.
+    :type metric: dict
+    :param quantile: The quantile to estimate, between 0 and 1.
+    :type quantile: float
+    :returns: The estimate, or None if there are no observations.
+    :rtype: float
+    """
+    if metric['count'] == 0:
+        return None
+
+    rank = quantile * metric['count']
+    cumulative = 0
+    lower = metric['min']
+    for bound, count in zip(metric['buckets'] + [metric['max']], metric['counts']):
+        if count and cumulative + count >= rank:
+            # The observed extremes are tighter than the bucket edges at either end.
+            upper = min(bound, metric['max'])
+            lower = max(lower, metric['min'])
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return metric['max']
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+# Copyright 2021 SuperDARN Canada
+#
+# record_index.py
+# Keep an index of the records in each Borealis two hour file.
+#
+# Finding the records of a time range, or the beams and frequency of a record, in a two hour file
+# otherwise means opening every record of it. data_write appends an entry to <data file>.index for
+# each record it writes, with the record time (epoch milliseconds, the record name of site files),
+# where the record is in the file, its size, frequency, number of sequences and beam numbers.
+#
+# The index is an 8 byte header followed by fixed size entries. Each entry is appended with a
+# single write to a file opened for appending, and readers drop an incomplete entry at the end,
+# so they only ever see whole entries, even while data_write is adding one. Entries are in time
+# order, so a time is found with a binary search, and the latest record is the last entry.
+
+import os
+import threading
+
+import numpy as np
+
+INDEX_SUFFIX = '.index'
+
+# Start of every index file. Bump the version if INDEX_DTYPE changes.
+INDEX_MAGIC = b'BRLIDX01'
+
+# Beam numbers kept per entry. num_beams has the full count of beams of the record.
+MAX_INDEX_BEAMS = 16
+
+# timestamp: epoch milliseconds of the first sequence, the record name in site files.
+# location: the record name (site files), row (array files) or byte offset (DMAP files).
+# size: the bytes the record added to the data file.
+# freq: frequency of the record in kHz, 0 if it has none.
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('location', '<i8'),
+    ('size', '<i8'),
+    ('freq', '<u4'),
+    ('num_sequences', '<u4'),
+    ('num_beams', '<u2'),
+    ('beam_nums', '<u2', (MAX_INDEX_BEAMS,)),
+])
+
+_index_lock = threading.Lock()
+
+
+def index_filename(data_file):
+    """
+    Get the index file of a data file.
+
+    :param data_file: the two hour data file.
+    :returns: the name of its index.
+    """
+    return data_file + INDEX_SUFFIX
+
+
+def _first(record, *fields):
+    """Get the first value of the first of the fields the record has, or 0."""
+    for field in fields:
+        value = np.asarray(record.get(field, [])).ravel()
+        if value.size:
+            return value[0]
+    return 0
+
+
+def make_entry(record, timestamp, location, size):
+    """
+    Make the index entry of a record.
+
+    :param record: the Borealis record, as given to DataWrite.write_file.
+    :param timestamp: the time of the record, in epoch milliseconds.
+    :param location: where the record is in the data file.
+    :param size: the bytes the record added to the data file.
+    :returns: the entry, a numpy record of INDEX_DTYPE.
+    """
+    entry = np.zeros((), dtype=INDEX_DTYPE)
+    entry['timestamp'] = int(timestamp)
+    entry['location'] = int(location)
+    entry['size'] = int(size)
+    entry['freq'] = int(_first(record, 'freq', 'rx_center_freq', 'tx_center_freq'))
+    entry['num_sequences'] = int(record.get('num_sequences', 0))
+    beam_nums = np.asarray(record.get('beam_nums', []), dtype=np.uint16).ravel()
+    entry['num_beams'] = beam_nums.size
+    entry['beam_nums'][:min(beam_nums.size, MAX_INDEX_BEAMS)] = beam_nums[:MAX_INDEX_BEAMS]
+    return entry
+
+
+def append_entry(data_file, record, timestamp, location, size):
+    """
+    Add a record to the index of a data file, creating the index if needed.
+
+    :param data_file: the two hour data file the record was written to.
+    :param record: the Borealis record.
+    :param timestamp: the time of the record, in epoch milliseconds.
+    :param location: where the record is in the data file.
+    :param size: the bytes the record added to the data file.
+    """
+    data = make_entry(record, timestamp, location, size).tobytes()
+    with _index_lock:
+        fd = os.open(index_filename(data_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            if os.fstat(fd).st_size == 0:
+                data = INDEX_MAGIC + data
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def _check_header(f, index_file):
+    header = f.read(len(INDEX_MAGIC))
+    if len(header) < len(INDEX_MAGIC):
+        return False
+    if header != INDEX_MAGIC:
+        raise ValueError("{} is not a record index".format(index_file))
+    return True
+
+
+def read_index(data_file):
+    """
+    Read the index of a data file.
+
+    :param data_file: the two hour data file.
+    :returns: array of INDEX_DTYPE, in time order.
+    :raises FileNotFoundError: if the data file has no index.
+    """
+    index_file = index_filename(data_file)
+    with open(index_file, 'rb') as f:
+        if not _check_header(f, index_file):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        data = f.read()
+    num_entries = len(data) // INDEX_DTYPE.itemsize
+    entries = np.frombuffer(data, dtype=INDEX_DTYPE, count=num_entries)
+    # Records written by overlapping threads can be appended slightly out of order.
+    if np.any(np.diff(entries['timestamp']) < 0):
+        entries = entries[np.argsort(entries['timestamp'], kind='stable')]
+    return entries
+
+
+def last_entry(data_file):
+    """
+    Read the last entry of the index of a data file, without reading the rest.
+
+    :param data_file: the two hour data file.
+    :returns: the entry, or None if the index has no entries.
+    :raises FileNotFoundError: if the data file has no index.
+    """
+    index_file = index_filename(data_file)
+    with open(index_file, 'rb') as f:
+        if not _check_header(f, index_file):
+            return None
+        num_entries = (os.fstat(f.fileno()).st_size - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        if num_entries == 0:
+            return None
+        f.seek(len(INDEX_MAGIC) + (num_entries - 1) * INDEX_DTYPE.itemsize)
+        return np.frombuffer(f.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+
+
+def find_records(entries, start=None, end=None):
+    """
+    Find the records in a time range.
+
+    :param entries: the index, from read_index.
+    :param start: the first time, in epoch milliseconds, or None for the first record.
+    :param end: the last time (inclusive), in epoch milliseconds, or None for the last record.
+    :returns: the entries of the records from start to end.
+    """
+    first = 0 if start is None else np.searchsorted(entries['timestamp'], start, 'left')
+    last = len(entries) if end is None else np.searchsorted(entries['timestamp'], end, 'right')
+    return entries[first:last]
+
+
+def nearest_record(entries, timestamp):
+    """
+    Find the record closest to a time.
+
+    :param entries: the index, from read_index.
+    :param timestamp: the time, in epoch milliseconds.
+    :returns: the entry of the record, or None if the index is empty.
+    """
+    if len(entries) == 0:
+        return None
+    i = np.searchsorted(entries['timestamp'], timestamp)
+    if i == len(entries) or (i > 0 and timestamp - entries['timestamp'][i - 1] <=
+                             entries['timestamp'][i] - timestamp):
+        i -= 1
+    return entries[i]
+
+
+def beam_nums(entry):
+    """
+    Get the beam numbers of an entry, at most MAX_INDEX_BEAMS of them.
+
+    :param entry: an index entry.
+    :returns: array of the beam numbers.
+    """
+    return entry['beam_nums'][:min(int(entry['num_beams']), MAX_INDEX_BEAMS)]
@@ -28,6 +28,7 @@ class SignalProcessingOptions(object):
             raise IOError(errmsg)
 
         self._router_address = raw_config["router_address"]
+        self._metrics_address = raw_config["metrics_address"]
         self._dsp_radctrl_identity = raw_config["dsp_to_radctrl_identity"]
         self._dsp_driver_identity = raw_config["dsp_to_driver_identity"]
         self._dsp_exphan_identity = raw_config["dsp_to_exphan_identity"]
@@ -69,6 +70,16 @@ class SignalProcessingOptions(object):
         """
         return self._router_address
 
+    @property
+    def metrics_address(self):
+        """
+        Gets the socket address that runtime metrics are published to.
+
+        :return:    socket address that runtime metrics are published to.
+        :rtype:     str
+        """
+        return self._metrics_address
+
     @property
     def dsp_radctrl_identity(self):
         """